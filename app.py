@@ -28,6 +28,7 @@ if os.getenv('RAILWAY_ENVIRONMENT'):
 from config import Config
 from line_bot_handler import LineBotHandler
 from linebot.exceptions import InvalidSignatureError
+from structured_logging import access_log
 
 # 日誌已在前面設定，這裡不需要重複設定
 
@@ -50,20 +51,16 @@ def index():
 @app.route("/callback", methods=['POST'])
 def callback():
     """Line Bot Webhook 端點"""
-    # 記錄所有請求頭
-    logger.info("=== Webhook Request ===")
-    logger.info(f"Method: {request.method}")
-    logger.info(f"URL: {request.url}")
-    logger.info(f"Headers: {dict(request.headers)}")
-    
-    # 取得請求的簽名
+    # 取得請求的簽名與內容
     signature = request.headers.get('X-Line-Signature', '')
-    logger.info(f"Signature present: {'Yes' if signature else 'No'}")
-    
-    # 取得請求的內容
     body = request.get_data(as_text=True)
-    logger.info(f"Body length: {len(body)}")
-    logger.info(f"Body preview: {body[:200]}..." if body else "Empty body")
+    
+    # 完整 headers 與 body 只留在環形緩衝區，stdout 只輸出取樣的摘要
+    if access_log.capturing:
+        access_log.capture("callback", "webhook_request", headers=dict(request.headers), body=body)
+    if access_log.sampled("callback"):
+        access_log.emit("callback", "webhook_request", body_length=len(body),
+                        signature_present=bool(signature))
     
     # 如果沒有簽名且 body 是空的或特定格式，可能是驗證請求
     if not signature and (not body or body == '{}'):
@@ -78,7 +75,7 @@ def callback():
     # 處理 webhook
     try:
         line_bot_handler.handle_webhook(body, signature)
-        logger.info("Webhook handled successfully")
+        access_log.log("callback", "webhook_queued" if line_bot_handler.async_mode else "webhook_handled")
     except InvalidSignatureError as e:
         logger.error(f"Invalid signature: {str(e)}")
         abort(400)
@@ -102,6 +99,7 @@ def health_check():
         "status": "healthy" if startup_status["startup_test_passed"] else "unhealthy",
         "service": "Persona Cruz AI Bot",
         "startup_tests": startup_status,
+        "webhook": line_bot_handler.get_webhook_stats(),
         "timestamp": startup_status["test_time"]
     }
     
@@ -111,6 +109,19 @@ def health_check():
     
     return health_status
 
+@app.route("/debug/logs", methods=['GET'])
+def debug_logs():
+    """查看環形緩衝區中最近的完整請求內容（需設定 DEBUG_LOG_TOKEN）"""
+    if not Config.DEBUG_LOG_TOKEN or request.headers.get('X-Debug-Token') != Config.DEBUG_LOG_TOKEN:
+        abort(404)
+    
+    limit = request.args.get('limit', 50, type=int)
+    route = request.args.get('route')
+    return {
+        "sampling": access_log.stats(),
+        "entries": access_log.recent(limit=limit, route=route)
+    }
+
 @app.route("/debug-env", methods=['GET'])
 def debug_env():
     """偵錯環境變數（部署後請刪除）"""
@@ -0,0 +1,140 @@
+"""
+Line Bot ASGI 入口（FastAPI）
+與 app.py 提供相同的 webhook 服務，但以 asyncio 處理事件，並提供 OpenAI 相容的聊天端點
+
+啟動方式：uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+"""
+from contextlib import asynccontextmanager
+import logging
+import sys
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from startup_test import StartupTest
+
+# 設定基礎日誌（在 import 其他模組前）
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+# 執行啟動自我檢測
+startup_tester = StartupTest()
+if not startup_tester.run_all_tests():
+    logger.error("啟動測試失敗！服務無法啟動。")
+    sys.exit(1)
+
+from config import Config
+from async_line_bot_handler import AsyncLineBotHandler
+from chat_completions import ChatCompletionService, create_chat_router
+from linebot.exceptions import InvalidSignatureError
+from structured_logging import access_log
+
+# 驗證環境變數
+try:
+    Config.validate()
+except ValueError as e:
+    logger.error(f"Configuration error: {e}")
+    sys.exit(1)
+
+line_bot_handler = AsyncLineBotHandler()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await line_bot_handler.startup()
+    yield
+    await line_bot_handler.shutdown()
+
+
+app = FastAPI(
+    title="Persona Cruz AI Line Bot",
+    description="LINE webhook 的 ASGI 版本",
+    lifespan=lifespan
+)
+
+# OpenAI 相容的串流聊天端點（LibreChat），與 LINE 共用同一個 GeminiService 與併發名額
+chat_service = ChatCompletionService(line_bot_handler.gemini_service)
+app.include_router(create_chat_router(chat_service))
+
+
+@app.get("/")
+async def index():
+    """首頁路由"""
+    return PlainTextResponse("Persona Cruz AI Line Bot is running!")
+
+
+@app.post("/callback")
+async def callback(request: Request):
+    """Line Bot Webhook 端點"""
+    signature = request.headers.get('X-Line-Signature', '')
+    body = (await request.body()).decode('utf-8')
+
+    # 完整 headers 與 body 只留在環形緩衝區，stdout 只輸出取樣的摘要
+    if access_log.capturing:
+        access_log.capture("callback", "webhook_request", headers=dict(request.headers), body=body)
+    if access_log.sampled("callback"):
+        access_log.emit("callback", "webhook_request", body_length=len(body),
+                        signature_present=bool(signature))
+
+    # 如果沒有簽名且 body 是空的或特定格式，可能是驗證請求
+    if not signature and (not body or body == '{}'):
+        logger.info("Possible verification request - returning 200")
+        return PlainTextResponse('OK')
+
+    # 如果沒有簽名，這是無效的請求
+    if not signature:
+        logger.warning("No signature provided")
+        raise HTTPException(status_code=400)
+
+    try:
+        count = line_bot_handler.handle_webhook_async(body, signature)
+        access_log.log("callback", "webhook_scheduled", events=count)
+    except InvalidSignatureError as e:
+        logger.error(f"Invalid signature: {str(e)}")
+        raise HTTPException(status_code=400)
+    except Exception as e:
+        logger.error(f"Error in callback: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400)
+
+    return PlainTextResponse('OK')
+
+
+@app.get("/health")
+async def health_check():
+    """健康檢查端點"""
+    startup_status = startup_tester.get_status()
+
+    health_status = {
+        "status": "healthy" if startup_status["startup_test_passed"] else "unhealthy",
+        "service": "Persona Cruz AI Bot",
+        "startup_tests": startup_status,
+        "webhook": line_bot_handler.get_webhook_stats(),
+        "chat": chat_service.stats(),
+        "timestamp": startup_status["test_time"]
+    }
+
+    # 如果有錯誤，返回 503 狀態碼
+    if not startup_status["startup_test_passed"]:
+        return JSONResponse(health_status, status_code=503)
+
+    return health_status
+
+
+@app.get("/debug/logs")
+async def debug_logs(request: Request, limit: int = 50, route: str = None):
+    """查看環形緩衝區中最近的完整請求內容（需設定 DEBUG_LOG_TOKEN）"""
+    if not Config.DEBUG_LOG_TOKEN or request.headers.get('X-Debug-Token') != Config.DEBUG_LOG_TOKEN:
+        raise HTTPException(status_code=404)
+
+    return {
+        "sampling": access_log.stats(),
+        "entries": access_log.recent(limit=limit, route=route)
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=Config.PORT)
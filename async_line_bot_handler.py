@@ -0,0 +1,194 @@
+"""
+Line Bot 非同步訊息處理器（ASGI 版本）
+Gemini 與 LINE API 呼叫都在事件迴圈上等待，不需要每個對話佔用一個執行緒
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from linebot import AsyncLineBotApi
+from linebot.exceptions import LineBotApiError
+from linebot.models import MessageEvent, TextMessage, TextSendMessage
+
+from config import Config
+from line_bot_handler import LineBotHandler
+from async_line_http_client import PooledAiohttpAsyncHttpClient, create_aiohttp_session
+from webhook_dedup import InMemoryDedupStore
+from structured_logging import access_log
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncLineBotHandler(LineBotHandler):
+    """沿用 LineBotHandler 的指令與去重邏輯，改用 asyncio 處理事件
+
+    - /callback 驗證簽名後立即回應，每個事件是一個 asyncio task
+    - 同一使用者的事件依序處理（asyncio.Lock 為 FIFO），不同使用者同時進行
+    - 量子同步等非必要工作仍交給回覆後管線，在回覆送出後才執行
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.async_line_bot_api = None
+        self._session = None
+        # 使用者 -> [Lock, 等待中的事件數]，沒有事件時回收
+        self._user_locks = {}
+        self._tasks = set()
+
+        # 統計資料
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.events_completed = 0
+
+    async def startup(self):
+        """建立保持連線的 aiohttp session（必須在事件迴圈中建立）"""
+        self._session = create_aiohttp_session()
+        self.async_line_bot_api = AsyncLineBotApi(
+            Config.LINE_CHANNEL_ACCESS_TOKEN,
+            PooledAiohttpAsyncHttpClient(self._session, metrics=self.line_http_metrics),
+            endpoint=Config.LINE_API_ENDPOINT
+        )
+        logger.info("AsyncLineBotHandler started")
+
+    async def shutdown(self):
+        """等待處理中的事件完成後關閉連線"""
+        if self._tasks:
+            logger.info(f"Waiting for {len(self._tasks)} in-flight events")
+            await asyncio.wait(set(self._tasks), timeout=self.sync_deadline)
+        if self._session is not None:
+            await self._session.close()
+        await asyncio.to_thread(self.post_reply.shutdown, True, self.sync_deadline)
+
+    def handle_webhook_async(self, body, signature) -> int:
+        """驗證簽名並為每個事件建立 task，回傳事件數量"""
+        # 簽名錯誤會拋出 InvalidSignatureError，由 asgi_app.py 回應 400
+        events = self.handler.parser.parse(body, signature)
+        for event in events:
+            task = asyncio.create_task(self._handle_event_async(event))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return len(events)
+
+    async def _handle_event_async(self, event):
+        """處理單一事件（對應 _dispatch_event）"""
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            # 共用資料表的去重需要等資料庫，交給執行緒避免阻塞事件迴圈
+            if self.dedup_store is None or isinstance(self.dedup_store, InMemoryDedupStore):
+                duplicate = self._is_duplicate_event(event)
+            else:
+                duplicate = await asyncio.to_thread(self._is_duplicate_event, event)
+            if duplicate:
+                return
+
+            if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+                async with self._user_lane(self._get_event_key(event)):
+                    # 處理期間提交的背景工作，會等回覆送出後才開始執行
+                    with self.post_reply.deferred():
+                        await self._process_text_message_async(event)
+        except Exception as e:
+            logger.error(f"Async webhook event failed: {e}", exc_info=True)
+        finally:
+            self.in_flight -= 1
+            self.events_completed += 1
+
+    @asynccontextmanager
+    async def _user_lane(self, key):
+        """同一使用者的事件依到達順序一次處理一個"""
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    async def _process_text_message_async(self, event):
+        """解析指令、產生回覆並送出（_process_text_message 的非同步版本）"""
+        user_id = event.source.user_id
+        message_text = event.message.text.strip()
+
+        access_log.capture("message", "received", user_id=user_id, text=message_text)
+        access_log.log("message", "received", user_id=user_id, length=len(message_text))
+
+        reply_task = asyncio.ensure_future(self._get_reply_text_async(event, user_id, message_text))
+        interim_sent = False
+        try:
+            if self.reply_deadlines is None:
+                reply_text = await reply_task
+            else:
+                budget = self.reply_deadlines.remaining(getattr(event, 'timestamp', None))
+                try:
+                    reply_text = await asyncio.wait_for(asyncio.shield(reply_task), budget)
+                except asyncio.TimeoutError:
+                    # 期限到了先送暫時回覆，完整答案完成後改用 push
+                    interim_sent = True
+                    self.reply_deadlines.record_interim()
+                    await self._send_reply_async(event.reply_token, Config.REPLY_INTERIM_MESSAGE)
+                    reply_text = await reply_task
+        except Exception as e:
+            logger.error(f"Error handling message: {str(e)}")
+            reply_text = "抱歉，處理您的訊息時發生錯誤。請稍後再試。"
+
+        if interim_sent:
+            await self._send_push_async(self._get_push_target(event), reply_text)
+        else:
+            await self._send_reply_async(event.reply_token, reply_text)
+
+    async def _get_reply_text_async(self, event, user_id, message_text):
+        """產生回覆文字
+
+        指令會讀寫量子記憶資料庫與使用者狀態（/test 還會呼叫外部服務），
+        量子同步要讀使用者的角色，都交給執行緒執行，不阻塞事件迴圈。
+        """
+        reply_text = await asyncio.to_thread(self._get_command_reply, user_id, message_text)
+        if reply_text is None:
+            reply_text = self._get_rejection_reply(event)
+        if reply_text is None:
+            # 一般對話，交給 Gemini 處理
+            try:
+                reply_text = await self.gemini_service.get_response_async(user_id, message_text)
+            finally:
+                self._release_admission()
+            await asyncio.to_thread(self._schedule_quantum_sync, user_id, message_text, reply_text)
+        return reply_text
+
+    async def _send_reply_async(self, reply_token, message_text):
+        """發送回覆訊息"""
+        try:
+            # 檢查訊息長度
+            if len(message_text) > 5000:
+                message_text = message_text[:4997] + "..."
+
+            await self.async_line_bot_api.reply_message(
+                reply_token,
+                TextSendMessage(text=message_text)
+            )
+        except LineBotApiError as e:
+            logger.error(f"Failed to send reply: {e}")
+
+    async def _send_push_async(self, to, message_text):
+        """以 push 訊息送出（reply token 已使用或過期時）"""
+        try:
+            if len(message_text) > 5000:
+                message_text = message_text[:4997] + "..."
+
+            await self.async_line_bot_api.push_message(to, TextSendMessage(text=message_text))
+        except LineBotApiError as e:
+            logger.error(f"Failed to push message: {e}")
+
+    def get_webhook_stats(self) -> dict:
+        """取得 webhook 處理狀態（供健康檢查使用）"""
+        stats = super().get_webhook_stats()
+        stats["asgi"] = {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "events_completed": self.events_completed,
+            "active_user_lanes": len(self._user_locks)
+        }
+        return stats
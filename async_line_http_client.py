@@ -0,0 +1,62 @@
+"""
+LINE Messaging API 的非同步連線池 HTTP client（ASGI 版本使用）
+獨立成模組，Flask 版本開機時不需要載入 aiohttp
+"""
+import time
+from typing import Optional
+
+import aiohttp
+from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient, AiohttpAsyncHttpResponse
+
+from config import Config
+from line_http_client import HttpLatencyMetrics, get_line_timeout, get_operation_name
+
+
+class PooledAiohttpAsyncHttpClient(AiohttpAsyncHttpClient):
+    """AiohttpAsyncHttpClient 加上延遲統計，並把逾時設定轉成 aiohttp.ClientTimeout"""
+
+    def __init__(self, session, timeout=None, metrics: Optional[HttpLatencyMetrics] = None):
+        super().__init__(session, timeout=timeout if timeout is not None else get_line_timeout())
+        self.metrics = metrics
+
+    async def _request(self, method: str, url: str, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        elif isinstance(timeout, (int, float)):
+            timeout = aiohttp.ClientTimeout(total=timeout)
+
+        start = time.monotonic()
+        try:
+            response = await self.session.request(method, url, timeout=timeout, **kwargs)
+        except Exception:
+            if self.metrics:
+                self.metrics.record(get_operation_name(url), time.monotonic() - start, error=True)
+            raise
+        if self.metrics:
+            self.metrics.record(get_operation_name(url), time.monotonic() - start,
+                                status=response.status)
+        return AiohttpAsyncHttpResponse(response)
+
+    async def get(self, url, headers=None, params=None, timeout=None):
+        return await self._request("GET", url, headers=headers, params=params, timeout=timeout)
+
+    async def post(self, url, headers=None, data=None, timeout=None):
+        return await self._request("POST", url, headers=headers, data=data, timeout=timeout)
+
+    async def delete(self, url, headers=None, data=None, timeout=None):
+        return await self._request("DELETE", url, headers=headers, data=data, timeout=timeout)
+
+    async def put(self, url, headers=None, data=None, timeout=None):
+        return await self._request("PUT", url, headers=headers, data=data, timeout=timeout)
+
+
+def create_aiohttp_session():
+    """建立保持連線的 aiohttp session（必須在事件迴圈中呼叫）"""
+    connector = aiohttp.TCPConnector(
+        limit=Config.LINE_HTTP_POOL_SIZE,
+        keepalive_timeout=Config.LINE_HTTP_KEEPALIVE
+    )
+    return aiohttp.ClientSession(connector=connector)
@@ -1,6 +1,7 @@
 import os
 import json
 import logging
+import threading
 from datetime import datetime, timedelta
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
@@ -11,11 +12,16 @@ from googleapiclient.errors import HttpError
 logger = logging.getLogger(__name__)
 
 class CalendarService:
-    """Google Calendar 服務整合"""
+    """Google Calendar 服務整合
+
+    googleapiclient 的 client（底層的 httplib2.Http）不是 thread-safe，
+    每個執行緒各自建立 client（見 service 屬性），日曆工具可以並行執行
+    """
     
     def __init__(self):
         """初始化 Google Calendar 服務"""
-        self.service = None
+        self._credentials = None
+        self._local = threading.local()
         # 服務帳戶需要使用具體的日曆 ID，而非 'primary'
         self.calendar_id = os.getenv('GOOGLE_CALENDAR_ID', 'primary')
         self._initialize_service()
@@ -36,12 +42,27 @@ class CalendarService:
                 logger.warning("Google Calendar credentials not found. Calendar features will be limited.")
                 return
             
-            self.service = build('calendar', 'v3', credentials=credentials)
+            self._local.service = self._build_service(credentials)
+            self._credentials = credentials
             logger.info("Google Calendar service initialized successfully")
             
         except Exception as e:
             logger.error(f"Failed to initialize Google Calendar service: {str(e)}")
     
+    @staticmethod
+    def _build_service(credentials):
+        return build('calendar', 'v3', credentials=credentials, cache_discovery=False)
+    
+    @property
+    def service(self):
+        """目前執行緒的 Calendar API client（第一次使用時建立；沒有憑證時為 None）"""
+        if self._credentials is None:
+            return None
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self._build_service(self._credentials)
+        return service
+    
     def list_events(self, max_results=10, time_min=None):
         """列出即將到來的行程"""
         if not self.service:
@@ -0,0 +1,228 @@
+"""
+OpenAI 相容的聊天端點（LibreChat 自訂端點使用）
+POST /v1/chat/completions 以 server-sent events 逐段送出 Gemini 的回應，
+model 欄位選擇人格（persona-cruz、persona-fire…），生成前注入該人格的相關量子記憶。
+"""
+import json
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from config import Config
+from line_http_client import HttpLatencyMetrics
+from structured_logging import access_log
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "persona-cruz-ai"
+
+# model ID -> 量子記憶的人格 ID（None 為預設助理）
+PERSONA_MODELS = {
+    DEFAULT_MODEL: None,
+    "persona-cruz": "cruz",
+    "persona-wuji": "wuji",
+    "persona-wood": "wood",
+    "persona-fire": "fire",
+    "persona-earth": "earth",
+    "persona-metal": "metal",
+    "persona-water": "water"
+}
+
+
+class ChatMessage(BaseModel):
+    """OpenAI 格式的訊息；content 可以是字串或 [{"type": "text", "text": ...}]"""
+    role: str
+    content: Union[str, List[Dict], None] = None
+
+
+class ChatCompletionRequest(BaseModel):
+    """OpenAI 格式的聊天請求（其餘取樣參數忽略）"""
+    model: str = DEFAULT_MODEL
+    messages: List[ChatMessage] = Field(..., min_length=1)
+    stream: bool = False
+    user: Optional[str] = None
+
+
+def content_text(content: Union[str, List[Dict], None]) -> str:
+    """取出訊息中的文字部分"""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+
+def parse_messages(messages: List[ChatMessage]) -> Tuple[str, List[Dict], str]:
+    """把 OpenAI 訊息拆成 (系統指示, 先前的對話, 最新的使用者訊息)
+
+    先前的對話轉成 [{'user': ..., 'assistant': ...}]，與 LINE 的對話歷史格式相同。
+    """
+    instructions = []
+    history: List[Dict] = []
+    pending_user: Optional[str] = None
+    message = ""
+
+    last_user = max((i for i, m in enumerate(messages) if m.role == "user"), default=None)
+    if last_user is None:
+        raise ValueError("messages must contain a user message")
+
+    for index, item in enumerate(messages):
+        text = content_text(item.content)
+        if item.role in ("system", "developer"):
+            if text:
+                instructions.append(text)
+        elif index == last_user:
+            message = text
+        elif item.role == "user":
+            if pending_user is not None:
+                history.append({'user': pending_user, 'assistant': ""})
+            pending_user = text
+        elif item.role == "assistant":
+            history.append({'user': pending_user or "", 'assistant': text})
+            pending_user = None
+    if pending_user is not None:
+        history.append({'user': pending_user, 'assistant': ""})
+
+    return "\n\n".join(instructions), history, message
+
+
+def format_sse(payload: Union[Dict, str]) -> str:
+    """一個 server-sent event"""
+    data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    return f"data: {data}\n\n"
+
+
+class ChatCompletionService:
+    """把 GeminiService 的串流包成 OpenAI 的 chat.completion(.chunk) 格式"""
+
+    def __init__(self, gemini_service):
+        self.gemini_service = gemini_service
+        # ttft：收到請求到送出第一段文字；completion：整段回應
+        self.metrics = HttpLatencyMetrics()
+
+        # 統計資料
+        self.requests = 0
+        self.streams = 0
+        self.disconnects = 0
+
+    def resolve_persona(self, model: str) -> Optional[str]:
+        if model not in PERSONA_MODELS:
+            raise ValueError(f"Unknown model: {model}")
+        return PERSONA_MODELS[model]
+
+    def list_models(self) -> Dict:
+        return {
+            "object": "list",
+            "data": [{"id": model, "object": "model", "owned_by": "persona-cruz-ai"}
+                     for model in PERSONA_MODELS]
+        }
+
+    async def _text_chunks(self, request: ChatCompletionRequest, user_id: str) -> AsyncIterator[str]:
+        persona = self.resolve_persona(request.model)
+        instructions, history, message = parse_messages(request.messages)
+        self.requests += 1
+        start = time.monotonic()
+        first = True
+        async for text in self.gemini_service.stream_chat_async(
+                user_id, message, history=history, persona=persona, instructions=instructions):
+            if first:
+                first = False
+                self.metrics.record("ttft", time.monotonic() - start)
+            yield text
+        self.metrics.record("completion", time.monotonic() - start)
+
+    async def stream(self, request: ChatCompletionRequest, user_id: str) -> AsyncIterator[str]:
+        """逐段產生 chat.completion.chunk 事件，最後送出 [DONE]"""
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(delta: Dict, finish_reason: Optional[str] = None) -> str:
+            return format_sse({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": request.model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            })
+
+        self.streams += 1
+        # 角色先送出，標頭與第一個事件不必等記憶檢索與模型
+        yield chunk({"role": "assistant", "content": ""})
+        try:
+            async for text in self._text_chunks(request, user_id):
+                yield chunk({"content": text})
+        except BaseException:
+            # 用戶端中途斷線：停止讀取 Gemini 的串流
+            self.disconnects += 1
+            raise
+        yield chunk({}, "stop")
+        yield format_sse("[DONE]")
+
+    async def complete(self, request: ChatCompletionRequest, user_id: str) -> Dict:
+        """非串流請求：收集完整回應後一次回傳"""
+        text = "".join([chunk async for chunk in self._text_chunks(request, user_id)])
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }]
+        }
+
+    def stats(self) -> Dict:
+        """取得請求數、斷線數與首字延遲"""
+        return {
+            "requests": self.requests,
+            "streams": self.streams,
+            "disconnects": self.disconnects,
+            "latency": self.metrics.stats()
+        }
+
+
+def create_chat_router(service: ChatCompletionService) -> APIRouter:
+    """建立 /v1 路由；需以 Authorization: Bearer CHAT_API_KEY 存取"""
+    router = APIRouter(prefix="/v1")
+
+    def authorize(request: Request):
+        # 未設定金鑰時端點停用
+        if not Config.CHAT_API_KEY:
+            raise HTTPException(status_code=404)
+        if request.headers.get("Authorization") != f"Bearer {Config.CHAT_API_KEY}":
+            raise HTTPException(status_code=401, detail="Invalid API key")
+
+    @router.get("/models", dependencies=[Depends(authorize)])
+    async def list_models():
+        """可選的人格（LibreChat 的模型清單）"""
+        return service.list_models()
+
+    @router.post("/chat/completions", dependencies=[Depends(authorize)])
+    async def chat_completions(body: ChatCompletionRequest):
+        """OpenAI 相容的聊天；stream=true 時以 server-sent events 逐段回傳"""
+        try:
+            service.resolve_persona(body.model)
+            parse_messages(body.messages)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        user_id = body.user or "librechat"
+        access_log.log("chat", "completion_request", user_id=user_id, model=body.model,
+                       stream=body.stream, messages=len(body.messages))
+        if not body.stream:
+            return await service.complete(body, user_id)
+        return StreamingResponse(
+            service.stream(body, user_id),
+            media_type="text/event-stream",
+            # 關閉反向代理的緩衝，每段文字立即送到用戶端
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    return router
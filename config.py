@@ -22,6 +22,55 @@ class Config:
     
     # Gemini 模型設定
     GEMINI_MODEL = 'gemini-1.5-flash'
+    # Gemini 呼叫的全域併發上限、單次回應期限與等待名額的期限（秒）
+    GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 8))
+    GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', 25))
+    GEMINI_QUEUE_TIMEOUT = float(os.getenv('GEMINI_QUEUE_TIMEOUT', 5))
+    # 對沖請求：第一個請求超過近期延遲的百分位仍未回應時，再送一個相同的請求
+    GEMINI_HEDGE_ENABLED = os.getenv('GEMINI_HEDGE_ENABLED', 'false').lower() == 'true'
+    GEMINI_HEDGE_PERCENTILE = float(os.getenv('GEMINI_HEDGE_PERCENTILE', 0.95))
+    GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv('GEMINI_HEDGE_MIN_SAMPLES', 20))
+    # 暫時性錯誤的重試；重試與對沖共用預算（每個請求存入 RATIO 個，每秒另補 MIN_PER_SECOND 個）
+    GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', 2))
+    GEMINI_RETRY_BASE_DELAY = float(os.getenv('GEMINI_RETRY_BASE_DELAY', 0.2))
+    GEMINI_RETRY_BUDGET_RATIO = float(os.getenv('GEMINI_RETRY_BUDGET_RATIO', 0.1))
+    GEMINI_RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('GEMINI_RETRY_BUDGET_MIN_PER_SECOND', 0.2))
+    # Function calling：同一輪的多個工具並行執行，每個工具有期限；工具迴圈最多幾輪模型呼叫
+    GEMINI_MAX_TOOL_STEPS = int(os.getenv('GEMINI_MAX_TOOL_STEPS', 3))
+    TOOL_MAX_WORKERS = int(os.getenv('TOOL_MAX_WORKERS', 8))
+    TOOL_TIMEOUT = float(os.getenv('TOOL_TIMEOUT', 8))
+    TOOL_TIMEOUTS = os.getenv('TOOL_TIMEOUTS', '')  # 個別工具的期限，例如 "quantum_search=5"
+    # 本地意圖路由：信心達到門檻的行程查詢、量子記憶搜尋/儲存直接執行工具；SHADOW_RATE 比例在背景與 Gemini 比對
+    INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', 'false').lower() == 'true'
+    INTENT_ROUTER_THRESHOLD = float(os.getenv('INTENT_ROUTER_THRESHOLD', 0.8))
+    INTENT_ROUTER_SHADOW_RATE = float(os.getenv('INTENT_ROUTER_SHADOW_RATE', 0.05))
+    # 語意快取：相似度達到門檻的問題直接使用先前的回應
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.9))
+    SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', 86400))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 1000))
+    SEMANTIC_CACHE_SAMPLE_RATE = float(os.getenv('SEMANTIC_CACHE_SAMPLE_RATE', 0.05))
+    SEMANTIC_CACHE_EMBEDDER = os.getenv('SEMANTIC_CACHE_EMBEDDER', 'local')  # local 或 gemini
+    # 每次請求的 prompt token 預算；較舊的對話併入滾動摘要（gemini 或 local）
+    CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', 2000))
+    CONTEXT_MAX_SYSTEM_TOKENS = int(os.getenv('CONTEXT_MAX_SYSTEM_TOKENS', 800))
+    CONTEXT_MAX_MESSAGE_TOKENS = int(os.getenv('CONTEXT_MAX_MESSAGE_TOKENS', 600))
+    CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv('CONTEXT_SUMMARY_MAX_TOKENS', 200))
+    CONTEXT_SUMMARY_BATCH = int(os.getenv('CONTEXT_SUMMARY_BATCH', 4))
+    CONTEXT_SUMMARY_MODE = os.getenv('CONTEXT_SUMMARY_MODE', 'local')
+    CONTEXT_MAX_SUMMARIES = int(os.getenv('CONTEXT_MAX_SUMMARIES', 10000))
+    # 對話歷史的記憶體上限與閒置時間；移出的對話存到 SPILL_PATH（SQLite，留空則直接丟棄）
+    CONVERSATION_MAX_MEMORY_MB = float(os.getenv('CONVERSATION_MAX_MEMORY_MB', 32))
+    CONVERSATION_IDLE_TTL = int(os.getenv('CONVERSATION_IDLE_TTL', 3600))
+    CONVERSATION_MAX_TURNS = int(os.getenv('CONVERSATION_MAX_TURNS', 50))
+    CONVERSATION_SPILL_PATH = os.getenv('CONVERSATION_SPILL_PATH', '/tmp/conversation_history.sqlite3')
+    CONVERSATION_SPILL_TTL = int(os.getenv('CONVERSATION_SPILL_TTL', 7 * 86400))
+    # 使用者狀態（人格模式、目前元素）：memory 只在單一 worker 有效；
+    # postgres 讓所有 worker 共用狀態與對話歷史，不需要 sticky routing
+    # （滾動摘要仍是每個 worker 各自保存，見 ContextBuilder）
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory').lower()
+    SESSION_TTL = int(os.getenv('SESSION_TTL', 7 * 86400))
+    SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', 100000))
     
     # 資料庫設定 (pgvector)
     DATABASE_URL = os.getenv('DATABASE_URL')
@@ -30,6 +79,89 @@ class Config:
         DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://')
     USE_QUANTUM_DATABASE = bool(DATABASE_URL)  # 自動偵測是否使用資料庫
     
+    # 量子記憶場快照：開機時直接還原，背景再與資料庫比對
+    QUANTUM_SNAPSHOT_ENABLED = os.getenv('QUANTUM_SNAPSHOT_ENABLED', 'false').lower() == 'true'
+    QUANTUM_SNAPSHOT_FILE = os.getenv('QUANTUM_SNAPSHOT_FILE', '/tmp/quantum_bridge_snapshot.json')
+    QUANTUM_SNAPSHOT_INTERVAL = float(os.getenv('QUANTUM_SNAPSHOT_INTERVAL', 300))  # 最短寫入間隔（秒）
+    
+    # 開機後在背景預先載入 Gemini 模型與 Calendar（不擋 worker 開機）
+    SERVICE_PREWARM = os.getenv('SERVICE_PREWARM', 'true').lower() == 'true'
+    # gunicorn preload 模式：在 master 載入一次共用資料（語料庫、五行角色、量子記憶），
+    # worker 以 copy-on-write 共用；需搭配 gunicorn.conf.py（讀取同一個環境變數）
+    PRELOAD_APP = os.getenv('PRELOAD_APP', 'false').lower() == 'true'
+    
+    # Webhook 非同步處理設定
+    # 開啟後 /callback 驗證簽名、放入佇列後立即回應 200
+    # （佇列已滿時丟棄事件，不在請求中處理）
+    WEBHOOK_ASYNC_MODE = os.getenv('WEBHOOK_ASYNC_MODE', 'false').lower() == 'true'
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 100))
+    # 同步模式下，一次 webhook 含多個事件時平行處理並等待的期限（秒）
+    WEBHOOK_SYNC_DEADLINE = float(os.getenv('WEBHOOK_SYNC_DEADLINE', 25))
+    
+    # 回覆後背景管線（量子同步、五行指標、語料寫檔）
+    # 量子記憶不是執行緒安全的，預設只用一個工作執行緒依序處理
+    POST_REPLY_WORKERS = int(os.getenv('POST_REPLY_WORKERS', 1))
+    POST_REPLY_QUEUE_SIZE = int(os.getenv('POST_REPLY_QUEUE_SIZE', 200))
+    POST_REPLY_TIME_BUDGET = float(os.getenv('POST_REPLY_TIME_BUDGET', 30))
+    
+    # 准入控制：每個使用者/群組與全域的 token bucket（refill 為每秒補充數量）
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'false').lower() == 'true'
+    RATE_LIMIT_USER_BURST = float(os.getenv('RATE_LIMIT_USER_BURST', 5))
+    RATE_LIMIT_USER_REFILL = float(os.getenv('RATE_LIMIT_USER_REFILL', 0.2))
+    RATE_LIMIT_GLOBAL_BURST = float(os.getenv('RATE_LIMIT_GLOBAL_BURST', 50))
+    RATE_LIMIT_GLOBAL_REFILL = float(os.getenv('RATE_LIMIT_GLOBAL_REFILL', 5))
+    # 同時進行的 Gemini 對話上限（0 表示不限制）
+    RATE_LIMIT_MAX_IN_FLIGHT = int(os.getenv('RATE_LIMIT_MAX_IN_FLIGHT', 32))
+    RATE_LIMIT_USER_MESSAGE = os.getenv('RATE_LIMIT_USER_MESSAGE', '你傳得有點快，讓我喘口氣，稍等一下再聊 🙏')
+    RATE_LIMIT_BUSY_MESSAGE = os.getenv('RATE_LIMIT_BUSY_MESSAGE', '現在聊天的人有點多，請過一會兒再試一次 🙏')
+    
+    # 結構化日誌取樣（格式：route=rate,route=rate），完整內容只留在記憶體環形緩衝區
+    LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', 'callback=0.1,message=0.1,gemini=0.05')
+    LOG_SAMPLE_DEFAULT = float(os.getenv('LOG_SAMPLE_DEFAULT', 1.0))
+    LOG_RING_BUFFER_SIZE = int(os.getenv('LOG_RING_BUFFER_SIZE', 200))
+    # /debug/logs 端點的存取權杖（未設定時端點停用）
+    DEBUG_LOG_TOKEN = os.getenv('DEBUG_LOG_TOKEN')
+    
+    # OpenAI 相容的 /v1/chat/completions（LibreChat 使用；未設定 CHAT_API_KEY 時端點停用）
+    CHAT_API_KEY = os.getenv('CHAT_API_KEY')
+    CHAT_STREAM_TIMEOUT = float(os.getenv('CHAT_STREAM_TIMEOUT', 60))
+    # 生成前取出的相關量子記憶；超過期限就不等，先開始生成
+    CHAT_MEMORY_TIMEOUT = float(os.getenv('CHAT_MEMORY_TIMEOUT', 0.5))
+    CHAT_MEMORY_LIMIT = int(os.getenv('CHAT_MEMORY_LIMIT', 3))
+    
+    # 回覆期限：超過預算先送暫時回覆，完整答案改用 push 送出（push 會計入訊息額度）
+    REPLY_DEADLINE_ENABLED = os.getenv('REPLY_DEADLINE_ENABLED', 'false').lower() == 'true'
+    REPLY_DEADLINE_BUDGET = float(os.getenv('REPLY_DEADLINE_BUDGET', 20))
+    REPLY_INTERIM_MESSAGE = os.getenv('REPLY_INTERIM_MESSAGE', '讓我想一下，完整的回覆馬上傳給你 🙏')
+    # 送出暫時回覆的執行緒數（與期限排程分開，慢的回覆不會延誤其他期限）
+    REPLY_INTERIM_WORKERS = int(os.getenv('REPLY_INTERIM_WORKERS', 4))
+    
+    # LINE API 連線池（保持連線，避免每次回覆重新 TLS 握手）
+    LINE_HTTP_POOL_SIZE = int(os.getenv('LINE_HTTP_POOL_SIZE', 10))
+    LINE_HTTP_CONNECT_TIMEOUT = float(os.getenv('LINE_HTTP_CONNECT_TIMEOUT', 3))
+    LINE_HTTP_READ_TIMEOUT = float(os.getenv('LINE_HTTP_READ_TIMEOUT', 10))
+    LINE_HTTP_KEEPALIVE = float(os.getenv('LINE_HTTP_KEEPALIVE', 30))
+    # LINE API 位址（離線壓測時指向 standin_server.py）
+    LINE_API_ENDPOINT = os.getenv('LINE_API_ENDPOINT', 'https://api.line.me')
+    
+    # Gemini 後端：live、record（錄製到 GEMINI_STANDIN_FILE）、replay（回放錄製檔）或 synthetic（離線產生）
+    GEMINI_BACKEND = os.getenv('GEMINI_BACKEND', 'live')
+    GEMINI_STANDIN_FILE = os.getenv('GEMINI_STANDIN_FILE', 'data/gemini_recordings.jsonl')
+    GEMINI_STANDIN_SPEED = float(os.getenv('GEMINI_STANDIN_SPEED', 1.0))  # 回放延遲除以此倍數
+    # synthetic 模式：延遲中位數與離散程度（對數常態）、暫時性錯誤比例、可用工具時回傳 function call 的比例
+    GEMINI_STANDIN_LATENCY_MS = float(os.getenv('GEMINI_STANDIN_LATENCY_MS', 800))
+    GEMINI_STANDIN_LATENCY_SIGMA = float(os.getenv('GEMINI_STANDIN_LATENCY_SIGMA', 0.5))
+    GEMINI_STANDIN_ERROR_RATE = float(os.getenv('GEMINI_STANDIN_ERROR_RATE', 0.0))
+    GEMINI_STANDIN_FUNCTION_CALL_RATE = float(os.getenv('GEMINI_STANDIN_FUNCTION_CALL_RATE', 0.5))
+    GEMINI_STANDIN_EMBED_LATENCY_MS = float(os.getenv('GEMINI_STANDIN_EMBED_LATENCY_MS', 80))
+    
+    # Webhook 重送去重（memory：程序內；postgres：所有 worker 共用）
+    WEBHOOK_DEDUP_ENABLED = os.getenv('WEBHOOK_DEDUP_ENABLED', 'true').lower() == 'true'
+    WEBHOOK_DEDUP_BACKEND = os.getenv('WEBHOOK_DEDUP_BACKEND', 'memory').lower()
+    WEBHOOK_DEDUP_TTL = float(os.getenv('WEBHOOK_DEDUP_TTL', 3600))
+    WEBHOOK_DEDUP_MAX_ENTRIES = int(os.getenv('WEBHOOK_DEDUP_MAX_ENTRIES', 10000))
+    
     @classmethod
     def validate(cls):
         """驗證必要的環境變數是否存在"""
@@ -0,0 +1,283 @@
+"""
+有 token 預算的對話上下文
+每次呼叫 Gemini 的 prompt 不超過預算：系統提示詞與使用者訊息過長時截斷，
+放不進預算的舊對話由每位使用者的滾動摘要代替，摘要在回覆送出後才更新。
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from structured_logging import access_log
+
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARK = "…"
+
+
+def estimate_tokens(text: str) -> int:
+    """估算 token 數：中文等非 ASCII 字元約 1 字 1 token，英數約 4 字元 1 token
+
+    Gemini 的 count_tokens 需要呼叫 API，不適合放在每次請求的路徑上；
+    實際用量由回應的 usage_metadata 記錄，可用來校正估算。
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "head") -> str:
+    """截斷文字到 max_tokens 以內；keep="tail" 時保留結尾"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分搜尋可保留的最多字元數
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        part = text[:mid] if keep == "head" else text[-mid:]
+        if estimate_tokens(part) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    if low == 0:
+        return ""
+    return text[:low] + TRUNCATION_MARK if keep == "head" else TRUNCATION_MARK + text[-low:]
+
+
+def format_turn(conv: Dict) -> str:
+    return f"使用者：{conv['user']}\n助理：{conv['assistant']}\n"
+
+
+def local_summary(previous: str, turns: List[Dict], max_chars: int = 40) -> str:
+    """不呼叫 API 的摘要：保留每輪使用者問題的開頭"""
+    topics = [conv['user'][:max_chars] for conv in turns]
+    return "；".join(([previous] if previous else []) + topics)
+
+
+@dataclass
+class BuiltContext:
+    """一次請求的上下文與 token 用量
+
+    history_digest：放進 prompt 的摘要與對話歷史的雜湊（沒有歷史時為空字串）
+    """
+    text: str
+    tokens: int
+    history_turns: int
+    summary_tokens: int
+    truncated: bool
+    history_digest: str = ""
+
+
+class _SummaryState:
+    """單一使用者的滾動摘要"""
+
+    def __init__(self):
+        self.text = ""
+        self.covered = -1  # 已併入摘要的最後一輪 turn 編號
+        self.refreshing_since: Optional[float] = None
+
+
+class ContextBuilder:
+    """依 token 預算組合系統提示詞、對話摘要、最近對話與使用者訊息
+
+    max_tokens：整個 prompt 的預算
+    max_system_tokens / max_message_tokens：系統提示詞與使用者訊息各自的上限
+    summary_batch：累積這麼多輪未摘要的舊對話才更新一次摘要
+    summarizer(previous, turns) -> str：產生新的摘要（在背景執行）
+    submit(name, fn, *args)：把摘要更新交給背景執行（例如回覆後管線）
+    refresh_timeout：背景工作被丟棄或卡住時，超過這個秒數後允許重新排程
+    max_summaries：最多保留幾位使用者的摘要，超過時移除最久沒用到的
+
+    摘要只存在這個程序的記憶體中：多個 worker 時，同一位使用者的摘要在各 worker 各自累積。
+    """
+
+    def __init__(self, max_tokens: int = 2000, max_system_tokens: int = 800,
+                 max_message_tokens: int = 600, max_turns: int = 10,
+                 summary_max_tokens: int = 200, summary_batch: int = 4,
+                 summarizer: Callable[[str, List[Dict]], str] = local_summary,
+                 submit: Optional[Callable] = None, refresh_timeout: float = 120.0,
+                 max_summaries: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_tokens = max_tokens
+        self.max_system_tokens = max_system_tokens
+        self.max_message_tokens = max_message_tokens
+        self.max_turns = max_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.summary_batch = max(1, summary_batch)
+        self.summarizer = summarizer
+        self.submit = submit
+        self.refresh_timeout = refresh_timeout
+        self.max_summaries = max(1, max_summaries)
+        self._clock = clock
+        self._summaries: "OrderedDict[str, _SummaryState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 統計資料
+        self.requests = 0
+        self.total_tokens = 0
+        self.peak_tokens = 0
+        self.truncated_requests = 0
+        self.summary_refreshes = 0
+        self.summary_failures = 0
+        self.summaries_evicted = 0
+        self.usage_reports = 0
+        self.total_prompt_tokens = 0
+
+    def build(self, user_id: str, system_prompt: str, history: List[Dict],
+              message: str, summarize: bool = True) -> BuiltContext:
+        """組合上下文；放不進預算的舊對話改由摘要代替
+
+        summarize=False：呼叫端每次自帶完整歷史（沒有 turn 編號），不讀也不建立摘要，
+        放不進預算的舊對話直接略過
+        """
+        system = truncate_to_tokens(system_prompt, self.max_system_tokens)
+        # 使用者訊息過長時保留結尾（通常是真正的問題）
+        user_message = truncate_to_tokens(message, self.max_message_tokens, keep="tail")
+        head = system + "\n\n"
+        tail = f"使用者：{user_message}\n助理："
+        budget = self.max_tokens - estimate_tokens(head) - estimate_tokens(tail)
+        truncated = system != system_prompt or user_message != message
+
+        summary = ""
+        if summarize:
+            with self._lock:
+                state = self._summaries.get(user_id)
+                if state is not None:
+                    self._summaries.move_to_end(user_id)
+                    summary = state.text
+
+        summary_block = f"先前對話摘要：{summary}\n\n" if summary else ""
+        summary_tokens = estimate_tokens(summary_block)
+        if summary_tokens > budget:
+            summary_block, summary_tokens = "", 0
+        budget -= summary_tokens
+
+        # 從最新的對話往回放，直到預算或輪數用完
+        recent: List[str] = []
+        for conv in reversed(history[-self.max_turns:]):
+            line = format_turn(conv)
+            cost = estimate_tokens(line)
+            if cost > budget:
+                truncated = True
+                break
+            recent.append(line)
+            budget -= cost
+        recent.reverse()
+
+        older = history[:len(history) - len(recent)]
+        if older and summarize:
+            self._schedule_refresh(user_id, older)
+
+        history_block = summary_block + "".join(recent)
+        text = head + history_block + tail
+        history_digest = (hashlib.sha1(history_block.encode("utf-8")).hexdigest()[:16]
+                          if history_block else "")
+        built = BuiltContext(text=text, tokens=estimate_tokens(text), history_turns=len(recent),
+                             summary_tokens=summary_tokens, truncated=truncated,
+                             history_digest=history_digest)
+        self._record(user_id, built)
+        return built
+
+    def _record(self, user_id: str, built: BuiltContext):
+        with self._lock:
+            self.requests += 1
+            self.total_tokens += built.tokens
+            self.peak_tokens = max(self.peak_tokens, built.tokens)
+            if built.truncated:
+                self.truncated_requests += 1
+        access_log.log("context", "built", user_id=user_id, tokens=built.tokens,
+                       history_turns=built.history_turns, summary_tokens=built.summary_tokens,
+                       truncated=built.truncated)
+
+    def record_usage(self, response):
+        """記錄 Gemini 回報的實際 prompt token 數"""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        if isinstance(prompt_tokens, int):
+            with self._lock:
+                self.usage_reports += 1
+                self.total_prompt_tokens += prompt_tokens
+
+    # ---- 滾動摘要 ----
+
+    def _schedule_refresh(self, user_id: str, older: List[Dict]):
+        """未摘要的舊對話累積到 summary_batch 輪時，在背景更新摘要"""
+        now = self._clock()
+        with self._lock:
+            state = self._summaries.get(user_id)
+            covered = state.covered if state else -1
+            pending = [conv for conv in older if conv.get('turn', -1) > covered]
+            if len(pending) < self.summary_batch:
+                return
+            if state is None:
+                # 真的要摘要時才建立狀態
+                state = self._summaries[user_id] = _SummaryState()
+                self._evict_locked()
+            elif state.refreshing_since is not None and now - state.refreshing_since < self.refresh_timeout:
+                return
+            state.refreshing_since = now
+            previous = state.text
+
+        if self.submit is None:
+            self._refresh(user_id, state, previous, pending)
+        elif self.submit("context_summary", self._refresh, user_id, state, previous, pending) is False:
+            # 背景佇列已滿，下一次請求再試
+            with self._lock:
+                state.refreshing_since = None
+
+    def _evict_locked(self):
+        """超過 max_summaries 時移除最久沒用到的摘要（呼叫端持有 _lock）"""
+        while len(self._summaries) > self.max_summaries:
+            self._summaries.popitem(last=False)
+            self.summaries_evicted += 1
+
+    def _refresh(self, user_id: str, state: _SummaryState, previous: str, pending: List[Dict]):
+        try:
+            text = self.summarizer(previous, pending)
+        except Exception as e:
+            logger.warning(f"Conversation summary failed for {user_id}: {e}")
+            text = None
+
+        with self._lock:
+            state.refreshing_since = None
+            if text is None:
+                self.summary_failures += 1
+                return
+            # 摘要產生期間使用者清除了歷史，丟棄結果
+            if self._summaries.get(user_id) is not state:
+                return
+            state.text = truncate_to_tokens(text.strip(), self.summary_max_tokens, keep="tail")
+            state.covered = pending[-1].get('turn', state.covered)
+            self.summary_refreshes += 1
+
+    def summary(self, user_id: str) -> str:
+        with self._lock:
+            state = self._summaries.get(user_id)
+            return state.text if state else ""
+
+    def clear(self, user_id: str):
+        """清除使用者的摘要（清除對話歷史時呼叫）"""
+        with self._lock:
+            self._summaries.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        """取得每次請求的 token 用量與摘要統計"""
+        with self._lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "requests": self.requests,
+                "avg_tokens": round(self.total_tokens / self.requests, 1) if self.requests else 0.0,
+                "peak_tokens": self.peak_tokens,
+                "truncated_requests": self.truncated_requests,
+                "avg_prompt_tokens_reported": (round(self.total_prompt_tokens / self.usage_reports, 1)
+                                               if self.usage_reports else None),
+                "summaries": len(self._summaries),
+                "summary_refreshes": self.summary_refreshes,
+                "summary_failures": self.summary_failures,
+                "summaries_evicted": self.summaries_evicted
+            }
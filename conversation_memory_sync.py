@@ -2,6 +2,7 @@
 對話記憶同步系統
 將開發對話自動同步到 CRUZ 記憶庫
 """
+import copy
 import json
 import os
 from datetime import datetime
@@ -9,6 +10,8 @@ from typing import Dict, List, Optional
 import re
 import logging
 
+from fork_safety import load_shared_json, remember_shared_json
+
 logger = logging.getLogger(__name__)
 
 class ConversationMemorySync:
@@ -22,11 +25,20 @@ class ConversationMemorySync:
     def load_corpus(self):
         """載入現有語料庫"""
         try:
-            with open(self.corpus_path, 'r', encoding='utf-8') as f:
-                self.corpus = json.load(f)
+            # 與 CruzPersonaSystem 共用同一份已解析的語料庫（唯讀，修改前先複製）
+            self.corpus = load_shared_json(self.corpus_path)
+            self._corpus_shared = True
         except FileNotFoundError:
             logger.warning(f"Corpus file not found at {self.corpus_path}")
             self.corpus = self._create_empty_corpus()
+            self._corpus_shared = False
+    
+    def _writable_corpus(self) -> Dict:
+        """要修改語料庫時先取得私有副本，共用的那份維持唯讀"""
+        if self._corpus_shared:
+            self.corpus = copy.deepcopy(self.corpus)
+            self._corpus_shared = False
+        return self.corpus
     
     def _create_empty_corpus(self) -> Dict:
         """創建空語料庫結構"""
@@ -61,6 +73,7 @@ class ConversationMemorySync:
         
         # 分析對話內容
         insights = self._extract_insights(self.conversation_buffer)
+        self._writable_corpus()
         
         # 轉換為 CRUZ 風格的語料
         for insight in insights:
@@ -243,6 +256,9 @@ class ConversationMemorySync:
         try:
             with open(self.corpus_path, 'w', encoding='utf-8') as f:
                 json.dump(self.corpus, f, ensure_ascii=False, indent=2)
+            remember_shared_json(self.corpus_path, self.corpus)
+            # 已交給其他使用者共用，之後再修改要重新複製
+            self._corpus_shared = True
             logger.info(f"Corpus saved to {self.corpus_path}")
         except Exception as e:
             logger.error(f"Failed to save corpus: {e}")
@@ -0,0 +1,379 @@
+"""
+有記憶體上限的對話歷史
+每個 worker 只在記憶體保留最近活躍的使用者：超過記憶體預算時淘汰最久沒用到的使用者，
+閒置太久的使用者也會移出。被移出的對話壓縮後存進本機 SQLite，下次對話時自動載回。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fork_safety import register_fork_hooks
+
+logger = logging.getLogger(__name__)
+
+# 每輪對話在 dict 與字串物件上的大約額外成本（位元組）
+TURN_OVERHEAD_BYTES = 240
+
+# spill 讀寫依使用者分配到這麼多把鎖；同一使用者的讀寫依序進行，不同使用者互不等待
+SPILL_LOCK_STRIPES = 64
+
+
+def estimate_turn_bytes(turn: Dict) -> int:
+    """估算一輪對話佔用的記憶體"""
+    return (TURN_OVERHEAD_BYTES + len(turn.get('user', '').encode('utf-8'))
+            + len(turn.get('assistant', '').encode('utf-8')))
+
+
+class SQLiteSpillStore:
+    """被移出記憶體的對話：每位使用者一列，內容為 zlib 壓縮的 JSON
+
+    同一台機器上的 worker 共用同一個檔案，使用者換到其他 worker 時也能載回歷史。
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 7 * 86400, prune_every: int = 1000,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = max(1, prune_every)
+        self._clock = clock
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        register_fork_hooks(before=self.close, after_in_child=self._reset_after_fork)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "user_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+            self._prune()
+        return self._conn
+
+    def save(self, user_id: str, turns: List[Dict]):
+        data = zlib.compress(json.dumps(turns, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, data, self._clock())
+            )
+            conn.commit()
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune()
+
+    def load(self, user_id: str) -> Optional[List[Dict]]:
+        """取出並刪除使用者的對話；沒有或已過期時回傳 None"""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT data, updated_at FROM conversations WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+            conn.commit()
+        data, updated_at = row
+        if self._clock() - updated_at >= self.ttl_seconds:
+            return None
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+    def delete(self, user_id: str):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+            conn.commit()
+
+    def _prune(self):
+        """刪除超過 TTL 的對話（呼叫前需持有鎖）"""
+        self._conn.execute("DELETE FROM conversations WHERE updated_at < ?",
+                           (self._clock() - self.ttl_seconds,))
+        self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _reset_after_fork(self):
+        """子程序重新建立連線"""
+        self._conn = None
+        self._lock = threading.Lock()
+
+
+class ConversationStore:
+    """以使用者為單位的對話歷史，有全域記憶體預算、LRU 與閒置 TTL
+
+    max_bytes：所有使用者對話在記憶體中的估算總量上限
+    idle_ttl：超過這個秒數沒有對話的使用者移出記憶體
+    spill：被移出的對話存放處（None 時直接丟棄）
+    on_evict(user_id)：使用者被移出記憶體時呼叫（例如釋放對話摘要）
+
+    spill 的 SQLite 讀寫不持有整個 store 的鎖：移出時先在鎖內取下對話，放開鎖後再寫入；
+    載回時先在鎖外讀取，再放回記憶體。同一使用者的讀寫由分段鎖（_spill_lock）保持順序，
+    還沒寫完就再次對話的使用者直接從 _spilling 取回。
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, idle_ttl: float = 3600,
+                 max_turns: int = 50, spill: Optional[SQLiteSpillStore] = None,
+                 on_evict: Optional[Callable[[str], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.spill = spill
+        self.on_evict = on_evict
+        self._clock = clock
+        # user_id -> {"turns": [...], "bytes": int, "last_used": float}，依最近使用排序
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        # 已移出記憶體、還沒寫進 spill 的對話：user_id -> turns
+        self._spilling: Dict[str, List[Dict]] = {}
+        # 已移出、等待放開鎖後寫入 spill 並通知 on_evict 的使用者
+        self._evicted: List[Tuple[str, List[Dict]]] = []
+        self._spill_locks = [threading.Lock() for _ in range(SPILL_LOCK_STRIPES)]
+
+        # 統計資料
+        self.lru_evictions = 0
+        self.idle_evictions = 0
+        self.spilled = 0
+        self.rehydrated = 0
+        self.spill_errors = 0
+
+    def get(self, user_id: str) -> List[Dict]:
+        """取得使用者的對話（不在記憶體時從 spill 載回）；回傳的是複本"""
+        self._ensure_loaded(user_id)
+        with self._lock:
+            session = self._touch(user_id, create=False)
+            turns = list(session["turns"]) if session else []
+        self._flush_evicted()
+        return turns
+
+    def append(self, user_id: str, user_message: str, ai_response: str) -> Dict:
+        """新增一輪對話，turn 編號在使用者的整段對話中遞增"""
+        self._ensure_loaded(user_id)
+        with self._lock:
+            session = self._touch(user_id, create=True)
+            turns = session["turns"]
+            turn = {
+                'turn': turns[-1]['turn'] + 1 if turns else 0,
+                'user': user_message,
+                'assistant': ai_response
+            }
+            turns.append(turn)
+            self._resize(session, estimate_turn_bytes(turn))
+
+            # 限制每個使用者最多保存 max_turns 則對話
+            while len(turns) > self.max_turns:
+                self._resize(session, -estimate_turn_bytes(turns.pop(0)))
+
+            self._evict_over_budget(keep=user_id)
+        self._flush_evicted()
+        return turn
+
+    def clear(self, user_id: str):
+        """清除使用者的對話（包含 spill 中的）"""
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session:
+                self._bytes -= session["bytes"]
+            # 還沒寫入的移出對話不再寫入
+            self._spilling.pop(user_id, None)
+        if self.spill is not None:
+            with self._spill_lock(user_id):
+                try:
+                    self.spill.delete(user_id)
+                except Exception as e:
+                    with self._lock:
+                        self.spill_errors += 1
+                    logger.warning(f"Failed to delete spilled conversation for {user_id}: {e}")
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            return user_id in self._sessions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def _spill_lock(self, user_id: str) -> threading.Lock:
+        return self._spill_locks[hash(user_id) % len(self._spill_locks)]
+
+    def _touch(self, user_id: str, create: bool) -> Optional[Dict]:
+        """取得並標記為最近使用；順便移出閒置的使用者（呼叫前需持有鎖，不做磁碟 I/O）"""
+        now = self._clock()
+        self._evict_idle(now, keep=user_id)
+
+        session = self._sessions.get(user_id)
+        if session is None:
+            if not create:
+                return None
+            session = self._install(user_id, [])
+        self._sessions.move_to_end(user_id)
+        session["last_used"] = now
+        return session
+
+    def _install(self, user_id: str, turns: List[Dict]) -> Dict:
+        """把對話放回記憶體（呼叫前需持有鎖）"""
+        session = {"turns": turns[-self.max_turns:], "bytes": 0, "last_used": self._clock()}
+        self._sessions[user_id] = session
+        self._resize(session, sum(estimate_turn_bytes(t) for t in session["turns"]))
+        self._evict_over_budget(keep=user_id)
+        return session
+
+    def _restore_spilling(self, user_id: str) -> bool:
+        """使用者在移出的對話寫入前又回來：直接放回記憶體（呼叫前需持有鎖）"""
+        turns = self._spilling.pop(user_id, None)
+        if turns is None:
+            return False
+        self._install(user_id, turns)
+        self.rehydrated += 1
+        return True
+
+    def _ensure_loaded(self, user_id: str):
+        """不在記憶體的使用者從 spill 載回；讀取磁碟時不持有整個 store 的鎖"""
+        if self.spill is None:
+            return
+        with self._lock:
+            if user_id in self._sessions or self._restore_spilling(user_id):
+                return
+
+        with self._spill_lock(user_id):
+            # 等鎖期間可能已經有其他請求載回
+            with self._lock:
+                if user_id in self._sessions or self._restore_spilling(user_id):
+                    return
+            turns = self._rehydrate(user_id)
+            if turns:
+                with self._lock:
+                    if user_id not in self._sessions:
+                        self._install(user_id, turns)
+        self._flush_evicted()
+
+    def _resize(self, session: Dict, delta: int):
+        session["bytes"] += delta
+        self._bytes += delta
+
+    def _evict_idle(self, now: float, keep: str):
+        # 依最近使用排序，最前面的最久沒用到；遇到未閒置的就可以停止
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session["last_used"] < self.idle_ttl or user_id == keep:
+                break
+            self._evict(user_id)
+            self.idle_evictions += 1
+
+    def _evict_over_budget(self, keep: str):
+        for user_id in list(self._sessions):
+            if self._bytes <= self.max_bytes:
+                break
+            if user_id == keep:
+                continue
+            self._evict(user_id)
+            self.lru_evictions += 1
+
+    def _evict(self, user_id: str):
+        """移出記憶體（呼叫前需持有鎖）；寫入 spill 與 on_evict 留到放開鎖後（_flush_evicted）"""
+        session = self._sessions.pop(user_id)
+        self._bytes -= session["bytes"]
+        if self.spill is not None and session["turns"]:
+            self._spilling[user_id] = session["turns"]
+        self._evicted.append((user_id, session["turns"]))
+
+    def _flush_evicted(self):
+        """寫入已移出的對話並通知 on_evict（不可持有 store 的鎖）"""
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+        for user_id, turns in evicted:
+            if self.spill is not None and turns:
+                self._spill_one(user_id, turns)
+            if self.on_evict is not None:
+                self.on_evict(user_id)
+
+    def _spill_one(self, user_id: str, turns: List[Dict]):
+        with self._spill_lock(user_id):
+            with self._lock:
+                # 寫入前使用者已經回來或被清除：記憶體中的版本才是最新的
+                if self._spilling.get(user_id) is not turns:
+                    return
+            try:
+                self.spill.save(user_id, turns)
+                saved = True
+            except Exception as e:
+                saved = False
+                logger.warning(f"Failed to spill conversation for {user_id}: {e}")
+            with self._lock:
+                if self._spilling.get(user_id) is turns:
+                    del self._spilling[user_id]
+                if saved:
+                    self.spilled += 1
+                else:
+                    self.spill_errors += 1
+
+    def _rehydrate(self, user_id: str) -> Optional[List[Dict]]:
+        """從 spill 讀取（不可持有 store 的鎖）"""
+        try:
+            turns = self.spill.load(user_id)
+        except Exception as e:
+            with self._lock:
+                self.spill_errors += 1
+            logger.warning(f"Failed to load spilled conversation for {user_id}: {e}")
+            return None
+        if turns:
+            with self._lock:
+                self.rehydrated += 1
+        return turns
+
+    def stats(self) -> Dict:
+        """取得記憶體用量、淘汰與 spill 統計"""
+        with self._lock:
+            return {
+                "users": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "lru_evictions": self.lru_evictions,
+                "idle_evictions": self.idle_evictions,
+                "spilled": self.spilled,
+                "pending_spills": len(self._spilling),
+                "rehydrated": self.rehydrated,
+                "spill_errors": self.spill_errors,
+                "spill_path": self.spill.path if self.spill else None
+            }
+
+
+def create_conversation_store(on_evict: Optional[Callable[[str], None]] = None) -> ConversationStore:
+    """依設定建立對話歷史；CONVERSATION_SPILL_PATH 為空時不寫入磁碟"""
+    from config import Config
+
+    spill = None
+    if Config.CONVERSATION_SPILL_PATH:
+        spill = SQLiteSpillStore(Config.CONVERSATION_SPILL_PATH,
+                                 ttl_seconds=Config.CONVERSATION_SPILL_TTL)
+    return ConversationStore(
+        max_bytes=int(Config.CONVERSATION_MAX_MEMORY_MB * 1024 * 1024),
+        idle_ttl=Config.CONVERSATION_IDLE_TTL,
+        max_turns=Config.CONVERSATION_MAX_TURNS,
+        spill=spill,
+        on_evict=on_evict
+    )
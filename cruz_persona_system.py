@@ -1,13 +1,17 @@
 """
 CRUZ 人格語料管理系統
 """
+import copy
 import json
 import os
 import logging
 from datetime import datetime
 from typing import List, Dict, Optional
 import re
+import threading
 from user_analyzer import UserAnalyzer
+from context_builder import estimate_tokens, truncate_to_tokens
+from fork_safety import load_shared_json, remember_shared_json
 
 logger = logging.getLogger(__name__)
 
@@ -16,15 +20,27 @@ class CruzPersonaSystem:
     
     def __init__(self):
         self.corpus_file = "data/cruz_corpus.json"
+        self._corpus_shared = False
         self.corpus = self.load_corpus()
         
+        # 使用次數不寫進共用的語料庫（避免其他使用者看到並弄髒 copy-on-write 的記憶體頁），
+        # 先記在這裡，寫檔時再合併：quote id -> 載入後增加的次數
+        self._usage_counts: Dict = {}
+        self._usage_lock = threading.Lock()
+        
+        # 回覆後背景管線（由 LineBotHandler 注入）：使用次數寫檔延後並合併
+        self.post_reply = None
+        self._save_pending = False
+        self._save_lock = threading.Lock()
+        
     def load_corpus(self) -> Dict:
-        """載入語料庫"""
+        """載入語料庫（同一程序內共用同一份唯讀資料；preload 模式下由所有 worker 共用）"""
         if os.path.exists(self.corpus_file):
-            with open(self.corpus_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            self._corpus_shared = True
+            return load_shared_json(self.corpus_file)
         else:
             logger.warning(f"Corpus file not found: {self.corpus_file}")
+            self._corpus_shared = False
             return {
                 "metadata": {"version": "1.0", "total_quotes": 0},
                 "traits": {},
@@ -32,14 +48,61 @@ class CruzPersonaSystem:
                 "reviewed_responses": []
             }
     
+    def _writable_corpus(self) -> Dict:
+        """要修改語料庫時先取得私有副本，共用的那份維持唯讀"""
+        if self._corpus_shared:
+            self.corpus = copy.deepcopy(self.corpus)
+            self._corpus_shared = False
+        return self.corpus
+    
+    def _usage_count(self, quote: Dict) -> int:
+        """語料的使用次數（檔案中的次數 + 尚未寫檔的次數）"""
+        return quote.get("usage_count", 0) + self._usage_counts.get(quote.get("id"), 0)
+    
+    def _record_usage(self, quote_id):
+        with self._usage_lock:
+            self._usage_counts[quote_id] = self._usage_counts.get(quote_id, 0) + 1
+    
     def save_corpus(self):
-        """儲存語料庫"""
-        self.corpus["metadata"]["last_updated"] = datetime.now().isoformat()
-        self.corpus["metadata"]["total_quotes"] = len(self.corpus["quotes"])
+        """儲存語料庫（合併使用次數後寫檔，寫入的版本成為新的共用版本）"""
+        with self._usage_lock:
+            usage_counts, self._usage_counts = self._usage_counts, {}
+        
+        corpus = self._writable_corpus()
+        for quote in corpus["quotes"]:
+            if quote.get("id") in usage_counts:
+                quote["usage_count"] = quote.get("usage_count", 0) + usage_counts[quote["id"]]
+        corpus["metadata"]["last_updated"] = datetime.now().isoformat()
+        corpus["metadata"]["total_quotes"] = len(corpus["quotes"])
         
         with open(self.corpus_file, 'w', encoding='utf-8') as f:
-            json.dump(self.corpus, f, ensure_ascii=False, indent=2)
-        logger.info(f"Corpus saved with {len(self.corpus['quotes'])} quotes")
+            json.dump(corpus, f, ensure_ascii=False, indent=2)
+        remember_shared_json(self.corpus_file, corpus)
+        # 已交給其他使用者共用，之後再修改要重新複製
+        self._corpus_shared = True
+        logger.info(f"Corpus saved with {len(corpus['quotes'])} quotes")
+    
+    def _schedule_save(self):
+        """語料使用次數變更後儲存；有背景管線時延後到回覆後，並合併多次寫入"""
+        if self.post_reply is None:
+            self.save_corpus()
+            return
+        
+        with self._save_lock:
+            if self._save_pending:
+                return
+            self._save_pending = True
+        
+        if not self.post_reply.submit("corpus_save", self._flush_pending_save):
+            # 佇列已滿被丟棄，下次變更時再排程
+            with self._save_lock:
+                self._save_pending = False
+    
+    def _flush_pending_save(self):
+        """背景執行實際的語料庫寫檔"""
+        with self._save_lock:
+            self._save_pending = False
+        self.save_corpus()
     
     def import_text_file(self, file_path: str) -> int:
         """
@@ -56,6 +119,7 @@ class CruzPersonaSystem:
         # 用 === 分割貼文
         posts = content.split('===')
         imported_count = 0
+        corpus = self._writable_corpus()
         
         for post in posts:
             post = post.strip()
@@ -69,7 +133,7 @@ class CruzPersonaSystem:
                 
                 if content_text:
                     # 生成 ID
-                    next_id = len(self.corpus["quotes"]) + 1
+                    next_id = len(corpus["quotes"]) + 1
                     
                     # 提取標籤（簡單的關鍵詞提取）
                     tags = self._extract_tags(content_text)
@@ -87,7 +151,7 @@ class CruzPersonaSystem:
                         "imported_at": datetime.now().isoformat()
                     }
                     
-                    self.corpus["quotes"].append(quote)
+                    corpus["quotes"].append(quote)
                     imported_count += 1
                     logger.info(f"Imported quote {next_id}: {content_text[:50]}...")
         
@@ -191,15 +255,16 @@ class CruzPersonaSystem:
         # 返回前 N 個
         results = []
         for score, quote in scores[:limit]:
+            # 更新使用次數
+            self._record_usage(quote["id"])
+            
             result = quote.copy()
+            result["usage_count"] = self._usage_count(quote)
             result["relevance_score"] = score
             results.append(result)
-            
-            # 更新使用次數
-            quote["usage_count"] += 1
         
         if results:
-            self.save_corpus()
+            self._schedule_save()
             
         return results
     
@@ -214,8 +279,9 @@ class CruzPersonaSystem:
     def add_reviewed_response(self, question: str, ai_response: str, 
                             cruz_response: str, selected: str):
         """添加 Review 記錄"""
+        corpus = self._writable_corpus()
         review = {
-            "id": len(self.corpus["reviewed_responses"]) + 1,
+            "id": len(corpus["reviewed_responses"]) + 1,
             "question": question,
             "ai_response": ai_response,
             "cruz_response": cruz_response,
@@ -223,17 +289,21 @@ class CruzPersonaSystem:
             "reviewed_at": datetime.now().isoformat()
         }
         
-        self.corpus["reviewed_responses"].append(review)
+        corpus["reviewed_responses"].append(review)
         self.save_corpus()
         
         logger.info(f"Added reviewed response #{review['id']}")
     
-    def generate_cruz_prompt(self, user_message: str) -> str:
-        """生成 CRUZ 風格的系統提示詞"""
+    def generate_cruz_prompt(self, user_message: str, max_tokens: Optional[int] = None) -> str:
+        """生成 CRUZ 風格的系統提示詞
+        
+        max_tokens：整段提示詞的 token 預算。人格描述與結尾的指示一定保留，
+        語料引用只使用剩下的預算（每則平分並截斷，放不下時省略）
+        """
         traits = self.get_cruz_traits()
         relevant_quotes = self.search_relevant_quotes(user_message, limit=2)
         
-        prompt = f"""你是 CRUZ（不是 Cruise），一位真實存在的人，現在透過 AI 與朋友對話。
+        header = f"""你是 CRUZ（不是 Cruise），一位真實存在的人，現在透過 AI 與朋友對話。
 
 【核心特質】
 {self._format_list(traits.get('core_values', []))}
@@ -248,14 +318,7 @@ class CruzPersonaSystem:
 【背景經歷】
 {self._format_list(traits.get('background', {}).get('experiences', []))}
 """
-        
-        if relevant_quotes:
-            prompt += "\n【相關語料參考】\n"
-            for i, quote in enumerate(relevant_quotes, 1):
-                prompt += f"{i}. {quote['content']}\n"
-            prompt += "\n基於以上語料，用 CRUZ 的方式回應，但不要直接複製。"
-        
-        prompt += """
+        closing = """
 
 記住：
 - 你是 CRUZ 本人，不是 AI 助理
@@ -263,7 +326,33 @@ class CruzPersonaSystem:
 - 給予實際可行的建議
 - 用溫暖的方式鼓勵他人"""
         
-        return prompt
+        return header + self._format_quotes(relevant_quotes, header + closing, max_tokens) + closing
+    
+    def _format_quotes(self, quotes: List[Dict], fixed: str, max_tokens: Optional[int]) -> str:
+        """語料引用段落；有預算時只使用人格描述與指示以外的部分"""
+        if not quotes:
+            return ""
+        opening = "\n【相關語料參考】\n"
+        instruction = "\n基於以上語料，用 CRUZ 的方式回應，但不要直接複製。"
+        contents = [quote['content'] for quote in quotes]
+        
+        if max_tokens is not None:
+            budget = (max_tokens - estimate_tokens(fixed) - estimate_tokens(opening + instruction)
+                      - 2 * len(contents))  # 每則的編號與換行
+            # 短的語料先分配，用不完的預算留給較長的語料
+            allowed = {}
+            order = sorted(range(len(contents)), key=lambda i: estimate_tokens(contents[i]))
+            for position, i in enumerate(order):
+                share = max(0, budget) // (len(order) - position)
+                allowed[i] = min(estimate_tokens(contents[i]), share)
+                budget -= allowed[i]
+            contents = [truncate_to_tokens(content, allowed[i]) if allowed[i] > 0 else ""
+                        for i, content in enumerate(contents)]
+            contents = [content for content in contents if content]
+            if not contents:
+                return ""
+        
+        return opening + "".join(f"{i}. {content}\n" for i, content in enumerate(contents, 1)) + instruction
     
     def _format_list(self, items: List[str]) -> str:
         """格式化列表為文字"""
@@ -279,7 +368,7 @@ class CruzPersonaSystem:
             "topics": list(self.corpus.get("frequent_topics", {}).keys()),
             "most_used_quotes": sorted(
                 self.corpus["quotes"], 
-                key=lambda x: x["usage_count"], 
+                key=self._usage_count, 
                 reverse=True
             )[:5]
         }
@@ -326,11 +415,8 @@ class CruzPersonaSystem:
         if memory_search:
             quote = memory_search[0]["content"]
             # 更新使用次數
-            for q in self.corpus["quotes"]:
-                if q["id"] == memory_search[0]["id"]:
-                    q["usage_count"] += 1
-                    break
-            self.save_corpus()
+            self._record_usage(memory_search[0]["id"])
+            self._schedule_save()
             
             # 截取適當長度
             if len(quote) > 200:
@@ -0,0 +1,137 @@
+"""
+多 worker 的 fork 安全工具
+preload 模式下語料庫、五行角色表、量子記憶等資料只在 gunicorn master 載入一次，
+fork 後由各 worker 以 copy-on-write 共用；連接池、HTTP session、執行緒這類
+程序專屬的資源則在 fork 前關閉或 fork 後重建，不會被父子程序共用。
+"""
+import gc
+import json
+import logging
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# fork 前（父程序）與 fork 後（子程序）要執行的回呼；以弱參照保存，物件被回收後自動失效
+_before_fork_hooks: List[Callable[[], Optional[Callable]]] = []
+_after_fork_hooks: List[Callable[[], Optional[Callable]]] = []
+
+# 已解析的 JSON 檔案：path -> (mtime, data)，同一程序內只解析一次
+_shared_json: Dict[str, Tuple[float, Any]] = {}
+_shared_lock = threading.Lock()
+
+
+def _weak_callback(callback: Callable) -> Callable[[], Optional[Callable]]:
+    """綁定方法用 WeakMethod，避免 hook 讓物件永遠無法回收"""
+    if hasattr(callback, '__self__') and hasattr(callback, '__func__'):
+        return weakref.WeakMethod(callback)
+    return lambda: callback
+
+
+def register_fork_hooks(before: Optional[Callable] = None,
+                        after_in_child: Optional[Callable] = None):
+    """註冊 fork 前後的回呼
+
+    before：在父程序 fork 之前執行，適合關閉會被子程序繼承的連線
+    after_in_child：在子程序中執行，適合重建鎖、佇列與執行緒狀態
+    """
+    if before is not None:
+        _before_fork_hooks.append(_weak_callback(before))
+    if after_in_child is not None:
+        _after_fork_hooks.append(_weak_callback(after_in_child))
+
+
+def _run_hooks(hooks: List[Callable[[], Optional[Callable]]], stage: str):
+    """依序執行仍然有效的回呼；單一回呼失敗不影響其他回呼"""
+    alive = []
+    for ref in hooks:
+        callback = ref()
+        if callback is None:
+            continue
+        alive.append(ref)
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Fork hook {getattr(callback, '__qualname__', callback)} "
+                           f"failed ({stage}): {e}")
+    hooks[:] = alive
+
+
+def _before_fork():
+    _run_hooks(_before_fork_hooks, "before fork")
+
+
+def _after_fork_in_child():
+    global _shared_lock
+    # 父程序 fork 時可能有執行緒正持有這把鎖
+    _shared_lock = threading.Lock()
+    _run_hooks(_after_fork_hooks, "after fork")
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
+
+def load_shared_json(path: str, default_factory: Optional[Callable[[], Any]] = None) -> Any:
+    """載入 JSON 檔案，同一程序內的多個使用者共用同一份解析結果
+
+    檔案修改時間改變時重新解析；檔案不存在時回傳 default_factory()（未提供則拋出
+    FileNotFoundError）。回傳的物件由所有使用者共用，必須當成唯讀：要修改時先
+    copy.deepcopy 取得私有副本，寫回檔案後以 remember_shared_json 交出新版本。
+    """
+    path = os.path.abspath(path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        if default_factory is None:
+            raise FileNotFoundError(path)
+        return default_factory()
+
+    with _shared_lock:
+        cached = _shared_json.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        _shared_json[path] = (mtime, data)
+        return data
+
+
+def remember_shared_json(path: str, data: Any):
+    """寫回檔案後更新快取，下一個載入者直接拿到同一份物件而不必重新解析
+
+    交出後 data 即成為共用資料，呼叫端之後不能再修改它。
+    """
+    path = os.path.abspath(path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return
+    with _shared_lock:
+        _shared_json[path] = (mtime, data)
+
+
+def freeze_shared_state():
+    """master 在 fork worker 前呼叫：把目前所有物件移出 GC 追蹤
+
+    GC 掃描時會寫入每個物件的標頭，讓 copy-on-write 的記憶體頁被複製；
+    凍結後 preload 載入的資料在 worker 中維持共用。
+    """
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+        logger.info(f"Froze {gc.get_freeze_count()} objects before forking workers")
+
+
+def stats() -> Dict:
+    """取得 fork 安全狀態"""
+    return {
+        "pid": os.getpid(),
+        "before_fork_hooks": len(_before_fork_hooks),
+        "after_fork_hooks": len(_after_fork_hooks),
+        "shared_json_files": len(_shared_json),
+        "frozen_objects": gc.get_freeze_count() if hasattr(gc, 'get_freeze_count') else 0
+    }
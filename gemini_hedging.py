@@ -0,0 +1,278 @@
+"""
+Gemini 呼叫的對沖請求與重試
+第一次呼叫超過近期延遲的高百分位仍未回應時，再送出一個相同的請求，取先回來的結果；
+可重試的錯誤以隨機退避重試。對沖與重試都要花費重試預算，服務異常時不會放大流量。
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+from fork_safety import register_fork_hooks
+from gemini_limiter import GeminiCallLimiter, gemini_limiter
+from line_http_client import HttpLatencyMetrics
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# google.api_core 的暫時性錯誤（429、500、503 等），重送同一個請求有機會成功
+RETRYABLE_ERRORS = {
+    "ResourceExhausted", "TooManyRequests", "InternalServerError",
+    "ServiceUnavailable", "BadGateway", "GatewayTimeout", "Aborted"
+}
+
+
+def is_retryable_error(e: Exception) -> bool:
+    """可以重試的錯誤；逾時不重試（整次回應的期限已經用完）"""
+    return type(e).__name__ in RETRYABLE_ERRORS or isinstance(e, ConnectionError)
+
+
+class RetryBudget:
+    """重試預算：每個正常請求存入 ratio 個 token，每次重試或對沖花費 1 個
+
+    另外每秒補充 min_per_second 個 token，流量很低時仍可重試。
+    服務異常時大部分請求都失敗，預算很快用完，重試量最多只是正常流量的 ratio 倍。
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 0.2,
+                 max_tokens: float = 10, clock: Callable[[], float] = time.monotonic):
+        self.ratio = ratio
+        self._bucket = TokenBucket(max_tokens, min_per_second, clock)
+        self.spent = 0
+        self.exhausted = 0
+
+    def record_request(self):
+        """正常請求存入預算"""
+        self._bucket.refund(self.ratio)
+
+    def try_spend(self) -> bool:
+        """有預算時扣除並回傳 True"""
+        if self._bucket.try_acquire(1):
+            self.spent += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def stats(self) -> Dict:
+        return {
+            "tokens": round(self._bucket.tokens, 2),
+            "spent": self.spent,
+            "exhausted": self.exhausted
+        }
+
+
+class GeminiHedger:
+    """為 Gemini 呼叫加上對沖與重試，所有請求仍經過 GeminiCallLimiter
+
+    hedge_percentile：第一個請求超過這個延遲百分位還沒回應時送出對沖請求
+    min_samples：延遲樣本數不足時不對沖（百分位還不可靠）
+    """
+
+    def __init__(self, limiter: GeminiCallLimiter, budget: Optional[RetryBudget] = None,
+                 metrics: Optional[HttpLatencyMetrics] = None,
+                 hedging_enabled: bool = False, hedge_percentile: float = 0.95,
+                 min_samples: int = 20, max_retries: int = 2,
+                 base_delay: float = 0.2, max_delay: float = 2.0,
+                 rng: Callable[[], float] = random.random):
+        self.limiter = limiter
+        self.budget = budget or RetryBudget()
+        self.metrics = metrics or HttpLatencyMetrics()
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # 統計資料
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+
+        register_fork_hooks(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """子程序不繼承父程序的執行緒池"""
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """同步對沖用的執行緒池（第一次需要時才建立）"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.limiter.max_concurrent * 2,
+                        thread_name_prefix="gemini-hedge"
+                    )
+        return self._executor
+
+    def hedge_delay(self, operation: str) -> Optional[float]:
+        """送出對沖請求前要等待的秒數；不對沖時回傳 None"""
+        if not self.hedging_enabled:
+            return None
+        return self.metrics.percentile(operation, self.hedge_percentile, self.min_samples)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """第 attempt 次重試前的等待時間（full jitter 指數退避）"""
+        return self._rng() * min(self.max_delay, self.base_delay * (2 ** attempt))
+
+    def _timeout(self, deadline: float) -> float:
+        remaining = self.limiter.remaining(deadline)
+        if remaining <= 0:
+            raise TimeoutError("Gemini response deadline exceeded")
+        return remaining
+
+    def _can_retry(self, e: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """可以重試時回傳退避秒數，否則回傳 None"""
+        if attempt >= self.max_retries or not is_retryable_error(e):
+            return None
+        delay = self.backoff_delay(attempt)
+        if self.limiter.remaining(deadline) <= delay or not self.budget.try_spend():
+            return None
+        self.retries += 1
+        logger.warning(f"Retrying Gemini call after {type(e).__name__} "
+                       f"(attempt {attempt + 1}, backoff {delay:.2f}s)")
+        return delay
+
+    # ---- 同步 ----
+
+    def call(self, operation: str, fn: Callable, *args, deadline: float, **kwargs) -> Any:
+        """同步呼叫：對沖 + 重試，整體不超過 deadline（time.monotonic() 時間）"""
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return self._call_hedged(operation, fn, args, kwargs, deadline)
+            except Exception as e:
+                delay = self._can_retry(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def _call_once(self, operation: str, fn: Callable, args, kwargs, deadline: float):
+        timeout = self._timeout(deadline)
+        start = time.monotonic()
+        try:
+            result = self.limiter.call(fn, *args, timeout=timeout, **kwargs)
+        except Exception:
+            self.metrics.record(operation, time.monotonic() - start, error=True)
+            raise
+        self.metrics.record(operation, time.monotonic() - start)
+        return result
+
+    def _call_hedged(self, operation: str, fn: Callable, args, kwargs, deadline: float):
+        delay = self.hedge_delay(operation)
+        if delay is None:
+            return self._call_once(operation, fn, args, kwargs, deadline)
+
+        executor = self._get_executor()
+        primary = executor.submit(self._call_once, operation, fn, args, kwargs, deadline)
+        done, _ = wait([primary], timeout=min(delay, self.limiter.remaining(deadline)))
+        if done or not self.budget.try_spend():
+            return primary.result()
+
+        # 同步的 SDK 呼叫無法取消，較慢的請求會在背景完成後丟棄
+        self.hedges += 1
+        hedge = executor.submit(self._call_once, operation, fn, args, kwargs, deadline)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    # ---- 非同步 ----
+
+    async def call_async(self, operation: str, fn: Callable, *args, deadline: float, **kwargs) -> Any:
+        """非同步呼叫：對沖 + 重試；較慢的請求會被取消"""
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return await self._call_hedged_async(operation, fn, args, kwargs, deadline)
+            except Exception as e:
+                delay = self._can_retry(e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _call_once_async(self, operation: str, fn: Callable, args, kwargs, deadline: float):
+        timeout = self._timeout(deadline)
+        start = time.monotonic()
+        try:
+            result = await self.limiter.call_async(fn, *args, timeout=timeout, **kwargs)
+        except Exception:
+            self.metrics.record(operation, time.monotonic() - start, error=True)
+            raise
+        self.metrics.record(operation, time.monotonic() - start)
+        return result
+
+    async def _call_hedged_async(self, operation: str, fn: Callable, args, kwargs, deadline: float):
+        delay = self.hedge_delay(operation)
+        if delay is None:
+            return await self._call_once_async(operation, fn, args, kwargs, deadline)
+
+        primary = asyncio.ensure_future(self._call_once_async(operation, fn, args, kwargs, deadline))
+        done, _ = await asyncio.wait({primary}, timeout=min(delay, self.limiter.remaining(deadline)))
+        if done or not self.budget.try_spend():
+            return await primary
+
+        self.hedges += 1
+        hedge = asyncio.ensure_future(self._call_once_async(operation, fn, args, kwargs, deadline))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        """取得對沖、重試、預算與各模型延遲統計"""
+        return {
+            "limiter": self.limiter.stats(),
+            "hedging_enabled": self.hedging_enabled,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retries": self.retries,
+            "retry_budget": self.budget.stats(),
+            "latency": self.metrics.stats()
+        }
+
+
+# 程序內所有 Gemini 呼叫共用（延遲分布與重試預算都是全域的）
+gemini_hedger = GeminiHedger(
+    gemini_limiter,
+    budget=RetryBudget(
+        ratio=Config.GEMINI_RETRY_BUDGET_RATIO,
+        min_per_second=Config.GEMINI_RETRY_BUDGET_MIN_PER_SECOND
+    ),
+    hedging_enabled=Config.GEMINI_HEDGE_ENABLED,
+    hedge_percentile=Config.GEMINI_HEDGE_PERCENTILE,
+    min_samples=Config.GEMINI_HEDGE_MIN_SAMPLES,
+    max_retries=Config.GEMINI_MAX_RETRIES,
+    base_delay=Config.GEMINI_RETRY_BASE_DELAY
+)
@@ -0,0 +1,149 @@
+"""
+Gemini 呼叫的併發上限與期限
+所有 Gemini 請求（LINE、ASGI、量子記憶 API）共用同一組名額，
+名額用完時排隊有上限，單次呼叫超過期限就取消，不會無限制地佔住執行緒或連線。
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiOverloadedError(Exception):
+    """等待 Gemini 併發名額逾時"""
+
+
+class GeminiCallLimiter:
+    """限制同時進行的 Gemini 呼叫數量，並為每次呼叫加上期限
+
+    同步呼叫（Flask 執行緒）與非同步呼叫（事件迴圈）各自計算名額，
+    一個程序通常只會使用其中一種模式。
+    """
+
+    def __init__(self, max_concurrent: int = 8, timeout: float = 25.0,
+                 queue_timeout: float = 5.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._sync_slots = threading.BoundedSemaphore(self.max_concurrent)
+        # asyncio.Semaphore 綁定事件迴圈，每個迴圈各建一個
+        self._async_slots: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+        # 統計資料
+        self.calls = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.peak_in_flight = 0
+
+    def remaining(self, deadline: Optional[float]) -> float:
+        """距離 deadline（time.monotonic() 時間）還剩多少秒，不超過單次呼叫期限"""
+        if deadline is None:
+            return self.timeout
+        return max(0.0, min(self.timeout, deadline - time.monotonic()))
+
+    def call(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """同步呼叫 Gemini（期限透過 SDK 的 request_options 傳入）"""
+        if not self._sync_slots.acquire(timeout=self.queue_timeout):
+            self._reject()
+        self._enter()
+        try:
+            kwargs.setdefault("request_options", {"timeout": self.timeout if timeout is None else timeout})
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if _is_deadline_error(e):
+                self.timeouts += 1
+            raise
+        finally:
+            self._exit()
+            self._sync_slots.release()
+
+    async def call_async(self, fn: Callable[..., Awaitable], *args,
+                         timeout: Optional[float] = None, **kwargs) -> Any:
+        """非同步呼叫 Gemini；超過期限時取消請求並拋出 asyncio.TimeoutError"""
+        timeout = self.timeout if timeout is None else timeout
+        slots = self._get_async_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject()
+
+        self._enter()
+        try:
+            kwargs.setdefault("request_options", {"timeout": timeout})
+            return await asyncio.wait_for(fn(*args, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"Gemini call cancelled after {timeout:.1f}s")
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self._exit()
+            slots.release()
+
+    def _get_async_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            slots = self._async_slots.get(loop)
+            if slots is None:
+                slots = asyncio.Semaphore(self.max_concurrent)
+                self._async_slots[loop] = slots
+            return slots
+
+    def _reject(self):
+        self.rejected += 1
+        logger.warning(f"Gemini concurrency limit ({self.max_concurrent}) reached, "
+                       f"rejected after waiting {self.queue_timeout:.1f}s")
+        raise GeminiOverloadedError("Gemini 併發名額已滿")
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "max_concurrent": self.max_concurrent,
+            "timeout": self.timeout,
+            "in_flight": in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled
+        }
+
+
+def _is_deadline_error(e: Exception) -> bool:
+    """google.api_core 的 DeadlineExceeded 或一般逾時"""
+    return isinstance(e, TimeoutError) or type(e).__name__ in ("DeadlineExceeded", "Timeout", "ReadTimeout")
+
+
+def is_timeout_error(e: Exception) -> bool:
+    """呼叫端判斷錯誤是否為逾時（同步或非同步）"""
+    return isinstance(e, asyncio.TimeoutError) or _is_deadline_error(e)
+
+
+# 程序內所有 Gemini 呼叫共用的限制器
+gemini_limiter = GeminiCallLimiter(
+    max_concurrent=Config.GEMINI_MAX_CONCURRENCY,
+    timeout=Config.GEMINI_TIMEOUT,
+    queue_timeout=Config.GEMINI_QUEUE_TIMEOUT
+)
@@ -1,60 +1,179 @@
-import google.generativeai as genai
+import asyncio
+import threading
+import time
 from config import Config
 import logging
 import json
 from datetime import datetime, timedelta
-from typing import Optional
-from calendar_service import CalendarService
+from typing import AsyncIterator, Dict, List, Optional, Tuple, TYPE_CHECKING
 from five_elements_agent import FiveElementsAgent
 from cruz_persona_system import CruzPersonaSystem
-from quantum_memory.quantum_bridge import QuantumMemoryBridge
-from quantum_memory.quantum_monitor import QuantumMonitor
+from service_registry import registry
+from structured_logging import access_log
+from gemini_limiter import GeminiOverloadedError, is_timeout_error
+from gemini_hedging import gemini_hedger
+from semantic_cache import create_semantic_cache
+from context_builder import ContextBuilder, format_turn, local_summary
+from conversation_store import create_conversation_store
+from session_store import SharedConversationHistory, UserSession, create_session_store
+from tool_executor import ToolExecutor, parse_tool_timeouts, tool_error
+from gemini_standin import create_generative_model
+from intent_router import (CALENDAR_KEYWORDS, CRUZ_TRIGGERS, ELEMENT_TRIGGERS, ROLE_REQUESTS,
+                           IntentRouter, RoutedIntent)
+
+if TYPE_CHECKING:
+    from quantum_memory.quantum_bridge import QuantumMemoryBridge
 
 logger = logging.getLogger(__name__)
 
+# 修改系統提示詞時遞增，語意快取中的舊回應會自動失效
+SYSTEM_PROMPT_VERSION = "1"
+
+# 未啟用任何人格時的系統提示詞
+DEFAULT_SYSTEM_PROMPT = """你是一個友善的 AI 助理，請用繁體中文回答。
+請保持回答簡潔清楚，並且親切有禮。
+如果使用者詢問你的身份，請告訴他們你是 Persona Cruz AI 助理。
+
+你可以幫助使用者管理 Google Calendar：
+- 建立新的行程（例如：幫我安排明天下午3點開會）
+- 查詢行程（例如：我明天有什麼行程？）
+- 刪除行程（需要提供事件ID）
+
+當使用者要求日曆相關操作時，請使用提供的函數來完成。"""
+
+# 量子記憶的人格 ID -> 五行元素
+PERSONA_ELEMENTS = {
+    "wuji": "無極",
+    "wood": "木",
+    "fire": "火",
+    "earth": "土",
+    "metal": "金",
+    "water": "水"
+}
+
+# _get_current_persona 的顯示名稱 → 量子記憶橋的人格 ID
+PERSONA_IDS = {"CRUZ": "cruz", **{element: persona_id for persona_id, element in PERSONA_ELEMENTS.items()}}
+
+# 回答會隨日期、時間改變的訊息，不放進語意快取
+TIME_SENSITIVE_KEYWORDS = ['今天', '明天', '昨天', '現在', '幾點', '星期', '日曆', '提醒']
+
+# 同一群組的工具不能同時執行（量子記憶橋的記憶晶體沒有自己的鎖）；
+# 日曆工具每個執行緒各有自己的 client，不需要排隊
+TOOL_GROUPS = {
+    "quantum_save": "quantum",
+    "quantum_search": "quantum",
+    "quantum_evolve": "quantum"
+}
+
 class GeminiService:
     def __init__(self):
         """初始化 Gemini 服務"""
-        genai.configure(api_key=Config.GEMINI_API_KEY)
-        
-        # 定義 Function Calling 工具
-        tools = self._get_calendar_tools()
+        # Gemini 模型在第一次使用時才建立（見 model 屬性），避免開機時載入 google.generativeai
+        self._model = None
+        self._model_lock = threading.Lock()
         
-        # 使用支援 Function Calling 的模型
-        try:
-            self.model = genai.GenerativeModel(
-                model_name=Config.GEMINI_MODEL,
-                tools=tools
-            )
-            logger.info(f"Gemini model initialized with function calling using {Config.GEMINI_MODEL}")
-        except Exception as e:
-            logger.warning(f"Failed to initialize with function calling: {str(e)}")
-            # 降級到基本模型
-            self.model = genai.GenerativeModel(Config.GEMINI_MODEL)
-            logger.info(f"Fallback to {Config.GEMINI_MODEL} without function calling")
+        # 每位使用者的人格模式與目前元素（Postgres 後端時所有 worker 共用）
+        self.sessions = create_session_store()
         
-        self.conversation_history = {}
+        # 對話歷史：共用後端時存在使用者狀態中；否則在記憶體中有上限，
+        # 被移出的使用者存到本機 SQLite，下次對話時載回
+        if self.sessions.shared:
+            self.conversation_history = SharedConversationHistory(self.sessions)
+        else:
+            self.conversation_history = create_conversation_store(on_evict=self._on_history_evicted)
         
-        # 初始化 Calendar Service（如果有憑證的話）
-        try:
-            self.calendar_service = CalendarService()
-        except Exception as e:
-            logger.warning(f"Calendar service initialization failed: {str(e)}")
-            self.calendar_service = None
+        # Calendar Service 在第一次使用時才建立（見 calendar_service 屬性）
+        self._calendar_service = None
+        self._calendar_service_set = False
         
         # 初始化五行系統
         self.five_elements = FiveElementsAgent()
-        self.element_mode = False  # 是否啟用五行模式
         
         # 初始化 CRUZ 人格系統
         self.cruz_persona = CruzPersonaSystem()
-        self.cruz_mode = False  # 是否啟用 CRUZ 模式
         
         # 初始化量子記憶系統
         self.quantum_bridges = {}
         self.quantum_monitor = None
         logger.info("量子記憶系統已初始化")
         
+        # 回覆後背景管線（由 LineBotHandler 注入；未設定時直接同步執行）
+        self.post_reply = None
+        
+        # 所有 Gemini 呼叫共用的併發上限、期限、對沖與重試
+        self.hedger = gemini_hedger
+        
+        # 模型一次要求多個工具時並行執行；工具迴圈最多 GEMINI_MAX_TOOL_STEPS 輪
+        self.tool_executor = ToolExecutor(
+            max_workers=Config.TOOL_MAX_WORKERS,
+            timeout=Config.TOOL_TIMEOUT,
+            tool_timeouts=parse_tool_timeouts(Config.TOOL_TIMEOUTS)
+        )
+        self.max_tool_steps = Config.GEMINI_MAX_TOOL_STEPS
+        self._tool_locks = {group: threading.Lock() for group in set(TOOL_GROUPS.values())}
+        
+        # 意思明確的查詢（行程、量子記憶）直接執行工具，不等模型選擇（未啟用時為 None）
+        self.intent_router = IntentRouter(
+            threshold=Config.INTENT_ROUTER_THRESHOLD,
+            shadow_rate=Config.INTENT_ROUTER_SHADOW_RATE
+        ) if Config.INTENT_ROUTER_ENABLED else None
+        
+        # 相似問題直接使用先前的回應（未啟用時為 None）
+        self.semantic_cache = create_semantic_cache(CALENDAR_KEYWORDS + TIME_SENSITIVE_KEYWORDS)
+        
+        # 每次請求的 prompt 有 token 預算，放不進去的舊對話由滾動摘要代替
+        self.context_builder = ContextBuilder(
+            max_tokens=Config.CONTEXT_MAX_TOKENS,
+            max_system_tokens=Config.CONTEXT_MAX_SYSTEM_TOKENS,
+            max_message_tokens=Config.CONTEXT_MAX_MESSAGE_TOKENS,
+            summary_max_tokens=Config.CONTEXT_SUMMARY_MAX_TOKENS,
+            summary_batch=Config.CONTEXT_SUMMARY_BATCH,
+            summarizer=self._summarize_turns if Config.CONTEXT_SUMMARY_MODE == 'gemini' else local_summary,
+            submit=self._defer,
+            max_summaries=Config.CONTEXT_MAX_SUMMARIES
+        )
+        
+    @property
+    def model(self):
+        """Gemini 模型（第一次存取時建立）"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._build_model()
+        return self._model
+    
+    @model.setter
+    def model(self, value):
+        self._model = value
+    
+    def _build_model(self):
+        """設定 Gemini 並建立支援 Function Calling 的模型（GEMINI_BACKEND 可改用離線替身）"""
+        # 定義 Function Calling 工具
+        tools = self._get_calendar_tools()
+        
+        # 使用支援 Function Calling 的模型
+        try:
+            model = create_generative_model(Config.GEMINI_MODEL, tools=tools)
+            logger.info(f"Gemini model initialized with function calling using {Config.GEMINI_MODEL}")
+        except Exception as e:
+            logger.warning(f"Failed to initialize with function calling: {str(e)}")
+            # 降級到基本模型
+            model = create_generative_model(Config.GEMINI_MODEL)
+            logger.info(f"Fallback to {Config.GEMINI_MODEL} without function calling")
+        return model
+    
+    @property
+    def calendar_service(self):
+        """Calendar Service（第一次存取時建立；沒有憑證時為 None）"""
+        if not self._calendar_service_set:
+            return registry.get("calendar_service")
+        return self._calendar_service
+    
+    @calendar_service.setter
+    def calendar_service(self, value):
+        self._calendar_service = value
+        self._calendar_service_set = True
+    
     def _get_calendar_tools(self):
         """定義日曆相關的工具函數"""
         calendar_tools = [
@@ -185,160 +304,548 @@ class GeminiService:
         
         return calendar_tools + quantum_tools
         
-    def get_response(self, user_id: str, message: str) -> str:
+    def get_response(self, user_id: str, message: str, timeout: Optional[float] = None) -> str:
         """
         處理使用者訊息並回傳 AI 回應
         
         Args:
             user_id: Line 使用者 ID
             message: 使用者訊息
+            timeout: 整次回應（含 function call 後的第二次呼叫）的期限，預設為 GEMINI_TIMEOUT
             
         Returns:
             AI 回應文字
         """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.hedger.limiter.timeout)
+        start_time = None
         try:
-            # 初始化 final_response
-            final_response = None
-            
-            # 檢查是否是五行系統指令
-            if message.strip() in ["/dashboard", "/狀態", "/儀表板"]:
-                return self.five_elements.get_dashboard()
-            elif message.strip() in ["/status", "/mini", "/簡報"]:
-                return self.five_elements.get_mini_dashboard()
-            elif message.strip() in ["/harmony", "/和諧度"]:
-                return self.five_elements.get_harmony_status()
-            
-            # 如果是簡單的日曆請求且 calendar_service 不可用，直接回應
-            if self.calendar_service is None and any(keyword in message for keyword in ['行程', '安排', '會議', '約會']):
-                return "抱歉，日曆功能目前無法使用。請確認日曆服務已正確設定。"
-            # 初始化使用者對話歷史
-            if user_id not in self.conversation_history:
-                self.conversation_history[user_id] = []
-            
-            # 建立對話上下文
-            context = self._build_context(user_id, message)
+            # 指令、無法處理的請求或語意快取命中時直接回應
+            direct_response, context, cache_scope, current_element = self._prepare_request(user_id, message)
+            if direct_response is not None:
+                return direct_response
             
             # 記錄開始時間
             start_time = datetime.now()
             
-            # 判斷當前使用的元素（如果有的話）
-            current_element = self.five_elements.current_role.element if self.five_elements.current_role else "火"
-            
-            # 呼叫 Gemini API with Function Calling
-            logger.info(f"=== Calling Gemini API ===")
-            logger.info(f"User ID: {user_id}")
-            logger.info(f"Message: {message}")
-            logger.info(f"Context length: {len(context)} chars")
-            logger.info(f"Current Element: {current_element}")
-            
-            response = self.model.generate_content(context)
-            logger.info(f"✅ Gemini API response received")
-            logger.info(f"Response type: {type(response)}")
-            logger.info(f"Has candidates: {hasattr(response, 'candidates')}")
-            
-            # 檢查是否有 function call
-            if hasattr(response, 'candidates') and response.candidates:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts') and candidate.content.parts:
-                    for part in candidate.content.parts:
-                        if hasattr(part, 'function_call') and part.function_call:
-                            logger.info(f"Function call detected: {part.function_call.name}")
-                            # 處理 function call
-                            function_response = self._handle_function_call(part.function_call)
-                            
-                            # 建立包含 function response 的新訊息
-                            messages = [
-                                {"role": "user", "parts": [{"text": message}]},
-                                {"role": "model", "parts": [{"function_call": {"name": part.function_call.name, "args": dict(part.function_call.args)}}]},
-                                {"role": "function", "parts": [{"function_response": {
-                                    "name": part.function_call.name,
-                                    "response": {"result": function_response}
-                                }}]}
-                            ]
-                            
-                            # 如果 function 回傳了訊息，直接使用
-                            if function_response.get('message'):
-                                final_response = function_response['message']
-                                logger.info(f"✅ Using function response message directly")
-                                logger.info(f"Message length: {len(final_response)}")
-                                logger.info(f"Message preview: {final_response[:200]}...")
-                            else:
-                                # 將 function 結果回傳給模型產生回應
-                                response = self.model.generate_content(messages)
-                                
-                                # 取得最終回應
-                                if hasattr(response, 'text'):
-                                    final_response = response.text
-                                else:
-                                    # 嘗試從 candidates 取得文字
-                                    try:
-                                        if response.candidates and response.candidates[0].content.parts:
-                                            final_response = response.candidates[0].content.parts[0].text
-                                        else:
-                                            final_response = "抱歉，我無法處理這個請求。"
-                                    except:
-                                        final_response = "抱歉，我遇到了一些問題。"
-                            
-                            # 找到 function call 後就跳出迴圈
-                            break
-            
-            # 如果不是 function call，取得一般回應
-            if final_response is None:
-                if hasattr(response, 'text'):
-                    final_response = response.text
-                else:
-                    final_response = "抱歉，我無法理解您的訊息。"
-            
-            # 確保 final_response 不是 None
-            if final_response is None:
-                final_response = "抱歉，我無法處理您的請求。"
-                logger.warning("final_response was None, using default message")
-            
-            # 儲存對話歷史
-            self._save_conversation(user_id, message, final_response)
-            
-            # 計算響應時間並更新指標
-            response_time = (datetime.now() - start_time).total_seconds()
-            self.five_elements.update_metrics(current_element, success=True, response_time=response_time)
-            
-            # 如果有角色切換，記錄流程
-            if self.five_elements.current_role:
-                self.five_elements.record_flow("用戶", current_element, "對話")
-            
-            logger.info(f"=== Returning final response ===")
-            logger.info(f"Response length: {len(final_response)}")
-            logger.info(f"Response preview: {final_response[:200]}...")
-            logger.info(f"Response time: {response_time:.2f}s")
+            # 意思明確的查詢直接執行工具，省下第一次 Gemini 呼叫
+            intent = self._route_intent(message)
+            if intent is not None:
+                function_responses = self.tool_executor.run_all(
+                    self._tool_calls([intent], user_id, deadline), deadline)
+                routed_response = self._finish_routed(user_id, message, context, intent, function_responses,
+                                                      current_element, start_time)
+                if routed_response is not None:
+                    return routed_response
             
-            return final_response
+            self._log_request(user_id, message, context, current_element)
+            
+            response = self.hedger.call(Config.GEMINI_MODEL, self.model.generate_content, context,
+                                        deadline=deadline)
+            self._log_model_response(response)
+            
+            # 處理 function call：執行工具並把結果回傳給模型，直到模型不再要求工具
+            response, final_response, used_tools = self._run_tool_loop(user_id, message, response, deadline)
+            
+            return self._complete_response(user_id, message, response, final_response, used_tools,
+                                           cache_scope, current_element, start_time)
+            
+        except Exception as e:
+            return self._handle_response_error(e, start_time, user_id)
+    
+    async def get_response_async(self, user_id: str, message: str,
+                                 timeout: Optional[float] = None) -> str:
+        """
+        get_response 的非同步版本（供 ASGI 服務使用）
+        
+        Gemini 呼叫使用 generate_content_async，等待期間不佔用執行緒；
+        使用者狀態、對話歷史、語意快取與日曆、量子記憶等同步工具都可能等 I/O，
+        一律交給執行緒執行，避免阻塞事件迴圈。超過期限時取消進行中的 Gemini 請求。
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.hedger.limiter.timeout)
+        start_time = None
+        try:
+            direct_response, context, cache_scope, current_element = await asyncio.to_thread(
+                self._prepare_request, user_id, message)
+            if direct_response is not None:
+                return direct_response
+            
+            start_time = datetime.now()
+            
+            intent = self._route_intent(message)
+            if intent is not None:
+                function_responses = await self.tool_executor.run_all_async(
+                    self._tool_calls([intent], user_id, deadline), deadline)
+                routed_response = await asyncio.to_thread(
+                    self._finish_routed, user_id, message, context, intent, function_responses,
+                    current_element, start_time)
+                if routed_response is not None:
+                    return routed_response
+            
+            self._log_request(user_id, message, context, current_element)
+            
+            response = await self.hedger.call_async(Config.GEMINI_MODEL, self.model.generate_content_async,
+                                                    context, deadline=deadline)
+            self._log_model_response(response)
+            
+            response, final_response, used_tools = await self._run_tool_loop_async(
+                user_id, message, response, deadline)
+            
+            return await asyncio.to_thread(self._complete_response, user_id, message, response, final_response,
+                                           used_tools, cache_scope, current_element, start_time)
+            
+        except Exception as e:
+            return await asyncio.to_thread(self._handle_response_error, e, start_time, user_id)
+    
+    async def stream_chat_async(self, user_id: str, message: str, history: Optional[List[Dict]] = None,
+                                persona: Optional[str] = None, instructions: str = "",
+                                timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        串流回應（供 OpenAI 相容的 /v1/chat/completions 使用）
+        
+        與 get_response_async 不同，對話歷史由呼叫端（LibreChat）提供，人格由呼叫端指定，
+        不讀寫 LINE 使用者的狀態。生成前先取出人格的相關量子記憶（有期限，逾時就略過）。
+        模型要求工具時改走一般的工具迴圈，一次回傳結果。
+        
+        Args:
+            user_id: 呼叫端的使用者 ID
+            message: 最新的使用者訊息
+            history: 先前的對話 [{'user': ..., 'assistant': ...}]
+            persona: 量子記憶的人格 ID（cruz、wuji、fire…），None 時使用預設提示詞
+            instructions: 呼叫端附加的系統指示
+            timeout: 整段串流的期限，預設為 CHAT_STREAM_TIMEOUT
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else Config.CHAT_STREAM_TIMEOUT)
+        start_time = datetime.now()
+        sent = False
+        try:
+            context = await self._build_chat_context(user_id, message, history or [], persona, instructions)
             
+            # stream=True 的呼叫在收到第一個 chunk 時返回，對沖與重試只發生在送出任何文字之前
+            response = await self.hedger.call_async(f"{Config.GEMINI_MODEL}:stream",
+                                                    self.model.generate_content_async, context,
+                                                    stream=True, deadline=deadline)
+            
+            if self._find_function_calls(response):
+                await response.resolve()
+                self._log_model_response(response)
+                response, final_response, _ = await self._run_tool_loop_async(user_id, message, response, deadline)
+                if final_response is None:
+                    final_response = self._extract_function_followup_text(response)
+                sent = True
+                yield final_response
+                return
+            
+            # SDK 的迭代器會先讀下一個 chunk 才交出目前這個；第一個 chunk 直接送出，不等第二個
+            first = self._chunk_text(response)
+            if first:
+                sent = True
+                yield first
+            
+            chunks = response.__aiter__()
+            skip_first = True
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), max(0.0, deadline - time.monotonic()))
+                except StopAsyncIteration:
+                    break
+                if skip_first:
+                    skip_first = False
+                    continue
+                text = self._chunk_text(chunk)
+                if text:
+                    sent = True
+                    yield text
+            self._log_model_response(response)
+        except Exception as e:
+            if sent:
+                logger.error(f"Gemini stream interrupted: {type(e).__name__}: {e}")
+                return
+            yield self._handle_response_error(e, start_time, element=PERSONA_ELEMENTS.get(persona, "火"))
+    
+    async def _build_chat_context(self, user_id: str, message: str, history: List[Dict],
+                                  persona: Optional[str], instructions: str) -> str:
+        """人格提示詞 + 呼叫端指示 + 相關量子記憶 + 對話歷史"""
+        if persona == "cruz":
+            system_prompt = self.cruz_persona.generate_cruz_prompt(
+                message, max_tokens=Config.CONTEXT_MAX_SYSTEM_TOKENS)
+        elif persona in PERSONA_ELEMENTS:
+            system_prompt = self.five_elements.get_role_prompt(PERSONA_ELEMENTS[persona])
+        else:
+            system_prompt = DEFAULT_SYSTEM_PROMPT
+        if instructions:
+            system_prompt += f"\n\n{instructions}"
+        
+        # 記憶檢索交給工具執行緒，超過 CHAT_MEMORY_TIMEOUT 就不等（首字延遲優先）
+        result = (await self.tool_executor.run_all_async(
+            [("memory_recall", self._recall_memories, (persona or "fire", message))],
+            deadline=time.monotonic() + Config.CHAT_MEMORY_TIMEOUT))[0]
+        memories = result.get("memories") or []
+        if memories:
+            system_prompt += "\n\n相關記憶：\n" + "\n".join(f"- {memory}" for memory in memories)
+        
+        # 呼叫端每次送來完整歷史，不在伺服器端累積摘要
+        return self.context_builder.build(f"chat:{user_id}", system_prompt, history, message,
+                                          summarize=False).text
+    
+    def _recall_memories(self, persona: str, message: str) -> Dict:
+        """取出人格中與訊息共振的記憶晶體"""
+        bridge = self._get_or_create_quantum_bridge("quantum_user")
+        memory = bridge.quantum_memories.get(persona)
+        keywords = bridge._extract_keywords(message)
+        if memory is None or not keywords:
+            return {"memories": []}
+        
+        memories = []
+        for crystal in memory.find_resonating_crystals(keywords)[:Config.CHAT_MEMORY_LIMIT]:
+            possibility = max(crystal.possibilities, key=lambda p: p.probability, default=None)
+            memories.append(f"{crystal.concept}：{possibility.description}" if possibility else crystal.concept)
+        return {"memories": memories}
+    
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """串流 chunk 的文字；只有結束原因或安全評分的 chunk 沒有文字"""
+        try:
+            return chunk.text
+        except Exception:
+            return ""
+    
+    def _prepare_request(self, user_id: str, message: str) -> Tuple[Optional[str], str, str, str]:
+        """呼叫 Gemini 前的準備（會讀寫使用者狀態、對話歷史與語意快取）
+        
+        Returns:
+            (直接使用的回應或 None, 上下文, 語意快取分區, 目前元素)
+        """
+        early_response = self._get_early_response(user_id, message)
+        if early_response is not None:
+            return early_response, "", "", ""
+        
+        context, cache_scope = self._build_context_and_scope(user_id, message)
+        
+        # 相似的問題已經回答過時直接使用
+        cached_response = self._get_cached_response(user_id, message, cache_scope)
+        if cached_response is not None:
+            return cached_response, context, cache_scope, ""
+        
+        return None, context, cache_scope, self._get_current_element(user_id)
+    
+    def _complete_response(self, user_id: str, message: str, response, final_response: Optional[str],
+                           used_tools: bool, cache_scope: str, current_element: str,
+                           start_time: datetime) -> str:
+        """完成回應並把一般文字回應放進語意快取"""
+        final_response = self._finish_response(user_id, message, response, final_response,
+                                               current_element, start_time)
+        self._store_cached_response(message, cache_scope, response, used_tools, start_time)
+        return final_response
+    
+    def _get_early_response(self, user_id: str, message: str) -> Optional[str]:
+        """處理不需要呼叫 Gemini 的訊息；需要呼叫時回傳 None"""
+        # 檢查是否是五行系統指令
+        if message.strip() in ["/dashboard", "/狀態", "/儀表板"]:
+            return self.five_elements.get_dashboard()
+        elif message.strip() in ["/status", "/mini", "/簡報"]:
+            return self.five_elements.get_mini_dashboard()
+        elif message.strip() in ["/harmony", "/和諧度"]:
+            return self.five_elements.get_harmony_status()
+        
+        # 如果是簡單的日曆請求且 calendar_service 不可用，直接回應
+        if any(keyword in message for keyword in CALENDAR_KEYWORDS) and self.calendar_service is None:
+            return "抱歉，日曆功能目前無法使用。請確認日曆服務已正確設定。"
+        return None
+    
+    def _get_cached_response(self, user_id: str, message: str, cache_scope: str) -> Optional[str]:
+        """語意快取命中時回傳先前的回應，並照常記入對話歷史"""
+        if self.semantic_cache is None:
+            return None
+        try:
+            cached_response = self.semantic_cache.get(cache_scope, message)
+        except Exception as e:
+            # 快取只是捷徑，失敗時照常呼叫 Gemini
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            return None
+        if cached_response is None:
+            return None
+        self._save_conversation(user_id, message, cached_response)
+        access_log.log("gemini", "semantic_cache_hit", user_id=user_id, scope=cache_scope)
+        return cached_response
+    
+    def _store_cached_response(self, message: str, cache_scope: str, response, used_tools: bool,
+                               start_time: datetime):
+        """一般文字回應放進語意快取；用到工具（日曆、量子記憶）的結果不快取"""
+        if self.semantic_cache is None or used_tools:
+            return
+        try:
+            text = response.text
+        except Exception:
+            return
+        latency = (datetime.now() - start_time).total_seconds()
+        try:
+            self.semantic_cache.put(cache_scope, message, text, latency)
+        except Exception as e:
+            logger.warning(f"Semantic cache store failed: {e}")
+    
+    def _get_current_element(self, user_id: str) -> str:
+        """判斷使用者當前使用的元素（如果有的話）"""
+        return self.sessions.get(user_id).element or "火"
+    
+    def _log_request(self, user_id: str, message: str, context: str, current_element: str):
+        # 完整 prompt 只留在環形緩衝區；stdout 只輸出取樣的摘要
+        access_log.capture("gemini", "request", user_id=user_id, message=message, context=context)
+        if access_log.sampled("gemini"):
+            access_log.emit("gemini", "request", user_id=user_id, context_chars=len(context),
+                            element=current_element)
+    
+    def _route_intent(self, message: str) -> Optional[RoutedIntent]:
+        if self.intent_router is None:
+            return None
+        return self.intent_router.route(message)
+    
+    def _finish_routed(self, user_id: str, message: str, context: str, intent: RoutedIntent,
+                       function_responses: list, current_element: str,
+                       start_time: datetime) -> Optional[str]:
+        """工具成功且有可直接回覆的訊息時完成回應；否則回傳 None，交回 Gemini 處理"""
+        final_response = self._get_function_message(function_responses)
+        if final_response is None or not all(response.get('success') for response in function_responses):
+            self.intent_router.record_fallback(intent)
+            access_log.log("gemini", "intent_fallback", name=intent.name)
+            return None
+        
+        # 省下的時間以近期 Gemini 呼叫延遲的中位數估計
+        latency_saved = self.hedger.metrics.percentile(Config.GEMINI_MODEL, 0.5) or 0.0
+        self.intent_router.record_routed(intent, latency_saved)
+        access_log.log("gemini", "intent_routed", user_id=user_id, name=intent.name,
+                       confidence=round(intent.confidence, 2))
+        if self.intent_router.should_shadow():
+            self._defer("intent_shadow", self._shadow_check_intent, context, intent)
+        return self._finish_response(user_id, message, None, final_response, current_element, start_time)
+    
+    def _shadow_check_intent(self, context: str, intent: RoutedIntent):
+        """背景詢問 Gemini 會選哪個工具，用來估算路由準確率"""
+        try:
+            response = self.hedger.call(Config.GEMINI_MODEL, self.model.generate_content, context,
+                                        deadline=time.monotonic() + self.hedger.limiter.timeout)
         except Exception as e:
-            logger.error(f"Gemini API error: {str(e)}")
-            logger.error(f"Error type: {type(e).__name__}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            
-            # 更新錯誤指標
-            if hasattr(self, 'five_elements'):
-                current_element = self.five_elements.current_role.element if self.five_elements.current_role else "火"
-                response_time = (datetime.now() - start_time).total_seconds() if 'start_time' in locals() else 0
-                self.five_elements.update_metrics(current_element, success=False, response_time=response_time)
-            
-            # 如果是日曆相關錯誤，提供更具體的訊息
-            if "calendar" in str(e).lower():
-                return "抱歉，我在處理日曆功能時遇到問題。請確認您已經分享日曆給我。"
+            logger.warning(f"Intent shadow check failed: {e}")
+            return
+        self.intent_router.record_shadow(intent, [call.name for call in self._find_function_calls(response)])
+    
+    def _log_model_response(self, response):
+        self.context_builder.record_usage(response)
+        if self.intent_router is not None:
+            # 模型選了路由器能處理的工具時記為漏判
+            self.intent_router.record_model_choice(
+                [call.name for call in self._find_function_calls(response)])
+        if access_log.sampled("gemini"):
+            access_log.emit("gemini", "response_received", response_type=type(response).__name__,
+                            has_candidates=hasattr(response, 'candidates'))
+    
+    def _find_function_calls(self, response) -> list:
+        """取得回應中所有的 function call"""
+        function_calls = []
+        if hasattr(response, 'candidates') and response.candidates:
+            candidate = response.candidates[0]
+            if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts') and candidate.content.parts:
+                for part in candidate.content.parts:
+                    if hasattr(part, 'function_call') and part.function_call:
+                        function_calls.append(part.function_call)
+        return function_calls
+    
+    def _run_tool_loop(self, user_id: str, message: str, response, deadline: float):
+        """執行模型要求的工具並把結果交回模型，最多 max_tool_steps 輪
+        
+        Returns:
+            (最後的模型回應, 直接使用的回應文字或 None, 是否用到工具)
+        """
+        steps = []
+        function_calls = self._find_function_calls(response)
+        while function_calls:
+            if len(steps) >= self.max_tool_steps:
+                return response, self._tool_steps_exceeded(), True
+            function_responses = self.tool_executor.run_all(
+                self._tool_calls(function_calls, user_id, deadline), deadline)
+            final_response = self._get_function_message(function_responses)
+            if final_response is not None:
+                return response, final_response, True
+            steps.append((function_calls, function_responses))
+            response = self.hedger.call(Config.GEMINI_MODEL, self.model.generate_content,
+                                        self._build_function_messages(message, steps), deadline=deadline)
+            function_calls = self._find_function_calls(response)
+        
+        if not steps:
+            return response, None, False
+        return response, self._extract_function_followup_text(response), True
+    
+    async def _run_tool_loop_async(self, user_id: str, message: str, response, deadline: float):
+        """_run_tool_loop 的非同步版本"""
+        steps = []
+        function_calls = self._find_function_calls(response)
+        while function_calls:
+            if len(steps) >= self.max_tool_steps:
+                return response, self._tool_steps_exceeded(), True
+            function_responses = await self.tool_executor.run_all_async(
+                self._tool_calls(function_calls, user_id, deadline), deadline)
+            final_response = self._get_function_message(function_responses)
+            if final_response is not None:
+                return response, final_response, True
+            steps.append((function_calls, function_responses))
+            response = await self.hedger.call_async(Config.GEMINI_MODEL, self.model.generate_content_async,
+                                                    self._build_function_messages(message, steps),
+                                                    deadline=deadline)
+            function_calls = self._find_function_calls(response)
+        
+        if not steps:
+            return response, None, False
+        return response, self._extract_function_followup_text(response), True
+    
+    def _tool_calls(self, function_calls: list, user_id: str, deadline: Optional[float] = None) -> list:
+        return [(call.name, self._handle_function_call, (call, user_id, deadline))
+                for call in function_calls]
+    
+    def _tool_steps_exceeded(self) -> str:
+        logger.warning(f"Tool loop stopped after {self.max_tool_steps} steps")
+        access_log.log("gemini", "tool_steps_exceeded", steps=self.max_tool_steps)
+        return "抱歉，這個請求需要的步驟太多了，請試著把問題拆小一點。"
+    
+    def _get_function_message(self, function_responses: list) -> Optional[str]:
+        """如果每個 function 都回傳了訊息，直接使用（多個時依序合併）"""
+        messages = [function_response.get('message') for function_response in function_responses]
+        if messages and all(messages):
+            final_response = "\n\n".join(messages)
+            access_log.log("gemini", "function_message_used", length=len(final_response),
+                           count=len(messages))
+            return final_response
+        return None
+    
+    def _build_function_messages(self, message: str, steps: list) -> list:
+        """建立包含每一輪 function call 與 function response 的訊息"""
+        messages = [{"role": "user", "parts": [{"text": message}]}]
+        for function_calls, function_responses in steps:
+            messages.append({"role": "model", "parts": [
+                {"function_call": {"name": call.name, "args": dict(call.args)}}
+                for call in function_calls
+            ]})
+            messages.append({"role": "function", "parts": [
+                {"function_response": {"name": call.name, "response": {"result": result}}}
+                for call, result in zip(function_calls, function_responses)
+            ]})
+        return messages
+    
+    def _extract_function_followup_text(self, response) -> str:
+        """取得 function 結果回傳給模型後的最終回應"""
+        if hasattr(response, 'text'):
+            return response.text
+        # 嘗試從 candidates 取得文字
+        try:
+            if response.candidates and response.candidates[0].content.parts:
+                return response.candidates[0].content.parts[0].text
+            return "抱歉，我無法處理這個請求。"
+        except:
+            return "抱歉，我遇到了一些問題。"
+    
+    def _finish_response(self, user_id: str, message: str, response, final_response: Optional[str],
+                         current_element: str, start_time: datetime) -> str:
+        """補上預設回應、儲存對話並安排指標更新"""
+        # 如果不是 function call，取得一般回應
+        if final_response is None:
+            if hasattr(response, 'text'):
+                final_response = response.text
             else:
-                return "抱歉，我現在無法回應您的訊息。請稍後再試。"
+                final_response = "抱歉，我無法理解您的訊息。"
+        
+        # 確保 final_response 不是 None
+        if final_response is None:
+            final_response = "抱歉，我無法處理您的請求。"
+            logger.warning("final_response was None, using default message")
+        
+        # 儲存對話歷史
+        self._save_conversation(user_id, message, final_response)
+        
+        # 計算響應時間並更新指標（回覆送出後再處理）
+        response_time = (datetime.now() - start_time).total_seconds()
+        self._defer("five_elements_metrics", self._record_element_metrics,
+                    user_id, current_element, True, response_time)
+        
+        access_log.capture("gemini", "response", user_id=user_id, response=final_response)
+        if access_log.sampled("gemini"):
+            access_log.emit("gemini", "response", user_id=user_id, length=len(final_response),
+                            response_time=round(response_time, 3))
+        
+        return final_response
+    
+    def _handle_response_error(self, e: Exception, start_time: Optional[datetime],
+                               user_id: Optional[str] = None, element: Optional[str] = None) -> str:
+        """記錄錯誤、更新錯誤指標並回傳給使用者的訊息
+
+        錯誤計入 element；未指定時使用 user_id 的當前元素
+        """
+        logger.error(f"Gemini API error: {str(e)}")
+        logger.error(f"Error type: {type(e).__name__}")
+        import traceback
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        
+        # 更新錯誤指標
+        if hasattr(self, 'five_elements'):
+            if element is None:
+                element = self._get_current_element(user_id) if user_id else "火"
+            response_time = (datetime.now() - start_time).total_seconds() if start_time else 0
+            self._defer("five_elements_metrics", self._record_element_metrics,
+                        user_id, element, False, response_time)
+        
+        if isinstance(e, GeminiOverloadedError):
+            return "目前詢問的人比較多，請稍後再試一次。"
+        if is_timeout_error(e):
+            return "抱歉，這次想得太久了，請稍後再試一次。"
+        
+        # 如果是日曆相關錯誤，提供更具體的訊息
+        if "calendar" in str(e).lower():
+            return "抱歉，我在處理日曆功能時遇到問題。請確認您已經分享日曆給我。"
+        else:
+            return "抱歉，我現在無法回應您的訊息。請稍後再試。"
+    
+    def _record_element_metrics(self, user_id: Optional[str], element: str, success: bool,
+                                response_time: float):
+        """更新五行指標；成功且使用者已切換到某個元素時記錄互動流程"""
+        self.five_elements.update_metrics(element, success=success, response_time=response_time)
+        
+        # 角色存在使用者狀態中，不看共用 agent 的 current_role
+        if success and user_id and self.sessions.get(user_id).element:
+            self.five_elements.record_flow("用戶", element, "對話")
     
-    def _handle_function_call(self, function_call):
-        """處理 function call"""
+    def _defer(self, name: str, fn, *args, **kwargs):
+        """非必要工作交給回覆後管線；沒有管線時直接執行。佇列已滿被丟棄時回傳 False"""
+        if self.post_reply is not None:
+            return self.post_reply.submit(name, fn, *args, **kwargs)
+        fn(*args, **kwargs)
+        return True
+    
+    def _handle_function_call(self, function_call, user_id: Optional[str] = None,
+                              deadline: Optional[float] = None):
+        """處理 function call；user_id 用來決定回應使用的人格
+
+        同群組的工具依序執行；等鎖最多等到工具的期限，逾時的工具不會繼續排隊
+        """
         function_name = function_call.name
         args = dict(function_call.args)
         
-        logger.info(f"=== Handling function call ===")
-        logger.info(f"Function name: {function_name}")
-        logger.info(f"Arguments: {args}")
+        access_log.capture("gemini", "function_call", name=function_name, args=args)
+        access_log.log("gemini", "function_call", name=function_name)
         
+        group = TOOL_GROUPS.get(function_name)
+        if group is not None:
+            lock = self._tool_locks[group]
+            if not lock.acquire(timeout=self.tool_executor.timeout_for(function_name, deadline)):
+                logger.warning(f"Tool {function_name} timed out waiting for the {group} lock")
+                return tool_error(function_name, "timed out waiting for another tool")
+            try:
+                result = self._dispatch_function_call(function_name, args, user_id)
+            finally:
+                lock.release()
+        else:
+            result = self._dispatch_function_call(function_name, args, user_id)
+            
+        access_log.capture("gemini", "function_result", name=function_name, result=result)
+        return result
+    
+    def _dispatch_function_call(self, function_name: str, args: dict, user_id: Optional[str]):
         result = None
         if function_name == "create_calendar_event":
             result = self._create_event_handler(args)
@@ -347,15 +854,13 @@ class GeminiService:
         elif function_name == "delete_calendar_event":
             result = self._delete_event_handler(args)
         elif function_name == "quantum_save":
-            result = self._quantum_save_handler(args)
+            result = self._quantum_save_handler(args, user_id)
         elif function_name == "quantum_search":
-            result = self._quantum_search_handler(args)
+            result = self._quantum_search_handler(args, user_id)
         elif function_name == "quantum_evolve":
-            result = self._quantum_evolve_handler(args)
+            result = self._quantum_evolve_handler(args, user_id)
         else:
             result = {"error": f"Unknown function: {function_name}"}
-            
-        logger.info(f"Function call result: {result}")
         return result
     
     def _create_event_handler(self, args):
@@ -507,138 +1012,142 @@ class GeminiService:
     
     def _build_context(self, user_id: str, message: str) -> str:
         """建立包含對話歷史的上下文"""
+        return self._build_context_and_scope(user_id, message)[0]
+    
+    def _build_context_and_scope(self, user_id: str, message: str) -> Tuple[str, str]:
+        """建立上下文，並回傳語意快取的分區（提示詞版本 + 模型 + 人格模式 + 對話歷史）"""
+        
+        session = self.sessions.get(user_id)
         
         # 檢查是否需要切換角色或使用五行系統
-        element_context = self._check_element_trigger(message)
+        element_context, element = self._check_element_trigger(message)
         
         # 檢查是否啟用 CRUZ 模式
-        cruz_context = self._check_cruz_mode(message)
+        cruz_context = self._check_cruz_mode(message, session)
+        
+        # 模式或元素有變化時寫回使用者狀態
+        enable_cruz = cruz_context is not None and not session.cruz_mode
+        if enable_cruz or (element is not None and element != session.element):
+            self.sessions.update(user_id, lambda s: self._apply_triggers(s, enable_cruz, element))
         
         # 根據優先級選擇系統提示詞
         if cruz_context:
             system_prompt = cruz_context
+            persona_mode = "cruz"
         elif element_context:
             system_prompt = element_context
+            persona_mode = f"element:{element}"
         else:
-            # 原本的系統提示詞
-            system_prompt = """你是一個友善的 AI 助理，請用繁體中文回答。
-請保持回答簡潔清楚，並且親切有禮。
-如果使用者詢問你的身份，請告訴他們你是 Persona Cruz AI 助理。
-
-你可以幫助使用者管理 Google Calendar：
-- 建立新的行程（例如：幫我安排明天下午3點開會）
-- 查詢行程（例如：我明天有什麼行程？）
-- 刪除行程（需要提供事件ID）
-
-當使用者要求日曆相關操作時，請使用提供的函數來完成。"""
-        
-        # 組合對話歷史
-        history = self.conversation_history.get(user_id, [])
-        context = system_prompt + "\n\n"
+            persona_mode = "default"
+            system_prompt = DEFAULT_SYSTEM_PROMPT
         
-        # 只保留最近 10 則對話
-        recent_history = history[-10:] if len(history) > 10 else history
+        # 依 token 預算組合對話歷史（最多最近 10 則，更早的由摘要代替）
+        history = self.conversation_history.get(user_id)
+        built = self.context_builder.build(user_id, system_prompt, history, message)
         
-        for conv in recent_history:
-            context += f"使用者：{conv['user']}\n"
-            context += f"助理：{conv['assistant']}\n"
-        
-        context += f"使用者：{message}\n助理："
-        
-        return context
+        # 回應取決於 prompt 中的對話歷史：只有歷史相同（通常是還沒有歷史）的請求共用快取，
+        # 「為什麼？」這類接續先前對話的追問不會拿到其他使用者的回答
+        cache_scope = (f"{SYSTEM_PROMPT_VERSION}:{Config.GEMINI_MODEL}:{persona_mode}:"
+                       f"{built.history_digest or 'new'}")
+        return built.text, cache_scope
     
     def _save_conversation(self, user_id: str, user_message: str, ai_response: str):
-        """儲存對話歷史"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        
-        self.conversation_history[user_id].append({
-            'user': user_message,
-            'assistant': ai_response
-        })
-        
-        # 限制每個使用者最多保存 50 則對話
-        if len(self.conversation_history[user_id]) > 50:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-50:]
+        """儲存對話歷史（每個使用者最多保存 CONVERSATION_MAX_TURNS 則）"""
+        self.conversation_history.append(user_id, user_message, ai_response)
     
     def clear_history(self, user_id: str):
         """清除特定使用者的對話歷史"""
-        if user_id in self.conversation_history:
-            del self.conversation_history[user_id]
+        self.conversation_history.clear(user_id)
+        self.context_builder.clear(user_id)
     
-    def _check_element_trigger(self, message: str) -> Optional[str]:
-        """檢查是否需要啟動五行系統"""
-        message_lower = message.lower()
+    def _on_history_evicted(self, user_id: str):
+        """使用者移出記憶體時一併釋放對話摘要（載回後會重新產生）"""
+        self.context_builder.clear(user_id)
+    
+    def _summarize_turns(self, previous: str, turns: list) -> str:
+        """請 Gemini 把舊對話併入摘要（在回覆後管線執行）"""
+        prompt = ("請把以下對話併入既有摘要，用繁體中文寫成 150 字以內的重點，"
+                  "保留使用者的需求、偏好與尚未解決的問題，只輸出摘要本身。\n\n"
+                  f"既有摘要：{previous or '（無）'}\n\n對話：\n"
+                  + "".join(format_turn(conv) for conv in turns))
+        deadline = time.monotonic() + self.hedger.limiter.timeout
+        response = self.hedger.call(f"{Config.GEMINI_MODEL}:summary", self.model.generate_content,
+                                    prompt, deadline=deadline)
+        return response.text
+    
+    @staticmethod
+    def _apply_triggers(session: UserSession, enable_cruz: bool, element: Optional[str]):
+        if enable_cruz:
+            session.cruz_mode = True
+        if element is not None:
+            session.element = element
+    
+    def set_persona_mode(self, user_id: str, cruz_mode: bool):
+        """切換使用者的 CRUZ 模式（/cruz、/ai 指令），同時關閉五行模式"""
+        def apply(session: UserSession):
+            session.cruz_mode = cruz_mode
+            session.element_mode = False
         
-        # 特定觸發詞
-        element_triggers = {
-            "五行": "分析",
-            "卡住": "無極",
-            "debug": "分析",
-            "測試": "水",
-            "開發": "火",
-            "架構": "土",
-            "優化": "金",
-            "需求": "木"
-        }
+        self.sessions.update(user_id, apply)
+    
+    def get_current_role(self, user_id: str) -> str:
+        """使用者當前活躍的角色名稱"""
+        session = self.sessions.get(user_id)
+        if session.cruz_mode:
+            return "CRUZ"
+        elif session.element_mode and session.element in self.five_elements.roles:
+            return self.five_elements.roles[session.element].name
+        return "AI助理"
+    
+    def _check_element_trigger(self, message: str) -> Tuple[Optional[str], Optional[str]]:
+        """檢查是否需要啟動五行系統；回傳 (角色提示詞, 元素)
+
+        元素由呼叫端寫回使用者狀態；五行 agent 由所有使用者共用，這裡不呼叫 switch_role
+        """
+        message_lower = message.lower()
         
         # 檢查是否有觸發詞
-        for trigger, suggested_element in element_triggers.items():
+        for trigger, suggested_element in ELEMENT_TRIGGERS.items():
             if trigger in message_lower:
                 if suggested_element == "分析":
                     # 讓無極分析適合的角色
                     analysis = self.five_elements.analyze_situation(message)
                     suggested_element = analysis["suggested_element"]
                 
-                # 切換角色並返回角色提示詞
-                self.five_elements.switch_role(suggested_element)
-                return self.five_elements.get_role_prompt(suggested_element)
+                return self.five_elements.get_role_prompt(suggested_element), suggested_element
         
         # 檢查是否明確要求某個角色
-        role_requests = {
-            "火": ["開發專員", "快速實作", "寫程式"],
-            "水": ["測試專員", "找bug", "檢查"],
-            "木": ["產品經理", "規劃", "功能設計"],
-            "土": ["架構師", "系統設計", "穩定性"],
-            "金": ["優化專員", "重構", "效能"],
-            "無極": ["觀察", "分析情況", "系統狀態"]
-        }
-        
-        for element, keywords in role_requests.items():
+        for element, keywords in ROLE_REQUESTS.items():
             for keyword in keywords:
                 if keyword in message_lower:
-                    self.five_elements.switch_role(element)
-                    return self.five_elements.get_role_prompt(element)
+                    return self.five_elements.get_role_prompt(element), element
         
-        return None
+        return None, None
     
-    def _check_cruz_mode(self, message: str) -> Optional[str]:
+    def _check_cruz_mode(self, message: str, session: UserSession) -> Optional[str]:
         """檢查是否需要啟動 CRUZ 模式"""
         message_lower = message.lower()
         
-        # CRUZ 模式觸發詞
-        cruz_triggers = [
-            "cruz", "tang", "湯明", "tangcruzz",
-            "思考者咖啡", "創業", "創造",
-            "你是誰", "自我介紹"
-        ]
-        
         # 檢查是否有觸發詞
-        for trigger in cruz_triggers:
+        for trigger in CRUZ_TRIGGERS:
             if trigger in message_lower:
-                self.cruz_mode = True
-                return self.cruz_persona.generate_cruz_prompt(message)
+                return self.cruz_persona.generate_cruz_prompt(
+                    message, max_tokens=Config.CONTEXT_MAX_SYSTEM_TOKENS)
         
         # 如果已經在 CRUZ 模式，保持模式
-        if self.cruz_mode:
-            return self.cruz_persona.generate_cruz_prompt(message)
+        if session.cruz_mode:
+            return self.cruz_persona.generate_cruz_prompt(
+                message, max_tokens=Config.CONTEXT_MAX_SYSTEM_TOKENS)
         
         return None
     
-    def _get_or_create_quantum_bridge(self, user_id: str) -> QuantumMemoryBridge:
+    def _get_or_create_quantum_bridge(self, user_id: str) -> "QuantumMemoryBridge":
         """獲取或創建用戶的量子記憶橋"""
         if user_id not in self.quantum_bridges:
-            persona_id = self._get_current_persona()
+            from quantum_memory.quantum_bridge import QuantumMemoryBridge
+            from quantum_memory.quantum_monitor import QuantumMonitor
+            
+            persona_id = self._get_current_persona(user_id)
             self.quantum_bridges[user_id] = QuantumMemoryBridge(persona_id)
             logger.info(f"創建新的量子記憶橋給用戶 {user_id}")
             
@@ -648,25 +1157,25 @@ class GeminiService:
         
         return self.quantum_bridges[user_id]
     
-    def _get_current_persona(self) -> str:
-        """獲取當前人格"""
-        if self.cruz_mode:
+    def _get_current_persona(self, user_id: Optional[str]) -> str:
+        """獲取使用者當前人格"""
+        session = self.sessions.get(user_id) if user_id else UserSession()
+        if session.cruz_mode:
             return "CRUZ"
-        elif self.element_mode:
+        elif session.element_mode:
             # 根據最近的對話選擇元素
-            return self.five_elements.current_role.element if self.five_elements.current_role else "火"
+            return session.element or "火"
         else:
             return "火"
     
-    def _quantum_save_handler(self, args):
+    def _quantum_save_handler(self, args, user_id: Optional[str] = None):
         """處理量子記憶儲存"""
         try:
             content = args.get('content')
             concept_type = args.get('concept_type', 'quantum_coordinate')
             
-            # 使用預設的 user_id（在實際使用時應該從上下文獲取）
-            user_id = "quantum_user"
-            bridge = self._get_or_create_quantum_bridge(user_id)
+            # 量子記憶橋共用預設的 user_id；人格依實際對話的使用者決定
+            bridge = self._get_or_create_quantum_bridge("quantum_user")
             
             # 儲存到量子記憶
             event = {
@@ -678,7 +1187,7 @@ class GeminiService:
             bridge.trigger_evolution(concept_type, event)
             
             # 獲取當前人格的 emoji
-            persona = self._get_current_persona()
+            persona = self._get_current_persona(user_id)
             emoji = self._get_persona_emoji(persona)
             
             message = f"{emoji} {persona}：我已經將「{content}」儲存到量子記憶系統中。\n"
@@ -700,21 +1209,22 @@ class GeminiService:
                 "message": f"儲存量子記憶時發生錯誤：{str(e)}"
             }
     
-    def _quantum_search_handler(self, args):
+    def _quantum_search_handler(self, args, user_id: Optional[str] = None):
         """處理量子記憶搜尋"""
         try:
             query = args.get('query')
             threshold = args.get('threshold', 0.5)
             
-            user_id = "quantum_user"
-            bridge = self._get_or_create_quantum_bridge(user_id)
-            
-            # 執行向量搜尋
-            memories = bridge.memory.find_resonating_crystals(query, threshold=threshold)
-            
-            persona = self._get_current_persona()
+            bridge = self._get_or_create_quantum_bridge("quantum_user")
+            persona = self._get_current_persona(user_id)
             emoji = self._get_persona_emoji(persona)
             
+            # 在目前人格的記憶晶體中找共振的概念（與 _recall_memories 相同）；
+            # 查詢太短抽不出關鍵詞時直接用整個查詢
+            memory = bridge.quantum_memories.get(PERSONA_IDS.get(persona, "fire"))
+            keywords = bridge._extract_keywords(query) or [query.strip()]
+            memories = memory.find_resonating_crystals(keywords, threshold=threshold) if memory else []
+            
             if memories:
                 message = f"{emoji} {persona}：找到 {len(memories)} 個相關的量子記憶：\n\n"
                 for i, crystal in enumerate(memories[:5], 1):  # 最多顯示5個
@@ -735,14 +1245,13 @@ class GeminiService:
                 "message": f"搜尋量子記憶時發生錯誤：{str(e)}"
             }
     
-    def _quantum_evolve_handler(self, args):
+    def _quantum_evolve_handler(self, args, user_id: Optional[str] = None):
         """處理量子演化"""
         try:
             concept = args.get('concept')
             event = args.get('event')
             
-            user_id = "quantum_user"
-            bridge = self._get_or_create_quantum_bridge(user_id)
+            bridge = self._get_or_create_quantum_bridge("quantum_user")
             
             # 觸發演化
             evolution_event = {
@@ -753,7 +1262,7 @@ class GeminiService:
             
             bridge.trigger_evolution(concept, evolution_event)
             
-            persona = self._get_current_persona()
+            persona = self._get_current_persona(user_id)
             emoji = self._get_persona_emoji(persona)
             
             message = f"{emoji} {persona}：量子演化已觸發！\n\n"
@@ -2,8 +2,8 @@
 量子記憶系統展示版 - 用於圖靈測試
 不依賴真實資料庫，完全模擬量子記憶行為
 """
-import google.generativeai as genai
 from config import Config
+from gemini_standin import create_generative_model
 import logging
 from datetime import datetime
 import random
@@ -15,8 +15,7 @@ logger = logging.getLogger(__name__)
 class GeminiServiceDemo:
     def __init__(self):
         """初始化展示版服務"""
-        genai.configure(api_key=Config.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel(Config.GEMINI_MODEL)
+        self.model = create_generative_model(Config.GEMINI_MODEL)
         logger.info(f"Demo Gemini model initialized with {Config.GEMINI_MODEL}")
         
         # 模擬的記憶存儲
@@ -0,0 +1,543 @@
+"""
+離線的 Gemini 替身（generate_content / embed_content）
+GEMINI_BACKEND 選擇模式：
+- live：直接使用 google.generativeai
+- record：使用真實 API，並把每次請求與回應（含延遲）寫入 GEMINI_STANDIN_FILE（JSONL）
+- replay：從錄製檔回放；相同請求回放原本的回應，其他請求從同類紀錄抽樣，延遲依錄到的分布
+- synthetic：不需要錄製檔，延遲、錯誤率與 function call 比例由設定決定
+替身模型提供 GeminiService 用到的介面（candidates、parts、function_call、text、串流），
+整個 bot 可以在沒有網路的機器上壓測。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSIONS = 768
+
+
+# ---- 回應物件（與 SDK 的 GenerateContentResponse 介面相同）----
+
+class _FunctionCall:
+    def __init__(self, name: str, args: Dict):
+        self.name = name
+        self.args = args
+
+
+class _Part:
+    def __init__(self, text: Optional[str] = None, function_call: Optional[_FunctionCall] = None):
+        self.text = text
+        self.function_call = function_call
+
+
+class _Content:
+    def __init__(self, parts: List[_Part]):
+        self.parts = parts
+
+
+class _Candidate:
+    def __init__(self, parts: List[_Part]):
+        self.content = _Content(parts)
+
+
+class _Usage:
+    def __init__(self, prompt_token_count: int):
+        self.prompt_token_count = prompt_token_count
+
+
+class StandinResponse:
+    """替身回應；record 為 describe_response 的格式"""
+
+    def __init__(self, record: Dict):
+        parts = [_Part(function_call=_FunctionCall(call["name"], call["args"]))
+                 for call in record.get("function_calls") or []]
+        if record.get("text"):
+            parts.append(_Part(text=record["text"]))
+        self.candidates = [_Candidate(parts)]
+        self.usage_metadata = _Usage(record.get("prompt_tokens") or 0)
+
+    @property
+    def text(self) -> str:
+        # 與 SDK 相同：沒有文字部分時拋出 ValueError
+        texts = [part.text for part in self.candidates[0].content.parts if part.text]
+        if not texts:
+            raise ValueError("Response has no text parts")
+        return "".join(texts)
+
+
+class StandinStream(StandinResponse):
+    """串流回應：建立時已收到第一個 chunk，其餘依延遲逐一送出"""
+
+    def __init__(self, record: Dict, chunks: List[str], delays: List[float]):
+        first = dict(record, text=chunks[0] if chunks else None)
+        super().__init__(first)
+        self._chunks = chunks
+        self._delays = delays
+
+    async def __aiter__(self):
+        yield self
+        for text, delay in zip(self._chunks[1:], self._delays):
+            await asyncio.sleep(delay)
+            yield StandinResponse({"text": text})
+
+    async def resolve(self):
+        return None
+
+
+def describe_response(response) -> Dict:
+    """把 SDK 回應轉成可寫入 JSONL 的紀錄"""
+    function_calls, texts = [], []
+    for candidate in (getattr(response, "candidates", None) or [])[:1]:
+        for part in candidate.content.parts:
+            if getattr(part, "function_call", None):
+                function_calls.append({"name": part.function_call.name,
+                                       "args": dict(part.function_call.args)})
+            elif getattr(part, "text", None):
+                texts.append(part.text)
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "text": "".join(texts) or None,
+        "function_calls": function_calls,
+        "prompt_tokens": getattr(usage, "prompt_token_count", None)
+    }
+
+
+def request_key(kind: str, model: str, payload: Any) -> str:
+    """請求的雜湊，回放時用來找出相同的請求"""
+    data = json.dumps([kind, model, payload], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def request_shape(contents: Any) -> str:
+    """prompt：一般請求；followup：帶有 function response 的後續請求"""
+    if isinstance(contents, list) and any(isinstance(item, dict) and item.get("role") == "function"
+                                          for item in contents):
+        return "followup"
+    return "prompt"
+
+
+def hash_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    """由文字雜湊產生固定的單位向量（相同文字得到相同向量）"""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def split_chunks(text: str, size: int) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def make_error(name: str, message: str) -> Exception:
+    """依錯誤名稱建立例外；google.api_core 有同名類別時使用它，重試邏輯才會一致"""
+    try:
+        from google.api_core import exceptions as api_exceptions
+        error_class = getattr(api_exceptions, name, None)
+        if isinstance(error_class, type) and issubclass(error_class, Exception):
+            return error_class(message)
+    except ImportError:
+        pass
+    return RuntimeError(f"{name}: {message}")
+
+
+def _timeout_of(request_options: Optional[Dict]) -> Optional[float]:
+    return (request_options or {}).get("timeout")
+
+
+# ---- 後端 ----
+
+class SyntheticBackend:
+    """依設定產生回應
+
+    latency_ms / latency_sigma：延遲為對數常態分布（中位數、離散程度）
+    error_rate：回傳暫時性錯誤（ServiceUnavailable / ResourceExhausted）的比例
+    function_call_rate：意圖路由判斷可以用工具的訊息中，回傳 function call 的比例
+    """
+
+    def __init__(self, latency_ms: float = 800, latency_sigma: float = 0.5, error_rate: float = 0.0,
+                 function_call_rate: float = 0.5, response_chars: int = 120,
+                 embed_latency_ms: float = 80, rng: Optional[random.Random] = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.function_call_rate = function_call_rate
+        self.response_chars = response_chars
+        self.embed_latency_ms = embed_latency_ms
+        self._rng = rng or random.Random()
+        self._router = None
+
+    def _sample(self, median_ms: float) -> float:
+        if median_ms <= 0:
+            return 0.0
+        return self._rng.lognormvariate(math.log(median_ms / 1000.0), self.latency_sigma)
+
+    def _route(self, message: str):
+        if self._router is None:
+            from intent_router import IntentRouter
+            self._router = IntentRouter(threshold=0.0, shadow_rate=0.0)
+        return self._router.route(message)
+
+    def generate(self, model: str, contents: Any, has_tools: bool) -> Dict:
+        latency = self._sample(self.latency_ms)
+        if self._rng.random() < self.error_rate:
+            return {"latency": latency * 0.2,
+                    "error": self._rng.choice(["ServiceUnavailable", "ResourceExhausted"])}
+
+        if request_shape(contents) == "followup":
+            names = [part["function_response"]["name"] for item in contents if item.get("role") == "function"
+                     for part in item["parts"]]
+            return {"latency": latency, "response": {"text": f"（離線回應）已完成 {', '.join(names)}。"}}
+
+        message = self._last_message(contents)
+        intent = self._route(message) if has_tools else None
+        if intent is not None and self._rng.random() < self.function_call_rate:
+            return {"latency": latency, "response": {
+                "function_calls": [{"name": intent.name, "args": intent.args}]}}
+
+        text = f"（離線回應）{message}"
+        while len(text) < self.response_chars:
+            text += "這是替身模型產生的回應內容，用來模擬真實回覆的長度。"
+        return {"latency": latency, "response": {"text": text}}
+
+    @staticmethod
+    def _last_message(contents: Any) -> str:
+        """context 的最後一則使用者訊息（「使用者：…\\n助理：」）"""
+        if not isinstance(contents, str):
+            return json.dumps(contents, ensure_ascii=False, default=str)[:50]
+        tail = contents.rsplit("使用者：", 1)[-1]
+        return tail.rsplit("\n助理：", 1)[0].strip()
+
+    def embed(self, model: str, content: str) -> Dict:
+        return {"latency": self._sample(self.embed_latency_ms),
+                "response": {"embedding": hash_embedding(content)}}
+
+
+class ReplayBackend:
+    """回放錄製檔；相同的請求回放原本的紀錄，其他請求從同類紀錄抽樣
+
+    speed：延遲除以這個倍數（2 表示以兩倍速回放）
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, rng: Optional[random.Random] = None):
+        self.speed = speed if speed > 0 else 1.0
+        self._rng = rng or random.Random()
+        self._by_key: Dict[str, List[Dict]] = {}
+        self._by_shape: Dict[str, List[Dict]] = {}
+        self._latencies: Dict[str, List[float]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load(path)
+
+    def _load(self, path: str):
+        count = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                shape = f"{record['kind']}:{record.get('shape', 'prompt')}"
+                self._by_key.setdefault(record["key"], []).append(record)
+                self._by_shape.setdefault(shape, []).append(record)
+                self._latencies.setdefault(record["kind"], []).append(record["latency"])
+                count += 1
+        logger.info(f"Loaded {count} recorded Gemini calls from {path}")
+
+    def _lookup(self, key: str, shape: str) -> Optional[Dict]:
+        with self._lock:
+            records = self._by_key.get(key)
+            if records:
+                # 同一個請求錄到多次時依序輪流回放
+                index = self._cursor.get(key, 0)
+                self._cursor[key] = index + 1
+                self.hits += 1
+                return records[index % len(records)]
+            self.misses += 1
+            candidates = self._by_shape.get(shape)
+            return self._rng.choice(candidates) if candidates else None
+
+    def _replay(self, kind: str, key: str, shape: str) -> Dict:
+        record = self._lookup(key, f"{kind}:{shape}")
+        if record is None:
+            raise make_error("NotFound", f"No recorded {kind} call to replay")
+        latency = record["latency"]
+        if key != record["key"]:
+            # 抽樣的紀錄：延遲改從錄到的分布抽樣，避免每次都是同一個值
+            latency = self._rng.choice(self._latencies[kind])
+        replayed = dict(record, latency=latency / self.speed)
+        if record.get("ttft") is not None and record["latency"] > 0:
+            replayed["ttft"] = record["ttft"] * (latency / record["latency"]) / self.speed
+        return replayed
+
+    def generate(self, model: str, contents: Any, has_tools: bool) -> Dict:
+        return self._replay("generate", request_key("generate", model, contents), request_shape(contents))
+
+    def embed(self, model: str, content: str) -> Dict:
+        return self._replay("embed", request_key("embed", model, content), "prompt")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class Recorder:
+    """把真實 API 的請求與回應附加到 JSONL"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def write(self, kind: str, model: str, payload: Any, latency: float,
+              response: Optional[Dict] = None, error: Optional[Exception] = None,
+              chunks: Optional[List[str]] = None, ttft: Optional[float] = None):
+        record = {
+            "kind": kind,
+            "key": request_key(kind, model, payload),
+            "shape": request_shape(payload),
+            "model": model,
+            "request": payload,
+            "latency": round(latency, 4),
+            "response": response,
+            "error": type(error).__name__ if error else None
+        }
+        if chunks is not None:
+            record["chunks"] = chunks
+            record["ttft"] = round(ttft, 4)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            # 每次開檔附加，fork 後的 worker 也能安全寫入
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.records += 1
+
+
+# ---- 替身模型 ----
+
+class StandinModel:
+    """取代 genai.GenerativeModel；回應與延遲由後端決定"""
+
+    def __init__(self, model_name: str, backend, tools=None, stream_chunk_chars: int = 20):
+        self.model_name = model_name
+        self.backend = backend
+        self.tools = tools
+        self.stream_chunk_chars = stream_chunk_chars
+
+    def _result(self, contents) -> Dict:
+        result = self.backend.generate(self.model_name, contents, bool(self.tools))
+        _stats.record("generate", result)
+        return result
+
+    @staticmethod
+    def _wait_time(result: Dict, request_options: Optional[Dict]):
+        """(等待秒數, 是否逾時)"""
+        timeout = _timeout_of(request_options)
+        if timeout is not None and result["latency"] > timeout:
+            return timeout, True
+        return result["latency"], False
+
+    @staticmethod
+    def _finish(result: Dict, timed_out: bool):
+        if timed_out:
+            raise make_error("DeadlineExceeded", "Stand-in latency exceeded the request timeout")
+        if result.get("error"):
+            raise make_error(result["error"], "Stand-in error")
+
+    def _stream(self, result: Dict, first_wait: float) -> StandinStream:
+        response = result["response"]
+        if response.get("function_calls") or not response.get("text"):
+            return StandinStream(response, [response.get("text") or ""], [])
+        chunks = result.get("chunks") or split_chunks(response["text"], self.stream_chunk_chars)
+        remaining = max(0.0, result["latency"] - first_wait)
+        delays = [remaining / max(1, len(chunks) - 1)] * (len(chunks) - 1)
+        return StandinStream(response, chunks, delays)
+
+    def _first_wait(self, result: Dict) -> float:
+        # 錄製時有首字延遲就用它；否則假設首字出現在總延遲的 40%
+        return result.get("ttft", result["latency"] * 0.4)
+
+    def generate_content(self, contents, stream: bool = False, request_options: Optional[Dict] = None,
+                         **kwargs):
+        result = self._result(contents)
+        wait, timed_out = self._wait_time(result, request_options)
+        time.sleep(wait)
+        self._finish(result, timed_out)
+        return StandinResponse(result["response"])
+
+    async def generate_content_async(self, contents, stream: bool = False,
+                                     request_options: Optional[Dict] = None, **kwargs):
+        result = self._result(contents)
+        if stream and not result.get("error"):
+            first_wait = min(self._first_wait(result), result["latency"])
+            wait, timed_out = self._wait_time(dict(result, latency=first_wait), request_options)
+            await asyncio.sleep(wait)
+            self._finish(result, timed_out)
+            return self._stream(result, first_wait)
+        wait, timed_out = self._wait_time(result, request_options)
+        await asyncio.sleep(wait)
+        self._finish(result, timed_out)
+        return StandinResponse(result["response"])
+
+
+class RecordingModel:
+    """包裝真實模型，每次呼叫寫入錄製檔（串流會先讀完再交給呼叫端）"""
+
+    def __init__(self, model, recorder: Recorder):
+        self.model = model
+        self.model_name = getattr(model, "model_name", Config.GEMINI_MODEL)
+        self.recorder = recorder
+
+    def generate_content(self, contents, **kwargs):
+        start = time.monotonic()
+        try:
+            response = self.model.generate_content(contents, **kwargs)
+        except Exception as e:
+            self.recorder.write("generate", self.model_name, contents, time.monotonic() - start, error=e)
+            raise
+        self.recorder.write("generate", self.model_name, contents, time.monotonic() - start,
+                            response=describe_response(response))
+        return response
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        start = time.monotonic()
+        try:
+            response = await self.model.generate_content_async(contents, stream=stream, **kwargs)
+            ttft = time.monotonic() - start
+            chunks = None
+            if stream:
+                await response.resolve()
+                chunks = [chunk.text async for chunk in response if _has_text(chunk)]
+        except Exception as e:
+            self.recorder.write("generate", self.model_name, contents, time.monotonic() - start, error=e)
+            raise
+        self.recorder.write("generate", self.model_name, contents, time.monotonic() - start,
+                            response=describe_response(response), chunks=chunks,
+                            ttft=ttft if stream else None)
+        return response
+
+
+def _has_text(chunk) -> bool:
+    try:
+        return bool(chunk.text)
+    except Exception:
+        return False
+
+
+# ---- 統計 ----
+
+class StandinStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+        self.function_calls = 0
+
+    def record(self, kind: str, result: Dict):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            if result.get("error"):
+                self.errors += 1
+            elif (result.get("response") or {}).get("function_calls"):
+                self.function_calls += 1
+
+
+_stats = StandinStats()
+_backend = None
+_recorder = None
+_lock = threading.Lock()
+
+
+def _get_backend():
+    """依 GEMINI_BACKEND 建立替身後端（每個程序一個）"""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                if Config.GEMINI_BACKEND == "replay":
+                    _backend = ReplayBackend(Config.GEMINI_STANDIN_FILE, speed=Config.GEMINI_STANDIN_SPEED)
+                else:
+                    _backend = SyntheticBackend(
+                        latency_ms=Config.GEMINI_STANDIN_LATENCY_MS,
+                        latency_sigma=Config.GEMINI_STANDIN_LATENCY_SIGMA,
+                        error_rate=Config.GEMINI_STANDIN_ERROR_RATE,
+                        function_call_rate=Config.GEMINI_STANDIN_FUNCTION_CALL_RATE,
+                        embed_latency_ms=Config.GEMINI_STANDIN_EMBED_LATENCY_MS
+                    )
+                logger.warning(f"Gemini stand-in enabled (GEMINI_BACKEND={Config.GEMINI_BACKEND})")
+    return _backend
+
+
+def _get_recorder() -> Recorder:
+    global _recorder
+    if _recorder is None:
+        with _lock:
+            if _recorder is None:
+                _recorder = Recorder(Config.GEMINI_STANDIN_FILE)
+                logger.warning(f"Recording Gemini calls to {Config.GEMINI_STANDIN_FILE}")
+    return _recorder
+
+
+def create_generative_model(model_name: str, tools=None):
+    """依 GEMINI_BACKEND 建立模型（live / record 使用真實 API）"""
+    if Config.GEMINI_BACKEND in ("replay", "synthetic"):
+        return StandinModel(model_name, _get_backend(), tools=tools)
+
+    import google.generativeai as genai
+    genai.configure(api_key=Config.GEMINI_API_KEY)
+    model = genai.GenerativeModel(model_name=model_name, tools=tools) if tools else genai.GenerativeModel(model_name)
+    if Config.GEMINI_BACKEND == "record":
+        return RecordingModel(model, _get_recorder())
+    return model
+
+
+def embed_content(model: str, content: str, **kwargs) -> Dict:
+    """取代 genai.embed_content；回傳 {"embedding": [...]}"""
+    if Config.GEMINI_BACKEND in ("replay", "synthetic"):
+        result = _get_backend().embed(model, content)
+        _stats.record("embed", result)
+        time.sleep(result["latency"])
+        if result.get("error"):
+            raise make_error(result["error"], "Stand-in error")
+        return result["response"]
+
+    import google.generativeai as genai
+    if Config.GEMINI_BACKEND != "record":
+        return genai.embed_content(model=model, content=content, **kwargs)
+
+    start = time.monotonic()
+    try:
+        result = genai.embed_content(model=model, content=content, **kwargs)
+    except Exception as e:
+        _get_recorder().write("embed", model, content, time.monotonic() - start, error=e)
+        raise
+    _get_recorder().write("embed", model, content, time.monotonic() - start,
+                          response={"embedding": list(result["embedding"])})
+    return result
+
+
+def stats() -> Optional[Dict]:
+    """替身的呼叫數、錯誤數與回放命中率；live 模式回傳 None"""
+    if Config.GEMINI_BACKEND == "live":
+        return None
+    with _stats._lock:
+        result = {
+            "backend": Config.GEMINI_BACKEND,
+            "calls": dict(_stats.calls),
+            "errors": _stats.errors,
+            "function_calls": _stats.function_calls
+        }
+    if isinstance(_backend, ReplayBackend):
+        result["replay"] = _backend.stats()
+    if _recorder is not None:
+        result["recorded"] = _recorder.records
+    return result
@@ -0,0 +1,20 @@
+"""
+gunicorn 設定
+PRELOAD_APP=true 時在 master 載入應用程式，worker 以 copy-on-write 共用唯讀資料；
+連接池、HTTP 連線與背景執行緒由 fork_safety 的 hook 在 fork 前後處理。
+"""
+import os
+
+# 與 Config.PRELOAD_APP 使用同一個環境變數
+preload_app = os.getenv('PRELOAD_APP', 'false').lower() == 'true'
+
+
+def when_ready(server):
+    """master 載入完成、開始 fork worker 之前"""
+    if preload_app:
+        from fork_safety import freeze_shared_state
+        freeze_shared_state()
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked (preload={preload_app})")
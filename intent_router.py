@@ -0,0 +1,233 @@
+"""
+本地意圖路由
+意思很明確的請求（「我明天有什麼行程？」、「記住…」、「搜尋記憶…」）直接呼叫工具，
+省下讓 Gemini 選工具的第一次呼叫；信心不足時交回 Gemini。
+觸發詞表也集中在這裡，GeminiService 的人格切換使用同一份。
+"""
+import logging
+import random
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Sequence
+
+from user_analyzer import UserAnalyzer
+
+logger = logging.getLogger(__name__)
+
+# 日曆相關的訊息
+CALENDAR_KEYWORDS = ['行程', '安排', '會議', '約會']
+
+# 五行系統觸發詞 -> 建議元素（"分析" 交給無極判斷）
+ELEMENT_TRIGGERS = {
+    "五行": "分析",
+    "卡住": "無極",
+    "debug": "分析",
+    "測試": "水",
+    "開發": "火",
+    "架構": "土",
+    "優化": "金",
+    "需求": "木"
+}
+
+# 明確要求某個角色
+ROLE_REQUESTS = {
+    "火": ["開發專員", "快速實作", "寫程式"],
+    "水": ["測試專員", "找bug", "檢查"],
+    "木": ["產品經理", "規劃", "功能設計"],
+    "土": ["架構師", "系統設計", "穩定性"],
+    "金": ["優化專員", "重構", "效能"],
+    "無極": ["觀察", "分析情況", "系統狀態"]
+}
+
+# CRUZ 模式觸發詞
+CRUZ_TRIGGERS = [
+    "cruz", "tang", "湯明", "tangcruzz",
+    "思考者咖啡", "創業", "創造",
+    "你是誰", "自我介紹"
+]
+
+# 查詢行程（不含新增、刪除）
+CALENDAR_QUERY_NOUNS = CALENDAR_KEYWORDS + ['日曆', '行事曆']
+CALENDAR_QUERY_WORDS = ['有什麼', '有哪些', '有沒有', '查', '看一下', '列出', '幾個', '什麼']
+CALENDAR_CHANGE_WORDS = ['幫我安排', '安排一個', '新增', '建立', '加入', '預約', '排一個',
+                         '提醒我', '取消', '刪除', '改到', '延到']
+# 日期詞 -> (date 參數, days_ahead)
+CALENDAR_DATES = {
+    '今天': ('today', 1),
+    '明天': ('tomorrow', 1),
+    '後天': (2, 1),
+    '這週': ('today', 7),
+    '本週': ('today', 7),
+    '這星期': ('today', 7)
+}
+
+QUANTUM_SEARCH_PATTERNS = [
+    (re.compile(r"(?:搜尋|搜索|查詢|找)(?:一下)?(?:量子)?記憶(?:中的|裡的)?[：:\s]*(?P<query>.+)"), 0.9),
+    # 「你記得…嗎」常常只是聊天，信心低於預設門檻，交給 Gemini 判斷
+    (re.compile(r"你(?:還)?記得(?P<query>.+?)嗎"), 0.6)
+]
+QUANTUM_SAVE_PATTERNS = [
+    (re.compile(r"^(?:請|幫我)?(?:記住|記下來|記下)[：:\s]*(?P<content>.+)"), 0.85)
+]
+
+# 這些意圖代表使用者在抒發或尋求建議，即使提到行程也不該直接查詢
+CONVERSATIONAL_INTENTS = {"尋求建議", "情緒抒發", "尋求支持", "尋求經驗分享"}
+
+_TRAILING_PUNCTUATION = "？?。！!～~ "
+
+
+class RoutedIntent:
+    """路由結果；name / args 與 Gemini 的 function_call 相同，可直接交給工具處理"""
+
+    def __init__(self, name: str, args: Dict, confidence: float):
+        self.name = name
+        self.args = args
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"RoutedIntent({self.name!r}, {self.args!r}, {self.confidence:.2f})"
+
+
+class IntentRouter:
+    """依觸發詞表與 UserAnalyzer 的意圖判斷是否能直接呼叫工具
+
+    threshold：信心達到門檻才直接執行
+    shadow_rate：直接執行的請求中，有多少比例在背景交給 Gemini 比對工具選擇（估算準確率）
+    """
+
+    ROUTABLE_TOOLS = ("list_calendar_events", "quantum_search", "quantum_save")
+
+    def __init__(self, threshold: float = 0.8, shadow_rate: float = 0.05,
+                 analyzer: Optional[UserAnalyzer] = None,
+                 now: Callable[[], datetime] = datetime.now,
+                 rng: Callable[[], float] = random.random):
+        self.threshold = threshold
+        self.shadow_rate = shadow_rate
+        self.analyzer = analyzer or UserAnalyzer()
+        self._now = now
+        self._rng = rng
+        self._lock = threading.Lock()
+
+        # 統計資料
+        self.lookups = 0
+        self.routed: Dict[str, int] = {tool: 0 for tool in self.ROUTABLE_TOOLS}
+        self.low_confidence = 0
+        self.fallbacks = 0
+        self.latency_saved = 0.0
+        self.shadow_checked = 0
+        self.shadow_agreed = 0
+        self.model_choices = 0
+        self.missed = 0
+
+    def route(self, message: str) -> Optional[RoutedIntent]:
+        """信心足夠時回傳要執行的工具，否則回傳 None"""
+        with self._lock:
+            self.lookups += 1
+
+        candidates = [self._match_calendar(message), self._match_quantum(message)]
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        if not candidates:
+            return None
+
+        best = max(candidates, key=lambda candidate: candidate.confidence)
+        if best.confidence < self.threshold:
+            with self._lock:
+                self.low_confidence += 1
+            return None
+        return best
+
+    def _is_conversational(self, message: str) -> bool:
+        return self.analyzer.analyze_user_intent(message)["intent"] in CONVERSATIONAL_INTENTS
+
+    def _match_calendar(self, message: str) -> Optional[RoutedIntent]:
+        if not any(noun in message for noun in CALENDAR_QUERY_NOUNS):
+            return None
+        if any(word in message for word in CALENDAR_CHANGE_WORDS):
+            return None
+
+        confidence = 0.4
+        if any(word in message for word in CALENDAR_QUERY_WORDS):
+            confidence += 0.3
+        if message.rstrip().endswith(('？', '?', '嗎')):
+            confidence += 0.1
+
+        date, days_ahead = 'today', 1
+        for keyword, (day, days) in CALENDAR_DATES.items():
+            if keyword in message:
+                confidence += 0.2
+                date = day if isinstance(day, str) else (self._now() + timedelta(days=day)).date().isoformat()
+                days_ahead = days
+                break
+
+        if self._is_conversational(message):
+            confidence -= 0.3
+        return RoutedIntent("list_calendar_events", {"date": date, "days_ahead": days_ahead},
+                            min(confidence, 1.0))
+
+    def _match_quantum(self, message: str) -> Optional[RoutedIntent]:
+        text = message.strip()
+        for pattern, confidence in QUANTUM_SEARCH_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                query = match.group("query").strip(_TRAILING_PUNCTUATION)
+                if len(query) >= 2:
+                    return RoutedIntent("quantum_search", {"query": query}, confidence)
+
+        for pattern, confidence in QUANTUM_SAVE_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                content = match.group("content").strip(_TRAILING_PUNCTUATION)
+                if len(content) >= 2 and not text.endswith(('？', '?', '嗎')):
+                    return RoutedIntent("quantum_save", {"content": content}, confidence)
+        return None
+
+    # ---- 指標 ----
+
+    def record_routed(self, intent: RoutedIntent, latency_saved: float):
+        """直接執行成功；latency_saved 是省下的 Gemini 呼叫時間估計"""
+        with self._lock:
+            self.routed[intent.name] = self.routed.get(intent.name, 0) + 1
+            self.latency_saved += latency_saved
+
+    def record_fallback(self, intent: RoutedIntent):
+        """工具失敗或沒有可直接回覆的訊息，交回 Gemini"""
+        with self._lock:
+            self.fallbacks += 1
+
+    def should_shadow(self) -> bool:
+        return self.shadow_rate > 0 and self._rng() < self.shadow_rate
+
+    def record_shadow(self, intent: RoutedIntent, model_tools: Sequence[str]):
+        """比對 Gemini 在同一則訊息選擇的工具"""
+        with self._lock:
+            self.shadow_checked += 1
+            if intent.name in model_tools:
+                self.shadow_agreed += 1
+            else:
+                logger.info(f"Intent router disagreed with model: routed {intent.name}, "
+                            f"model chose {list(model_tools) or 'no tool'}")
+
+    def record_model_choice(self, model_tools: Sequence[str]):
+        """訊息走 Gemini 時，模型選了路由器能處理的工具即記為漏判"""
+        with self._lock:
+            self.model_choices += 1
+            if any(tool in self.ROUTABLE_TOOLS for tool in model_tools):
+                self.missed += 1
+
+    def stats(self) -> Dict:
+        """取得路由數、準確率（背景比對）、漏判數與省下的時間"""
+        with self._lock:
+            routed_total = sum(self.routed.values())
+            return {
+                "lookups": self.lookups,
+                "routed": dict(self.routed),
+                "routed_total": routed_total,
+                "low_confidence": self.low_confidence,
+                "fallbacks": self.fallbacks,
+                "shadow_checked": self.shadow_checked,
+                "accuracy": (round(self.shadow_agreed / self.shadow_checked, 3)
+                             if self.shadow_checked else None),
+                "missed": self.missed,
+                "latency_saved_s": round(self.latency_saved, 2)
+            }
@@ -2,7 +2,7 @@
 Line Bot 訊息處理器
 """
 import logging
-from linebot import LineBotApi, WebhookHandler
+from linebot import WebhookHandler
 from linebot.exceptions import LineBotApiError
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage,
@@ -12,96 +12,331 @@ from config import Config
 from gemini_service import GeminiService
 from jokes import get_random_joke
 from quantum_integration import quantum_integration
+from worker_pool import BoundedWorkerPool
+from user_lane_executor import LaneRejectedError, UserLaneExecutor
+from webhook_dedup import create_dedup_store, get_event_dedup_key
+from post_reply_pipeline import PostReplyPipeline
+from line_http_client import HttpLatencyMetrics, create_line_bot_api
+import gemini_standin
+from reply_deadline import ReplyDeadlineTracker
+from structured_logging import access_log
+from rate_limiter import AdmissionController, USER_RATE_LIMITED
+from service_registry import registry
+import fork_safety
 import json
+import threading
+from concurrent.futures import wait
 
 logger = logging.getLogger(__name__)
 
 class LineBotHandler:
     def __init__(self):
         """初始化 Line Bot 處理器"""
-        self.line_bot_api = LineBotApi(Config.LINE_CHANNEL_ACCESS_TOKEN)
+        # 保持連線的 LINE API client，並統計每次呼叫的延遲
+        self.line_http_metrics = HttpLatencyMetrics()
+        self.line_bot_api = create_line_bot_api(self.line_http_metrics)
         self.handler = WebhookHandler(Config.LINE_CHANNEL_SECRET)
         self.gemini_service = GeminiService()
         
+        # 回覆後背景管線：非必要工作在回覆送出後才執行
+        self.post_reply = PostReplyPipeline(
+            max_workers=Config.POST_REPLY_WORKERS,
+            max_queue_size=Config.POST_REPLY_QUEUE_SIZE,
+            time_budget=Config.POST_REPLY_TIME_BUDGET
+        )
+        self.gemini_service.post_reply = self.post_reply
+        self.gemini_service.cruz_persona.post_reply = self.post_reply
+        
+        # 回覆期限：來不及時先送暫時回覆，完整答案改用 push
+        self.reply_deadlines = None
+        if Config.REPLY_DEADLINE_ENABLED:
+            self.reply_deadlines = ReplyDeadlineTracker(
+                budget=Config.REPLY_DEADLINE_BUDGET,
+                sender_workers=Config.REPLY_INTERIM_WORKERS
+            )
+        
+        # 准入控制：單一使用者或群組不能佔滿 Gemini 容量
+        self.admission = None
+        if Config.RATE_LIMIT_ENABLED:
+            self.admission = AdmissionController(
+                user_burst=Config.RATE_LIMIT_USER_BURST,
+                user_refill=Config.RATE_LIMIT_USER_REFILL,
+                global_burst=Config.RATE_LIMIT_GLOBAL_BURST,
+                global_refill=Config.RATE_LIMIT_GLOBAL_REFILL,
+                max_in_flight=Config.RATE_LIMIT_MAX_IN_FLIGHT
+            )
+        
+        # 重送事件去重（LINE 在我們回應太慢時會重送）
+        self.dedup_store = create_dedup_store() if Config.WEBHOOK_DEDUP_ENABLED else None
+        
         # 註冊訊息處理器 - 使用裝飾器方式
         @self.handler.add(MessageEvent, message=TextMessage)
         def handle_message(event):
-            self.handle_text_message(event)
+            self._dispatch_event(event)
+        
+        # 非同步 webhook 模式：驗證簽名後放入佇列，由背景執行緒處理
+        self.async_mode = Config.WEBHOOK_ASYNC_MODE
+        # 同步模式等待同一請求內所有事件完成的期限
+        self.sync_deadline = Config.WEBHOOK_SYNC_DEADLINE
+        self.worker_pool = BoundedWorkerPool(
+            max_workers=Config.WEBHOOK_WORKERS,
+            max_queue_size=Config.WEBHOOK_QUEUE_SIZE,
+            name="webhook"
+        )
+        # 同一使用者依序處理，不同使用者平行處理；
+        # 非同步模式佇列已滿時直接拒絕（立即回應 200），同步模式改在請求中處理
+        self.lane_executor = UserLaneExecutor(self.worker_pool, inline_when_full=not self.async_mode)
+        if self.async_mode:
+            logger.info("Webhook async mode enabled")
+        
+        # 較重的服務在背景預先建立，第一則訊息不必等待
+        if Config.PRELOAD_APP:
+            # preload 模式在 master 同步載入，fork 前不留下背景執行緒
+            self._preload_shared_state()
+        elif Config.SERVICE_PREWARM:
+            threading.Thread(target=self._prewarm_services, name="service-prewarm", daemon=True).start()
         
         logger.info("LineBotHandler initialized successfully")
     
+    def _prewarm_services(self):
+        """預先載入 Gemini 模型與 Calendar Service（失敗時等第一次使用再重試）"""
+        try:
+            self.gemini_service.model
+            self.gemini_service.calendar_service
+        except Exception as e:
+            logger.warning(f"Service prewarm failed: {e}")
+    
+    def _preload_shared_state(self):
+        """preload 模式：在 gunicorn master 載入唯讀資料，worker fork 後共用同一份記憶體"""
+        self._prewarm_services()
+        try:
+            # 七個人格的量子記憶；資料庫連線會在 fork 前關閉，由各 worker 重新建立
+            registry.get("quantum_integration")
+        except Exception as e:
+            logger.warning(f"Quantum memory preload failed, workers will load it on demand: {e}")
+        logger.info("Shared state preloaded for copy-on-write workers")
+    
     def handle_webhook(self, body, signature):
         """處理 webhook 請求"""
-        self.handler.handle(body, signature)
+        # 簽名錯誤會拋出 InvalidSignatureError，由 app.py 回應 400
+        events = self.handler.parser.parse(body, signature)
+        
+        if not self.async_mode and len(events) <= 1:
+            # 單一事件直接在請求中處理，不需要經過執行緒池
+            for event in events:
+                self._dispatch_event(event)
+            return
+        
+        # 佇列已滿時：同步模式改在目前請求中處理（背壓），非同步模式拒絕並記錄
+        futures = [
+            self.lane_executor.submit(self._get_event_key(event), self._dispatch_event, event)
+            for event in events
+        ]
+        
+        if not self.async_mode:
+            self._wait_for_events(futures)
+            return
+        
+        shed = sum(1 for future in futures
+                   if future.done() and isinstance(future.exception(), LaneRejectedError))
+        if shed:
+            access_log.log("webhook", "shed", events=shed)
+    
+    def _wait_for_events(self, futures):
+        """同步模式：等待所有事件完成，超過期限的事件留在背景繼續處理"""
+        done, not_done = wait(futures, timeout=self.sync_deadline)
+        
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Webhook event failed: {error}")
+        
+        if not_done:
+            logger.warning(f"{len(not_done)}/{len(futures)} webhook events still running "
+                           f"after {self.sync_deadline:.1f}s, continuing in background")
+    
+    def _get_event_key(self, event):
+        """事件分道的鍵：優先使用 user_id，群組事件沒有時改用群組或聊天室 ID"""
+        source = getattr(event, 'source', None)
+        for attr in ('user_id', 'group_id', 'room_id'):
+            value = getattr(source, attr, None)
+            if value:
+                return value
+        return "unknown"
+    
+    def _dispatch_event(self, event):
+        """依事件類型分派處理（對應 handler.add 註冊的事件）"""
+        if self._is_duplicate_event(event):
+            return
+        
+        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+            self.handle_text_message(event)
+    
+    def _is_duplicate_event(self, event) -> bool:
+        """檢查是否為已處理過的重送事件（先標記再處理，最多處理一次）"""
+        if self.dedup_store is None:
+            return False
+        
+        key = get_event_dedup_key(event)
+        if key is None or self.dedup_store.check_and_mark(key):
+            return False
+        
+        delivery_context = getattr(event, 'delivery_context', None)
+        is_redelivery = getattr(delivery_context, 'is_redelivery', None)
+        logger.info(f"Skipping duplicate webhook event {key} (redelivery: {is_redelivery})")
+        return True
+    
+    def get_webhook_stats(self) -> dict:
+        """取得 webhook 處理狀態（供健康檢查使用）"""
+        return {
+            "async_mode": self.async_mode,
+            "sync_deadline": self.sync_deadline,
+            "worker_pool": self.worker_pool.stats(),
+            "lanes": self.lane_executor.stats(),
+            "post_reply": self.post_reply.stats(),
+            "dedup": self.dedup_store.stats() if self.dedup_store else None,
+            "line_http": self.line_http_metrics.stats(),
+            "reply_deadline": self.reply_deadlines.stats() if self.reply_deadlines else None,
+            "admission": self.admission.stats() if self.admission else None,
+            "gemini": self.gemini_service.hedger.stats(),
+            "tools": self.gemini_service.tool_executor.stats(),
+            "gemini_standin": gemini_standin.stats(),
+            "intent_router": (self.gemini_service.intent_router.stats()
+                              if self.gemini_service.intent_router else None),
+            "semantic_cache": (self.gemini_service.semantic_cache.stats()
+                               if self.gemini_service.semantic_cache else None),
+            "context": self.gemini_service.context_builder.stats(),
+            "conversations": self.gemini_service.conversation_history.stats(),
+            "sessions": self.gemini_service.sessions.stats(),
+            "services": registry.stats(),
+            "fork": fork_safety.stats()
+        }
     
     def handle_text_message(self, event):
         """處理文字訊息"""
+        # 處理期間提交的背景工作，會等回覆送出後才開始執行
+        with self.post_reply.deferred():
+            self._process_text_message(event)
+    
+    def _process_text_message(self, event):
+        """解析指令、產生回覆並送出"""
         user_id = event.source.user_id
         message_text = event.message.text.strip()
         
-        logger.info(f"Received message from {user_id}: {message_text}")
+        access_log.capture("message", "received", user_id=user_id, text=message_text)
+        access_log.log("message", "received", user_id=user_id, length=len(message_text))
         
+        deadline = self._track_reply_deadline(event)
         try:
-            # 處理特殊命令
-            if message_text in ['/help', '幫助']:
-                reply_text = self._get_help_message()
-            elif message_text in ['/clear', '清除對話']:
-                self.gemini_service.clear_history(user_id)
-                reply_text = "已清除對話記錄！讓我們重新開始吧。"
-            elif message_text == '/test':
-                reply_text = self._run_self_test()
-            elif message_text in ['說個笑話', '講個笑話', '來個笑話']:
-                reply_text = get_random_joke()
-            # 五行系統指令
-            elif message_text in ['/dashboard', '/狀態', '/儀表板']:
-                reply_text = self.gemini_service.get_response(user_id, message_text)
-            elif message_text in ['/status', '/mini', '/簡報']:
-                reply_text = self.gemini_service.get_response(user_id, message_text)
-            elif message_text in ['/harmony', '/和諧度']:
-                reply_text = self.gemini_service.get_response(user_id, message_text)
-            # 量子記憶系統指令
-            elif message_text in ['/quantum', '/量子']:
-                reply_text = quantum_integration.get_quantum_status()
-            elif message_text.startswith('/quantum '):
-                # 查看特定角色的量子記憶
-                persona = message_text.split(' ', 1)[1]
-                reply_text = quantum_integration.get_persona_quantum_report(persona)
-            elif message_text in ['/entangle', '/糾纏']:
-                reply_text = quantum_integration.get_entanglement_status()
-            elif message_text in ['/evolve', '/演化']:
-                reply_text = quantum_integration.get_evolution_insights()
-            # CRUZ 模式指令
-            elif message_text in ['/cruz', '/CRUZ', '切換到CRUZ']:
-                self.gemini_service.cruz_mode = True
-                self.gemini_service.element_mode = False
-                reply_text = "已切換到 CRUZ 模式！我是 CRUZ，很高興能和你聊天。有什麼想討論的嗎？"
-            elif message_text in ['/ai', '/AI', '切換到AI']:
-                self.gemini_service.cruz_mode = False
-                self.gemini_service.element_mode = False
-                reply_text = "已切換回 AI 助理模式。"
-            else:
+            reply_text = self._get_command_reply(user_id, message_text)
+            if reply_text is None:
+                reply_text = self._get_rejection_reply(event)
+            if reply_text is None:
                 # 一般對話，交給 Gemini 處理
-                reply_text = self.gemini_service.get_response(user_id, message_text)
-                
-                # 將對話同步到量子記憶系統
                 try:
-                    current_role = self._get_current_role()
-                    quantum_integration.process_conversation(
-                        user_id=user_id,
-                        message=message_text,
-                        response=reply_text,
-                        current_role=current_role
-                    )
-                except Exception as e:
-                    logger.warning(f"Failed to sync to quantum memory: {e}")
+                    reply_text = self.gemini_service.get_response(user_id, message_text)
+                finally:
+                    self._release_admission()
+                self._schedule_quantum_sync(user_id, message_text, reply_text)
             
             # 發送回覆
-            self._send_reply(event.reply_token, reply_text)
+            self._deliver_reply(event, deadline, reply_text)
             
         except Exception as e:
             logger.error(f"Error handling message: {str(e)}")
             error_message = "抱歉，處理您的訊息時發生錯誤。請稍後再試。"
-            self._send_reply(event.reply_token, error_message)
+            self._deliver_reply(event, deadline, error_message)
+    
+    def _track_reply_deadline(self, event):
+        """開始追蹤 reply token 期限；未啟用時回傳 None"""
+        if self.reply_deadlines is None:
+            return None
+        return self.reply_deadlines.track(
+            lambda: self._send_reply(event.reply_token, Config.REPLY_INTERIM_MESSAGE),
+            getattr(event, 'timestamp', None)
+        )
+    
+    def _deliver_reply(self, event, deadline, message_text):
+        """期限內用 reply token 回覆；已送出暫時回覆時改用 push"""
+        if deadline is None or deadline.claim_reply():
+            self._send_reply(event.reply_token, message_text)
+        else:
+            self._send_push(self._get_push_target(event), message_text)
+    
+    def _get_push_target(self, event):
+        """push 的對象：群組或聊天室中回到原本的對話，否則回給使用者"""
+        source = event.source
+        return (getattr(source, 'group_id', None) or getattr(source, 'room_id', None)
+                or source.user_id)
+    
+    def _get_command_reply(self, user_id, message_text):
+        """處理特殊命令；一般對話回傳 None"""
+        if message_text in ['/help', '幫助']:
+            return self._get_help_message()
+        elif message_text in ['/clear', '清除對話']:
+            self.gemini_service.clear_history(user_id)
+            return "已清除對話記錄！讓我們重新開始吧。"
+        elif message_text == '/test':
+            return self._run_self_test()
+        elif message_text in ['說個笑話', '講個笑話', '來個笑話']:
+            return get_random_joke()
+        # 五行系統指令
+        elif message_text in ['/dashboard', '/狀態', '/儀表板']:
+            return self.gemini_service.get_response(user_id, message_text)
+        elif message_text in ['/status', '/mini', '/簡報']:
+            return self.gemini_service.get_response(user_id, message_text)
+        elif message_text in ['/harmony', '/和諧度']:
+            return self.gemini_service.get_response(user_id, message_text)
+        # 量子記憶系統指令
+        elif message_text in ['/quantum', '/量子']:
+            return quantum_integration.get_quantum_status()
+        elif message_text.startswith('/quantum '):
+            # 查看特定角色的量子記憶
+            persona = message_text.split(' ', 1)[1]
+            return quantum_integration.get_persona_quantum_report(persona)
+        elif message_text in ['/entangle', '/糾纏']:
+            return quantum_integration.get_entanglement_status()
+        elif message_text in ['/evolve', '/演化']:
+            return quantum_integration.get_evolution_insights()
+        # CRUZ 模式指令
+        elif message_text in ['/cruz', '/CRUZ', '切換到CRUZ']:
+            self.gemini_service.set_persona_mode(user_id, cruz_mode=True)
+            return "已切換到 CRUZ 模式！我是 CRUZ，很高興能和你聊天。有什麼想討論的嗎？"
+        elif message_text in ['/ai', '/AI', '切換到AI']:
+            self.gemini_service.set_persona_mode(user_id, cruz_mode=False)
+            return "已切換回 AI 助理模式。"
+        return None
+    
+    def _get_rejection_reply(self, event):
+        """准入檢查：放行回傳 None（處理完要呼叫 _release_admission），否則回傳固定訊息"""
+        if self.admission is None:
+            return None
+        
+        # 群組或聊天室整體共用一個額度（與 push 對象相同）
+        key = self._get_push_target(event)
+        reason = self.admission.try_admit(key)
+        if reason is None:
+            return None
+        
+        access_log.log("message", "rejected", key=key, reason=reason)
+        if reason == USER_RATE_LIMITED:
+            return Config.RATE_LIMIT_USER_MESSAGE
+        return Config.RATE_LIMIT_BUSY_MESSAGE
+    
+    def _release_admission(self):
+        if self.admission is not None:
+            self.admission.release()
+    
+    def _schedule_quantum_sync(self, user_id, message_text, reply_text):
+        """將對話同步到量子記憶系統（回覆送出後才執行）"""
+        self.post_reply.submit(
+            "quantum_sync",
+            quantum_integration.process_conversation,
+            user_id=user_id,
+            message=message_text,
+            response=reply_text,
+            current_role=self.gemini_service.get_current_role(user_id)
+        )
     
     def _send_reply(self, reply_token, message_text):
         """發送回覆訊息"""
@@ -117,6 +352,16 @@ class LineBotHandler:
         except LineBotApiError as e:
             logger.error(f"Failed to send reply: {e}")
     
+    def _send_push(self, to, message_text):
+        """以 push 訊息送出（reply token 已使用或過期時）"""
+        try:
+            if len(message_text) > 5000:
+                message_text = message_text[:4997] + "..."
+            
+            self.line_bot_api.push_message(to, TextSendMessage(text=message_text))
+        except LineBotApiError as e:
+            logger.error(f"Failed to push message: {e}")
+    
     def _get_help_message(self):
         """取得說明訊息"""
         return """🤖 Persona Cruz AI 助理使用說明
@@ -186,13 +431,3 @@ class LineBotHandler:
             results.append("❌ 五行系統異常")
         
         return "🔧 系統自我測試結果：\n\n" + "\n".join(results)
-    
-    def _get_current_role(self):
-        """獲取當前活躍的角色"""
-        if self.gemini_service.cruz_mode:
-            return "CRUZ"
-        elif self.gemini_service.element_mode and hasattr(self.gemini_service, 'five_elements'):
-            current = self.gemini_service.five_elements.get_current_element()
-            if current:
-                return current.name
-        return "AI助理"
\ No newline at end of file
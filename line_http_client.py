@@ -0,0 +1,172 @@
+"""
+LINE Messaging API 的連線池 HTTP client
+SDK 預設的 RequestsHttpClient 每次呼叫都用 requests.post，沒有重用連線，
+尖峰時每個回覆都要重新做 TLS 握手；這裡改用保持連線的 Session
+（非同步版本見 async_line_http_client.py）
+"""
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot import LineBotApi
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+from config import Config
+from fork_safety import register_fork_hooks
+
+logger = logging.getLogger(__name__)
+
+
+def get_operation_name(url: str) -> str:
+    """由 URL 取得 API 名稱，例如 /v2/bot/message/reply -> message/reply"""
+    path = urlparse(url).path
+    for prefix in ("/v2/bot/", "/v3/bot/"):
+        if path.startswith(prefix):
+            return path[len(prefix):]
+    return path.lstrip("/") or "unknown"
+
+
+class HttpLatencyMetrics:
+    """依 API 名稱統計呼叫次數、錯誤數與延遲分布"""
+
+    def __init__(self, window: int = 256):
+        self.window = window
+        self._lock = threading.Lock()
+        self._operations: Dict[str, Dict] = {}
+
+    def record(self, operation: str, duration: float, status: Optional[int] = None,
+               error: bool = False):
+        with self._lock:
+            entry = self._operations.get(operation)
+            if entry is None:
+                entry = self._operations[operation] = {
+                    "count": 0,
+                    "errors": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "last_status": None,
+                    "recent": deque(maxlen=self.window),
+                    "successes": deque(maxlen=self.window)
+                }
+            entry["count"] += 1
+            entry["total_time"] += duration
+            entry["max_time"] = max(entry["max_time"], duration)
+            entry["recent"].append(duration)
+            if status is not None:
+                entry["last_status"] = status
+            if error or (status is not None and status >= 400):
+                entry["errors"] += 1
+            else:
+                entry["successes"].append(duration)
+
+    def percentile(self, operation: str, fraction: float, min_samples: int = 1) -> Optional[float]:
+        """近期成功呼叫延遲的百分位（秒）；樣本不足時回傳 None"""
+        with self._lock:
+            entry = self._operations.get(operation)
+            recent = sorted(entry["successes"]) if entry else []
+        if len(recent) < max(1, min_samples):
+            return None
+        return _percentile(recent, fraction)
+
+    def stats(self) -> Dict:
+        """取得各 API 的延遲統計（毫秒）"""
+        with self._lock:
+            snapshot = {name: dict(entry, recent=list(entry["recent"]), successes=None)
+                        for name, entry in self._operations.items()}
+
+        result = {}
+        for name, entry in snapshot.items():
+            recent = sorted(entry["recent"])
+            result[name] = {
+                "count": entry["count"],
+                "errors": entry["errors"],
+                "last_status": entry["last_status"],
+                "avg_ms": round(entry["total_time"] / entry["count"] * 1000, 1),
+                "p50_ms": round(_percentile(recent, 0.50) * 1000, 1),
+                "p95_ms": round(_percentile(recent, 0.95) * 1000, 1),
+                "max_ms": round(entry["max_time"] * 1000, 1)
+            }
+        return result
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def get_line_timeout() -> Tuple[float, float]:
+    """(連線逾時, 讀取逾時)"""
+    return (Config.LINE_HTTP_CONNECT_TIMEOUT, Config.LINE_HTTP_READ_TIMEOUT)
+
+
+class PooledRequestsHttpClient(RequestsHttpClient):
+    """共用 requests.Session 的 HttpClient，連線保持開啟供後續呼叫重用"""
+
+    def __init__(self, timeout=None, pool_size: int = 10,
+                 metrics: Optional[HttpLatencyMetrics] = None):
+        super().__init__(timeout=timeout if timeout is not None else get_line_timeout())
+        self.metrics = metrics
+        self.session = requests.Session()
+        # 重試交給呼叫端決定，這裡不自動重送（避免重複回覆）
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # fork 前關閉保持中的連線，子程序之後自行建立，不會與父程序共用同一個 socket
+        register_fork_hooks(before=self.session.close)
+
+    def _request(self, method: str, url: str, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+
+        start = time.monotonic()
+        status = None
+        try:
+            response = self.session.request(method, url, timeout=timeout, **kwargs)
+            status = response.status_code
+            return RequestsHttpResponse(response)
+        except Exception:
+            if self.metrics:
+                self.metrics.record(get_operation_name(url), time.monotonic() - start, error=True)
+            raise
+        finally:
+            if self.metrics and status is not None:
+                self.metrics.record(get_operation_name(url), time.monotonic() - start, status=status)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request("GET", url, headers=headers, params=params, stream=stream, timeout=timeout)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request("POST", url, headers=headers, data=data, timeout=timeout)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request("DELETE", url, headers=headers, data=data, timeout=timeout)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request("PUT", url, headers=headers, data=data, timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+
+def create_line_bot_api(metrics: Optional[HttpLatencyMetrics] = None) -> LineBotApi:
+    """建立使用連線池的 LineBotApi"""
+    # LineBotApi 會以 http_client(timeout=...) 建立 client，用 partial 帶入其他參數
+    http_client = functools.partial(
+        PooledRequestsHttpClient,
+        pool_size=Config.LINE_HTTP_POOL_SIZE,
+        metrics=metrics
+    )
+    return LineBotApi(
+        Config.LINE_CHANNEL_ACCESS_TOKEN,
+        endpoint=Config.LINE_API_ENDPOINT,
+        timeout=get_line_timeout(),
+        http_client=http_client
+    )
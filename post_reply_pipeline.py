@@ -0,0 +1,117 @@
+"""
+回覆後背景處理管線
+量子記憶同步、五行指標、語料使用次數寫檔等非必要工作，
+在回覆送出後才執行，不佔用使用者等待回覆的時間
+"""
+import logging
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict
+
+from worker_pool import BoundedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+# 目前處理中的訊息所暫存的工作（回覆送出後才真正提交）
+_held_tasks: ContextVar = ContextVar("post_reply_held_tasks", default=None)
+
+
+class PostReplyPipeline:
+    """回覆後執行的背景工作管線
+
+    - 有自己的佇列與執行緒，不與 webhook 處理互相搶資源
+    - 每個工作都有時間預算：排隊太久的工作直接丟棄，執行超時會記錄警告
+    - 工作失敗只記錄日誌，不影響使用者回覆
+    """
+
+    def __init__(self, max_workers: int = 1, max_queue_size: int = 200,
+                 time_budget: float = 30.0):
+        self.pool = BoundedWorkerPool(
+            max_workers=max_workers,
+            max_queue_size=max_queue_size,
+            name="post-reply"
+        )
+        self.time_budget = time_budget
+        self._lock = threading.Lock()
+        self.task_stats = defaultdict(lambda: {
+            "completed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "expired": 0,
+            "over_budget": 0,
+            "total_time": 0.0
+        })
+
+    @contextmanager
+    def deferred(self):
+        """在此區塊內提交的工作會先暫存，離開區塊（回覆送出後）才提交"""
+        token = _held_tasks.set([])
+        try:
+            yield
+        finally:
+            held = _held_tasks.get()
+            _held_tasks.reset(token)
+            for name, fn, args, kwargs in held:
+                self._enqueue(name, fn, args, kwargs)
+
+    def submit(self, name: str, fn: Callable, *args, **kwargs) -> bool:
+        """提交背景工作；在 deferred() 區塊內會等到回覆送出後才執行"""
+        held = _held_tasks.get()
+        if held is not None:
+            held.append((name, fn, args, kwargs))
+            return True
+        return self._enqueue(name, fn, args, kwargs)
+
+    def _enqueue(self, name: str, fn: Callable, args: tuple, kwargs: dict) -> bool:
+        enqueued_at = time.monotonic()
+        if self.pool.submit(self._run, name, enqueued_at, fn, args, kwargs):
+            return True
+
+        self._record(name, "dropped")
+        logger.warning(f"Post-reply queue full, dropped task: {name}")
+        return False
+
+    def _run(self, name: str, enqueued_at: float, fn: Callable, args: tuple, kwargs: dict):
+        """執行單一工作，並套用時間預算與錯誤隔離"""
+        waited = time.monotonic() - enqueued_at
+        if waited > self.time_budget:
+            self._record(name, "expired")
+            logger.warning(f"Post-reply task {name} expired after waiting {waited:.1f}s")
+            return
+
+        start = time.monotonic()
+        try:
+            fn(*args, **kwargs)
+            self._record(name, "completed")
+        except Exception as e:
+            self._record(name, "failed")
+            logger.warning(f"Post-reply task {name} failed: {e}")
+        finally:
+            duration = time.monotonic() - start
+            with self._lock:
+                self.task_stats[name]["total_time"] += duration
+            if duration > self.time_budget:
+                self._record(name, "over_budget")
+                logger.warning(f"Post-reply task {name} took {duration:.1f}s "
+                               f"(budget {self.time_budget:.1f}s)")
+
+    def _record(self, name: str, field: str):
+        with self._lock:
+            self.task_stats[name][field] += 1
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        """關閉管線，等待已排隊的工作完成"""
+        self.pool.shutdown(wait=wait, timeout=timeout)
+
+    def stats(self) -> Dict:
+        """取得管線統計"""
+        with self._lock:
+            tasks = {name: dict(values) for name, values in self.task_stats.items()}
+        return {
+            "time_budget": self.time_budget,
+            "pool": self.pool.stats(),
+            "tasks": tasks
+        }
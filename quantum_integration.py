@@ -3,8 +3,8 @@
 """
 import logging
 from typing import Optional, Dict, Any
-from quantum_memory import QuantumMemoryBridge, QuantumMonitor
 from five_elements_agent import FiveElementsAgent
+from service_registry import lazy_service
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +13,8 @@ class QuantumIntegration:
     """整合量子記憶到現有系統"""
     
     def __init__(self):
+        from quantum_memory import QuantumMemoryBridge, QuantumMonitor
+        
         # 強制使用資料庫模式
         self.bridge = QuantumMemoryBridge(use_database=True)
         self.monitor = QuantumMonitor(self.bridge)
@@ -235,4 +237,5 @@ class QuantumIntegration:
 
 
 # 全局實例
-quantum_integration = QuantumIntegration()
\ No newline at end of file
+# 第一次使用時才建立（會連接資料庫並載入七個角色的記憶）
+quantum_integration = lazy_service("quantum_integration")
\ No newline at end of file
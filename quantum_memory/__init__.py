@@ -2,23 +2,31 @@
 量子記憶系統
 一個基於量子概念的 AI 記憶演化系統
 """
-
-from .quantum_memory import QuantumMemory, MemoryCrystal, Possibility, QuantumIdentity
-from .quantum_bridge import QuantumMemoryBridge
-from .evolution_engine import QuantumEvolutionEngine
-from .quantum_monitor import QuantumMonitor
-from .database import QuantumDatabase
-from .vectorizer import QuantumVectorizer
+import importlib
 
 __version__ = "1.0.0"
-__all__ = [
-    'QuantumMemory',
-    'QuantumIdentity',
-    'MemoryCrystal', 
-    'Possibility',
-    'QuantumMemoryBridge',
-    'QuantumEvolutionEngine',
-    'QuantumMonitor',
-    'QuantumDatabase',
-    'QuantumVectorizer'
-]
\ No newline at end of file
+
+# 匯出名稱 -> 所在模組；第一次存取時才載入（資料庫與向量化器會帶入 psycopg2、numpy、genai）
+_EXPORTS = {
+    'QuantumMemory': '.quantum_memory',
+    'QuantumIdentity': '.quantum_memory',
+    'MemoryCrystal': '.quantum_memory',
+    'Possibility': '.quantum_memory',
+    'QuantumMemoryBridge': '.quantum_bridge',
+    'QuantumEvolutionEngine': '.evolution_engine',
+    'QuantumMonitor': '.quantum_monitor',
+    'QuantumDatabase': '.database',
+    'QuantumVectorizer': '.vectorizer',
+    'BridgeSnapshot': '.snapshot',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
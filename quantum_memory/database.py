@@ -11,8 +11,11 @@ import psycopg2
 from psycopg2.extras import RealDictCursor, Json
 from psycopg2.pool import SimpleConnectionPool
 import numpy as np
+import threading
 from contextlib import contextmanager
 
+from fork_safety import register_fork_hooks
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,7 +26,10 @@ class QuantumDatabase:
         # 優先使用已轉換的 Config.DATABASE_URL
         from config import Config
         self.database_url = database_url or Config.DATABASE_URL
-        self.pool = None
+        self._pool = None
+        # fork 前關閉的連接池，在子程序第一次使用時重新建立
+        self._reopen_pool = False
+        self._pool_lock = threading.Lock()
         
         if not self.database_url:
             raise ValueError("❌ 錯誤：未設定 DATABASE_URL！量子記憶系統需要 pgvector 資料庫。")
@@ -44,6 +50,36 @@ class QuantumDatabase:
                 logger.error(f"❌ 資料庫連接失敗: {e}")
                 self.pool = None
                 raise RuntimeError(f"量子記憶系統需要 pgvector 資料庫！錯誤: {e}")
+            
+            register_fork_hooks(before=self._close_before_fork,
+                                after_in_child=self._reset_after_fork)
+    
+    @property
+    def pool(self):
+        """連接池；fork 後第一次使用時重新連線（不重跑資料庫初始化）"""
+        if self._pool is None and self._reopen_pool:
+            with self._pool_lock:
+                if self._pool is None and self._reopen_pool:
+                    self._pool = SimpleConnectionPool(1, 10, self.database_url)
+                    self._reopen_pool = False
+                    logger.info(f"✅ 資料庫連接池已在程序 {os.getpid()} 重新建立")
+        return self._pool
+    
+    @pool.setter
+    def pool(self, value):
+        self._pool = value
+    
+    def _close_before_fork(self):
+        """fork 前關閉連線，避免 master 與 worker 共用同一個資料庫 socket"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._reopen_pool = True
+    
+    def _reset_after_fork(self):
+        """子程序重建鎖（fork 當下可能有執行緒正持有）"""
+        self._pool_lock = threading.Lock()
     
     @contextmanager
     def get_connection(self):
@@ -181,6 +217,25 @@ class QuantumDatabase:
                 
                 return cur.fetchone()
     
+    def get_memory_watermarks(self) -> Dict[str, datetime]:
+        """每個角色最後一次變更的時間（主記憶、晶體、漣漪取最新者），一次查詢取得"""
+        with self.get_connection() as conn:
+            if not conn:
+                return {}
+                
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT qm.persona_id,
+                           GREATEST(
+                               qm.updated_at,
+                               (SELECT MAX(updated_at) FROM memory_crystals WHERE memory_id = qm.id),
+                               (SELECT MAX(timestamp) FROM quantum_ripples WHERE memory_id = qm.id)
+                           ) AS watermark
+                    FROM quantum_memories qm
+                """)
+                
+                return {row['persona_id']: row['watermark'] for row in cur.fetchall()}
+    
     def save_memory_crystal(self, memory_id: int, crystal_data: dict,
                           concept_vector: Optional[List[float]] = None):
         """儲存記憶晶體"""
@@ -335,6 +390,7 @@ class QuantumDatabase:
     
     def close(self):
         """關閉連接池"""
-        if self.pool:
-            self.pool.closeall()
+        self._reopen_pool = False
+        if self._pool:
+            self._pool.closeall()
             logger.info("資料庫連接池已關閉")
\ No newline at end of file
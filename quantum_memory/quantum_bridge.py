@@ -3,8 +3,10 @@
 連接現有記憶系統與量子記憶系統
 """
 import asyncio
+import atexit
 import json
 import logging
+import threading
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from collections import deque
@@ -16,51 +18,178 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from .quantum_memory import QuantumMemory
 from .evolution_engine import QuantumEvolutionEngine
+from .snapshot import BridgeSnapshot
+from fork_safety import register_fork_hooks
 
 logger = logging.getLogger(__name__)
 
 class QuantumMemoryBridge:
     """橋接現有記憶系統與量子記憶"""
     
-    def __init__(self, use_database: bool = True):
+    PERSONAS = [
+        ("wuji", "無極", "系統觀察者，維持平衡與和諧"),
+        ("cruz", "CRUZ", "直接果斷，鼓勵創造的數位分身"),
+        ("wood", "木", "產品經理，創意與成長的推動者"),
+        ("fire", "火", "開發專員，熱情快速的實踐者"),
+        ("earth", "土", "架構師，穩固基礎的建造者"),
+        ("metal", "金", "優化專員，精益求精的完美主義者"),
+        ("water", "水", "測試專員，細心謹慎的品質守護者")
+    ]
+    
+    def __init__(self, use_database: bool = True, snapshot: Optional[BridgeSnapshot] = None):
         self.quantum_memories: Dict[str, QuantumMemory] = {}
         self.evolution_engine = QuantumEvolutionEngine()
         self.sync_queue = deque()
         self.evolution_threshold = 0.3  # 觸發演化的最小共振值
         self.use_database = use_database
         
+        # 本地快照：開機時直接還原，再於背景與資料庫比對
+        self.snapshot = snapshot if snapshot is not None else self._create_default_snapshot()
+        self._snapshot_dirty = False
+        self._reconciled = True
+        self._reconcile_thread = None
+        
         # 初始化所有角色的量子記憶
         self._initialize_personas()
         
         # 載入現有記憶系統的映射
         self.legacy_mappings = self._load_legacy_mappings()
+        
+        if self.snapshot:
+            atexit.register(self.flush_snapshot)
+            # preload 模式下 master 還沒比對完就 fork 時，由 worker 接手
+            register_fork_hooks(after_in_child=self._resume_reconcile_after_fork)
+    
+    @staticmethod
+    def _create_default_snapshot() -> Optional[BridgeSnapshot]:
+        """依設定建立快照；未啟用時回傳 None"""
+        from config import Config
+        if not Config.QUANTUM_SNAPSHOT_ENABLED:
+            return None
+        return BridgeSnapshot(Config.QUANTUM_SNAPSHOT_FILE, interval=Config.QUANTUM_SNAPSHOT_INTERVAL)
     
     def _initialize_personas(self):
         """初始化所有角色的量子記憶"""
-        personas = [
-            ("wuji", "無極", "系統觀察者，維持平衡與和諧"),
-            ("cruz", "CRUZ", "直接果斷，鼓勵創造的數位分身"),
-            ("wood", "木", "產品經理，創意與成長的推動者"),
-            ("fire", "火", "開發專員，熱情快速的實踐者"),
-            ("earth", "土", "架構師，穩固基礎的建造者"),
-            ("metal", "金", "優化專員，精益求精的完美主義者"),
-            ("water", "水", "測試專員，細心謹慎的品質守護者")
-        ]
+        restored = self.snapshot.load() if self.snapshot else {}
         
-        for persona_id, name, essence in personas:
-            memory = QuantumMemory(persona_id, use_database=self.use_database)
-            memory.identity.essence = essence
-            
-            # 設定初始量子態
-            if persona_id == "wuji":
-                memory.identity.frequency = 0.5  # 中庸頻率
-                memory.identity.amplitude = 0.8  # 較高影響力
-            elif persona_id == "cruz":
-                memory.identity.frequency = 0.9  # 高頻快速
-                memory.identity.amplitude = 0.9  # 強影響力
+        for persona_id, name, essence in self.PERSONAS:
+            memory = None
+            state = restored.get(persona_id)
+            if state:
+                memory = self._restore_persona(persona_id, state)
+            if memory is None:
+                memory = QuantumMemory(persona_id, use_database=self.use_database)
             
+            self._apply_persona_defaults(persona_id, memory, essence)
             self.quantum_memories[persona_id] = memory
             logger.info(f"Initialized quantum memory for {name}")
+        
+        if not self.snapshot:
+            return
+        
+        if restored:
+            logger.info(f"Restored {len(restored)} quantum memories from snapshot")
+            if self.use_database:
+                self._start_reconcile()
+        else:
+            # 第一次開機：寫下快照，下次重新啟動就能直接還原
+            self._snapshot_dirty = True
+            self.flush_snapshot()
+    
+    def _restore_persona(self, persona_id: str, state: dict) -> Optional[QuantumMemory]:
+        """從快照還原單一角色；失敗時回傳 None 改走一般載入"""
+        try:
+            memory = QuantumMemory(persona_id, use_database=self.use_database, autoload=False)
+            memory.restore(state)
+            if self.use_database:
+                memory._memory_id = state.get("memory_id")
+            if state.get("db_watermark"):
+                memory.db_watermark = datetime.fromisoformat(state["db_watermark"])
+            return memory
+        except Exception as e:
+            logger.warning(f"Failed to restore {persona_id} from snapshot: {e}")
+            return None
+    
+    @staticmethod
+    def _apply_persona_defaults(persona_id: str, memory: QuantumMemory, essence: str):
+        """設定角色本質與初始量子態"""
+        memory.identity.essence = essence
+        
+        if persona_id == "wuji":
+            memory.identity.frequency = 0.5  # 中庸頻率
+            memory.identity.amplitude = 0.8  # 較高影響力
+        elif persona_id == "cruz":
+            memory.identity.frequency = 0.9  # 高頻快速
+            memory.identity.amplitude = 0.9  # 強影響力
+    
+    def _start_reconcile(self):
+        """在背景與資料庫比對，不擋住開機"""
+        self._reconciled = False
+        self._reconcile_thread = threading.Thread(
+            target=self._reconcile_with_database, name="quantum-reconcile", daemon=True
+        )
+        self._reconcile_thread.start()
+    
+    def _resume_reconcile_after_fork(self):
+        """子程序中重新開始尚未完成的比對"""
+        if not self._reconciled:
+            self._start_reconcile()
+    
+    def _reconcile_with_database(self):
+        """只重新載入資料庫中比快照新的角色（以 updated_at 為水位）"""
+        try:
+            from service_registry import registry
+            watermarks = registry.get("quantum_database").get_memory_watermarks()
+        except Exception as e:
+            logger.warning(f"Quantum snapshot reconcile skipped: {e}")
+            return
+        
+        essences = {persona_id: essence for persona_id, _, essence in self.PERSONAS}
+        reloaded = 0
+        for persona_id, memory in list(self.quantum_memories.items()):
+            db_watermark = watermarks.get(persona_id)
+            if db_watermark is None:
+                continue
+            if memory.db_watermark is not None and db_watermark <= memory.db_watermark:
+                continue
+            
+            # 資料庫讀取失敗時保留快照內容，不退回較舊的備份檔
+            if memory.load(fallback_to_file=False):
+                self._apply_persona_defaults(persona_id, memory, essences[persona_id])
+                reloaded += 1
+        
+        self._reconciled = True
+        logger.info(f"Quantum snapshot reconciled with database "
+                    f"({reloaded}/{len(self.quantum_memories)} personas reloaded)")
+        if reloaded:
+            self._snapshot_dirty = True
+            self.flush_snapshot()
+    
+    def _snapshot_state(self) -> Dict[str, dict]:
+        """所有角色的快照內容"""
+        personas = {}
+        for persona_id, memory in list(self.quantum_memories.items()):
+            state = memory.to_dict()
+            state["memory_id"] = getattr(memory, '_memory_id', None)
+            state["db_watermark"] = memory.db_watermark.isoformat() if memory.db_watermark else None
+            personas[persona_id] = state
+        return personas
+    
+    def flush_snapshot(self) -> bool:
+        """有變更時立即寫入快照（定期寫入與正常關閉時使用）"""
+        if not self.snapshot or not self._snapshot_dirty:
+            return False
+        self._snapshot_dirty = False
+        if self.snapshot.save(self._snapshot_state()):
+            return True
+        self._snapshot_dirty = True
+        return False
+    
+    def _maybe_write_snapshot(self):
+        """演化後標記變更，超過寫入間隔才真的寫檔"""
+        self._snapshot_dirty = True
+        if self.snapshot and self.snapshot.is_due():
+            self.flush_snapshot()
     
     def _load_legacy_mappings(self) -> dict:
         """載入傳統記憶系統的映射規則"""
@@ -119,6 +248,7 @@ class QuantumMemoryBridge:
             
             # 保存演化後的記憶
             evolved_memory.save()
+            self._maybe_write_snapshot()
             
             logger.info(f"Quantum evolution triggered for {persona_id} with resonance {resonance:.2f}")
     
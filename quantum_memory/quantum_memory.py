@@ -9,8 +9,6 @@ from typing import Dict, List, Optional, Any
 from collections import deque
 from dataclasses import dataclass, field
 import logging
-from .database import QuantumDatabase
-from .vectorizer import QuantumVectorizer
 
 logger = logging.getLogger(__name__)
 
@@ -146,15 +144,16 @@ class QuantumIdentity:
 class QuantumMemory:
     """單一角色的量子記憶"""
     
-    def __init__(self, persona_id: str, use_database: bool = True):
+    def __init__(self, persona_id: str, use_database: bool = True, autoload: bool = True):
         self.persona_id = persona_id
         self.identity = QuantumIdentity()
         self.use_database = use_database
         
-        # 初始化資料庫和向量化器
+        # 初始化資料庫和向量化器（所有角色共用同一個連接池與向量快取）
         if self.use_database:
-            self.db = QuantumDatabase()
-            self.vectorizer = QuantumVectorizer()
+            from service_registry import registry
+            self.db = registry.get("quantum_database")
+            self.vectorizer = registry.get("quantum_vectorizer")
             self._memory_id = None  # 資料庫中的記憶 ID
         self.crystals: Dict[str, MemoryCrystal] = {}
         self.ripples: deque = deque(maxlen=100)  # 最近100個漣漪
@@ -162,9 +161,12 @@ class QuantumMemory:
         self.evolution_count = 0
         self.created_at = datetime.now()
         self.last_save = None
+        # 最後一次從資料庫讀到的資料時間（用於快照與資料庫的比對）
+        self.db_watermark: Optional[datetime] = None
         
-        # 嘗試載入現有記憶
-        self.load()
+        # 嘗試載入現有記憶（由快照還原時不需要）
+        if autoload:
+            self.load()
     
     def add_crystal(self, concept: str, initial_possibilities: List[Dict[str, Any]]) -> MemoryCrystal:
         """添加新的記憶晶體"""
@@ -259,24 +261,40 @@ class QuantumMemory:
         crystals_with_score.sort(key=lambda x: x[1], reverse=True)
         return [crystal for crystal, _ in crystals_with_score[:n]]
     
-    def save(self):
-        """保存量子記憶到檔案和資料庫"""
-        # 總是保存到檔案作為備份
-        memory_path = f"quantum_memory/memories/{self.persona_id}.json"
-        
-        data = {
+    def to_dict(self) -> dict:
+        """量子記憶的完整狀態（備份檔與快照共用的格式）"""
+        return {
             "persona_id": self.persona_id,
             "identity": self.identity.to_dict(),
             "crystals": {
                 cid: crystal.to_dict() 
-                for cid, crystal in self.crystals.items()
+                for cid, crystal in list(self.crystals.items())
             },
             "ripples": list(self.ripples),
-            "entanglements": self.entanglements,
+            "entanglements": dict(self.entanglements),
             "evolution_count": self.evolution_count,
-            "created_at": self.created_at.isoformat(),
-            "last_save": datetime.now().isoformat()
+            "created_at": self.created_at.isoformat()
         }
+    
+    def restore(self, data: dict):
+        """從 to_dict() 的結果還原狀態"""
+        self.identity = QuantumIdentity.from_dict(data["identity"])
+        self.crystals = {
+            cid: MemoryCrystal.from_dict(crystal_data)
+            for cid, crystal_data in data.get("crystals", {}).items()
+        }
+        self.ripples = deque(data.get("ripples", []), maxlen=100)
+        self.entanglements = data.get("entanglements", {})
+        self.evolution_count = data.get("evolution_count", 0)
+        self.created_at = datetime.fromisoformat(data["created_at"])
+    
+    def save(self):
+        """保存量子記憶到檔案和資料庫"""
+        # 總是保存到檔案作為備份
+        memory_path = f"quantum_memory/memories/{self.persona_id}.json"
+        
+        data = self.to_dict()
+        data["last_save"] = datetime.now().isoformat()
         
         os.makedirs(os.path.dirname(memory_path), exist_ok=True)
         
@@ -319,7 +337,7 @@ class QuantumMemory:
         self.last_save = datetime.now()
         logger.info(f"Saved quantum memory for {self.persona_id}")
     
-    def load(self):
+    def load(self, fallback_to_file: bool = True):
         """從資料庫或檔案載入量子記憶"""
         loaded_from_db = False
         
@@ -328,13 +346,11 @@ class QuantumMemory:
             try:
                 memory_data = self.db.get_quantum_memory(self.persona_id)
                 if memory_data:
-                    self._memory_id = memory_data['id']
-                    self.identity = QuantumIdentity.from_dict(memory_data['identity_data'])
-                    self.created_at = memory_data['created_at']
+                    watermark = memory_data['updated_at']
                     
                     # 載入記憶晶體
-                    crystals_data = self.db.get_memory_crystals(self._memory_id)
-                    self.crystals = {}
+                    crystals_data = self.db.get_memory_crystals(memory_data['id'])
+                    crystals = {}
                     for crystal_data in crystals_data:
                         crystal = MemoryCrystal.from_dict({
                             'id': crystal_data['crystal_id'],
@@ -344,17 +360,27 @@ class QuantumMemory:
                             'creation_time': crystal_data['created_at'].isoformat(),
                             'last_evolution': crystal_data['updated_at'].isoformat()
                         })
-                        self.crystals[crystal.id] = crystal
+                        crystals[crystal.id] = crystal
+                        watermark = max(watermark, crystal_data['updated_at'])
                     
                     # 載入漣漪
-                    ripples_data = self.db.get_ripples(self._memory_id)
-                    self.ripples = deque(maxlen=100)
+                    ripples_data = self.db.get_ripples(memory_data['id'])
+                    ripples = deque(maxlen=100)
                     for ripple_data in ripples_data:
-                        self.ripples.append({
+                        ripples.append({
                             'timestamp': ripple_data['timestamp'].isoformat(),
                             'event': ripple_data['event_data'],
                             'impact': ripple_data['impact']
                         })
+                        watermark = max(watermark, ripple_data['timestamp'])
+                    
+                    # 全部讀完才替換，背景重新載入時其他執行緒不會看到一半的狀態
+                    self._memory_id = memory_data['id']
+                    self.identity = QuantumIdentity.from_dict(memory_data['identity_data'])
+                    self.created_at = memory_data['created_at']
+                    self.crystals = crystals
+                    self.ripples = ripples
+                    self.db_watermark = watermark
                     
                     loaded_from_db = True
                     logger.info(f"Loaded quantum memory from database for {self.persona_id}")
@@ -362,32 +388,25 @@ class QuantumMemory:
                 logger.error(f"Failed to load from database: {e}")
         
         # 如果資料庫載入失敗，從檔案載入
-        if not loaded_from_db:
+        if not loaded_from_db and fallback_to_file:
             memory_path = f"quantum_memory/memories/{self.persona_id}.json"
             
             if not os.path.exists(memory_path):
                 logger.info(f"No existing memory found for {self.persona_id}")
-                return
+                return False
             
             try:
                 with open(memory_path, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                 
-                self.identity = QuantumIdentity.from_dict(data["identity"])
-                
-                self.crystals = {}
-                for cid, crystal_data in data.get("crystals", {}).items():
-                    self.crystals[cid] = MemoryCrystal.from_dict(crystal_data)
-                
-                self.ripples = deque(data.get("ripples", []), maxlen=100)
-                self.entanglements = data.get("entanglements", {})
-                self.evolution_count = data.get("evolution_count", 0)
-                self.created_at = datetime.fromisoformat(data["created_at"])
+                self.restore(data)
                 
                 logger.info(f"Loaded quantum memory from file for {self.persona_id}")
                 
             except Exception as e:
                 logger.error(f"Failed to load quantum memory: {e}")
+        
+        return loaded_from_db
     
     def to_summary(self) -> str:
         """生成記憶摘要"""
@@ -0,0 +1,95 @@
+"""
+量子記憶場快照
+把所有角色的量子記憶寫成單一本地檔案，重新啟動時直接還原，
+不必等待每個角色各自向資料庫查詢主記憶、晶體與漣漪。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BridgeSnapshot:
+    """QuantumMemoryBridge 的本地快照檔
+
+    檔案以暫存檔寫入後再原子替換，程序中途結束也不會留下寫到一半的快照。
+    每個角色的狀態附帶 db_watermark，開機後用來判斷資料庫是否有更新的資料。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, interval: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.path = path
+        self.interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_write: Optional[float] = None
+
+        # 統計資料
+        self.writes = 0
+        self.restored_personas = 0
+
+    def load(self) -> Dict[str, dict]:
+        """讀取快照；檔案不存在、損毀或版本不符時回傳空 dict"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Quantum snapshot unreadable, ignoring: {e}")
+            return {}
+
+        if data.get("version") != self.VERSION:
+            logger.info(f"Quantum snapshot version {data.get('version')} ignored")
+            return {}
+
+        personas = data.get("personas", {})
+        self.restored_personas = len(personas)
+        return personas
+
+    def save(self, personas: Dict[str, dict]) -> bool:
+        """寫入快照，成功回傳 True"""
+        data = {
+            "version": self.VERSION,
+            "written_at": datetime.now().isoformat(),
+            "personas": personas
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"Failed to write quantum snapshot: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                return False
+
+            self._last_write = self._clock()
+            self.writes += 1
+        return True
+
+    def is_due(self) -> bool:
+        """距離上次寫入是否已超過間隔"""
+        return self._last_write is None or self._clock() - self._last_write >= self.interval
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "interval": self.interval,
+            "writes": self.writes,
+            "restored_personas": self.restored_personas
+        }
@@ -6,7 +6,7 @@ import logging
 import hashlib
 import numpy as np
 from typing import List, Dict, Optional, Any
-import google.generativeai as genai
+from gemini_standin import embed_content
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -61,7 +61,7 @@ class QuantumVectorizer:
         
         try:
             # 使用 Gemini embedding API
-            result = genai.embed_content(
+            result = embed_content(
                 model=self.model_name,
                 content=text,
                 task_type="retrieval_document"
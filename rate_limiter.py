@@ -0,0 +1,136 @@
+"""
+Token bucket 限流與准入控制
+避免單一使用者或群組佔滿 Gemini 的容量；超過限制時直接回覆固定訊息，不排隊
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+USER_RATE_LIMITED = "user_rate_limited"
+GLOBAL_RATE_LIMITED = "global_rate_limited"
+OVERLOADED = "overloaded"
+
+
+class TokenBucket:
+    """容量 capacity、每秒補充 refill_rate 個 token 的 token bucket"""
+
+    def __init__(self, capacity: float, refill_rate: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """有足夠 token 時扣除並回傳 True"""
+        with self._lock:
+            self._refill(self._clock())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def refund(self, tokens: float = 1):
+        """歸還 token（後續檢查失敗時使用）"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def is_full(self) -> bool:
+        with self._lock:
+            self._refill(self._clock())
+            return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """每個使用者一個 token bucket，加上全域 bucket 與同時處理數上限
+
+    try_admit() 回傳 None 代表放行（處理完要呼叫 release()），否則回傳拒絕原因。
+    """
+
+    def __init__(self, user_burst: float = 5, user_refill: float = 0.2,
+                 global_burst: float = 50, global_refill: float = 5,
+                 max_in_flight: int = 0, max_users: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.user_burst = user_burst
+        self.user_refill = user_refill
+        self.max_in_flight = max_in_flight
+        self.max_users = max(1, max_users)
+        self._clock = clock
+        self.global_bucket = TokenBucket(global_burst, global_refill, clock)
+        self._user_buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+        # 統計資料
+        self.admitted = 0
+        self.rejected = {USER_RATE_LIMITED: 0, GLOBAL_RATE_LIMITED: 0, OVERLOADED: 0}
+
+    def _get_user_bucket(self, key: Hashable) -> TokenBucket:
+        with self._lock:
+            bucket = self._user_buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.user_burst, self.user_refill, self._clock)
+                self._user_buckets[key] = bucket
+                self._evict_idle()
+            else:
+                self._user_buckets.move_to_end(key)
+            return bucket
+
+    def _evict_idle(self):
+        """使用者數超過上限時，移除最久沒出現的使用者（久未出現的 bucket 通常早已補滿）"""
+        while len(self._user_buckets) > self.max_users:
+            self._user_buckets.popitem(last=False)
+
+    def try_admit(self, key: Hashable) -> Optional[str]:
+        """檢查是否放行；放行回傳 None，否則回傳拒絕原因"""
+        # 檢查與佔用同時處理名額在同一個臨界區，同時到達的請求不會一起超過上限
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.rejected[OVERLOADED] += 1
+                return OVERLOADED
+            self.in_flight += 1
+
+        user_bucket = self._get_user_bucket(key)
+        if not user_bucket.try_acquire():
+            with self._lock:
+                self.in_flight -= 1
+                self.rejected[USER_RATE_LIMITED] += 1
+            return USER_RATE_LIMITED
+
+        if not self.global_bucket.try_acquire():
+            # 全域額度不足，不扣使用者的額度
+            user_bucket.refund()
+            with self._lock:
+                self.in_flight -= 1
+                self.rejected[GLOBAL_RATE_LIMITED] += 1
+            return GLOBAL_RATE_LIMITED
+
+        with self._lock:
+            self.admitted += 1
+        return None
+
+    def release(self):
+        """放行的請求處理完畢"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "tracked_users": len(self._user_buckets),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected)
+            }
@@ -0,0 +1,145 @@
+"""
+回覆期限追蹤
+LINE 的 reply token 很快就會失效；回覆來不及產生時先送出簡短回覆，
+完整答案完成後再用 push 訊息送出，避免 Gemini 的結果白白浪費
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from fork_safety import register_fork_hooks
+from worker_pool import BoundedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+REPLIED = "replied"
+INTERIM = "interim"
+
+
+class ReplyDeadline:
+    """單一事件的回覆期限：正式回覆與暫時回覆只有一方能使用 reply token"""
+
+    def __init__(self, expires_at: float, on_expire: Callable):
+        self.expires_at = expires_at
+        self._on_expire = on_expire
+        self._lock = threading.Lock()
+        self.state = PENDING
+
+    def claim_reply(self) -> bool:
+        """在期限前完成時取得 reply token；已送出暫時回覆則回傳 False（改用 push）"""
+        with self._lock:
+            if self.state == PENDING:
+                self.state = REPLIED
+                return True
+            return False
+
+    def _expire(self) -> bool:
+        """期限到時改為暫時回覆狀態；已正式回覆則回傳 False"""
+        with self._lock:
+            if self.state != PENDING:
+                return False
+            self.state = INTERIM
+            return True
+
+    def _send_interim(self):
+        """送出暫時回覆"""
+        try:
+            self._on_expire()
+        except Exception as e:
+            logger.warning(f"Interim reply failed: {e}")
+
+
+class ReplyDeadlineTracker:
+    """以單一背景執行緒追蹤所有事件的回覆期限
+
+    期限從事件發生時間（event.timestamp）起算，排隊等待的時間也會計入。
+    暫時回覆交給 sender_workers 個執行緒送出，一則慢的 LINE 回覆不會延誤其他期限。
+    """
+
+    def __init__(self, budget: float = 20.0, clock: Callable[[], float] = time.monotonic,
+                 sender_workers: int = 4):
+        self.budget = budget
+        self._clock = clock
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.sender = BoundedWorkerPool(max_workers=sender_workers, max_queue_size=100,
+                                        name="reply-interim")
+
+        # 統計資料
+        self.tracked = 0
+        self.interim_sent = 0
+
+        register_fork_hooks(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """子程序不繼承父程序的排程執行緒與待處理期限"""
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def remaining(self, event_timestamp_ms: Optional[int] = None) -> float:
+        """距離期限還剩多少秒（扣掉事件從發生到現在已經過的時間）"""
+        if not event_timestamp_ms:
+            return self.budget
+        age = time.time() - event_timestamp_ms / 1000
+        return max(0.0, self.budget - max(0.0, age))
+
+    def track(self, on_expire: Callable, event_timestamp_ms: Optional[int] = None) -> ReplyDeadline:
+        """開始追蹤一個事件，期限到而尚未回覆時呼叫 on_expire"""
+        deadline = ReplyDeadline(self._clock() + self.remaining(event_timestamp_ms), on_expire)
+        with self._cond:
+            heapq.heappush(self._heap, (deadline.expires_at, next(self._counter), deadline))
+            self.tracked += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="reply-deadline", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return deadline
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+
+                expires_at, _, deadline = self._heap[0]
+                if deadline.state != PENDING:
+                    # 已正式回覆，直接移除
+                    heapq.heappop(self._heap)
+                    continue
+
+                wait_time = expires_at - self._clock()
+                if wait_time > 0:
+                    self._cond.wait(wait_time)
+                    continue
+
+                heapq.heappop(self._heap)
+                if not deadline._expire():
+                    continue
+                # 先計數再送出，送出完成時統計已經包含這一則
+                self.interim_sent += 1
+
+            logger.warning("Reply deadline reached, sending interim reply")
+            if not self.sender.submit(deadline._send_interim):
+                # 送出佇列已滿：在排程執行緒送出，暫時回覆不能遺失
+                deadline._send_interim()
+
+    def record_interim(self):
+        """由呼叫端自行送出暫時回覆時（ASGI 版本）計入統計"""
+        with self._cond:
+            self.interim_sent += 1
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "budget": self.budget,
+                "tracked": self.tracked,
+                "interim_sent": self.interim_sent,
+                "pending": len(self._heap)
+            }
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+匯入時間分析腳本
+以 python -X importtime 在乾淨的子程序中載入模組，列出最耗時的套件，
+並可設定上限讓 CI 在開機時間退步時失敗
+
+範例：
+    python scripts/import_profile.py line_bot_handler --top 15
+    python scripts/import_profile.py line_bot_handler --max-ms 1500 --forbid psycopg2 numpy
+"""
+import sys
+import os
+import subprocess
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def profile_imports(module):
+    """回傳 [(套件名稱, 自身微秒, 累計微秒)] 與子程序的錯誤輸出"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=PROJECT_ROOT
+    )
+
+    entries = []
+    errors = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            errors.append(line)
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # 表頭
+        entries.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} 失敗：\n" + "\n".join(errors[-20:]))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分析模組的匯入時間')
+    parser.add_argument('module', nargs='?', default='line_bot_handler',
+                        help='要載入的模組（預設：line_bot_handler）')
+    parser.add_argument('--top', type=int, default=20, help='列出最耗時的前 N 個套件')
+    parser.add_argument('--max-ms', type=float, help='總匯入時間上限（毫秒），超過時結束碼為 1')
+    parser.add_argument('--forbid', nargs='*', default=[],
+                        help='不應在開機時載入的套件（例如 psycopg2 numpy）')
+
+    args = parser.parse_args()
+
+    entries = profile_imports(args.module)
+    loaded = {name for name, _, _ in entries}
+    total_ms = next((cumulative for name, _, cumulative in entries if name == args.module), 0) / 1000
+
+    # 只看頂層套件的累計時間，避免子模組重複計算
+    top_level = {}
+    for name, _, cumulative in entries:
+        root = name.split('.')[0]
+        if name == root:
+            top_level[root] = max(top_level.get(root, 0), cumulative)
+
+    print(f"📦 import {args.module}: {total_ms:.0f} ms，共載入 {len(entries)} 個模組")
+    print("=" * 50)
+    for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    for name in args.forbid:
+        if name in loaded:
+            print(f"\n❌ {name} 在開機時就被載入了")
+            failed = True
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"\n❌ 匯入時間 {total_ms:.0f} ms 超過上限 {args.max_ms:.0f} ms")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+    print("\n✅ 匯入時間在預期內")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Gemini 回應的語意快取
+很多使用者問的是幾乎一樣的問題（「你是誰」、「自我介紹」、常見的 CRUZ 話題），
+相似度夠高時直接使用先前的回應，不必再呼叫一次 Gemini。
+"""
+import logging
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict, deque
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from structured_logging import access_log
+
+logger = logging.getLogger(__name__)
+
+# 標點與空白不影響語意
+_IGNORED_CHARS = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_message(message: str) -> str:
+    """全形轉半形、轉小寫並移除標點與空白"""
+    text = unicodedata.normalize("NFKC", message).lower()
+    return _IGNORED_CHARS.sub("", text)
+
+
+def ngram_embedding(text: str) -> Dict[str, float]:
+    """本地的字元 n-gram 向量（單字 + 雙字），不需要呼叫外部 API
+
+    中文短句以字為單位比對就有不錯的效果，雙字組合用來區分語序。
+    """
+    grams = Counter(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return dict(grams)
+
+
+def cosine_similarity(a, b) -> float:
+    """兩個向量的餘弦相似度（支援 dict 稀疏向量與 list 密集向量）"""
+    if isinstance(a, Mapping):
+        if len(a) > len(b):
+            a, b = b, a
+        dot = sum(weight * b.get(key, 0.0) for key, weight in a.items())
+        norm_a = math.sqrt(sum(w * w for w in a.values()))
+        norm_b = math.sqrt(sum(w * w for w in b.values()))
+    else:
+        dot = sum(x * y for x, y in zip(a, b))
+        norm_a = math.sqrt(sum(x * x for x in a))
+        norm_b = math.sqrt(sum(y * y for y in b))
+    if norm_a == 0 or norm_b == 0:
+        return 0.0
+    return dot / (norm_a * norm_b)
+
+
+class SemanticResponseCache:
+    """以 (人格模式, 系統提示詞版本) 分區、以訊息向量相似度查詢的回應快取
+
+    - 相似度達到 threshold 才算命中；正規化後完全相同的訊息直接命中
+    - 每筆回應有 TTL，總數超過 max_entries 時淘汰最久沒用到的
+    - 含有排除關鍵字（日曆、時間相關）的訊息不查詢也不儲存
+    - 依 sample_rate 取樣命中紀錄，供人工檢查是否誤判
+    - embedder 失敗或回傳 None 時不做相似度查詢也不儲存（完全相同的訊息仍可命中）
+    """
+
+    def __init__(self, threshold: float = 0.9, ttl_seconds: float = 86400,
+                 max_entries: int = 1000, min_chars: int = 2,
+                 excluded_keywords: Iterable[str] = (),
+                 embedder: Callable[[str], object] = ngram_embedding,
+                 sample_rate: float = 0.05, max_samples: int = 50,
+                 clock: Callable[[], float] = time.monotonic,
+                 rng: Callable[[], float] = random.random):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.min_chars = min_chars
+        self.excluded_keywords = tuple(excluded_keywords)
+        self.embedder = embedder
+        self.sample_rate = sample_rate
+        self._clock = clock
+        self._rng = rng
+        # (scope, normalized) -> {"vector", "response", "stored_at", "latency", "message"}
+        self._entries: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hit_samples: deque = deque(maxlen=max_samples)
+
+        # 統計資料
+        self.lookups = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self.stores = 0
+        self.excluded = 0
+        self.evictions = 0
+        self.embed_failures = 0
+        self.latency_saved = 0.0
+
+    def is_cacheable(self, message: str) -> bool:
+        """訊息是否適合快取（太短或與日曆、時間相關的不快取）"""
+        if len(normalize_message(message)) < self.min_chars:
+            return False
+        return not any(keyword in message for keyword in self.excluded_keywords)
+
+    def get(self, scope: str, message: str) -> Optional[str]:
+        """查詢快取；沒有夠相似的回應時回傳 None"""
+        if not self.is_cacheable(message):
+            self.excluded += 1
+            return None
+
+        normalized = normalize_message(message)
+        now = self._clock()
+        self.lookups += 1
+
+        with self._lock:
+            self._purge_expired(now)
+            entry = self._entries.get((scope, normalized))
+        similarity = 1.0
+        if entry is not None:
+            self.exact_hits += 1
+        else:
+            # 向量可能要呼叫外部 API，不要在持有鎖時計算
+            vector = self._embed(normalized)
+            if vector is None:
+                return None
+            with self._lock:
+                entry, similarity = self._find_similar(scope, vector)
+
+        if entry is None:
+            return None
+
+        with self._lock:
+            key = (scope, entry["normalized"])
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            self.latency_saved += entry["latency"]
+
+        if self.sample_rate > 0 and self._rng() < self.sample_rate:
+            self._record_sample(scope, message, entry, similarity)
+        return entry["response"]
+
+    def put(self, scope: str, message: str, response: str, latency: float = 0.0):
+        """儲存回應；latency 是這次呼叫 Gemini 花的時間，用來估算命中省下的時間"""
+        if not response or not self.is_cacheable(message):
+            return
+
+        normalized = normalize_message(message)
+        vector = self._embed(normalized)
+        if vector is None:
+            return
+        entry = {
+            "normalized": normalized,
+            "message": message,
+            "vector": vector,
+            "response": response,
+            "latency": latency,
+            "stored_at": self._clock()
+        }
+        with self._lock:
+            self._entries[(scope, normalized)] = entry
+            self._entries.move_to_end((scope, normalized))
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _embed(self, normalized: str):
+        """計算向量；embedder 失敗或沒有結果時回傳 None"""
+        try:
+            vector = self.embedder(normalized)
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            vector = None
+        if vector is None:
+            with self._lock:
+                self.embed_failures += 1
+        return vector
+
+    def _find_similar(self, scope: str, vector) -> Tuple[Optional[Dict], float]:
+        """在同一個分區中找相似度最高且達到門檻的回應"""
+        best, best_similarity = None, self.threshold
+        for (entry_scope, _), entry in self._entries.items():
+            if entry_scope != scope:
+                continue
+            similarity = cosine_similarity(vector, entry["vector"])
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        return best, best_similarity
+
+    def _purge_expired(self, now: float):
+        """移除過期的回應"""
+        expired = [key for key, entry in self._entries.items()
+                   if now - entry["stored_at"] >= self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def _record_sample(self, scope: str, message: str, entry: Dict, similarity: float):
+        """保存命中樣本，檢查相似度門檻是否造成誤判"""
+        sample = {
+            "scope": scope,
+            "message": message,
+            "matched": entry["message"],
+            "similarity": round(similarity, 3),
+            "response": entry["response"][:200]
+        }
+        self.hit_samples.append(sample)
+        access_log.capture("semantic_cache", "hit_sample", **sample)
+        access_log.log("semantic_cache", "hit_sample", scope=scope, similarity=sample["similarity"])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """取得命中率、省下的時間與最近的命中樣本"""
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "entries": size,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "exact_hits": self.exact_hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "stores": self.stores,
+            "excluded": self.excluded,
+            "evictions": self.evictions,
+            "embed_failures": self.embed_failures,
+            "latency_saved_s": round(self.latency_saved, 2),
+            "recent_samples": list(self.hit_samples)[-5:]
+        }
+
+
+def create_semantic_cache(excluded_keywords: Sequence[str] = ()) -> Optional[SemanticResponseCache]:
+    """依設定建立語意快取；未啟用時回傳 None"""
+    from config import Config
+
+    if not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+
+    embedder = ngram_embedding
+    if Config.SEMANTIC_CACHE_EMBEDDER == 'gemini':
+        from service_registry import registry
+
+        def embedder(text: str) -> List[float]:
+            return registry.get("quantum_vectorizer").vectorize_text(text)
+
+    return SemanticResponseCache(
+        threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds=Config.SEMANTIC_CACHE_TTL,
+        max_entries=Config.SEMANTIC_CACHE_MAX_ENTRIES,
+        excluded_keywords=excluded_keywords,
+        embedder=embedder,
+        sample_rate=Config.SEMANTIC_CACHE_SAMPLE_RATE
+    )
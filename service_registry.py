@@ -0,0 +1,128 @@
+"""
+服務註冊表
+較重的服務（Calendar、量子記憶、向量化器）在第一次使用時才建立，
+worker 開機時不需要連資料庫或載入 Google API 用戶端
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+    """以名稱註冊工廠函數，第一次 get() 時建立並快取實例（執行緒安全）"""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._build_times: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        """註冊服務工廠；已建立的實例會被捨棄"""
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """取得服務實例，必要時建立"""
+        if name in self._instances:
+            return self._instances[name]
+
+        with self._lock:
+            if name in self._instances:
+                return self._instances[name]
+            if name not in self._factories:
+                raise KeyError(f"Service not registered: {name}")
+
+            start = time.monotonic()
+            instance = self._factories[name]()
+            self._build_times[name] = time.monotonic() - start
+            self._instances[name] = instance
+            logger.info(f"Service {name} built in {self._build_times[name]:.2f}s")
+            return instance
+
+    def is_built(self, name: str) -> bool:
+        return name in self._instances
+
+    def set(self, name: str, instance: Any):
+        """直接指定實例（測試或預先建立時使用）"""
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self, name: str):
+        """捨棄已建立的實例，下次 get() 重新建立"""
+        with self._lock:
+            self._instances.pop(name, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                name: {
+                    "built": name in self._instances,
+                    "build_time": round(self._build_times[name], 3) if name in self._build_times else None
+                }
+                for name in self._factories
+            }
+
+
+class LazyService:
+    """在第一次存取屬性時才從註冊表取得服務的代理物件
+
+    讓既有的 `from module import service` 寫法不需修改就能延遲建立。
+    """
+
+    def __init__(self, registry: ServiceRegistry, name: str):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._registry.get(self._name), attr, value)
+
+    def __repr__(self):
+        state = "built" if self._registry.is_built(self._name) else "lazy"
+        return f"<LazyService {self._name} ({state})>"
+
+
+registry = ServiceRegistry()
+
+
+def lazy_service(name: str) -> LazyService:
+    return LazyService(registry, name)
+
+
+def _build_calendar_service():
+    """Calendar 為選用功能，未設定憑證時回傳 None"""
+    try:
+        from calendar_service import CalendarService
+        return CalendarService()
+    except Exception as e:
+        logger.warning(f"Calendar service initialization failed: {str(e)}")
+        return None
+
+
+def _build_quantum_database():
+    from quantum_memory.database import QuantumDatabase
+    return QuantumDatabase()
+
+
+def _build_quantum_vectorizer():
+    from quantum_memory.vectorizer import QuantumVectorizer
+    return QuantumVectorizer()
+
+
+def _build_quantum_integration():
+    from quantum_integration import QuantumIntegration
+    return QuantumIntegration()
+
+
+registry.register("calendar_service", _build_calendar_service)
+# 所有 QuantumMemory 共用同一個連接池與向量快取，而不是每個角色各開一個
+registry.register("quantum_database", _build_quantum_database)
+registry.register("quantum_vectorizer", _build_quantum_vectorizer)
+registry.register("quantum_integration", _build_quantum_integration)
@@ -0,0 +1,387 @@
+"""
+每位使用者的對話狀態（CRUZ / 五行模式、目前的元素、共用後端時還有對話歷史）
+程序內後端只在單一 worker 有效；Postgres 後端讓所有 worker 與機器共用同一份狀態，
+不需要 sticky routing。寫入以版本號做樂觀鎖，衝突時重新讀取並套用修改。
+"""
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from fork_safety import register_fork_hooks
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UserSession:
+    """單一使用者的狀態；version 由後端維護，不寫入序列化內容"""
+    cruz_mode: bool = False
+    element_mode: bool = False
+    element: Optional[str] = None
+    turns: List[Dict] = field(default_factory=list)
+    version: int = 0
+
+
+def encode_session(session: UserSession) -> bytes:
+    """壓縮的序列化格式：短鍵 JSON + zlib，對話以 [turn, user, assistant] 陣列儲存"""
+    payload = {}
+    if session.cruz_mode:
+        payload["c"] = 1
+    if session.element_mode:
+        payload["e"] = 1
+    if session.element:
+        payload["r"] = session.element
+    if session.turns:
+        payload["t"] = [[t['turn'], t['user'], t['assistant']] for t in session.turns]
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode('utf-8'))
+
+
+def decode_session(data: bytes, version: int) -> UserSession:
+    payload = json.loads(zlib.decompress(data).decode('utf-8'))
+    return UserSession(
+        cruz_mode=bool(payload.get("c")),
+        element_mode=bool(payload.get("e")),
+        element=payload.get("r"),
+        turns=[{'turn': turn, 'user': user, 'assistant': assistant}
+               for turn, user, assistant in payload.get("t", [])],
+        version=version
+    )
+
+
+class InProcessSessionBackend:
+    """程序內的狀態表（容量上限 + 閒置 TTL）"""
+
+    shared = False
+
+    def __init__(self, max_entries: int = 100000, ttl_seconds: float = 7 * 86400,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # user_id -> (data, version, updated_at)，依最近使用排序
+        self._entries: "OrderedDict[str, Tuple[bytes, int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, user_id: str) -> Optional[Tuple[bytes, int]]:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            data, version, updated_at = entry
+            if now - updated_at >= self.ttl_seconds:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return data, version
+
+    def compare_and_set(self, user_id: str, data: bytes, expected_version: int) -> Optional[int]:
+        """版本相符時寫入並回傳新版本，否則回傳 None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            current = entry[1] if entry else 0
+            if current != expected_version:
+                return None
+            self._entries[user_id] = (data, current + 1, self._clock())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return current + 1
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            size = len(self._entries)
+        return {"backend": "memory", "entries": size}
+
+
+class PostgresSessionBackend:
+    """以 Postgres 資料表保存狀態，所有 worker 共用
+
+    資料庫失敗時退回程序內狀態，不會因此擋住訊息處理。
+    """
+
+    shared = True
+
+    def __init__(self, database_url: Optional[str] = None, ttl_seconds: float = 7 * 86400,
+                 cleanup_interval: int = 1000):
+        self.database_url = database_url or Config.DATABASE_URL
+        if not self.database_url:
+            raise ValueError("PostgresSessionBackend 需要 DATABASE_URL")
+
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_interval = max(1, cleanup_interval)
+        self.fallback = InProcessSessionBackend(ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._writes = 0
+        self.errors = 0
+        self._initialize_table()
+        register_fork_hooks(before=self._close_pool, after_in_child=self._reset_after_fork)
+
+    @property
+    def pool(self):
+        """連接池；fork 之後在第一次使用時重新建立"""
+        if self._pool is None:
+            from psycopg2.pool import SimpleConnectionPool
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = SimpleConnectionPool(1, 5, self.database_url)
+        return self._pool
+
+    def _close_pool(self):
+        """fork 前關閉連線，避免父子程序共用同一個資料庫 socket"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    def _reset_after_fork(self):
+        """子程序重建鎖（fork 當下可能有執行緒正持有）"""
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+
+    def _initialize_table(self):
+        """建立狀態資料表"""
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS user_sessions (
+                        user_id VARCHAR(128) PRIMARY KEY,
+                        data BYTEA NOT NULL,
+                        version BIGINT NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_updated_at ON user_sessions(updated_at)")
+            conn.commit()
+        finally:
+            self.pool.putconn(conn)
+
+    def _execute(self, query: str, params: tuple, fetch: bool = True):
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                row = cur.fetchone() if fetch else None
+            conn.commit()
+            return row
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def load(self, user_id: str) -> Optional[Tuple[bytes, int]]:
+        try:
+            row = self._execute("""
+                SELECT data, version FROM user_sessions
+                WHERE user_id = %s
+                  AND updated_at >= CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+            """, (user_id, self.ttl_seconds))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Session table unavailable, using in-process store: {e}")
+            return self.fallback.load(user_id)
+        if row is None:
+            return None
+        return bytes(row[0]), row[1]
+
+    def compare_and_set(self, user_id: str, data: bytes, expected_version: int) -> Optional[int]:
+        """版本相符時寫入並回傳新版本，否則回傳 None"""
+        try:
+            if expected_version == 0:
+                # 新使用者或已過期的紀錄
+                row = self._execute("""
+                    INSERT INTO user_sessions (user_id, data, version)
+                    VALUES (%s, %s, 1)
+                    ON CONFLICT (user_id) DO UPDATE
+                        SET data = EXCLUDED.data, version = user_sessions.version + 1,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE user_sessions.updated_at
+                              < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                    RETURNING version
+                """, (user_id, data, self.ttl_seconds))
+            else:
+                row = self._execute("""
+                    UPDATE user_sessions
+                    SET data = %s, version = version + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = %s AND version = %s
+                    RETURNING version
+                """, (data, user_id, expected_version))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Session table unavailable, using in-process store: {e}")
+            return self.fallback.compare_and_set(user_id, data, expected_version)
+
+        with self._lock:
+            self._writes += 1
+            should_cleanup = self._writes % self.cleanup_interval == 0
+        if should_cleanup:
+            self._cleanup_expired()
+        return row[0] if row else None
+
+    def delete(self, user_id: str):
+        try:
+            self._execute("DELETE FROM user_sessions WHERE user_id = %s", (user_id,), fetch=False)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to delete session for {user_id}: {e}")
+        self.fallback.delete(user_id)
+
+    def _cleanup_expired(self):
+        """定期清除過期紀錄，避免資料表無限成長"""
+        try:
+            self._execute("""
+                DELETE FROM user_sessions
+                WHERE updated_at < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+            """, (self.ttl_seconds,), fetch=False)
+        except Exception as e:
+            logger.warning(f"Failed to clean up session table: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "postgres",
+            "errors": self.errors,
+            "fallback": self.fallback.stats()
+        }
+
+
+class SessionStore:
+    """讀取與修改使用者狀態；修改以樂觀鎖寫入，版本衝突時重新讀取後再套用"""
+
+    def __init__(self, backend, max_turns: int = 50, max_retries: int = 3):
+        self.backend = backend
+        self.max_turns = max_turns
+        self.max_retries = max(0, max_retries)
+        self._lock = threading.Lock()
+
+        # 統計資料
+        self.reads = 0
+        self.writes = 0
+        self.conflicts = 0
+        self.dropped_writes = 0
+        self.decode_errors = 0
+
+    @property
+    def shared(self) -> bool:
+        """後端是否由所有 worker 共用"""
+        return self.backend.shared
+
+    def get(self, user_id: str) -> UserSession:
+        """取得使用者狀態；沒有紀錄時回傳預設值"""
+        with self._lock:
+            self.reads += 1
+        entry = self.backend.load(user_id)
+        if entry is None:
+            return UserSession()
+        data, version = entry
+        try:
+            return decode_session(data, version)
+        except Exception as e:
+            # 無法解析的紀錄視為空狀態，下一次寫入時覆蓋
+            with self._lock:
+                self.decode_errors += 1
+            logger.warning(f"Discarding unreadable session for {user_id}: {e}")
+            return UserSession(version=version)
+
+    def update(self, user_id: str, mutate: Callable[[UserSession], None]) -> UserSession:
+        """以 mutate 修改狀態並寫回；其他 worker 同時寫入時重新讀取最新版本再套用"""
+        for attempt in range(self.max_retries + 1):
+            session = self.get(user_id)
+            mutate(session)
+            session.turns = session.turns[-self.max_turns:]
+            new_version = self.backend.compare_and_set(user_id, encode_session(session), session.version)
+            if new_version is not None:
+                session.version = new_version
+                with self._lock:
+                    self.writes += 1
+                return session
+            with self._lock:
+                self.conflicts += 1
+
+        with self._lock:
+            self.dropped_writes += 1
+        logger.warning(f"Session update for {user_id} dropped after {self.max_retries + 1} conflicts")
+        return self.get(user_id)
+
+    def delete(self, user_id: str):
+        self.backend.delete(user_id)
+
+    def stats(self) -> Dict:
+        """取得讀寫、版本衝突與後端統計"""
+        with self._lock:
+            counters = {
+                "reads": self.reads,
+                "writes": self.writes,
+                "conflicts": self.conflicts,
+                "dropped_writes": self.dropped_writes,
+                "decode_errors": self.decode_errors
+            }
+        counters["backend"] = self.backend.stats()
+        return counters
+
+
+class SharedConversationHistory:
+    """共用後端時的對話歷史：存在使用者狀態中，任何 worker 都能接續對話
+
+    介面與 ConversationStore 相同（get / append / clear / stats）。
+    """
+
+    def __init__(self, sessions: SessionStore):
+        self.sessions = sessions
+
+    def get(self, user_id: str) -> List[Dict]:
+        return self.sessions.get(user_id).turns
+
+    def append(self, user_id: str, user_message: str, ai_response: str) -> Dict:
+        turn = {}
+
+        def add_turn(session: UserSession):
+            turns = session.turns
+            turn.clear()
+            turn.update({
+                'turn': turns[-1]['turn'] + 1 if turns else 0,
+                'user': user_message,
+                'assistant': ai_response
+            })
+            turns.append(dict(turn))
+
+        self.sessions.update(user_id, add_turn)
+        return turn
+
+    def clear(self, user_id: str):
+        def clear_turns(session: UserSession):
+            session.turns = []
+
+        self.sessions.update(user_id, clear_turns)
+
+    def stats(self) -> Dict:
+        return {"backend": "session_store", "max_turns": self.sessions.max_turns}
+
+
+def create_session_store() -> SessionStore:
+    """依設定建立使用者狀態；Postgres 無法使用時退回程序內版本"""
+    backend = None
+    if Config.SESSION_BACKEND == 'postgres':
+        try:
+            backend = PostgresSessionBackend(ttl_seconds=Config.SESSION_TTL)
+            logger.info("User sessions using shared Postgres table")
+        except Exception as e:
+            logger.warning(f"Postgres session store unavailable, falling back to memory: {e}")
+
+    if backend is None:
+        backend = InProcessSessionBackend(max_entries=Config.SESSION_MAX_ENTRIES,
+                                          ttl_seconds=Config.SESSION_TTL)
+    return SessionStore(backend, max_turns=Config.CONVERSATION_MAX_TURNS)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+離線壓測工具：LINE Messaging API 替身 + webhook 壓力產生器
+
+搭配 GEMINI_BACKEND=synthetic（或 replay）時，整個 bot 不需要網路：
+
+    # 1. bot 指向 LINE 替身
+    LINE_API_ENDPOINT=http://127.0.0.1:8090 GEMINI_BACKEND=synthetic gunicorn app:app
+    # 2. 以每秒 20 則訊息壓測 60 秒（同時啟動 LINE 替身，統計回覆送達的端到端延遲）
+    python standin_server.py load --url http://127.0.0.1:5000/callback --rate 20 --duration 60
+
+只需要 LINE 替身時：python standin_server.py line --port 8090
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import requests
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MESSAGES = [
+    "你好",
+    "今天天氣如何？",
+    "我明天有什麼行程？",
+    "這週有哪些會議？",
+    "幫我安排明天下午三點開會",
+    "記住我喜歡喝拿鐵",
+    "你還記得我喜歡的咖啡嗎？",
+    "你是誰？",
+    "我最近工作好累，該怎麼辦？",
+    "/dashboard"
+]
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values: List[float]) -> Dict:
+    """延遲分布（毫秒）"""
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+    return {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 0.5)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(max(values) if values else None)
+    }
+
+
+class LineStandin:
+    """接受所有 LINE API 呼叫並回傳 200，記錄回覆送達的時間"""
+
+    def __init__(self, latency_ms: float = 30):
+        self.latency_ms = latency_ms
+        self._lock = threading.Lock()
+        self.calls: Counter = Counter()
+        self.reply_arrivals: Dict[str, float] = {}
+        self.pushes = 0
+        self.server = None
+
+    def _record(self, path: str, body: Dict):
+        operation = path.split("/v2/bot/", 1)[-1]
+        with self._lock:
+            self.calls[operation] += 1
+            if operation == "message/reply" and "replyToken" in body:
+                self.reply_arrivals[body["replyToken"]] = time.monotonic()
+            elif operation.startswith("message/push"):
+                self.pushes += 1
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, payload: Dict):
+                if standin.latency_ms > 0:
+                    time.sleep(random.expovariate(1000.0 / standin.latency_ms))
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw or b"{}")
+                except ValueError:
+                    body = {}
+                standin._record(self.path, body)
+                self._respond({})
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    self._respond(standin.stats())
+                    return
+                standin._record(self.path, {})
+                if "/profile/" in self.path:
+                    user_id = self.path.rsplit("/", 1)[-1]
+                    self._respond({"userId": user_id, "displayName": "壓測使用者"})
+                else:
+                    self._respond({})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host: str = "127.0.0.1", port: int = 8090) -> "LineStandin":
+        """在背景執行緒啟動"""
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="line-standin", daemon=True).start()
+        logger.info(f"LINE stand-in listening on http://{host}:{port}")
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "replies": len(self.reply_arrivals), "pushes": self.pushes}
+
+
+def build_webhook_body(user_id: str, text: str) -> Dict:
+    """一則文字訊息的 webhook 內容"""
+    return {
+        "destination": "Ustandin",
+        "events": [{
+            "type": "message",
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "source": {"type": "user", "userId": user_id},
+            "webhookEventId": uuid.uuid4().hex,
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": uuid.uuid4().hex,
+            "message": {"id": str(random.randint(10 ** 12, 10 ** 13)), "type": "text",
+                        "quoteToken": uuid.uuid4().hex, "text": text}
+        }]
+    }
+
+
+def sign(body: bytes, channel_secret: str) -> str:
+    """X-Line-Signature：以 channel secret 計算的 HMAC-SHA256（base64）"""
+    digest = hmac.new(channel_secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def run_load(url: str, channel_secret: str, rate: float, duration: float, users: int,
+             messages: List[str], line: Optional[LineStandin] = None,
+             concurrency: int = 32, drain: float = 30.0) -> Dict:
+    """以固定速率送出 webhook（不等前一個完成），回傳 webhook 與端到端延遲"""
+    local = threading.local()
+    lock = threading.Lock()
+    sent_at: Dict[str, float] = {}
+    statuses: Counter = Counter()
+    webhook_latencies: List[float] = []
+
+    def send(index: int):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        payload = build_webhook_body(f"Uload{index % users:06d}", messages[index % len(messages)])
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json", "X-Line-Signature": sign(body, channel_secret)}
+        start = time.monotonic()
+        with lock:
+            sent_at[payload["events"][0]["replyToken"]] = start
+        try:
+            status = session.post(url, data=body, headers=headers, timeout=30).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        with lock:
+            statuses[str(status)] += 1
+            webhook_latencies.append(time.monotonic() - start)
+
+    total = int(rate * duration)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index in range(total):
+            delay = started + index / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, index)
+
+    # 等處理中的訊息回覆
+    if line is not None:
+        wait_until = time.monotonic() + drain
+        while time.monotonic() < wait_until and len(line.reply_arrivals) + line.pushes < total:
+            time.sleep(0.2)
+
+    result = {
+        "sent": total,
+        "elapsed_s": round(time.monotonic() - started, 1),
+        "statuses": dict(statuses),
+        "webhook": summarize(webhook_latencies)
+    }
+    if line is not None:
+        end_to_end = [line.reply_arrivals[token] - sent for token, sent in sent_at.items()
+                      if token in line.reply_arrivals]
+        result["end_to_end"] = summarize(end_to_end)
+        result["line"] = line.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE API 替身與離線壓測")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    line_parser = sub.add_parser("line", help="只啟動 LINE API 替身")
+    line_parser.add_argument("--host", default="127.0.0.1")
+    line_parser.add_argument("--port", type=int, default=8090)
+    line_parser.add_argument("--latency-ms", type=float, default=30)
+
+    load_parser = sub.add_parser("load", help="啟動 LINE 替身並以固定速率送出 webhook")
+    load_parser.add_argument("--url", default=f"http://127.0.0.1:{Config.PORT}/callback")
+    load_parser.add_argument("--rate", type=float, default=10, help="每秒訊息數")
+    load_parser.add_argument("--duration", type=float, default=30, help="秒")
+    load_parser.add_argument("--users", type=int, default=100, help="模擬的使用者數")
+    load_parser.add_argument("--concurrency", type=int, default=32)
+    load_parser.add_argument("--messages", help="訊息檔（每行一則），預設使用內建範例")
+    load_parser.add_argument("--line-port", type=int, default=8090, help="0 表示不啟動 LINE 替身")
+    load_parser.add_argument("--line-latency-ms", type=float, default=30)
+    load_parser.add_argument("--drain", type=float, default=30, help="送完後等待回覆的秒數")
+    load_parser.add_argument("--secret", default=Config.LINE_CHANNEL_SECRET)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "line":
+        LineStandin(args.latency_ms).start(args.host, args.port)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+
+    if not args.secret:
+        parser.error("LINE_CHANNEL_SECRET 未設定（或以 --secret 指定）")
+    messages = DEFAULT_MESSAGES
+    if args.messages:
+        with open(args.messages, encoding="utf-8") as f:
+            messages = [line.strip() for line in f if line.strip()]
+
+    line = LineStandin(args.line_latency_ms).start(port=args.line_port) if args.line_port else None
+    try:
+        result = run_load(args.url, args.secret, args.rate, args.duration, args.users, messages,
+                          line=line, concurrency=args.concurrency, drain=args.drain)
+    finally:
+        if line is not None:
+            line.stop()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
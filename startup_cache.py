@@ -0,0 +1,146 @@
+"""
+啟動檢測結果快取
+同一份設定與程式碼（指紋相同）最近已通過的檢測不必每個 worker 重跑一次，
+避免滾動部署時每個 worker 開機都打好幾次 Gemini、資料庫與 git log
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 影響檢測結果的環境變數（只存雜湊，不會寫出原值）
+FINGERPRINT_ENV_VARS = [
+    'LINE_CHANNEL_ACCESS_TOKEN',
+    'LINE_CHANNEL_SECRET',
+    'GEMINI_API_KEY',
+    'GEMINI_MODEL',
+    'DATABASE_URL',
+    'GOOGLE_CALENDAR_CREDENTIALS',
+]
+
+# 找不到 commit 時，改用這些檔案的內容當作程式碼版本
+FINGERPRINT_SOURCE_FILES = [
+    'startup_test.py',
+    'config.py',
+    'gemini_service.py',
+    'line_bot_handler.py',
+]
+
+
+def get_deployed_commit() -> Optional[str]:
+    """取得部署的 commit（不啟動 git 子程序）"""
+    for var in ('RAILWAY_GIT_COMMIT_SHA', 'SOURCE_COMMIT', 'GIT_COMMIT'):
+        if os.getenv(var):
+            return os.getenv(var)
+
+    head_path = os.path.join(PROJECT_ROOT, '.git', 'HEAD')
+    try:
+        with open(head_path, 'r') as f:
+            head = f.read().strip()
+        if not head.startswith('ref: '):
+            return head
+        ref_path = os.path.join(PROJECT_ROOT, '.git', head[5:])
+        if os.path.exists(ref_path):
+            with open(ref_path, 'r') as f:
+                return f.read().strip()
+    except OSError:
+        pass
+    return None
+
+
+def compute_fingerprint() -> str:
+    """設定與程式碼版本的指紋"""
+    digest = hashlib.sha256()
+    for var in FINGERPRINT_ENV_VARS:
+        digest.update(f"{var}={os.getenv(var, '')}\n".encode('utf-8'))
+
+    commit = get_deployed_commit()
+    if commit:
+        digest.update(f"commit={commit}\n".encode('utf-8'))
+    else:
+        for filename in FINGERPRINT_SOURCE_FILES:
+            try:
+                with open(os.path.join(PROJECT_ROOT, filename), 'rb') as f:
+                    digest.update(f.read())
+            except OSError:
+                continue
+    return digest.hexdigest()
+
+
+class StartupResultCache:
+    """以檔案保存的檢測結果快取，指紋不同時整份作廢
+
+    檔案放在 /tmp，同一個容器內的 worker 共用；寫入採用 os.replace 確保不會讀到半份檔案。
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None,
+                 fingerprint: Optional[str] = None, clock=time.time):
+        self.path = path or os.getenv('STARTUP_CACHE_FILE', '/tmp/startup_check_cache.json')
+        self.ttl = ttl if ttl is not None else float(os.getenv('STARTUP_CACHE_TTL', 3600))
+        self.fingerprint = fingerprint or compute_fingerprint()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self) -> Dict:
+        empty = {"fingerprint": self.fingerprint, "checks": {}, "values": {}}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return empty
+
+        if data.get("fingerprint") != self.fingerprint:
+            logger.info("Startup cache fingerprint changed, running full checks")
+            return empty
+        data.setdefault("checks", {})
+        data.setdefault("values", {})
+        return data
+
+    def get_check_age(self, test_name: str) -> Optional[float]:
+        """檢測在有效期限內通過過時，回傳距今秒數；否則回傳 None"""
+        with self._lock:
+            passed_at = self._data["checks"].get(test_name)
+        if passed_at is None:
+            return None
+        age = self._clock() - passed_at
+        return age if 0 <= age < self.ttl else None
+
+    def record_check(self, test_name: str, passed: bool):
+        """記錄檢測結果：通過就更新時間，失敗就移除快取"""
+        with self._lock:
+            if passed:
+                self._data["checks"][test_name] = self._clock()
+            else:
+                self._data["checks"].pop(test_name, None)
+            self._save()
+
+    def get_value(self, key: str) -> Any:
+        with self._lock:
+            return self._data["values"].get(key)
+
+    def set_value(self, key: str, value: Any):
+        with self._lock:
+            self._data["values"][key] = value
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._data = {"fingerprint": self.fingerprint, "checks": {}, "values": {}}
+            self._save()
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to write startup cache: {e}")
@@ -3,13 +3,13 @@ import sys
 import time
 import logging
 from datetime import datetime
-import google.generativeai as genai
 from linebot import LineBotApi
 from linebot.exceptions import LineBotApiError
 import json
+import copy
+import threading
 import subprocess
-import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from startup_cache import StartupResultCache
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +27,9 @@ class TestAgent:
     - 提供改進建議
     """
     
-    def __init__(self):
+    def __init__(self, cache=None):
+        # 啟動檢測結果快取（用來保存 git log，避免每個 worker 都啟動子程序）
+        self.cache = cache
         # 在 Railway 環境使用環境變數存儲記憶
         self.is_railway = os.getenv('RAILWAY_ENVIRONMENT') is not None
         self.memory_file = "/tmp/test_memory.json" if not self.is_railway else None
@@ -35,6 +37,7 @@ class TestAgent:
         self.personality = "🧪 資深測試專員"
         self.project_root = os.path.dirname(os.path.abspath(__file__))  # 專案根目錄
         self.age = self._calculate_age()  # 計算測試專員年齡
+        self._lock = threading.RLock()  # 啟動檢測平行執行時保護記憶
     
     def _load_memory(self):
         """載入測試記憶"""
@@ -45,12 +48,9 @@ class TestAgent:
             
             # 嘗試讀取最近的 git log
             try:
-                result = subprocess.run(
-                    ['git', 'log', '--oneline', '-10'],
-                    capture_output=True, text=True, cwd=self.project_root
-                )
-                if result.returncode == 0 and result.stdout.strip():
-                    commits = result.stdout.strip().split('\n')
+                git_log = self._read_git_log()
+                if git_log:
+                    commits = git_log.split('\n')
                     memory["git_commits"] = [
                         {"commit": c.split(' ', 1)[0], "message": c.split(' ', 1)[1] if ' ' in c else c}
                         for c in commits if c
@@ -85,6 +85,25 @@ class TestAgent:
         
         return self._get_default_memory()
     
+    def _read_git_log(self):
+        """讀取最近的 git log；同一份部署只需要讀一次"""
+        if self.cache is not None:
+            cached = self.cache.get_value("git_log")
+            if cached:
+                return cached
+        
+        result = subprocess.run(
+            ['git', 'log', '--oneline', '-10'],
+            capture_output=True, text=True, cwd=self.project_root
+        )
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+        
+        git_log = result.stdout.strip()
+        if self.cache is not None:
+            self.cache.set_value("git_log", git_log)
+        return git_log
+    
     def _get_default_memory(self):
         """取得預設記憶結構"""
         return {
@@ -102,6 +121,10 @@ class TestAgent:
     
     def remember_test(self, test_name, success, duration, error=None):
         """記住測試結果並進行反思"""
+        with self._lock:
+            self._remember_test(test_name, success, duration, error)
+    
+    def _remember_test(self, test_name, success, duration, error=None):
         record = {
             "test": test_name,
             "success": success,
@@ -406,15 +429,46 @@ class TestAgent:
         return " | ".join(insights)
 
 class StartupTest:
-    """啟動時自我檢測系統"""
+    """啟動時自我檢測系統
+    
+    各項檢測彼此獨立，同時在背景執行緒執行：
+    - 關鍵檢測必須在時間預算內通過，服務才會啟動
+    - 非關鍵檢測不擋啟動，完成後才更新 /health；失敗只列為警告
+    """
+    
+    # (測試名稱, 方法, 是否為關鍵檢測)；名稱需與各方法寫入 results 的鍵一致
+    CHECKS = [
+        ("環境變數檢查", "_test_environment_variables", True),
+        ("pgvector 資料庫", "_test_pgvector_database", True),
+        ("Gemini API 連線", "_test_gemini_connection", True),
+        ("Line Bot 設定", "_test_line_bot_credentials", True),
+        ("Google Calendar", "_test_google_calendar", False),
+        ("基本 AI 功能", "_test_basic_ai_response", True),
+        ("Function Calling", "_test_function_calling", False),
+    ]
     
-    def __init__(self):
+    def __init__(self, force_full_check=None):
         self.start_time = time.time()
         self.tests = []
         self.results = {}
         self.critical_failures = []
         self.warnings = []
-        self.test_agent = TestAgent()  # 測試專員
+        
+        # 相同設定與程式碼最近通過的檢測直接沿用；強制完整檢測時仍會更新快取
+        if force_full_check is None:
+            force_full_check = os.getenv('STARTUP_FORCE_FULL_CHECK', 'false').lower() == 'true'
+        self.force_full_check = force_full_check
+        self.cache = None
+        if os.getenv('STARTUP_CACHE_ENABLED', 'true').lower() == 'true':
+            self.cache = StartupResultCache()
+        
+        self.test_agent = TestAgent(cache=self.cache)  # 測試專員
+        self.time_budget = float(os.getenv('STARTUP_TEST_BUDGET', 20))
+        self.pending_checks = set()
+        # 超過時間預算、已計為失敗的關鍵檢測；之後才完成的結果只列為警告
+        self.timed_out_checks = set()
+        self.check_durations = {}
+        self._lock = threading.Lock()
         
     def run_all_tests(self) -> bool:
         """執行所有啟動測試"""
@@ -423,24 +477,100 @@ class StartupTest:
         print(f"🤖 測試專員洞察: {self.test_agent.get_insights()}")
         print("="*50)
         
-        # 執行各項測試
-        self._test_environment_variables()
-        self._test_pgvector_database()  # 新增 pgvector 測試
-        self._test_gemini_connection()
-        self._test_line_bot_credentials()
-        self._test_google_calendar()
-        self._test_basic_ai_response()
-        self._test_function_calling()  # 新增 Function Calling 測試
+        # 所有檢測同時開始，結果依原本順序顯示
+        critical_done = []
+        for test_name, method_name, critical in self.CHECKS:
+            self.results[test_name] = "⏳ 執行中"
+            self.pending_checks.add(test_name)
+            done = threading.Event()
+            if critical:
+                critical_done.append((test_name, done))
+            threading.Thread(
+                target=self._run_check,
+                args=(test_name, method_name, critical, done),
+                name=f"startup-check-{method_name}",
+                daemon=True
+            ).start()
+        
+        # 只等關鍵檢測，超過時間預算視為失敗
+        deadline = self.start_time + self.time_budget
+        for test_name, done in critical_done:
+            if not done.wait(max(0.0, deadline - time.time())):
+                with self._lock:
+                    if test_name not in self.pending_checks:
+                        # 等待逾時的同時剛好完成
+                        continue
+                    self.timed_out_checks.add(test_name)
+                    self.results[test_name] = "⏱️ 逾時"
+                    self.critical_failures.append(f"{test_name} 超過啟動時間預算 ({self.time_budget:.0f} 秒)")
         
         # 計算測試時間
         self.test_duration = time.time() - self.start_time
         
         # 顯示測試報告
-        self._print_report()
+        with self._lock:
+            self._print_report()
         
         # 返回是否所有關鍵測試都通過
         return len(self.critical_failures) == 0
     
+    def _run_check(self, test_name, method_name, critical, done):
+        """在獨立的副本上執行單一檢測，完成後合併結果"""
+        cache_age = None
+        if self.cache is not None and not self.force_full_check:
+            cache_age = self.cache.get_check_age(test_name)
+        
+        if cache_age is not None:
+            with self._lock:
+                self.results[test_name] = "✅ 通過（快取）"
+                self.check_durations[test_name] = 0.0
+                self.pending_checks.discard(test_name)
+            done.set()
+            
+            # 快取超過一半有效期時不擋啟動，在背景重新驗證；失敗只列為警告並清除快取
+            if cache_age < self.cache.ttl / 2:
+                return
+            critical = False
+            logger.info(f"Revalidating cached startup check in background: {test_name}")
+        
+        # 各檢測直接寫入 results / critical_failures / warnings，
+        # 用淺複製讓每個檢測有自己的清單，再在鎖內合併
+        probe = copy.copy(self)
+        probe.results = {}
+        probe.critical_failures = []
+        probe.warnings = []
+        started = time.time()
+        
+        try:
+            getattr(probe, method_name)()
+        except Exception as e:
+            probe.results[test_name] = "❌ 失敗"
+            probe.critical_failures.append(f"{test_name} 執行錯誤: {str(e)}")
+            logger.error(f"Startup check {test_name} crashed: {e}", exc_info=True)
+        
+        with self._lock:
+            if test_name in self.timed_out_checks:
+                # 已經以逾時計為失敗並輸出報告：不覆蓋結果，也不再新增關鍵失敗
+                self.warnings.extend(probe.warnings)
+                self.warnings.append(f"（逾時後完成）{test_name}: {probe.results.get(test_name, '未回報結果')}")
+                self.warnings.extend(f"（逾時後）{failure}" for failure in probe.critical_failures)
+            else:
+                self.results.update(probe.results)
+                self.warnings.extend(probe.warnings)
+                if critical:
+                    self.critical_failures.extend(probe.critical_failures)
+                else:
+                    self.warnings.extend(f"（非關鍵）{failure}" for failure in probe.critical_failures)
+            self.check_durations[test_name] = round(time.time() - started, 2)
+            self.pending_checks.discard(test_name)
+        
+        if self.cache is not None:
+            self.cache.record_check(test_name, probe.results.get(test_name) == "✅ 通過")
+        
+        if not critical or test_name in self.timed_out_checks:
+            logger.info(f"Background startup check finished: {test_name} -> {self.results.get(test_name)}")
+        done.set()
+    
     def _test_environment_variables(self):
         """測試環境變數"""
         test_name = "環境變數檢查"
@@ -473,8 +603,8 @@ class StartupTest:
                 self.results[test_name] = "⏭️ 跳過"
                 self.warnings.append("未設定 Gemini API Key")
                 return
-                
-            genai.configure(api_key=api_key)
+            
+            from gemini_standin import create_generative_model
             
             # 嘗試不同的模型名稱
             models_to_try = ['gemini-1.5-flash', 'gemini-1.5-pro', 'gemini-pro']
@@ -483,7 +613,7 @@ class StartupTest:
             
             for model_name in models_to_try:
                 try:
-                    model = genai.GenerativeModel(model_name)
+                    model = create_generative_model(model_name)
                     response = model.generate_content("回應OK即可")
                     if response and response.text:
                         successful_model = model_name
@@ -510,6 +640,9 @@ class StartupTest:
         test_name = "pgvector 資料庫"
         print(f"\n🗄️  測試 {test_name}...")
         
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+        
         # 執行完整的 DNS 考古診斷（永久保存每次的診斷結果）
         from system_intelligence.diagnostics import DNSArchaeology
         from system_intelligence import SystemChronicles
@@ -790,6 +923,9 @@ class StartupTest:
             "warnings": self.warnings,
             "errors": self.critical_failures,
             "test_duration": getattr(self, 'test_duration', 0),
+            "pending_checks": sorted(self.pending_checks),
+            "force_full_check": self.force_full_check,
+            "check_durations": dict(self.check_durations),
             "test_time": datetime.now().isoformat(),
             "test_agent_insights": self.test_agent.get_insights()
         }
\ No newline at end of file
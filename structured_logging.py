@@ -0,0 +1,108 @@
+"""
+取樣式結構化日誌
+每個路由有自己的取樣率，被取樣的紀錄以單行 JSON 輸出；
+完整的請求內容（headers、body、prompt）只保留在有上限的記憶體環形緩衝區，
+透過 debug 端點查看，不寫入 stdout
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger("access")
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """解析 "callback=0.1,gemini=0.05" 格式的取樣率設定"""
+    rates = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        route, rate = item.split("=", 1)
+        try:
+            rates[route.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            logging.getLogger(__name__).warning(f"Invalid sample rate for {route}: {rate}")
+    return rates
+
+
+class StructuredLogger:
+    """依路由取樣的結構化日誌與完整內容環形緩衝區
+
+    熱路徑用法：先呼叫 sampled()，未被取樣時不需要組任何字串。
+    """
+
+    def __init__(self, sample_rates: Optional[Dict[str, float]] = None,
+                 default_rate: float = 1.0, ring_size: int = 200,
+                 random_fn=random.random):
+        self.sample_rates = sample_rates or {}
+        self.default_rate = default_rate
+        self.ring_size = ring_size
+        self._ring = deque(maxlen=ring_size) if ring_size > 0 else None
+        self._ring_lock = threading.Lock()
+        self._random = random_fn
+        # 統計（只求近似值，不加鎖）
+        self.seen: Dict[str, int] = {}
+        self.emitted: Dict[str, int] = {}
+
+    def sampled(self, route: str) -> bool:
+        """這筆紀錄是否要輸出"""
+        self.seen[route] = self.seen.get(route, 0) + 1
+        rate = self.sample_rates.get(route, self.default_rate)
+        return rate >= 1.0 or (rate > 0.0 and self._random() < rate)
+
+    def emit(self, route: str, event: str, **fields):
+        """輸出一筆結構化紀錄（呼叫前應先檢查 sampled()）"""
+        self.emitted[route] = self.emitted.get(route, 0) + 1
+        record = {"route": route, "event": event}
+        record.update(fields)
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def log(self, route: str, event: str, **fields):
+        """取樣後輸出"""
+        if self.sampled(route):
+            self.emit(route, event, **fields)
+
+    @property
+    def capturing(self) -> bool:
+        """環形緩衝區是否啟用（未啟用時不需要準備完整內容）"""
+        return self._ring is not None
+
+    def capture(self, route: str, event: str, **payload):
+        """把完整內容存進環形緩衝區"""
+        if self._ring is None:
+            return
+        entry = {"time": time.time(), "route": route, "event": event, "payload": payload}
+        with self._ring_lock:
+            self._ring.append(entry)
+
+    def recent(self, limit: int = 50, route: Optional[str] = None) -> List[Dict]:
+        """取得最近的完整內容（新的在前）"""
+        if self._ring is None:
+            return []
+        with self._ring_lock:
+            entries = list(self._ring)
+        if route:
+            entries = [entry for entry in entries if entry["route"] == route]
+        return list(reversed(entries[-limit:])) if limit > 0 else []
+
+    def stats(self) -> Dict:
+        return {
+            "default_rate": self.default_rate,
+            "sample_rates": dict(self.sample_rates),
+            "ring_size": self.ring_size,
+            "seen": dict(self.seen),
+            "emitted": dict(self.emitted)
+        }
+
+
+access_log = StructuredLogger(
+    sample_rates=parse_sample_rates(Config.LOG_SAMPLE_RATES),
+    default_rate=Config.LOG_SAMPLE_DEFAULT,
+    ring_size=Config.LOG_RING_BUFFER_SIZE
+)
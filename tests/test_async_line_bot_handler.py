@@ -0,0 +1,173 @@
+"""
+ASGI 版 Line Bot 處理器的測試案例
+確保會阻塞的工作不在事件迴圈上執行、同一使用者依序回覆、
+超過回覆期限時先送暫時回覆再 push 完整答案
+"""
+import pytest
+import sys
+import os
+import asyncio
+import json
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from standin_server import build_webhook_body, sign
+
+SECRET = "test-secret"
+
+
+class FakeAsyncLineApi:
+    """記錄 reply 與 push 的內容"""
+
+    def __init__(self):
+        self.replies = []
+        self.pushes = []
+
+    async def reply_message(self, reply_token, message):
+        self.replies.append(message.text)
+
+    async def push_message(self, to, message):
+        self.pushes.append((to, message.text))
+
+
+@pytest.fixture
+def make_handler(monkeypatch):
+    """建立不連網路的 AsyncLineBotHandler；reply_budget 為 None 時不追蹤回覆期限"""
+    handlers = []
+
+    def factory(reply_budget=None):
+        monkeypatch.setattr(Config, "LINE_CHANNEL_SECRET", SECRET)
+        monkeypatch.setattr(Config, "LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+        monkeypatch.setattr(Config, "SERVICE_PREWARM", False)
+        monkeypatch.setattr(Config, "PRELOAD_APP", False)
+        monkeypatch.setattr(Config, "RATE_LIMIT_ENABLED", False)
+        monkeypatch.setattr(Config, "REPLY_DEADLINE_ENABLED", reply_budget is not None)
+        if reply_budget is not None:
+            monkeypatch.setattr(Config, "REPLY_DEADLINE_BUDGET", reply_budget)
+        from async_line_bot_handler import AsyncLineBotHandler
+        handler = AsyncLineBotHandler()
+        handler.async_line_bot_api = FakeAsyncLineApi()
+        handler._schedule_quantum_sync = lambda *args: None
+        handlers.append(handler)
+        return handler
+
+    yield factory
+    for handler in handlers:
+        handler.post_reply.shutdown(wait=False)
+        handler.worker_pool.shutdown(wait=False)
+
+
+def deliver(handler, messages) -> None:
+    """送出一個 webhook（[(user_id, text), ...]）並等所有事件處理完"""
+    events = [build_webhook_body(user, text)["events"][0] for user, text in messages]
+    body = json.dumps({"destination": "Utest", "events": events})
+
+    async def run():
+        handler.handle_webhook_async(body, sign(body.encode("utf-8"), SECRET))
+        await asyncio.wait(set(handler._tasks), timeout=5)
+
+    asyncio.run(run())
+
+
+class TestAsyncLineBotHandler:
+    """測試 asyncio 事件處理"""
+
+    def test_blocking_command_does_not_stall_other_users(self, make_handler):
+        """測試：一位使用者的指令阻塞時，其他使用者的回覆不受影響"""
+        # Arrange
+        handler = make_handler()
+
+        def command_reply(user_id, message_text):
+            if user_id == "Uslow":
+                time.sleep(0.3)
+                return "指令完成"
+            return None
+
+        async def get_response_async(user_id, message_text):
+            return "你好！"
+
+        handler._get_command_reply = command_reply
+        handler.gemini_service.get_response_async = get_response_async
+
+        # Act
+        deliver(handler, [("Uslow", "/quantum"), ("Ufast", "嗨")])
+
+        # Assert
+        assert handler.async_line_bot_api.replies == ["你好！", "指令完成"]
+
+    def test_same_user_replies_in_order(self, make_handler):
+        """測試：同一使用者的訊息依到達順序回覆"""
+        # Arrange
+        handler = make_handler()
+        delays = {"第一則": 0.1, "第二則": 0.0}
+
+        async def get_response_async(user_id, message_text):
+            await asyncio.sleep(delays[message_text])
+            return f"回覆{message_text}"
+
+        handler.gemini_service.get_response_async = get_response_async
+
+        # Act
+        deliver(handler, [("Ua", "第一則"), ("Ua", "第二則")])
+
+        # Assert
+        assert handler.async_line_bot_api.replies == ["回覆第一則", "回覆第二則"]
+        assert handler.get_webhook_stats()["asgi"]["active_user_lanes"] == 0
+
+    def test_deadline_sends_interim_then_push(self, make_handler):
+        """測試：超過回覆期限時先送暫時回覆，完整答案改用 push"""
+        # Arrange
+        handler = make_handler(reply_budget=0.05)
+
+        async def get_response_async(user_id, message_text):
+            await asyncio.sleep(0.2)
+            return "完整答案"
+
+        handler.gemini_service.get_response_async = get_response_async
+
+        # Act
+        deliver(handler, [("Ua", "問題")])
+
+        # Assert
+        api = handler.async_line_bot_api
+        assert api.replies == [Config.REPLY_INTERIM_MESSAGE]
+        assert api.pushes == [("Ua", "完整答案")]
+        assert handler.reply_deadlines.stats()["interim_sent"] == 1
+
+
+def test_get_response_async_prepares_request_off_the_loop(make_handler):
+    """測試：讀寫使用者狀態與對話歷史的準備工作在執行緒中執行，事件迴圈持續運作"""
+    # Arrange
+    service = make_handler().gemini_service
+
+    def slow_prepare(user_id, message):
+        time.sleep(0.2)
+        return "快取的回應", "", "", ""
+
+    service._prepare_request = slow_prepare
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        response = await service.get_response_async("Ua", "你好")
+        task.cancel()
+        return response, ticks
+
+    # Act
+    response, ticks = asyncio.run(run())
+
+    # Assert
+    assert response == "快取的回應"
+    assert ticks >= 10
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
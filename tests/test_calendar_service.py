@@ -0,0 +1,52 @@
+"""
+CalendarService 的測試案例
+確保每個執行緒使用自己的 Google API client
+"""
+import pytest
+import sys
+import os
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import calendar_service
+from calendar_service import CalendarService
+
+
+class TestCalendarServiceThreads:
+    """測試 Calendar API client 的執行緒隔離"""
+
+    def test_each_thread_builds_its_own_client(self, monkeypatch):
+        """測試：不同執行緒拿到不同的 client，同一執行緒重複使用"""
+        # Arrange
+        monkeypatch.delenv("GOOGLE_CALENDAR_CREDENTIALS", raising=False)
+        monkeypatch.setattr(calendar_service, "build", lambda *args, **kwargs: object())
+        service = CalendarService()
+        service._credentials = object()
+        clients = []
+
+        # Act
+        main_client = service.service
+        thread = threading.Thread(target=lambda: clients.append(service.service))
+        thread.start()
+        thread.join()
+
+        # Assert
+        assert main_client is service.service
+        assert clients[0] is not None
+        assert clients[0] is not main_client
+
+    def test_no_credentials_means_no_client(self, monkeypatch):
+        """測試：沒有憑證時 service 為 None"""
+        # Arrange
+        monkeypatch.delenv("GOOGLE_CALENDAR_CREDENTIALS", raising=False)
+
+        # Act
+        service = CalendarService()
+
+        # Assert
+        assert service.service is None
+        assert service.list_events() == {"error": "Calendar service not initialized"}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,123 @@
+"""
+OpenAI 相容聊天端點的測試案例
+確保 OpenAI 訊息轉成對話歷史、人格由 model 欄位選擇，
+串流以 chat.completion.chunk 事件逐段送出並以 [DONE] 結束
+"""
+import pytest
+import sys
+import os
+import asyncio
+import json
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_completions import (ChatCompletionRequest, ChatCompletionService, ChatMessage,
+                              format_sse, parse_messages)
+
+
+class FakeGeminiService:
+    """記錄呼叫參數並依序串流固定文字"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = []
+
+    async def stream_chat_async(self, user_id, message, history=None, persona=None, instructions=""):
+        self.calls.append({"user_id": user_id, "message": message, "history": history,
+                           "persona": persona, "instructions": instructions})
+        for chunk in self.chunks:
+            yield chunk
+
+
+def events(stream) -> list:
+    """收集串流事件並解析 data 欄位"""
+    async def collect():
+        return [event async for event in stream]
+    parsed = []
+    for event in asyncio.run(collect()):
+        assert event.startswith("data: ") and event.endswith("\n\n")
+        data = event[len("data: "):].strip()
+        parsed.append(data if data == "[DONE]" else json.loads(data))
+    return parsed
+
+
+class TestParseMessages:
+    """測試訊息轉換"""
+
+    def test_split_instructions_history_and_message(self):
+        """測試：系統訊息成為指示，先前的問答成為對話歷史，最後的使用者訊息為本次問題"""
+        # Arrange
+        messages = [
+            ChatMessage(role="system", content="回答簡短"),
+            ChatMessage(role="user", content="你好"),
+            ChatMessage(role="assistant", content="嗨"),
+            ChatMessage(role="user", content=[{"type": "text", "text": "今天天氣"},
+                                              {"type": "image_url", "image_url": {}}])
+        ]
+
+        # Act
+        instructions, history, message = parse_messages(messages)
+
+        # Assert
+        assert instructions == "回答簡短"
+        assert history == [{'user': "你好", 'assistant': "嗨"}]
+        assert message == "今天天氣"
+
+    def test_missing_user_message_is_rejected(self):
+        """測試：沒有使用者訊息時拋出 ValueError"""
+        # Act & Assert
+        with pytest.raises(ValueError):
+            parse_messages([ChatMessage(role="system", content="hi")])
+
+
+class TestChatCompletionService:
+    """測試串流與非串流回應"""
+
+    def test_stream_emits_role_content_stop_and_done(self):
+        """測試：先送出角色，再逐段送出內容，最後是 stop 與 [DONE]"""
+        # Arrange
+        gemini = FakeGeminiService(["你", "好"])
+        service = ChatCompletionService(gemini)
+        request = ChatCompletionRequest(model="persona-cruz", stream=True,
+                                        messages=[ChatMessage(role="user", content="嗨")])
+
+        # Act
+        parsed = events(service.stream(request, "u1"))
+
+        # Assert
+        deltas = [event["choices"][0]["delta"] for event in parsed[:-1]]
+        assert deltas == [{"role": "assistant", "content": ""}, {"content": "你"}, {"content": "好"}, {}]
+        assert parsed[-2]["choices"][0]["finish_reason"] == "stop"
+        assert parsed[-1] == "[DONE]"
+        assert len({event["id"] for event in parsed[:-1]}) == 1
+        assert gemini.calls[0]["persona"] == "cruz"
+        assert service.stats()["latency"]["ttft"]["count"] == 1
+
+    def test_complete_joins_chunks(self):
+        """測試：非串流請求回傳完整的 chat.completion"""
+        # Arrange
+        service = ChatCompletionService(FakeGeminiService(["你", "好"]))
+        request = ChatCompletionRequest(messages=[ChatMessage(role="user", content="嗨")])
+
+        # Act
+        result = asyncio.run(service.complete(request, "u1"))
+
+        # Assert
+        assert result["object"] == "chat.completion"
+        assert result["choices"][0]["message"] == {"role": "assistant", "content": "你好"}
+
+    def test_unknown_model_is_rejected(self):
+        """測試：不支援的 model 拋出 ValueError"""
+        # Act & Assert
+        with pytest.raises(ValueError):
+            ChatCompletionService(FakeGeminiService([])).resolve_persona("gpt-4")
+
+
+def test_format_sse_keeps_unicode():
+    """測試：事件內容保留中文，不轉成跳脫序列"""
+    # Act & Assert
+    assert format_sse({"content": "你好"}) == 'data: {"content": "你好"}\n\n'
+    assert format_sse("[DONE]") == "data: [DONE]\n\n"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
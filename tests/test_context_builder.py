@@ -0,0 +1,233 @@
+"""
+對話上下文 token 預算的測試案例
+確保 prompt 不超過預算，舊對話改由背景更新的滾動摘要代替
+"""
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_builder import ContextBuilder, estimate_tokens, truncate_to_tokens
+from cruz_persona_system import CruzPersonaSystem
+
+CRUZ_CLOSING = "記住：\n- 你是 CRUZ 本人，不是 AI 助理"
+
+
+def make_history(count: int, text: str = "這是一段對話內容") -> list:
+    return [{'turn': i, 'user': f"{text}{i}", 'assistant': f"回覆{i}"} for i in range(count)]
+
+
+class TestTokenEstimate:
+    """測試 token 估算與截斷"""
+
+    def test_cjk_and_ascii_estimates(self):
+        """測試：中文 1 字 1 token，英數約 4 字元 1 token"""
+        # Act & Assert
+        assert estimate_tokens("你好") == 2
+        assert estimate_tokens("abcdefgh") == 2
+        assert estimate_tokens("") == 0
+
+    def test_truncate_keeps_head_or_tail(self):
+        """測試：截斷後不超過上限，並可選擇保留開頭或結尾"""
+        # Arrange
+        text = "一二三四五六七八九十"
+
+        # Act
+        head = truncate_to_tokens(text, 5)
+        tail = truncate_to_tokens(text, 5, keep="tail")
+
+        # Assert
+        assert head.startswith("一") and estimate_tokens(head) <= 5
+        assert tail.endswith("十") and estimate_tokens(tail) <= 5
+        assert truncate_to_tokens(text, 20) == text
+
+
+class TestBudget:
+    """測試 token 預算"""
+
+    def test_context_stays_within_budget(self):
+        """測試：長對話與過長的系統提示詞都被限制在預算內"""
+        # Arrange
+        builder = ContextBuilder(max_tokens=120, max_system_tokens=30, max_message_tokens=20,
+                                 summary_batch=100)
+        history = make_history(10)
+
+        # Act
+        built = builder.build("u1", "系" * 100, history, "最新的問題")
+
+        # Assert
+        assert built.tokens <= 120
+        assert built.truncated is True
+        assert 0 < built.history_turns < 10
+        assert built.text.endswith("使用者：最新的問題\n助理：")
+        assert "這是一段對話內容9" in built.text
+
+    def test_short_context_is_unchanged(self):
+        """測試：預算足夠時保留最近 10 則對話且不截斷"""
+        # Arrange
+        builder = ContextBuilder(max_tokens=2000)
+
+        # Act
+        built = builder.build("u1", "系統提示", make_history(3), "你好")
+
+        # Assert
+        assert built.history_turns == 3
+        assert built.truncated is False
+        assert builder.stats()["requests"] == 1
+        assert builder.stats()["peak_tokens"] == built.tokens
+
+
+class TestRollingSummary:
+    """測試滾動摘要"""
+
+    def test_old_turns_are_folded_into_summary(self):
+        """測試：放不進上下文的舊對話累積到批次數量後併入摘要"""
+        # Arrange
+        folded = []
+
+        def summarizer(previous, turns):
+            folded.append([conv['turn'] for conv in turns])
+            return previous + "".join(f"[{conv['turn']}]" for conv in turns)
+
+        builder = ContextBuilder(max_turns=2, summary_batch=3, summarizer=summarizer)
+
+        # Act
+        builder.build("u1", "系統", make_history(4), "問題")
+        builder.build("u1", "系統", make_history(5), "問題")
+        built = builder.build("u1", "系統", make_history(5), "問題")
+
+        # Assert
+        assert folded == [[0, 1, 2]]
+        assert builder.summary("u1") == "[0][1][2]"
+        assert "先前對話摘要：[0][1][2]" in built.text
+
+    def test_refresh_is_submitted_off_the_hot_path(self):
+        """測試：摘要更新交給背景執行，執行前不會重複排程"""
+        # Arrange
+        submitted = []
+        builder = ContextBuilder(max_turns=1, summary_batch=1,
+                                 summarizer=lambda previous, turns: "摘要",
+                                 submit=lambda name, fn, *args: submitted.append((fn, args)))
+
+        # Act
+        builder.build("u1", "系統", make_history(3), "問題")
+        builder.build("u1", "系統", make_history(3), "問題")
+
+        # Assert
+        assert len(submitted) == 1
+        assert builder.summary("u1") == ""
+        fn, args = submitted[0]
+        fn(*args)
+        assert builder.summary("u1") == "摘要"
+
+    def test_dropped_refresh_can_be_retried(self):
+        """測試：背景佇列已滿時，下一次請求重新排程"""
+        # Arrange
+        attempts = []
+
+        def full_queue(name, fn, *args):
+            attempts.append(name)
+            return False
+
+        builder = ContextBuilder(max_turns=1, summary_batch=1, submit=full_queue)
+
+        # Act
+        builder.build("u1", "系統", make_history(3), "問題")
+        builder.build("u1", "系統", make_history(3), "問題")
+
+        # Assert
+        assert len(attempts) == 2
+
+    def test_clear_discards_in_flight_summary(self):
+        """測試：清除歷史後，進行中的摘要結果被丟棄"""
+        # Arrange
+        submitted = []
+        builder = ContextBuilder(max_turns=1, summary_batch=1,
+                                 summarizer=lambda previous, turns: "舊摘要",
+                                 submit=lambda name, fn, *args: submitted.append((fn, args)))
+        builder.build("u1", "系統", make_history(3), "問題")
+
+        # Act
+        builder.clear("u1")
+        fn, args = submitted[0]
+        fn(*args)
+
+        # Assert
+        assert builder.summary("u1") == ""
+
+    def test_stateless_history_creates_no_summary_state(self):
+        """測試：呼叫端自帶歷史（沒有 turn 編號）時不建立也不排程摘要"""
+        # Arrange
+        submitted = []
+        builder = ContextBuilder(max_turns=1, summary_batch=1,
+                                 submit=lambda name, fn, *args: submitted.append(name))
+        history = [{'user': f"問題{i}", 'assistant': f"回覆{i}"} for i in range(5)]
+
+        # Act
+        for i in range(20):
+            built = builder.build(f"chat:u{i}", "系統", history, "問題", summarize=False)
+
+        # Assert
+        assert submitted == []
+        assert builder.stats()["summaries"] == 0
+        assert built.history_turns == 1
+
+    def test_summaries_are_bounded(self):
+        """測試：摘要數量超過上限時移除最久沒用到的使用者"""
+        # Arrange
+        builder = ContextBuilder(max_turns=1, summary_batch=1, max_summaries=2,
+                                 summarizer=lambda previous, turns: "摘要")
+
+        # Act
+        builder.build("u1", "系統", make_history(3), "問題")
+        builder.build("u2", "系統", make_history(3), "問題")
+        builder.build("u1", "系統", make_history(3), "問題")
+        builder.build("u3", "系統", make_history(3), "問題")
+
+        # Assert
+        stats = builder.stats()
+        assert stats["summaries"] == 2
+        assert stats["summaries_evicted"] == 1
+        assert builder.summary("u1") == "摘要"
+        assert builder.summary("u2") == ""
+
+
+class TestCruzPromptBudget:
+    """測試 CRUZ 提示詞依段落分配預算"""
+
+    @pytest.mark.parametrize("message", ["創業好難", "cruz 你覺得 AI 會取代人嗎"])
+    def test_instructions_survive_system_budget(self, message):
+        """測試：語料很長時只縮短語料，人格描述與結尾指示完整保留"""
+        # Arrange
+        persona = CruzPersonaSystem()
+        persona.save_corpus = lambda: None  # 不寫回語料檔
+        builder = ContextBuilder(max_system_tokens=800)
+
+        # Act
+        prompt = persona.generate_cruz_prompt(message, max_tokens=800)
+        built = builder.build("u1", prompt, [], message)
+
+        # Assert
+        assert estimate_tokens(prompt) <= 800
+        assert prompt.startswith("你是 CRUZ")
+        assert "【相關語料參考】" in prompt
+        assert "基於以上語料，用 CRUZ 的方式回應" in built.text
+        assert CRUZ_CLOSING in built.text
+        assert not built.truncated
+
+    def test_tiny_budget_drops_quotes(self):
+        """測試：預算放不下語料時整段省略，指示仍然保留"""
+        # Arrange
+        persona = CruzPersonaSystem()
+        persona.save_corpus = lambda: None
+
+        # Act
+        prompt = persona.generate_cruz_prompt("創業好難", max_tokens=100)
+
+        # Assert
+        assert "【相關語料參考】" not in prompt
+        assert prompt.endswith("用溫暖的方式鼓勵他人")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,225 @@
+"""
+對話歷史儲存的測試案例
+確保記憶體用量有上限，被移出的使用者存到 SQLite 後能自動載回
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_store import ConversationStore, SQLiteSpillStore, estimate_turn_bytes
+
+
+class FakeClock:
+    """可手動前進的時鐘"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def spill(tmp_path):
+    store = SQLiteSpillStore(str(tmp_path / "history.sqlite3"))
+    yield store
+    store.close()
+
+
+class BlockingSpill:
+    """指定的操作會等到 release 才繼續的 spill"""
+
+    def __init__(self, spill, blocking=("save", "load")):
+        self.spill = spill
+        self.blocking = blocking
+        self.path = spill.path
+        self.release = threading.Event()
+        self.entered = threading.Event()
+
+    def _wait(self, operation):
+        if operation in self.blocking:
+            self.entered.set()
+            self.release.wait(5)
+
+    def save(self, user_id, turns):
+        self._wait("save")
+        self.spill.save(user_id, turns)
+
+    def load(self, user_id):
+        self._wait("load")
+        return self.spill.load(user_id)
+
+    def delete(self, user_id):
+        self.spill.delete(user_id)
+
+
+class TestConversationStore:
+    """測試記憶體中的對話歷史"""
+
+    def test_turns_are_numbered_and_capped(self):
+        """測試：turn 編號遞增，且每位使用者最多保留 max_turns 則"""
+        # Arrange
+        store = ConversationStore(max_turns=3)
+
+        # Act
+        for i in range(5):
+            store.append("u1", f"問題{i}", f"回覆{i}")
+
+        # Assert
+        history = store.get("u1")
+        assert [turn['turn'] for turn in history] == [2, 3, 4]
+        assert store.stats()["bytes"] == sum(estimate_turn_bytes(turn) for turn in history)
+
+    def test_least_recently_used_user_is_evicted_over_budget(self):
+        """測試：超過記憶體預算時移出最久沒用到的使用者"""
+        # Arrange
+        turn_bytes = estimate_turn_bytes({'user': "問題", 'assistant': "回覆"})
+        evicted = []
+        store = ConversationStore(max_bytes=turn_bytes * 2, on_evict=evicted.append)
+        store.append("u1", "問題", "回覆")
+        store.append("u2", "問題", "回覆")
+        store.get("u1")
+
+        # Act
+        store.append("u3", "問題", "回覆")
+
+        # Assert
+        assert evicted == ["u2"]
+        assert "u1" in store and "u3" in store and "u2" not in store
+        assert store.stats()["lru_evictions"] == 1
+
+    def test_idle_users_are_evicted(self):
+        """測試：閒置超過 TTL 的使用者被移出"""
+        # Arrange
+        clock = FakeClock()
+        store = ConversationStore(idle_ttl=60, clock=clock)
+        store.append("u1", "問題", "回覆")
+
+        # Act
+        clock.now = 61
+        store.append("u2", "問題", "回覆")
+
+        # Assert
+        assert "u1" not in store
+        assert store.stats()["idle_evictions"] == 1
+
+    def test_missing_user_has_empty_history(self):
+        """測試：沒有對話的使用者回傳空列表，且不佔用記憶體"""
+        # Arrange
+        store = ConversationStore()
+
+        # Act & Assert
+        assert store.get("unknown") == []
+        assert len(store) == 0
+
+
+class TestSpill:
+    """測試移出到 SQLite 與載回"""
+
+    def test_evicted_user_is_rehydrated(self, spill):
+        """測試：被移出的使用者下次對話時自動載回，turn 編號接續"""
+        # Arrange
+        clock = FakeClock()
+        store = ConversationStore(idle_ttl=60, spill=spill, clock=clock)
+        store.append("u1", "我叫小明", "你好小明")
+        clock.now = 61
+        store.append("u2", "問題", "回覆")
+
+        # Act
+        history = store.get("u1")
+        turn = store.append("u1", "我叫什麼", "你叫小明")
+
+        # Assert
+        assert history[0]['user'] == "我叫小明"
+        assert turn['turn'] == 1
+        assert store.stats()["spilled"] == 1
+        assert store.stats()["rehydrated"] == 1
+        assert spill.count() == 0
+
+    def test_clear_removes_spilled_history(self, spill):
+        """測試：清除歷史時一併刪除磁碟上的對話"""
+        # Arrange
+        spill.save("u1", [{'turn': 0, 'user': "問題", 'assistant': "回覆"}])
+        store = ConversationStore(spill=spill)
+
+        # Act
+        store.clear("u1")
+
+        # Assert
+        assert store.get("u1") == []
+
+    def test_expired_spill_is_ignored(self, tmp_path):
+        """測試：超過保存期限的對話不會載回"""
+        # Arrange
+        clock = FakeClock()
+        spill = SQLiteSpillStore(str(tmp_path / "history.sqlite3"), ttl_seconds=100, clock=clock)
+        spill.save("u1", [{'turn': 0, 'user': "問題", 'assistant': "回覆"}])
+
+        # Act
+        clock.now = 101
+        turns = spill.load("u1")
+
+        # Assert
+        assert turns is None
+        spill.close()
+
+
+class TestSpillConcurrency:
+    """測試 spill 的磁碟 I/O 不會擋住其他使用者"""
+
+    def test_slow_rehydrate_does_not_block_other_users(self, spill):
+        """測試：一位使用者從磁碟載回時，其他使用者的讀寫照常進行"""
+        # Arrange
+        spill.save("u1", [{'turn': 0, 'user': "我叫小明", 'assistant': "你好小明"}])
+        blocking = BlockingSpill(spill, blocking=())
+        store = ConversationStore(spill=blocking)
+        store.append("u2", "問題", "回覆")
+        blocking.blocking = ("load",)
+        loader = threading.Thread(target=store.get, args=("u1",))
+        loader.start()
+        blocking.entered.wait(2)
+
+        # Act
+        start = time.monotonic()
+        store.append("u2", "第二個問題", "第二個回覆")
+        history = store.get("u2")
+        elapsed = time.monotonic() - start
+        blocking.release.set()
+        loader.join(2)
+
+        # Assert
+        assert elapsed < 0.5
+        assert len(history) == 2
+        assert store.get("u1")[0]['user'] == "我叫小明"
+
+    def test_user_returning_during_spill_keeps_history(self, spill):
+        """測試：移出的對話還在寫入時使用者又回來，直接取回記憶體中的對話"""
+        # Arrange
+        clock = FakeClock()
+        blocking = BlockingSpill(spill, blocking=("save",))
+        store = ConversationStore(idle_ttl=60, spill=blocking, clock=clock)
+        store.append("u1", "我叫小明", "你好小明")
+        clock.now = 61
+        evictor = threading.Thread(target=store.append, args=("u2", "問題", "回覆"))
+        evictor.start()
+        blocking.entered.wait(2)
+
+        # Act
+        start = time.monotonic()
+        history = store.get("u1")
+        elapsed = time.monotonic() - start
+        blocking.release.set()
+        evictor.join(2)
+
+        # Assert
+        assert elapsed < 0.5
+        assert history[0]['user'] == "我叫小明"
+        assert store.stats()["rehydrated"] == 1
+        assert store.stats()["pending_spills"] == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,212 @@
+"""
+fork 安全工具的測試案例
+確保共用 JSON 只解析一次，且 fork 後的子程序能重建執行緒與鎖
+"""
+import pytest
+import sys
+import os
+import json
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fork_safety
+from worker_pool import BoundedWorkerPool
+
+
+class TestSharedJson:
+    """測試共用 JSON 快取"""
+
+    def test_same_file_returns_same_object(self, tmp_path):
+        """測試：同一個檔案只解析一次，多個載入者拿到同一份物件"""
+        # Arrange
+        path = tmp_path / "corpus.json"
+        path.write_text(json.dumps({"quotes": [1, 2]}), encoding="utf-8")
+
+        # Act
+        first = fork_safety.load_shared_json(str(path))
+        second = fork_safety.load_shared_json(str(path))
+
+        # Assert
+        assert first is second
+        assert first["quotes"] == [1, 2]
+
+    def test_modified_file_is_reloaded(self, tmp_path):
+        """測試：檔案被外部修改後重新解析"""
+        # Arrange
+        path = tmp_path / "corpus.json"
+        path.write_text(json.dumps({"version": 1}), encoding="utf-8")
+        first = fork_safety.load_shared_json(str(path))
+
+        # Act
+        path.write_text(json.dumps({"version": 2}), encoding="utf-8")
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        second = fork_safety.load_shared_json(str(path))
+
+        # Assert
+        assert first["version"] == 1
+        assert second["version"] == 2
+
+    def test_remember_keeps_saved_object(self, tmp_path):
+        """測試：寫回檔案後，下一個載入者拿到同一份物件"""
+        # Arrange
+        path = tmp_path / "corpus.json"
+        path.write_text(json.dumps({"quotes": []}), encoding="utf-8")
+        data = fork_safety.load_shared_json(str(path))
+        data["quotes"].append("new")
+
+        # Act
+        path.write_text(json.dumps(data), encoding="utf-8")
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        fork_safety.remember_shared_json(str(path), data)
+
+        # Assert
+        assert fork_safety.load_shared_json(str(path)) is data
+
+    def test_missing_file_uses_default(self, tmp_path):
+        """測試：檔案不存在時使用預設值，未提供預設值則拋出例外"""
+        # Arrange
+        path = str(tmp_path / "missing.json")
+
+        # Act & Assert
+        assert fork_safety.load_shared_json(path, dict) == {}
+        with pytest.raises(FileNotFoundError):
+            fork_safety.load_shared_json(path)
+
+
+class TestSharedCorpus:
+    """測試共用語料庫維持唯讀"""
+
+    @pytest.fixture
+    def corpus_dir(self, tmp_path, monkeypatch):
+        corpus = {
+            "metadata": {"version": "1.0", "total_quotes": 1},
+            "traits": {},
+            "quotes": [{"id": 1, "content": "創業就是不斷解決問題", "date": "2024-01-01",
+                        "context": "創業", "tags": ["創業"], "usage_count": 2}],
+            "reviewed_responses": []
+        }
+        (tmp_path / "data").mkdir()
+        (tmp_path / "data" / "cruz_corpus.json").write_text(json.dumps(corpus, ensure_ascii=False),
+                                                           encoding="utf-8")
+        monkeypatch.chdir(tmp_path)
+        return tmp_path
+
+    def test_usage_counts_do_not_touch_shared_corpus(self, corpus_dir):
+        """測試：使用次數記在各自的實例中，寫檔時才合併，其他使用者的資料不變"""
+        # Arrange
+        from cruz_persona_system import CruzPersonaSystem
+        first = CruzPersonaSystem()
+        second = CruzPersonaSystem()
+        shared = second.corpus
+
+        # Act
+        results = first.search_relevant_quotes("創業")
+        first.save_corpus()
+
+        # Assert
+        saved = json.loads((corpus_dir / "data" / "cruz_corpus.json").read_text(encoding="utf-8"))
+        assert results[0]["usage_count"] == 3
+        assert shared["quotes"][0]["usage_count"] == 2
+        assert second.corpus is shared
+        assert saved["quotes"][0]["usage_count"] == 3
+
+    def test_memory_sync_copies_before_writing(self, corpus_dir):
+        """測試：對話記憶同步新增語料時不修改共用的那份"""
+        # Arrange
+        from cruz_persona_system import CruzPersonaSystem
+        from conversation_memory_sync import ConversationMemorySync
+        persona = CruzPersonaSystem()
+        sync = ConversationMemorySync()
+        quotes_before = len(persona.corpus["quotes"])
+
+        # Act
+        sync.conversation_buffer = [{"timestamp": "", "speaker": "Cruz", "context": "開發對話",
+                                     "message": "我覺得創業最重要的是先做出能用的東西，再慢慢優化"}]
+        sync.process_and_save_conversations()
+
+        # Assert
+        assert len(persona.corpus["quotes"]) == quotes_before
+        assert "development_conversations" not in persona.corpus
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 os.fork")
+class TestForkHooks:
+    """測試 fork 前後的回呼"""
+
+    def _run_in_child(self, fn) -> int:
+        """在子程序執行 fn，回傳結束碼"""
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = 0 if fn() else 1
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        return os.waitstatus_to_exitcode(status)
+
+    def test_hooks_run_around_fork(self, tmp_path):
+        """測試：before 在父程序執行，after_in_child 只在子程序執行"""
+        # Arrange
+        calls = []
+        marker = tmp_path / "child"
+
+        class Resource:
+            def close(self):
+                calls.append("before")
+
+            def reset(self):
+                marker.write_text(str(os.getpid()))
+
+        resource = Resource()
+        fork_safety.register_fork_hooks(before=resource.close, after_in_child=resource.reset)
+
+        # Act
+        code = self._run_in_child(lambda: True)
+
+        # Assert
+        assert code == 0
+        assert calls == ["before"]
+        assert marker.read_text() != str(os.getpid())
+
+    def test_worker_pool_restarts_in_child(self):
+        """測試：父程序已啟動的執行緒池，在子程序中仍能執行工作"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=1, max_queue_size=10, name="fork-test")
+        pool.submit(lambda: None)
+
+        def child():
+            import threading
+            done = threading.Event()
+            return pool.submit(done.set) and done.wait(5)
+
+        # Act
+        code = self._run_in_child(child)
+
+        # Assert
+        assert code == 0
+        pool.shutdown()
+
+    def test_collected_owner_hook_is_dropped(self):
+        """測試：物件被回收後，它註冊的 hook 不再執行"""
+        # Arrange
+        calls = []
+
+        class Resource:
+            def close(self):
+                calls.append("closed")
+
+        resource = Resource()
+        fork_safety.register_fork_hooks(before=resource.close)
+        del resource
+
+        # Act
+        code = self._run_in_child(lambda: True)
+
+        # Assert
+        assert code == 0
+        assert calls == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,189 @@
+"""
+Gemini 對沖請求與重試的測試案例
+確保慢請求會被對沖、暫時性錯誤會重試，且重試預算能擋住流量放大
+"""
+import pytest
+import sys
+import os
+import asyncio
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_limiter import GeminiCallLimiter
+from gemini_hedging import GeminiHedger, RetryBudget, is_retryable_error
+
+
+class ServiceUnavailable(Exception):
+    """模擬 google.api_core 的 503 錯誤"""
+
+
+def make_hedger(**kwargs) -> GeminiHedger:
+    options = dict(hedging_enabled=True, min_samples=5, base_delay=0.001, rng=lambda: 1.0)
+    options.update(kwargs)
+    return GeminiHedger(GeminiCallLimiter(max_concurrent=4, timeout=5), **options)
+
+
+def warm_up(hedger: GeminiHedger, latency: float = 0.01, samples: int = 5):
+    """放入延遲樣本，讓對沖門檻生效"""
+    for _ in range(samples):
+        hedger.metrics.record("model", latency)
+
+
+class TestRetryBudget:
+    """測試重試預算"""
+
+    def test_budget_runs_out_without_deposits(self):
+        """測試：沒有正常請求存入時，預算用完就拒絕"""
+        # Arrange
+        budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2, clock=lambda: 0.0)
+
+        # Act
+        results = [budget.try_spend() for _ in range(3)]
+
+        # Assert
+        assert results == [True, True, False]
+        assert budget.stats()["exhausted"] == 1
+
+    def test_requests_deposit_tokens(self):
+        """測試：每個正常請求存入 ratio 個 token"""
+        # Arrange
+        budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2, clock=lambda: 0.0)
+        budget.try_spend()
+        budget.try_spend()
+
+        # Act
+        budget.record_request()
+        budget.record_request()
+
+        # Assert
+        assert budget.try_spend() is True
+        assert budget.try_spend() is False
+
+
+class TestSyncHedging:
+    """測試同步呼叫的對沖與重試"""
+
+    def test_slow_primary_is_hedged(self):
+        """測試：第一個請求超過延遲百分位時送出對沖請求，取先回來的結果"""
+        # Arrange
+        hedger = make_hedger()
+        warm_up(hedger)
+        calls = []
+        release = threading.Event()
+
+        def generate_content(contents, request_options=None):
+            calls.append(contents)
+            if len(calls) == 1:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        # Act
+        result = hedger.call("model", generate_content, "hi", deadline=time.monotonic() + 5)
+        release.set()
+
+        # Assert
+        assert result == "fast"
+        assert hedger.hedges == 1
+        assert hedger.hedge_wins == 1
+
+    def test_no_hedge_without_enough_samples(self):
+        """測試：延遲樣本不足時不對沖"""
+        # Arrange
+        hedger = make_hedger(min_samples=50)
+        warm_up(hedger)
+
+        # Act
+        result = hedger.call("model", lambda contents, request_options=None: contents,
+                             "hi", deadline=time.monotonic() + 5)
+
+        # Assert
+        assert result == "hi"
+        assert hedger.hedge_delay("model") is None
+        assert hedger.hedges == 0
+
+    def test_retryable_error_is_retried(self):
+        """測試：暫時性錯誤以退避重試後成功"""
+        # Arrange
+        hedger = make_hedger(hedging_enabled=False)
+        attempts = []
+
+        def generate_content(contents, request_options=None):
+            attempts.append(contents)
+            if len(attempts) < 3:
+                raise ServiceUnavailable("503")
+            return "ok"
+
+        # Act
+        result = hedger.call("model", generate_content, "hi", deadline=time.monotonic() + 5)
+
+        # Assert
+        assert result == "ok"
+        assert len(attempts) == 3
+        assert hedger.retries == 2
+
+    def test_exhausted_budget_stops_retries(self):
+        """測試：重試預算用完時直接拋出錯誤"""
+        # Arrange
+        budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=1, clock=lambda: 0.0)
+        hedger = make_hedger(hedging_enabled=False, budget=budget, max_retries=5)
+        attempts = []
+
+        def generate_content(contents, request_options=None):
+            attempts.append(contents)
+            raise ServiceUnavailable("503")
+
+        # Act & Assert
+        with pytest.raises(ServiceUnavailable):
+            hedger.call("model", generate_content, "hi", deadline=time.monotonic() + 5)
+        assert len(attempts) == 2
+
+    def test_non_retryable_error_is_raised(self):
+        """測試：非暫時性錯誤不重試"""
+        # Arrange
+        hedger = make_hedger(hedging_enabled=False)
+
+        def generate_content(contents, request_options=None):
+            raise ValueError("bad request")
+
+        # Act & Assert
+        assert not is_retryable_error(ValueError("bad request"))
+        with pytest.raises(ValueError):
+            hedger.call("model", generate_content, "hi", deadline=time.monotonic() + 5)
+        assert hedger.retries == 0
+
+
+class TestAsyncHedging:
+    """測試非同步呼叫的對沖"""
+
+    def test_losing_request_is_cancelled(self):
+        """測試：對沖請求先回來時取消較慢的請求"""
+        # Arrange
+        hedger = make_hedger()
+        warm_up(hedger)
+        cancelled = []
+        calls = []
+
+        async def generate_content_async(contents, request_options=None):
+            calls.append(contents)
+            if len(calls) == 1:
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append("primary")
+                    raise
+            return "fast"
+
+        # Act
+        result = asyncio.run(hedger.call_async("model", generate_content_async, "hi",
+                                               deadline=time.monotonic() + 5))
+
+        # Assert
+        assert result == "fast"
+        assert cancelled == ["primary"]
+        assert hedger.hedge_wins == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,126 @@
+"""
+Gemini 併發限制器的測試案例
+確保同時進行的呼叫數量有上限，且超過期限的呼叫會被取消
+"""
+import pytest
+import sys
+import os
+import asyncio
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_limiter import GeminiCallLimiter, GeminiOverloadedError, is_timeout_error
+
+
+class TestSyncCalls:
+    """測試同步呼叫"""
+
+    def test_timeout_is_passed_as_request_options(self):
+        """測試：期限透過 request_options 傳給 SDK"""
+        # Arrange
+        limiter = GeminiCallLimiter(max_concurrent=2, timeout=10)
+        received = {}
+
+        def generate_content(contents, request_options=None):
+            received["options"] = request_options
+            return "ok"
+
+        # Act
+        result = limiter.call(generate_content, "hi", timeout=3)
+
+        # Assert
+        assert result == "ok"
+        assert received["options"] == {"timeout": 3}
+
+    def test_concurrency_is_capped(self):
+        """測試：名額用完時後來的呼叫排隊，等不到就拒絕"""
+        # Arrange
+        limiter = GeminiCallLimiter(max_concurrent=1, timeout=10, queue_timeout=0.05)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_call(request_options=None):
+            started.set()
+            release.wait(5)
+
+        worker = threading.Thread(target=limiter.call, args=(slow_call,))
+        worker.start()
+        started.wait(5)
+
+        # Act & Assert
+        with pytest.raises(GeminiOverloadedError):
+            limiter.call(lambda request_options=None: None)
+        release.set()
+        worker.join(5)
+        assert limiter.stats()["rejected"] == 1
+        assert limiter.stats()["in_flight"] == 0
+
+    def test_remaining_never_exceeds_call_timeout(self):
+        """測試：剩餘時間不超過單次期限，過期則為 0"""
+        # Arrange
+        limiter = GeminiCallLimiter(timeout=5)
+        now = time.monotonic()
+
+        # Act & Assert
+        assert limiter.remaining(None) == 5
+        assert limiter.remaining(now + 60) == 5
+        assert limiter.remaining(now - 1) == 0
+
+
+class TestAsyncCalls:
+    """測試非同步呼叫"""
+
+    def test_slow_call_is_cancelled_at_deadline(self):
+        """測試：超過期限的呼叫被取消並拋出逾時"""
+        # Arrange
+        limiter = GeminiCallLimiter(max_concurrent=2, timeout=10)
+        cancelled = []
+
+        async def generate_content_async(contents, request_options=None):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(contents)
+                raise
+
+        # Act
+        with pytest.raises(asyncio.TimeoutError) as exc_info:
+            asyncio.run(limiter.call_async(generate_content_async, "hi", timeout=0.05))
+
+        # Assert
+        assert cancelled == ["hi"]
+        assert is_timeout_error(exc_info.value)
+        assert limiter.stats()["timeouts"] == 1
+        assert limiter.stats()["in_flight"] == 0
+
+    def test_async_concurrency_is_capped(self):
+        """測試：同時進行的非同步呼叫不超過上限"""
+        # Arrange
+        limiter = GeminiCallLimiter(max_concurrent=2, timeout=10, queue_timeout=5)
+        active = []
+        peak = []
+
+        async def generate_content_async(contents, request_options=None):
+            active.append(contents)
+            peak.append(len(active))
+            await asyncio.sleep(0.01)
+            active.remove(contents)
+            return contents
+
+        async def run_all():
+            return await asyncio.gather(*[
+                limiter.call_async(generate_content_async, i) for i in range(6)
+            ])
+
+        # Act
+        results = asyncio.run(run_all())
+
+        # Assert
+        assert results == list(range(6))
+        assert max(peak) == 2
+        assert limiter.stats()["peak_in_flight"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
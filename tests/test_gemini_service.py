@@ -0,0 +1,276 @@
+"""
+GeminiService 的測試案例
+以離線替身模型執行完整的回應流程，確保語意快取不會跨對話歷史共用回應
+"""
+import pytest
+import sys
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from gemini_standin import StandinModel, SyntheticBackend
+from semantic_cache import SemanticResponseCache
+
+GENERIC_ERROR_REPLY = "抱歉，我現在無法回應您的訊息。請稍後再試。"
+
+
+class CountingModel:
+    """轉交給替身模型，並記錄每次 generate_content 的內容"""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = []
+
+    def generate_content(self, contents, **kwargs):
+        self.calls.append(contents)
+        return self.model.generate_content(contents, **kwargs)
+
+    async def generate_content_async(self, contents, **kwargs):
+        self.calls.append(contents)
+        return await self.model.generate_content_async(contents, **kwargs)
+
+
+@pytest.fixture
+def make_service(monkeypatch, tmp_path):
+    """建立使用替身模型、不連網路的 GeminiService；參數覆寫 Config"""
+    def factory(**config):
+        monkeypatch.setattr(Config, "CONVERSATION_SPILL_PATH", str(tmp_path / "history.sqlite3"))
+        monkeypatch.setattr(Config, "CONTEXT_SUMMARY_MODE", "local")
+        for name, value in config.items():
+            monkeypatch.setattr(Config, name, value)
+        from gemini_service import GeminiService
+        service = GeminiService()
+        service.calendar_service = None
+        backend = SyntheticBackend(latency_ms=0, function_call_rate=0.0, rng=random.Random(1))
+        service.model = CountingModel(StandinModel("gemini-test", backend,
+                                                   tools=service._get_calendar_tools()))
+        return service
+    return factory
+
+
+def broken_embedder(text):
+    raise RuntimeError("embedding API unavailable")
+
+
+class BrokenCache:
+    """查詢與儲存都失敗的快取"""
+
+    def get(self, scope, message):
+        raise TypeError("broken cache")
+
+    def put(self, scope, message, response, latency=0.0):
+        raise TypeError("broken cache")
+
+
+class TestSemanticCacheScope:
+    """測試語意快取的分區"""
+
+    def test_users_with_different_history_do_not_share_answers(self, make_service):
+        """測試：接續不同對話的相同追問不會拿到另一位使用者的回答"""
+        # Arrange
+        service = make_service(SEMANTIC_CACHE_ENABLED=True, INTENT_ROUTER_ENABLED=False)
+        service._save_conversation("Ua", "介紹一下 Python", "Python 是一種程式語言")
+        service._save_conversation("Ub", "我最近在考慮換工作", "可以先想想你最在意的是什麼")
+
+        # Act
+        service.get_response("Ua", "為什麼？")
+        service.get_response("Ub", "為什麼？")
+
+        # Assert
+        assert len(service.model.calls) == 2
+        assert service.semantic_cache.stats()["hits"] == 0
+
+    def test_users_without_history_share_answers(self, make_service):
+        """測試：沒有對話歷史的相同問題仍然共用快取"""
+        # Arrange
+        service = make_service(SEMANTIC_CACHE_ENABLED=True, INTENT_ROUTER_ENABLED=False)
+
+        # Act
+        first = service.get_response("Ua", "量子力學是什麼")
+        second = service.get_response("Ub", "量子力學是什麼")
+
+        # Assert
+        assert second == first
+        assert len(service.model.calls) == 1
+        assert service.semantic_cache.stats()["hits"] == 1
+
+    @pytest.mark.parametrize("embedder", [lambda text: None, broken_embedder])
+    def test_broken_embedder_does_not_fail_the_reply(self, make_service, embedder):
+        """測試：快取的向量計算失敗時照常由 Gemini 回答"""
+        # Arrange
+        service = make_service(INTENT_ROUTER_ENABLED=False)
+        service.semantic_cache = SemanticResponseCache(embedder=embedder, sample_rate=0)
+
+        # Act
+        replies = [service.get_response("Ua", "量子力學是什麼"),
+                   service.get_response("Ub", "量子力學是什麼呢")]
+
+        # Assert
+        assert len(service.model.calls) == 2
+        assert GENERIC_ERROR_REPLY not in replies
+
+    def test_cache_errors_do_not_fail_the_reply(self, make_service):
+        """測試：快取查詢或儲存拋出例外時照常由 Gemini 回答"""
+        # Arrange
+        service = make_service(INTENT_ROUTER_ENABLED=False)
+        service.semantic_cache = BrokenCache()
+
+        # Act
+        reply = service.get_response("Ua", "量子力學是什麼")
+
+        # Assert
+        assert reply != GENERIC_ERROR_REPLY
+        assert len(service.model.calls) == 1
+
+
+class FailingModel:
+    """每次呼叫都失敗的模型"""
+
+    def generate_content(self, contents, **kwargs):
+        raise ValueError("model unavailable")
+
+
+class TestElementPerUser:
+    """測試五行元素只存在使用者狀態中"""
+
+    def test_element_trigger_does_not_switch_shared_agent(self, make_service):
+        """測試：一位使用者要求某個角色，不會改變共用 agent 或其他使用者的元素"""
+        # Arrange
+        service = make_service(SEMANTIC_CACHE_ENABLED=False, INTENT_ROUTER_ENABLED=False)
+
+        # Act
+        service.get_response("Ua", "請測試專員幫我看看這段程式")
+        service.get_response("Ub", "今天天氣如何")
+
+        # Assert
+        assert service.sessions.get("Ua").element == "水"
+        assert service.sessions.get("Ub").element is None
+        assert service.five_elements.current_role is None
+
+    def test_error_metrics_use_the_users_element(self, make_service):
+        """測試：錯誤計入發生錯誤的使用者目前的元素"""
+        # Arrange
+        service = make_service(SEMANTIC_CACHE_ENABLED=False, INTENT_ROUTER_ENABLED=False)
+        service.sessions.update("Ua", lambda s: service._apply_triggers(s, False, "水"))
+        service.model = FailingModel()
+
+        # Act
+        reply = service.get_response("Ua", "你好")
+
+        # Assert
+        assert reply
+        assert service.five_elements.element_health["水"]["errors"] == 1
+        assert service.five_elements.element_health["火"]["errors"] == 0
+
+
+class ConcurrentCalendar:
+    """兩個查詢同時進行時才會回應的日曆"""
+
+    def __init__(self):
+        self.barrier = threading.Barrier(2, timeout=2)
+
+    def list_events(self, max_results=10, time_min=None):
+        self.barrier.wait()
+        return {"success": True, "events": []}
+
+
+class TestToolConcurrency:
+    """測試工具的並行與排隊"""
+
+    def test_calendar_tools_run_in_parallel(self, make_service):
+        """測試：日曆工具不再共用一把鎖，可以同時執行"""
+        # Arrange
+        service = make_service()
+        service.calendar_service = ConcurrentCalendar()
+        calls = [SimpleNamespace(name="list_calendar_events", args={}) for _ in range(2)]
+
+        # Act
+        results = service.tool_executor.run_all(service._tool_calls(calls, "Ua"),
+                                                time.monotonic() + 5)
+
+        # Assert
+        assert [result["success"] for result in results] == [True, True]
+
+    def test_locked_tool_gives_up_at_its_timeout(self, make_service):
+        """測試：同群組的工具卡住時，後來的工具等到期限就回傳錯誤，不會一直排隊"""
+        # Arrange
+        service = make_service()
+        call = SimpleNamespace(name="quantum_search", args={"query": "量子"})
+        lock = service._tool_locks["quantum"]
+        lock.acquire()
+
+        # Act
+        try:
+            start = time.monotonic()
+            result = service._handle_function_call(call, "Ua", time.monotonic() + 0.1)
+            elapsed = time.monotonic() - start
+        finally:
+            lock.release()
+
+        # Assert
+        assert result["success"] is False
+        assert elapsed < 1
+
+
+class BrokenCalendar:
+    """查詢行程一律失敗的日曆"""
+
+    def list_events(self, max_results=10, time_min=None):
+        return {"error": "calendar down"}
+
+
+class FakeMemory:
+    """記錄搜尋關鍵詞的人格記憶"""
+
+    def __init__(self, crystals):
+        self.crystals = crystals
+        self.searched = []
+
+    def find_resonating_crystals(self, keywords, threshold=0.3):
+        self.searched.append(keywords)
+        return self.crystals
+
+
+class TestIntentRouting:
+    """測試直接執行工具的路由"""
+
+    def test_failed_routed_tool_falls_back_to_gemini(self, make_service):
+        """測試：路由的工具失敗時（即使有訊息）改由 Gemini 回答，並記錄 fallback"""
+        # Arrange
+        service = make_service(SEMANTIC_CACHE_ENABLED=False, INTENT_ROUTER_ENABLED=True,
+                               INTENT_ROUTER_SHADOW_RATE=0.0)
+        service.calendar_service = BrokenCalendar()
+
+        # Act
+        reply = service.get_response("Ua", "今天有什麼行程？")
+
+        # Assert
+        assert reply != "查詢行程失敗"
+        assert len(service.model.calls) == 1
+        stats = service.intent_router.stats()
+        assert stats["fallbacks"] == 1
+        assert stats["routed_total"] == 0
+
+    def test_quantum_search_uses_persona_memory(self, make_service):
+        """測試：量子記憶搜尋使用目前人格的記憶晶體"""
+        # Arrange
+        service = make_service()
+        memory = FakeMemory([SimpleNamespace(concept="拿鐵咖啡", stability=0.9)])
+        service.quantum_bridges["quantum_user"] = SimpleNamespace(
+            quantum_memories={"fire": memory}, _extract_keywords=lambda text: [])
+
+        # Act
+        result = service._quantum_search_handler({"query": "咖啡"}, "Ua")
+
+        # Assert
+        assert result["success"] is True
+        assert memory.searched == [["咖啡"]]
+        assert result["memories"] == [{"concept": "拿鐵咖啡", "stability": 0.9}]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
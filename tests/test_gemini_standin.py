@@ -0,0 +1,141 @@
+"""
+離線 Gemini 替身的測試案例
+確保替身回應與 SDK 介面相同、錯誤與逾時會觸發原本的重試邏輯，
+錄製的請求可以原樣回放
+"""
+import pytest
+import sys
+import os
+import asyncio
+import math
+import random
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_standin import (RecordingModel, Recorder, ReplayBackend, StandinModel, StandinResponse,
+                            SyntheticBackend, hash_embedding)
+from gemini_hedging import is_retryable_error
+from gemini_limiter import is_timeout_error
+
+TOOLS = [{"name": "list_calendar_events"}]
+
+
+def synthetic(**kwargs) -> SyntheticBackend:
+    options = dict(latency_ms=0, rng=random.Random(1))
+    options.update(kwargs)
+    return SyntheticBackend(**options)
+
+
+def function_call_names(response) -> list:
+    return [part.function_call.name for part in response.candidates[0].content.parts if part.function_call]
+
+
+class TestSyntheticBackend:
+    """測試 synthetic 模式"""
+
+    def test_routable_message_returns_function_call(self):
+        """測試：可以用工具的訊息回傳 function call，參數與意圖路由相同"""
+        # Arrange
+        model = StandinModel("gemini-test", synthetic(function_call_rate=1.0), tools=TOOLS)
+
+        # Act
+        response = model.generate_content("系統提示\n\n使用者：我明天有什麼行程？\n助理：")
+
+        # Assert
+        assert function_call_names(response) == ["list_calendar_events"]
+        assert response.candidates[0].content.parts[0].function_call.args["date"] == "tomorrow"
+
+    def test_followup_returns_text(self):
+        """測試：帶有 function response 的後續請求回傳文字"""
+        # Arrange
+        model = StandinModel("gemini-test", synthetic(), tools=TOOLS)
+        contents = [
+            {"role": "user", "parts": [{"text": "我明天有什麼行程？"}]},
+            {"role": "function", "parts": [{"function_response": {"name": "list_calendar_events",
+                                                                  "response": {}}}]}
+        ]
+
+        # Act
+        response = model.generate_content(contents)
+
+        # Assert
+        assert "list_calendar_events" in response.text
+
+    def test_errors_are_retryable(self):
+        """測試：模擬的錯誤會被視為可重試的暫時性錯誤"""
+        # Arrange
+        model = StandinModel("gemini-test", synthetic(error_rate=1.0))
+
+        # Act
+        with pytest.raises(Exception) as error:
+            model.generate_content("你好")
+
+        # Assert
+        assert is_retryable_error(error.value)
+
+    def test_latency_over_timeout_raises_deadline(self):
+        """測試：延遲超過 request_options 的期限時拋出逾時錯誤"""
+        # Arrange
+        model = StandinModel("gemini-test", synthetic(latency_ms=5000, latency_sigma=0.01))
+
+        # Act
+        with pytest.raises(Exception) as error:
+            model.generate_content("你好", request_options={"timeout": 0.01})
+
+        # Assert
+        assert is_timeout_error(error.value)
+
+    def test_stream_yields_first_chunk_then_rest(self):
+        """測試：串流的第一個 chunk 在回應中，逐一讀取後組成完整文字"""
+        # Arrange
+        model = StandinModel("gemini-test", synthetic(response_chars=60), stream_chunk_chars=10)
+
+        async def collect():
+            response = await model.generate_content_async("使用者：你好\n助理：", stream=True)
+            return response.text, [chunk.text async for chunk in response]
+
+        # Act
+        first, chunks = asyncio.run(collect())
+
+        # Assert
+        assert first == chunks[0]
+        assert len(chunks) > 1
+        assert "".join(chunks).startswith("（離線回應）你好")
+
+
+class TestRecordReplay:
+    """測試錄製與回放"""
+
+    def test_recorded_call_is_replayed(self, tmp_path):
+        """測試：錄製的請求原樣回放，其他請求從同類紀錄抽樣"""
+        # Arrange
+        path = str(tmp_path / "recordings.jsonl")
+        live = StandinModel("gemini-test", synthetic(function_call_rate=1.0), tools=TOOLS)
+        recorder = RecordingModel(live, Recorder(path))
+        recorder.generate_content("使用者：今天有什麼行程？\n助理：")
+        recorder.generate_content("使用者：你好\n助理：")
+        backend = ReplayBackend(path, rng=random.Random(1))
+        replay = StandinModel("gemini-test", backend, tools=TOOLS)
+
+        # Act
+        hit = replay.generate_content("使用者：今天有什麼行程？\n助理：")
+        miss = replay.generate_content("使用者：完全不同的問題\n助理：")
+
+        # Assert
+        assert function_call_names(hit) == ["list_calendar_events"]
+        assert isinstance(miss, StandinResponse)
+        assert backend.stats() == {"hits": 1, "misses": 1}
+
+
+def test_hash_embedding_is_stable_unit_vector():
+    """測試：相同文字得到相同的單位向量"""
+    # Act
+    vector = hash_embedding("量子記憶")
+
+    # Assert
+    assert vector == hash_embedding("量子記憶")
+    assert vector != hash_embedding("另一段文字")
+    assert math.isclose(sum(value * value for value in vector), 1.0, rel_tol=1e-6)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
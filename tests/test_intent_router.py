@@ -0,0 +1,161 @@
+"""
+本地意圖路由的測試案例
+確保意思明確的行程查詢與量子記憶請求直接對應到工具，
+新增行程、情緒抒發等訊息交回 Gemini，並正確統計準確率與省下的時間
+"""
+import pytest
+import sys
+import os
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_router import IntentRouter
+
+
+def make_router(**kwargs) -> IntentRouter:
+    return IntentRouter(now=lambda: datetime(2026, 3, 1, 9, 0), **kwargs)
+
+
+class TestCalendarRouting:
+    """測試行程查詢"""
+
+    def test_clear_query_is_routed_with_date(self):
+        """測試：明確的行程查詢直接對應到 list_calendar_events 並帶入日期"""
+        # Arrange
+        router = make_router()
+
+        # Act
+        intent = router.route("我明天有什麼行程？")
+
+        # Assert
+        assert intent.name == "list_calendar_events"
+        assert intent.args == {"date": "tomorrow", "days_ahead": 1}
+
+    def test_day_after_tomorrow_uses_iso_date(self):
+        """測試：後天轉換成實際日期"""
+        # Act
+        intent = make_router().route("後天有哪些會議？")
+
+        # Assert
+        assert intent.args == {"date": "2026-03-03", "days_ahead": 1}
+
+    def test_creating_event_goes_to_model(self):
+        """測試：新增行程需要模型解析時間，不直接執行"""
+        # Act & Assert
+        assert make_router().route("幫我安排明天下午三點開會") is None
+
+    def test_emotional_message_goes_to_model(self):
+        """測試：提到行程但在尋求建議的訊息交回模型"""
+        # Arrange
+        router = make_router()
+
+        # Act
+        intent = router.route("我好煩，明天的會議好多該怎麼辦？")
+
+        # Assert
+        assert intent is None
+        assert router.stats()["low_confidence"] == 1
+
+    def test_vague_mention_is_below_threshold(self):
+        """測試：只提到行程但沒有明確查詢時不直接執行"""
+        # Act & Assert
+        assert make_router().route("我的行程") is None
+
+
+class TestQuantumRouting:
+    """測試量子記憶"""
+
+    def test_search_extracts_query(self):
+        """測試：搜尋記憶的請求帶入查詢內容"""
+        # Act
+        intent = make_router().route("搜尋記憶：咖啡店的名字")
+
+        # Assert
+        assert intent.name == "quantum_search"
+        assert intent.args == {"query": "咖啡店的名字"}
+
+    def test_remember_question_is_left_to_gemini(self):
+        """測試：「你還記得…嗎」信心不足，預設門檻下交給 Gemini"""
+        # Arrange
+        router = make_router()
+
+        # Act
+        intent = router.route("你還記得我喜歡的咖啡嗎？")
+
+        # Assert
+        assert intent is None
+        assert router.low_confidence == 1
+
+    def test_remember_question_is_search_with_lower_threshold(self):
+        """測試：降低門檻時「你還記得…嗎」視為搜尋"""
+        # Act
+        intent = make_router(threshold=0.5).route("你還記得我喜歡的咖啡嗎？")
+
+        # Assert
+        assert intent.name == "quantum_search"
+        assert intent.args == {"query": "我喜歡的咖啡"}
+
+    def test_save_extracts_content(self):
+        """測試：要求記住的內容直接儲存"""
+        # Act
+        intent = make_router().route("記住我喜歡喝拿鐵")
+
+        # Assert
+        assert intent.name == "quantum_save"
+        assert intent.args == {"content": "我喜歡喝拿鐵"}
+
+    def test_question_about_saving_is_not_routed(self):
+        """測試：問句不會被當成要儲存的內容"""
+        # Act & Assert
+        assert make_router().route("記住了嗎？") is None
+
+
+class TestMetrics:
+    """測試路由指標"""
+
+    def test_routed_and_fallback_counts(self):
+        """測試：記錄直接執行的次數、交回模型的次數與省下的時間"""
+        # Arrange
+        router = make_router()
+        intent = router.route("今天有什麼行程？")
+
+        # Act
+        router.record_routed(intent, 1.5)
+        router.record_fallback(intent)
+
+        # Assert
+        stats = router.stats()
+        assert stats["routed"]["list_calendar_events"] == 1
+        assert stats["fallbacks"] == 1
+        assert stats["latency_saved_s"] == 1.5
+
+    def test_shadow_accuracy(self):
+        """測試：背景比對的結果計入準確率"""
+        # Arrange
+        router = make_router(shadow_rate=1.0, rng=lambda: 0.5)
+        intent = router.route("今天有什麼行程？")
+
+        # Act
+        router.record_shadow(intent, ["list_calendar_events"])
+        router.record_shadow(intent, [])
+
+        # Assert
+        assert router.should_shadow() is True
+        assert router.stats()["accuracy"] == 0.5
+
+    def test_model_choice_counts_misses(self):
+        """測試：模型選了可路由的工具時記為漏判"""
+        # Arrange
+        router = make_router()
+
+        # Act
+        router.record_model_choice(["quantum_search"])
+        router.record_model_choice(["create_calendar_event"])
+        router.record_model_choice([])
+
+        # Assert
+        assert router.stats()["missed"] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
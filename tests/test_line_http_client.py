@@ -0,0 +1,84 @@
+"""
+LINE API 連線池 client 的測試案例
+確保呼叫共用同一個 Session，並正確記錄延遲統計
+"""
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from line_http_client import HttpLatencyMetrics, PooledRequestsHttpClient, get_operation_name
+
+
+class FakeSession:
+    """記錄呼叫參數的假 Session"""
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return SimpleNamespace(status_code=self.status_code)
+
+
+class TestLineHttpClient:
+    """測試連線池 client"""
+
+    def test_operation_name_from_url(self):
+        """測試：由 URL 取得 API 名稱"""
+        assert get_operation_name("https://api.line.me/v2/bot/message/reply") == "message/reply"
+        assert get_operation_name("https://api.line.me/v2/bot/info") == "info"
+
+    def test_requests_share_session_and_record_metrics(self):
+        """測試：多次呼叫使用同一個 Session，並依 API 統計"""
+        # Arrange
+        metrics = HttpLatencyMetrics()
+        client = PooledRequestsHttpClient(timeout=(1, 2), metrics=metrics)
+        client.session = FakeSession()
+        url = "https://api.line.me/v2/bot/message/reply"
+
+        # Act
+        client.post(url, data="{}")
+        client.post(url, data="{}")
+
+        # Assert
+        assert len(client.session.calls) == 2
+        assert client.session.calls[0][2]["timeout"] == (1, 2)
+        stats = metrics.stats()["message/reply"]
+        assert stats["count"] == 2
+        assert stats["errors"] == 0
+        assert stats["last_status"] == 200
+
+    def test_error_status_counts_as_error(self):
+        """測試：4xx/5xx 回應計入錯誤數"""
+        # Arrange
+        metrics = HttpLatencyMetrics()
+        client = PooledRequestsHttpClient(metrics=metrics)
+        client.session = FakeSession(status_code=400)
+
+        # Act
+        client.post("https://api.line.me/v2/bot/message/push")
+
+        # Assert
+        assert metrics.stats()["message/push"]["errors"] == 1
+
+    def test_percentiles(self):
+        """測試：延遲百分位數計算"""
+        # Arrange
+        metrics = HttpLatencyMetrics()
+
+        # Act
+        for ms in range(1, 101):
+            metrics.record("message/reply", ms / 1000, status=200)
+
+        # Assert
+        stats = metrics.stats()["message/reply"]
+        assert stats["p50_ms"] == 51.0
+        assert stats["p95_ms"] == 96.0
+        assert stats["max_ms"] == 100.0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,118 @@
+"""
+回覆後背景管線的測試案例
+確保 deferred() 區塊內的工作等回覆送出後才執行、排隊超過預算的工作被丟棄
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from post_reply_pipeline import PostReplyPipeline
+
+
+class TestPostReplyPipeline:
+    """測試回覆後管線"""
+
+    def test_deferred_tasks_wait_until_block_exits(self):
+        """測試：區塊內提交的工作在離開區塊（回覆送出）後才執行"""
+        # Arrange
+        pipeline = PostReplyPipeline(max_workers=1, max_queue_size=10)
+        events = []
+        ran = threading.Event()
+
+        def task():
+            events.append("task")
+            ran.set()
+
+        # Act
+        with pipeline.deferred():
+            pipeline.submit("sync", task)
+            time.sleep(0.05)
+            events.append("reply_sent")
+
+        # Assert
+        assert ran.wait(5)
+        assert events == ["reply_sent", "task"]
+        pipeline.shutdown(timeout=5)
+        assert pipeline.stats()["tasks"]["sync"]["completed"] == 1
+
+    def test_tasks_outside_deferred_run_immediately(self):
+        """測試：不在區塊內時直接排入佇列"""
+        # Arrange
+        pipeline = PostReplyPipeline(max_workers=1, max_queue_size=10)
+        ran = threading.Event()
+
+        # Act
+        pipeline.submit("sync", ran.set)
+
+        # Assert
+        assert ran.wait(5)
+        pipeline.shutdown(timeout=5)
+
+    def test_task_waiting_past_budget_expires(self):
+        """測試：排隊時間超過預算的工作不執行，記為 expired"""
+        # Arrange
+        pipeline = PostReplyPipeline(max_workers=1, max_queue_size=10, time_budget=0.05)
+        release = threading.Event()
+        ran = []
+
+        # Act：第一個工作佔住唯一的執行緒，第二個排隊超過預算
+        pipeline.submit("blocker", release.wait, 5)
+        pipeline.submit("late", ran.append, "late")
+        time.sleep(0.2)
+        release.set()
+        pipeline.shutdown(timeout=5)
+
+        # Assert
+        stats = pipeline.stats()["tasks"]
+        assert ran == []
+        assert stats["late"]["expired"] == 1
+        assert stats["blocker"]["over_budget"] == 1
+
+    def test_failed_task_is_isolated(self):
+        """測試：工作失敗只記錄，不影響後面的工作"""
+        # Arrange
+        pipeline = PostReplyPipeline(max_workers=1, max_queue_size=10)
+        done = threading.Event()
+
+        def fail():
+            raise RuntimeError("boom")
+
+        # Act
+        with pipeline.deferred():
+            pipeline.submit("broken", fail)
+            pipeline.submit("ok", done.set)
+
+        # Assert
+        assert done.wait(5)
+        pipeline.shutdown(timeout=5)
+        assert pipeline.stats()["tasks"]["broken"]["failed"] == 1
+
+    def test_full_queue_drops_task(self):
+        """測試：佇列已滿時工作被丟棄並回傳 False"""
+        # Arrange
+        pipeline = PostReplyPipeline(max_workers=1, max_queue_size=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        # Act
+        pipeline.submit("blocker", block)
+        assert started.wait(5)
+        pipeline.submit("queued", lambda: None)
+        accepted = pipeline.submit("dropped", lambda: None)
+        release.set()
+        pipeline.shutdown(timeout=5)
+
+        # Assert
+        assert accepted is False
+        assert pipeline.stats()["tasks"]["dropped"]["dropped"] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,131 @@
+"""
+量子記憶場快照的測試案例
+確保重新啟動時從快照還原，並只重新載入資料庫中較新的角色
+"""
+import pytest
+import sys
+import os
+import json
+from datetime import datetime
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quantum_memory.snapshot import BridgeSnapshot
+from quantum_memory.quantum_bridge import QuantumMemoryBridge
+from service_registry import registry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestBridgeSnapshot:
+    """測試快照檔讀寫"""
+
+    def test_save_and_load_round_trip(self, tmp_path):
+        """測試：寫入的角色狀態可以原樣讀回"""
+        # Arrange
+        snapshot = BridgeSnapshot(str(tmp_path / "snapshot.json"))
+
+        # Act
+        saved = snapshot.save({"cruz": {"evolution_count": 3}})
+        personas = snapshot.load()
+
+        # Assert
+        assert saved is True
+        assert personas == {"cruz": {"evolution_count": 3}}
+        assert snapshot.stats()["writes"] == 1
+
+    def test_corrupt_or_old_snapshot_is_ignored(self, tmp_path):
+        """測試：損毀或版本不符的快照視為不存在"""
+        # Arrange
+        path = tmp_path / "snapshot.json"
+        snapshot = BridgeSnapshot(str(path))
+
+        # Act & Assert
+        path.write_text("{not json", encoding="utf-8")
+        assert snapshot.load() == {}
+        path.write_text(json.dumps({"version": 0, "personas": {"cruz": {}}}), encoding="utf-8")
+        assert snapshot.load() == {}
+        assert BridgeSnapshot(str(tmp_path / "missing.json")).load() == {}
+
+    def test_write_interval(self, tmp_path):
+        """測試：寫入後要超過間隔才再次到期"""
+        # Arrange
+        clock = FakeClock()
+        snapshot = BridgeSnapshot(str(tmp_path / "snapshot.json"), interval=60, clock=clock)
+
+        # Act & Assert
+        assert snapshot.is_due()
+        snapshot.save({})
+        assert not snapshot.is_due()
+        clock.now = 61
+        assert snapshot.is_due()
+
+
+class TestBridgeWarmStart:
+    """測試 QuantumMemoryBridge 從快照還原"""
+
+    def test_first_boot_writes_snapshot(self, tmp_path):
+        """測試：沒有快照時正常載入，並寫下所有角色的快照"""
+        # Arrange
+        snapshot = BridgeSnapshot(str(tmp_path / "snapshot.json"))
+
+        # Act
+        QuantumMemoryBridge(use_database=False, snapshot=snapshot)
+
+        # Assert
+        personas = snapshot.load()
+        assert set(personas) == {p[0] for p in QuantumMemoryBridge.PERSONAS}
+
+    def test_restart_restores_from_snapshot(self, tmp_path):
+        """測試：重新啟動時使用快照內容，角色本質仍套用預設值"""
+        # Arrange
+        path = tmp_path / "snapshot.json"
+        QuantumMemoryBridge(use_database=False, snapshot=BridgeSnapshot(str(path)))
+        data = json.loads(path.read_text(encoding="utf-8"))
+        data["personas"]["fire"]["evolution_count"] = 42
+        data["personas"]["fire"]["identity"]["essence"] = "被改過的本質"
+        path.write_text(json.dumps(data), encoding="utf-8")
+
+        # Act
+        bridge = QuantumMemoryBridge(use_database=False, snapshot=BridgeSnapshot(str(path)))
+
+        # Assert
+        fire = bridge.quantum_memories["fire"]
+        assert fire.evolution_count == 42
+        assert fire.identity.essence == "開發專員，熱情快速的實踐者"
+
+    def test_reconcile_reloads_only_newer_personas(self, tmp_path):
+        """測試：只重新載入資料庫水位比快照新的角色"""
+        # Arrange
+        bridge = QuantumMemoryBridge(use_database=False,
+                                     snapshot=BridgeSnapshot(str(tmp_path / "snapshot.json")))
+        old, new = datetime(2025, 1, 1), datetime(2025, 6, 1)
+        reloaded = []
+        for persona_id, memory in bridge.quantum_memories.items():
+            memory.db_watermark = old
+            memory.load = lambda fallback_to_file=True, pid=persona_id: reloaded.append(pid) or True
+
+        class FakeDatabase:
+            def get_memory_watermarks(self):
+                return {"cruz": new, "water": old}
+
+        registry.set("quantum_database", FakeDatabase())
+
+        # Act
+        try:
+            bridge._reconcile_with_database()
+        finally:
+            registry.reset("quantum_database")
+
+        # Assert
+        assert reloaded == ["cruz"]
+        assert bridge._reconciled is True
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,146 @@
+"""
+Token bucket 限流與准入控制的測試案例
+"""
+import pytest
+import sys
+import os
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import (
+    TokenBucket, AdmissionController,
+    USER_RATE_LIMITED, GLOBAL_RATE_LIMITED, OVERLOADED
+)
+
+
+class FakeClock:
+    """可手動推進的時鐘"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket:
+    """測試 token bucket"""
+
+    def test_burst_then_refill(self):
+        """測試：用完容量後被拒絕，經過時間補充後恢復"""
+        # Arrange
+        clock = FakeClock()
+        bucket = TokenBucket(capacity=2, refill_rate=1, clock=clock)
+
+        # Act & Assert
+        assert bucket.try_acquire() is True
+        assert bucket.try_acquire() is True
+        assert bucket.try_acquire() is False
+        clock.now = 1.0
+        assert bucket.try_acquire() is True
+
+    def test_refill_capped_at_capacity(self):
+        """測試：補充不會超過容量"""
+        clock = FakeClock()
+        bucket = TokenBucket(capacity=2, refill_rate=1, clock=clock)
+        clock.now = 100
+        assert bucket.is_full()
+        assert bucket.tokens == 2
+
+
+class TestAdmissionController:
+    """測試准入控制"""
+
+    def test_user_limit_does_not_affect_others(self):
+        """測試：一個使用者超過限制不影響其他使用者"""
+        # Arrange
+        clock = FakeClock()
+        controller = AdmissionController(user_burst=2, user_refill=0, global_burst=100,
+                                         global_refill=0, clock=clock)
+
+        # Act
+        results = [controller.try_admit("chatty") for _ in range(3)]
+
+        # Assert
+        assert results == [None, None, USER_RATE_LIMITED]
+        assert controller.try_admit("quiet") is None
+
+    def test_global_limit_refunds_user_token(self):
+        """測試：全域額度不足時拒絕，且不扣使用者額度"""
+        # Arrange
+        clock = FakeClock()
+        controller = AdmissionController(user_burst=1, user_refill=0, global_burst=1,
+                                         global_refill=1, clock=clock)
+        controller.try_admit("a")
+
+        # Act
+        rejected = controller.try_admit("b")
+        clock.now = 1.0
+        retried = controller.try_admit("b")
+
+        # Assert
+        assert rejected == GLOBAL_RATE_LIMITED
+        assert retried is None
+
+    def test_max_in_flight(self):
+        """測試：同時處理數達上限時回報過載，釋放後恢復"""
+        # Arrange
+        controller = AdmissionController(max_in_flight=1)
+
+        # Act
+        first = controller.try_admit("a")
+        second = controller.try_admit("b")
+        controller.release()
+        third = controller.try_admit("b")
+
+        # Assert
+        assert first is None
+        assert second == OVERLOADED
+        assert third is None
+        assert controller.stats()["rejected"][OVERLOADED] == 1
+
+    def test_concurrent_admits_never_exceed_max_in_flight(self):
+        """測試：同時到達的請求不會一起通過同時處理數的檢查"""
+        # Arrange
+        controller = AdmissionController(user_burst=100, global_burst=1000, max_in_flight=3)
+        barrier = threading.Barrier(32)
+        results = []
+
+        def admit(index):
+            barrier.wait()
+            results.append(controller.try_admit(f"user{index}"))
+
+        # Act
+        threads = [threading.Thread(target=admit, args=(i,)) for i in range(32)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Assert
+        assert results.count(None) == 3
+        assert controller.stats()["in_flight"] == 3
+
+    def test_rate_limited_request_frees_in_flight_slot(self):
+        """測試：被 token bucket 拒絕的請求不佔用同時處理名額"""
+        # Arrange
+        controller = AdmissionController(user_burst=1, user_refill=0, max_in_flight=2)
+
+        # Act
+        controller.try_admit("chatty")
+        rejected = controller.try_admit("chatty")
+
+        # Assert
+        assert rejected == USER_RATE_LIMITED
+        assert controller.stats()["in_flight"] == 1
+
+    def test_idle_users_are_evicted(self):
+        """測試：追蹤的使用者數量有上限"""
+        controller = AdmissionController(max_users=2)
+        for key in ("a", "b", "c"):
+            controller.try_admit(key)
+        assert controller.stats()["tracked_users"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
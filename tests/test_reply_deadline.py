@@ -0,0 +1,88 @@
+"""
+回覆期限追蹤的測試案例
+確保 reply token 只會被正式回覆或暫時回覆其中一方使用
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reply_deadline import ReplyDeadlineTracker, REPLIED, INTERIM
+
+
+class TestReplyDeadline:
+    """測試回覆期限"""
+
+    def test_reply_in_time_skips_interim(self):
+        """測試：期限內完成時不送暫時回覆"""
+        # Arrange
+        tracker = ReplyDeadlineTracker(budget=0.05)
+        interim = threading.Event()
+
+        # Act
+        deadline = tracker.track(interim.set)
+        claimed = deadline.claim_reply()
+        time.sleep(0.15)
+
+        # Assert
+        assert claimed is True
+        assert deadline.state == REPLIED
+        assert not interim.is_set()
+        assert tracker.stats()["interim_sent"] == 0
+
+    def test_expired_sends_interim_then_push(self):
+        """測試：超過期限送出暫時回覆，之後的正式回覆改走 push"""
+        # Arrange
+        tracker = ReplyDeadlineTracker(budget=0.05)
+        interim = threading.Event()
+
+        # Act
+        deadline = tracker.track(interim.set)
+        interim.wait(timeout=2)
+        claimed = deadline.claim_reply()
+
+        # Assert
+        assert interim.is_set()
+        assert claimed is False
+        assert deadline.state == INTERIM
+        assert tracker.stats()["interim_sent"] == 1
+
+    def test_slow_interim_does_not_delay_other_deadlines(self):
+        """測試：一則暫時回覆送得很慢時，其他事件的暫時回覆照常送出"""
+        # Arrange
+        tracker = ReplyDeadlineTracker(budget=0.05)
+        release = threading.Event()
+        second = threading.Event()
+
+        # Act
+        start = time.monotonic()
+        tracker.track(lambda: release.wait(2))
+        tracker.track(second.set)
+        fired = second.wait(timeout=2)
+        elapsed = time.monotonic() - start
+        release.set()
+
+        # Assert
+        assert fired
+        assert elapsed < 0.5
+        assert tracker.stats()["interim_sent"] == 2
+
+    def test_event_age_reduces_budget(self):
+        """測試：事件已經過的時間會從預算中扣除"""
+        # Arrange
+        tracker = ReplyDeadlineTracker(budget=20)
+        ten_seconds_ago = int((time.time() - 10) * 1000)
+
+        # Act
+        remaining = tracker.remaining(ten_seconds_ago)
+
+        # Assert
+        assert 9 < remaining <= 10
+        assert tracker.remaining(int((time.time() - 60) * 1000)) == 0.0
+        assert tracker.remaining(None) == 20
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
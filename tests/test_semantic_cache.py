@@ -0,0 +1,178 @@
+"""
+語意快取的測試案例
+確保相似的問題能共用回應，而不同人格模式、過期或與時間相關的問題不會誤用快取
+"""
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semantic_cache import SemanticResponseCache, cosine_similarity, ngram_embedding, normalize_message
+
+
+class FakeClock:
+    """可手動前進的時鐘"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestNormalization:
+    """測試訊息正規化與向量"""
+
+    def test_punctuation_and_width_are_ignored(self):
+        """測試：全形、大小寫、標點與空白不影響正規化結果"""
+        # Act & Assert
+        assert normalize_message("你是誰？") == normalize_message("你是誰")
+        assert normalize_message("ＣＲＵＺ 是誰!") == normalize_message("cruz是誰")
+
+    def test_identical_text_has_full_similarity(self):
+        """測試：相同文字的相似度為 1，完全不同的為 0"""
+        # Act & Assert
+        assert cosine_similarity(ngram_embedding("你好"), ngram_embedding("你好")) == pytest.approx(1.0)
+        assert cosine_similarity(ngram_embedding("你好"), ngram_embedding("再見")) == 0.0
+        assert cosine_similarity([1.0, 0.0], [1.0, 0.0]) == pytest.approx(1.0)
+
+
+class TestLookup:
+    """測試快取查詢"""
+
+    def test_exact_match_after_normalization(self):
+        """測試：正規化後相同的訊息直接命中"""
+        # Arrange
+        cache = SemanticResponseCache(sample_rate=0)
+        cache.put("default", "你是誰？", "我是 CRUZ 的 AI 助理", latency=1.5)
+
+        # Act
+        result = cache.get("default", "你是誰")
+
+        # Assert
+        assert result == "我是 CRUZ 的 AI 助理"
+        assert cache.stats()["exact_hits"] == 1
+        assert cache.stats()["latency_saved_s"] == 1.5
+
+    def test_similar_message_hits_and_different_message_misses(self):
+        """測試：相似度達到門檻才命中"""
+        # Arrange
+        cache = SemanticResponseCache(threshold=0.8, sample_rate=0)
+        cache.put("default", "請介紹一下你自己", "你好，我是助理")
+
+        # Act
+        similar = cache.get("default", "請介紹一下你自己吧")
+        different = cache.get("default", "今天天氣如何")
+
+        # Assert
+        assert similar == "你好，我是助理"
+        assert different is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["lookups"] == 2
+
+    def test_scopes_are_isolated(self):
+        """測試：不同人格模式的回應不會互相使用"""
+        # Arrange
+        cache = SemanticResponseCache(sample_rate=0)
+        cache.put("1:model:cruz", "你是誰", "我是 CRUZ")
+
+        # Act & Assert
+        assert cache.get("1:model:default", "你是誰") is None
+        assert cache.get("1:model:cruz", "你是誰") == "我是 CRUZ"
+
+    def test_excluded_keywords_are_not_cached(self):
+        """測試：與日曆、時間相關的訊息不儲存也不查詢"""
+        # Arrange
+        cache = SemanticResponseCache(excluded_keywords=["今天", "行程"], sample_rate=0)
+
+        # Act
+        cache.put("default", "今天有什麼行程", "你今天沒有行程")
+        result = cache.get("default", "今天有什麼行程")
+
+        # Assert
+        assert result is None
+        assert cache.stats()["entries"] == 0
+        assert cache.stats()["excluded"] == 1
+
+
+class TestExpiry:
+    """測試過期與淘汰"""
+
+    def test_entries_expire_after_ttl(self):
+        """測試：超過 TTL 的回應不再使用"""
+        # Arrange
+        clock = FakeClock()
+        cache = SemanticResponseCache(ttl_seconds=60, sample_rate=0, clock=clock)
+        cache.put("default", "你是誰", "我是助理")
+
+        # Act
+        clock.now = 61
+        result = cache.get("default", "你是誰")
+
+        # Assert
+        assert result is None
+        assert cache.stats()["entries"] == 0
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """測試：超過上限時淘汰最久沒用到的回應"""
+        # Arrange
+        cache = SemanticResponseCache(max_entries=2, sample_rate=0)
+        cache.put("default", "第一個問題", "一")
+        cache.put("default", "第二個問題", "二")
+        cache.get("default", "第一個問題")
+
+        # Act
+        cache.put("default", "第三個問題", "三")
+
+        # Assert
+        assert cache.get("default", "第一個問題") == "一"
+        assert cache.get("default", "第二個問題") is None
+        assert cache.stats()["evictions"] == 1
+
+
+class TestSampling:
+    """測試命中取樣"""
+
+    def test_hits_are_sampled_for_review(self):
+        """測試：命中時依取樣比例保存原始問題與對應的快取問題"""
+        # Arrange
+        cache = SemanticResponseCache(threshold=0.8, sample_rate=0.5, rng=lambda: 0.0)
+        cache.put("default", "請介紹一下你自己", "你好，我是助理")
+
+        # Act
+        cache.get("default", "請介紹一下你自己吧")
+
+        # Assert
+        samples = cache.stats()["recent_samples"]
+        assert len(samples) == 1
+        assert samples[0]["message"] == "請介紹一下你自己吧"
+        assert samples[0]["matched"] == "請介紹一下你自己"
+        assert 0.8 <= samples[0]["similarity"] < 1.0
+
+
+def broken_embedder(text):
+    raise RuntimeError("embedding API unavailable")
+
+
+class TestEmbedderFailure:
+    """測試向量計算失敗"""
+
+    @pytest.mark.parametrize("embedder", [lambda text: None, broken_embedder])
+    def test_failed_embedding_skips_lookup_and_store(self, embedder):
+        """測試：embedder 回傳 None 或失敗時不查詢也不儲存，也不拋出例外"""
+        # Arrange
+        cache = SemanticResponseCache(embedder=embedder, sample_rate=0)
+
+        # Act
+        cache.put("default", "請介紹一下你自己", "你好，我是助理")
+        result = cache.get("default", "請介紹一下你自己吧")
+
+        # Assert
+        stats = cache.stats()
+        assert result is None
+        assert stats["stores"] == 0
+        assert stats["embed_failures"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
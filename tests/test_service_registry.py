@@ -0,0 +1,85 @@
+"""
+服務註冊表的測試案例
+確保服務在第一次使用時才建立，且只建立一次
+"""
+import pytest
+import sys
+import os
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from service_registry import ServiceRegistry, LazyService
+
+
+class TestServiceRegistry:
+    """測試服務註冊表"""
+
+    def test_factory_runs_on_first_get_only(self):
+        """測試：註冊時不建立，第一次 get() 才建立並快取"""
+        # Arrange
+        registry = ServiceRegistry()
+        calls = []
+        registry.register("svc", lambda: calls.append(1) or object())
+
+        # Act
+        built_before = registry.is_built("svc")
+        first = registry.get("svc")
+        second = registry.get("svc")
+
+        # Assert
+        assert built_before is False
+        assert first is second
+        assert len(calls) == 1
+        assert registry.stats()["svc"]["built"] is True
+
+    def test_concurrent_get_builds_once(self):
+        """測試：多個執行緒同時取得時只建立一次"""
+        # Arrange
+        registry = ServiceRegistry()
+        calls = []
+        start = threading.Barrier(8)
+        registry.register("svc", lambda: calls.append(1) or object())
+        results = []
+
+        def worker():
+            start.wait()
+            results.append(registry.get("svc"))
+
+        # Act
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Assert
+        assert len(calls) == 1
+        assert len({id(result) for result in results}) == 1
+
+    def test_lazy_service_proxies_attributes(self):
+        """測試：代理物件在存取屬性時才建立服務"""
+        # Arrange
+        class Counter:
+            value = 1
+
+        registry = ServiceRegistry()
+        registry.register("counter", Counter)
+        proxy = LazyService(registry, "counter")
+
+        # Act
+        built_before = registry.is_built("counter")
+        proxy.value = 5
+
+        # Assert
+        assert built_before is False
+        assert registry.get("counter").value == 5
+        assert proxy.value == 5
+
+    def test_unknown_service_raises(self):
+        """測試：未註冊的服務"""
+        with pytest.raises(KeyError):
+            ServiceRegistry().get("missing")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
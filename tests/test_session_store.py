@@ -0,0 +1,174 @@
+"""
+使用者狀態儲存的測試案例
+確保狀態以緊湊格式序列化、以版本號避免多個 worker 互相覆蓋，
+並讓共用後端的對話歷史能在任何 worker 接續
+"""
+import pytest
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import (InProcessSessionBackend, SessionStore, SharedConversationHistory,
+                           UserSession, decode_session, encode_session)
+
+
+class FakeClock:
+    """可手動前進的時鐘"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestSerialization:
+    """測試序列化格式"""
+
+    def test_round_trip(self):
+        """測試：序列化後可以還原所有欄位"""
+        # Arrange
+        session = UserSession(cruz_mode=True, element="水",
+                              turns=[{'turn': 3, 'user': "你好", 'assistant': "嗨"}])
+
+        # Act
+        restored = decode_session(encode_session(session), version=7)
+
+        # Assert
+        assert restored == UserSession(cruz_mode=True, element="水",
+                                       turns=[{'turn': 3, 'user': "你好", 'assistant': "嗨"}], version=7)
+
+    def test_default_session_is_compact(self):
+        """測試：預設狀態只佔用很少的位元組"""
+        # Act
+        data = encode_session(UserSession())
+
+        # Assert
+        assert len(data) < 16
+
+
+class TestInProcessBackend:
+    """測試程序內後端"""
+
+    def test_compare_and_set_rejects_stale_version(self):
+        """測試：版本不符時拒絕寫入"""
+        # Arrange
+        backend = InProcessSessionBackend()
+        assert backend.compare_and_set("u1", b"a", 0) == 1
+
+        # Act & Assert
+        assert backend.compare_and_set("u1", b"b", 0) is None
+        assert backend.compare_and_set("u1", b"b", 1) == 2
+        assert backend.load("u1") == (b"b", 2)
+
+    def test_entries_are_bounded_and_expire(self):
+        """測試：超過容量時移除最久沒用到的使用者，過期的狀態不再讀到"""
+        # Arrange
+        clock = FakeClock()
+        backend = InProcessSessionBackend(max_entries=2, ttl_seconds=60, clock=clock)
+        backend.compare_and_set("u1", b"1", 0)
+        backend.compare_and_set("u2", b"2", 0)
+        backend.load("u1")
+
+        # Act
+        backend.compare_and_set("u3", b"3", 0)
+
+        # Assert
+        assert backend.load("u2") is None
+        assert backend.load("u1") is not None
+        clock.now = 61
+        assert backend.load("u3") is None
+
+
+class TestSessionStore:
+    """測試樂觀鎖更新"""
+
+    def test_update_retries_after_concurrent_write(self):
+        """測試：其他 worker 同時寫入時，重新讀取最新版本再套用修改"""
+        # Arrange
+        store = SessionStore(InProcessSessionBackend())
+        store.update("u1", lambda s: setattr(s, 'element', "火"))
+        attempts = []
+
+        def enable_cruz(session):
+            attempts.append(session.version)
+            if len(attempts) == 1:
+                # 模擬另一個 worker 在讀取後、寫入前修改了狀態
+                store.update("u1", lambda s: setattr(s, 'element', "水"))
+            session.cruz_mode = True
+
+        # Act
+        result = store.update("u1", enable_cruz)
+
+        # Assert
+        assert attempts == [1, 2]
+        assert result.cruz_mode is True
+        assert result.element == "水"
+        assert store.stats()["conflicts"] == 1
+
+    def test_write_is_dropped_after_repeated_conflicts(self):
+        """測試：持續衝突時放棄寫入並回傳目前的狀態"""
+        # Arrange
+        store = SessionStore(InProcessSessionBackend(), max_retries=1)
+        store.update("u1", lambda s: None)
+
+        def always_conflicts(session):
+            store.backend.compare_and_set("u1", encode_session(session), session.version)
+
+        # Act
+        store.update("u1", always_conflicts)
+
+        # Assert
+        assert store.stats()["dropped_writes"] == 1
+
+    def test_unreadable_session_is_reset(self):
+        """測試：無法解析的紀錄視為空狀態，下一次寫入時覆蓋"""
+        # Arrange
+        store = SessionStore(InProcessSessionBackend())
+        store.backend.compare_and_set("u1", b"not zlib", 0)
+
+        # Act
+        session = store.update("u1", lambda s: setattr(s, 'cruz_mode', True))
+
+        # Assert
+        assert session.cruz_mode is True
+        assert store.stats()["decode_errors"] == 1
+
+
+class TestSharedConversationHistory:
+    """測試存在使用者狀態中的對話歷史"""
+
+    def test_history_is_shared_between_workers(self):
+        """測試：兩個 worker 使用同一個後端時可以接續同一段對話"""
+        # Arrange
+        backend = InProcessSessionBackend()
+        worker_a = SharedConversationHistory(SessionStore(backend, max_turns=2))
+        worker_b = SharedConversationHistory(SessionStore(backend, max_turns=2))
+
+        # Act
+        worker_a.append("u1", "問題0", "回覆0")
+        worker_b.append("u1", "問題1", "回覆1")
+        turn = worker_a.append("u1", "問題2", "回覆2")
+
+        # Assert
+        assert turn['turn'] == 2
+        assert [t['user'] for t in worker_b.get("u1")] == ["問題1", "問題2"]
+
+    def test_clear_keeps_persona_mode(self):
+        """測試：清除對話歷史不會改變人格模式"""
+        # Arrange
+        store = SessionStore(InProcessSessionBackend())
+        history = SharedConversationHistory(store)
+        store.update("u1", lambda s: setattr(s, 'cruz_mode', True))
+        history.append("u1", "問題", "回覆")
+
+        # Act
+        history.clear("u1")
+
+        # Assert
+        assert history.get("u1") == []
+        assert store.get("u1").cruz_mode is True
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,88 @@
+"""
+啟動檢測結果快取的測試案例
+"""
+import pytest
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startup_cache import StartupResultCache, compute_fingerprint
+
+
+class FakeClock:
+    """可手動推進的時鐘"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStartupResultCache:
+    """測試啟動快取"""
+
+    def test_passed_check_is_reused_within_ttl(self, tmp_path):
+        """測試：有效期限內通過的檢測可以沿用，過期後失效"""
+        # Arrange
+        clock = FakeClock()
+        path = str(tmp_path / "cache.json")
+        StartupResultCache(path=path, ttl=60, fingerprint="abc", clock=clock).record_check("Gemini", True)
+
+        # Act
+        cache = StartupResultCache(path=path, ttl=60, fingerprint="abc", clock=clock)
+        clock.now += 10
+        fresh_age = cache.get_check_age("Gemini")
+        clock.now += 60
+        expired_age = cache.get_check_age("Gemini")
+
+        # Assert
+        assert fresh_age == 10
+        assert expired_age is None
+
+    def test_fingerprint_change_discards_cache(self, tmp_path):
+        """測試：設定或程式碼改變時整份快取作廢"""
+        # Arrange
+        path = str(tmp_path / "cache.json")
+        old = StartupResultCache(path=path, fingerprint="old")
+        old.record_check("Gemini", True)
+        old.set_value("git_log", "abc123 init")
+
+        # Act
+        cache = StartupResultCache(path=path, fingerprint="new")
+
+        # Assert
+        assert cache.get_check_age("Gemini") is None
+        assert cache.get_value("git_log") is None
+
+    def test_failed_check_removes_entry(self, tmp_path):
+        """測試：檢測失敗會移除快取"""
+        cache = StartupResultCache(path=str(tmp_path / "cache.json"), fingerprint="abc")
+        cache.record_check("pgvector", True)
+        cache.record_check("pgvector", False)
+        assert cache.get_check_age("pgvector") is None
+
+    def test_secrets_are_not_written(self, tmp_path, monkeypatch):
+        """測試：快取檔只保存指紋雜湊，不含環境變數原值"""
+        # Arrange
+        monkeypatch.setenv("GEMINI_API_KEY", "super-secret-key")
+        path = tmp_path / "cache.json"
+
+        # Act
+        StartupResultCache(path=str(path), fingerprint=compute_fingerprint()).record_check("Gemini", True)
+
+        # Assert
+        assert "super-secret-key" not in path.read_text()
+        assert len(json.loads(path.read_text())["fingerprint"]) == 64
+
+    def test_fingerprint_depends_on_env(self, monkeypatch):
+        """測試：模型設定改變時指紋也改變"""
+        monkeypatch.setenv("GEMINI_MODEL", "model-a")
+        first = compute_fingerprint()
+        monkeypatch.setenv("GEMINI_MODEL", "model-b")
+        assert compute_fingerprint() != first
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,131 @@
+"""
+平行啟動自我檢測的測試案例
+確保關鍵檢測受時間預算限制，非關鍵檢測不擋啟動
+"""
+import pytest
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startup_test import StartupTest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """每個測試使用獨立的啟動快取檔"""
+    monkeypatch.setenv("STARTUP_CACHE_FILE", str(tmp_path / "startup_cache.json"))
+
+
+class FakeStartupTest(StartupTest):
+    """以假檢測取代真實的外部服務檢測"""
+
+    CHECKS = [
+        ("快速關鍵", "_check_fast", True),
+        ("緩慢非關鍵", "_check_slow_optional", False),
+    ]
+
+    def _check_fast(self):
+        self.results["快速關鍵"] = "✅ 通過"
+
+    def _check_slow_optional(self):
+        time.sleep(0.3)
+        self.results["緩慢非關鍵"] = "❌ 失敗"
+        self.critical_failures.append("選用服務無法連線")
+
+
+class TestStartupParallel:
+    """測試平行啟動檢測"""
+
+    def test_slow_optional_check_runs_in_background(self):
+        """測試：非關鍵檢測在背景完成，失敗只列為警告"""
+        # Arrange
+        tester = FakeStartupTest()
+
+        # Act
+        started = time.time()
+        passed = tester.run_all_tests()
+        elapsed = time.time() - started
+
+        # Assert
+        assert passed is True
+        assert elapsed < 0.3
+        assert "緩慢非關鍵" in tester.get_status()["pending_checks"]
+
+        time.sleep(0.5)
+        status = tester.get_status()
+        assert status["pending_checks"] == []
+        assert status["startup_test_passed"] is True
+        assert status["test_results"]["緩慢非關鍵"] == "❌ 失敗"
+        assert any("選用服務無法連線" in warning for warning in status["warnings"])
+
+    def test_cached_check_is_skipped(self):
+        """測試：同一指紋下已通過的檢測，下次啟動直接沿用"""
+        # Arrange
+        FakeStartupTest().run_all_tests()
+
+        # Act
+        tester = FakeStartupTest()
+        tester.run_all_tests()
+
+        # Assert
+        assert tester.results["快速關鍵"] == "✅ 通過（快取）"
+
+    def test_force_full_check_ignores_cache(self):
+        """測試：強制完整檢測時不使用快取"""
+        # Arrange
+        FakeStartupTest().run_all_tests()
+
+        # Act
+        tester = FakeStartupTest(force_full_check=True)
+        tester.run_all_tests()
+
+        # Assert
+        assert tester.results["快速關鍵"] == "✅ 通過"
+
+    def test_critical_check_over_budget_fails(self):
+        """測試：關鍵檢測超過時間預算視為失敗"""
+        # Arrange
+        class SlowCritical(FakeStartupTest):
+            CHECKS = [("緩慢關鍵", "_check_slow_optional", True)]
+
+        tester = SlowCritical()
+        tester.time_budget = 0.05
+
+        # Act
+        passed = tester.run_all_tests()
+
+        # Assert
+        assert passed is False
+        assert tester.results["緩慢關鍵"] == "⏱️ 逾時"
+
+    def test_late_result_does_not_contradict_report(self):
+        """測試：逾時的關鍵檢測之後才完成，結果維持逾時，失敗只列為警告"""
+        # Arrange
+        class LateCritical(FakeStartupTest):
+            CHECKS = [("緩慢關鍵", "_check_late", True)]
+
+            def _check_late(self):
+                time.sleep(0.2)
+                self.results["緩慢關鍵"] = "✅ 通過"
+                self.critical_failures.append("逾時後才回報的失敗")
+
+        tester = LateCritical()
+        tester.time_budget = 0.05
+
+        # Act
+        passed = tester.run_all_tests()
+        failures_at_report = list(tester.critical_failures)
+        time.sleep(0.4)
+
+        # Assert
+        status = tester.get_status()
+        assert passed is False
+        assert status["pending_checks"] == []
+        assert status["test_results"]["緩慢關鍵"] == "⏱️ 逾時"
+        assert tester.critical_failures == failures_at_report
+        assert any("逾時後才回報的失敗" in warning for warning in status["warnings"])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,72 @@
+"""
+取樣式結構化日誌的測試案例
+"""
+import pytest
+import sys
+import os
+import json
+import logging
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_logging import StructuredLogger, parse_sample_rates
+
+
+class TestStructuredLogger:
+    """測試結構化日誌"""
+
+    def test_parse_sample_rates(self):
+        """測試：解析取樣率設定，忽略格式錯誤的項目並限制在 0~1"""
+        rates = parse_sample_rates("callback=0.1, gemini=2,bad,message=x")
+        assert rates == {"callback": 0.1, "gemini": 1.0}
+
+    def test_sampling_rejects_without_emitting(self, caplog):
+        """測試：未被取樣時不輸出任何紀錄"""
+        # Arrange
+        log = StructuredLogger(sample_rates={"callback": 0.5}, random_fn=lambda: 0.9)
+
+        # Act
+        with caplog.at_level(logging.INFO, logger="access"):
+            log.log("callback", "webhook_request", body_length=10)
+
+        # Assert
+        assert caplog.records == []
+        assert log.stats()["seen"] == {"callback": 1}
+        assert log.stats()["emitted"] == {}
+
+    def test_sampled_record_is_json(self, caplog):
+        """測試：被取樣的紀錄以單行 JSON 輸出"""
+        # Arrange
+        log = StructuredLogger(sample_rates={"callback": 0.5}, random_fn=lambda: 0.1)
+
+        # Act
+        with caplog.at_level(logging.INFO, logger="access"):
+            log.log("callback", "webhook_request", body_length=10)
+
+        # Assert
+        record = json.loads(caplog.records[0].getMessage())
+        assert record == {"route": "callback", "event": "webhook_request", "body_length": 10}
+
+    def test_ring_buffer_is_bounded(self):
+        """測試：環形緩衝區只保留最新的內容，且可依路由過濾"""
+        # Arrange
+        log = StructuredLogger(ring_size=3)
+
+        # Act
+        for i in range(5):
+            log.capture("gemini" if i % 2 else "callback", "request", index=i)
+
+        # Assert
+        entries = log.recent(limit=10)
+        assert [entry["payload"]["index"] for entry in entries] == [4, 3, 2]
+        assert [entry["payload"]["index"] for entry in log.recent(route="gemini")] == [3]
+
+    def test_ring_buffer_disabled(self):
+        """測試：環形緩衝區大小為 0 時不保存內容"""
+        log = StructuredLogger(ring_size=0)
+        log.capture("callback", "request", body="x")
+        assert log.capturing is False
+        assert log.recent() == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
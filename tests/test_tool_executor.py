@@ -0,0 +1,119 @@
+"""
+工具並行執行的測試案例
+確保多個工具同時執行、逾時或失敗的工具回傳錯誤而不影響其他工具
+"""
+import pytest
+import sys
+import os
+import asyncio
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tool_executor import ToolExecutor, parse_tool_timeouts
+
+
+def sleeper(result, seconds):
+    time.sleep(seconds)
+    return result
+
+
+class TestSyncExecution:
+    """測試同步執行"""
+
+    def test_tools_run_concurrently(self):
+        """測試：兩個工具同時執行，總時間接近較慢的那一個"""
+        # Arrange
+        executor = ToolExecutor(max_workers=4, timeout=5)
+        barrier = threading.Barrier(2, timeout=5)
+
+        def tool(name):
+            barrier.wait()
+            return {"name": name}
+
+        # Act
+        results = executor.run_all([("a", tool, ("a",)), ("b", tool, ("b",))])
+
+        # Assert
+        assert results == [{"name": "a"}, {"name": "b"}]
+        assert executor.stats()["parallel_batches"] == 1
+
+    def test_slow_tool_times_out(self):
+        """測試：超過個別期限的工具回傳逾時錯誤，其他工具照常回傳"""
+        # Arrange
+        executor = ToolExecutor(timeout=5, tool_timeouts={"slow": 0.05})
+
+        # Act
+        results = executor.run_all([
+            ("slow", sleeper, ({"ok": True}, 1)),
+            ("fast", sleeper, ({"ok": True}, 0))
+        ])
+
+        # Assert
+        assert results[0] == {"success": False, "error": "slow: timeout"}
+        assert results[1] == {"ok": True}
+        assert executor.stats()["timeouts"] == 1
+
+    def test_failing_tool_returns_error(self):
+        """測試：工具拋出例外時回傳錯誤結果"""
+        # Arrange
+        executor = ToolExecutor()
+
+        def broken():
+            raise RuntimeError("calendar down")
+
+        # Act
+        results = executor.run_all([("broken", broken, ())])
+
+        # Assert
+        assert results == [{"success": False, "error": "broken: calendar down"}]
+        assert executor.stats()["latency"]["broken"]["errors"] == 1
+
+    def test_timeout_never_exceeds_deadline(self):
+        """測試：工具期限不超過整次回應的剩餘時間"""
+        # Arrange
+        executor = ToolExecutor(timeout=10)
+
+        # Act
+        timeout = executor.timeout_for("tool", time.monotonic() + 1)
+
+        # Assert
+        assert timeout <= 1
+        assert executor.timeout_for("tool", time.monotonic() - 1) == 0
+
+
+class TestAsyncExecution:
+    """測試非同步執行"""
+
+    def test_async_tools_run_concurrently_with_timeouts(self):
+        """測試：非同步版本同時執行工具，逾時的工具不會拖住其他結果"""
+        # Arrange
+        executor = ToolExecutor(timeout=5, tool_timeouts={"slow": 0.05})
+
+        # Act
+        start = time.monotonic()
+        results = asyncio.run(executor.run_all_async([
+            ("slow", sleeper, ({"ok": True}, 1)),
+            ("a", sleeper, ({"name": "a"}, 0.1)),
+            ("b", sleeper, ({"name": "b"}, 0.1))
+        ]))
+        elapsed = time.monotonic() - start
+
+        # Assert
+        assert results == [{"success": False, "error": "slow: timeout"}, {"name": "a"}, {"name": "b"}]
+        assert elapsed < 0.5
+
+
+def test_parse_tool_timeouts():
+    """測試：解析個別工具期限設定"""
+    # Act & Assert
+    assert parse_tool_timeouts("quantum_search=5, list_calendar_events=6.5") == {
+        "quantum_search": 5.0,
+        "list_calendar_events": 6.5
+    }
+    assert parse_tool_timeouts("") == {}
+    assert parse_tool_timeouts("bad=x") == {}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
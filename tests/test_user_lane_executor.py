@@ -0,0 +1,137 @@
+"""
+依使用者分道執行器的測試案例
+確保同一使用者依序處理、不同使用者平行處理
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker_pool import BoundedWorkerPool
+from user_lane_executor import LaneRejectedError, UserLaneExecutor
+
+
+class TestUserLaneExecutor:
+    """測試分道執行器"""
+
+    def test_same_user_runs_in_order(self):
+        """測試：同一使用者的工作依提交順序執行"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=4, max_queue_size=50, name="test")
+        executor = UserLaneExecutor(pool)
+        results = []
+
+        def record(value):
+            time.sleep(0.01)
+            results.append(value)
+
+        # Act
+        futures = [executor.submit("user_a", record, i) for i in range(10)]
+        for future in futures:
+            future.result(timeout=5)
+
+        # Assert
+        assert results == list(range(10))
+        pool.shutdown()
+
+    def test_different_users_run_in_parallel(self):
+        """測試：不同使用者的工作可以同時執行"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=2, max_queue_size=10, name="test")
+        executor = UserLaneExecutor(pool)
+        both_started = threading.Barrier(2, timeout=5)
+
+        # Act：兩個工作互相等待，只有平行執行才會成功
+        futures = [
+            executor.submit("user_a", both_started.wait),
+            executor.submit("user_b", both_started.wait)
+        ]
+
+        # Assert
+        for future in futures:
+            future.result(timeout=5)
+        pool.shutdown()
+
+    def test_idle_lanes_are_reclaimed(self):
+        """測試：道清空後會被回收"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=2, max_queue_size=10, name="test")
+        executor = UserLaneExecutor(pool)
+
+        # Act
+        futures = [executor.submit(f"user_{i}", lambda: None) for i in range(5)]
+        for future in futures:
+            future.result(timeout=5)
+        time.sleep(0.05)
+
+        # Assert
+        stats = executor.stats()
+        assert executor.active_lanes() == 0
+        assert stats["lanes_created"] == 5
+        assert stats["lanes_reclaimed"] == 5
+        pool.shutdown()
+
+    def test_pool_full_drains_inline(self):
+        """測試：執行緒池滿載時改在呼叫端執行，不會遺失工作"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=1, max_queue_size=1, name="test")
+        executor = UserLaneExecutor(pool)
+        release = threading.Event()
+        # 佔住唯一的執行緒並塞滿佇列
+        while pool.submit(release.wait, 5):
+            time.sleep(0.01)
+
+        # Act
+        future = executor.submit("user_a", lambda: threading.current_thread().name)
+
+        # Assert
+        assert future.result(timeout=1) == threading.current_thread().name
+        assert executor.stats()["inline_drains"] == 1
+        release.set()
+        pool.shutdown()
+
+    def test_pool_full_rejects_without_inline(self):
+        """測試：不允許在呼叫端處理時，執行緒池滿載直接拒絕並回收這條道"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=1, max_queue_size=1, name="test")
+        executor = UserLaneExecutor(pool, inline_when_full=False)
+        release = threading.Event()
+        while pool.submit(release.wait, 5):
+            time.sleep(0.01)
+        ran = []
+
+        # Act
+        future = executor.submit("user_a", lambda: ran.append(1))
+
+        # Assert
+        with pytest.raises(LaneRejectedError):
+            future.result(timeout=1)
+        assert ran == []
+        stats = executor.stats()
+        assert stats["rejected"] == 1
+        assert stats["inline_drains"] == 0
+        assert executor.active_lanes() == 0
+        release.set()
+        pool.shutdown()
+
+    def test_task_exception_is_isolated(self):
+        """測試：單一工作失敗不影響同一道後續的工作"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=1, max_queue_size=10, name="test")
+        executor = UserLaneExecutor(pool)
+
+        # Act
+        failing = executor.submit("user_a", lambda: 1 / 0)
+        following = executor.submit("user_a", lambda: "ok")
+
+        # Assert
+        with pytest.raises(ZeroDivisionError):
+            failing.result(timeout=5)
+        assert following.result(timeout=5) == "ok"
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,90 @@
+"""
+Webhook 重送去重的測試案例
+確保同一事件在 TTL 內只處理一次
+"""
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook_dedup import InMemoryDedupStore, get_event_dedup_key
+
+
+class FakeClock:
+    """可手動推進的時鐘"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestInMemoryDedupStore:
+    """測試程序內去重表"""
+
+    def test_first_seen_then_duplicate(self):
+        """測試：第一次看到回傳 True，重送回傳 False"""
+        # Arrange
+        store = InMemoryDedupStore(ttl_seconds=60)
+
+        # Act
+        first = store.check_and_mark("event:abc")
+        second = store.check_and_mark("event:abc")
+
+        # Assert
+        assert first is True
+        assert second is False
+        assert store.stats()["duplicates"] == 1
+
+    def test_key_expires_after_ttl(self):
+        """測試：超過 TTL 後同一個鍵視為新事件"""
+        # Arrange
+        clock = FakeClock()
+        store = InMemoryDedupStore(ttl_seconds=60, clock=clock)
+        store.check_and_mark("event:abc")
+
+        # Act
+        clock.now = 61
+        result = store.check_and_mark("event:abc")
+
+        # Assert
+        assert result is True
+        assert store.stats()["entries"] == 1
+
+    def test_max_entries_evicts_oldest(self):
+        """測試：超過容量上限時淘汰最舊的鍵"""
+        # Arrange
+        store = InMemoryDedupStore(ttl_seconds=60, max_entries=2)
+
+        # Act
+        for key in ("a", "b", "c"):
+            store.check_and_mark(key)
+
+        # Assert
+        assert store.stats()["entries"] == 2
+        assert store.check_and_mark("a") is True
+        assert store.check_and_mark("c") is False
+
+
+class TestEventDedupKey:
+    """測試事件去重鍵"""
+
+    def test_prefers_webhook_event_id(self):
+        """測試：優先使用 webhookEventId"""
+        event = SimpleNamespace(webhook_event_id="01H", message=SimpleNamespace(id="123"))
+        assert get_event_dedup_key(event) == "event:01H"
+
+    def test_falls_back_to_message_id(self):
+        """測試：沒有 webhookEventId 時使用訊息 ID"""
+        event = SimpleNamespace(webhook_event_id=None, message=SimpleNamespace(id="123"))
+        assert get_event_dedup_key(event) == "message:123"
+
+    def test_returns_none_without_ids(self):
+        """測試：兩者皆無時不去重"""
+        assert get_event_dedup_key(SimpleNamespace()) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,140 @@
+"""
+多事件 webhook 的測試案例
+確保同一請求內不同使用者的事件並行處理，同步模式在 WEBHOOK_SYNC_DEADLINE 內回應
+"""
+import pytest
+import sys
+import os
+import json
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from standin_server import build_webhook_body, sign
+
+SECRET = "test-secret"
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    """不連網路的 LineBotHandler（同步模式、不預熱、不做准入與期限）"""
+    yield from make_handler(monkeypatch, async_mode=False)
+
+
+@pytest.fixture
+def async_handler(monkeypatch):
+    """非同步模式的 LineBotHandler（一個 worker、佇列只有一格）"""
+    monkeypatch.setattr(Config, "WEBHOOK_QUEUE_SIZE", 1)
+    monkeypatch.setattr(Config, "WEBHOOK_WORKERS", 1)
+    yield from make_handler(monkeypatch, async_mode=True)
+
+
+def make_handler(monkeypatch, async_mode: bool):
+    monkeypatch.setattr(Config, "LINE_CHANNEL_SECRET", SECRET)
+    monkeypatch.setattr(Config, "LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+    monkeypatch.setattr(Config, "WEBHOOK_ASYNC_MODE", async_mode)
+    monkeypatch.setattr(Config, "WEBHOOK_SYNC_DEADLINE", 0.5)
+    if not async_mode:
+        monkeypatch.setattr(Config, "WEBHOOK_WORKERS", 4)
+    monkeypatch.setattr(Config, "SERVICE_PREWARM", False)
+    monkeypatch.setattr(Config, "PRELOAD_APP", False)
+    monkeypatch.setattr(Config, "RATE_LIMIT_ENABLED", False)
+    monkeypatch.setattr(Config, "REPLY_DEADLINE_ENABLED", False)
+    from line_bot_handler import LineBotHandler
+    line_handler = LineBotHandler()
+    yield line_handler
+    line_handler.worker_pool.shutdown(wait=False)
+
+
+def webhook(users) -> tuple:
+    """每位使用者一則文字訊息的 webhook 內容與簽名"""
+    events = [build_webhook_body(user, "你好")["events"][0] for user in users]
+    body = json.dumps({"destination": "Utest", "events": events})
+    return body, sign(body.encode("utf-8"), SECRET)
+
+
+class TestWebhookFanOut:
+    """測試多事件並行處理"""
+
+    def test_events_from_different_users_run_concurrently(self, handler):
+        """測試：三位使用者的事件並行處理，總時間接近單一事件"""
+        # Arrange
+        handled = []
+        lock = threading.Lock()
+
+        def slow_message(event):
+            time.sleep(0.2)
+            with lock:
+                handled.append(event.source.user_id)
+
+        handler.handle_text_message = slow_message
+        body, signature = webhook(["Ua", "Ub", "Uc"])
+
+        # Act
+        start = time.monotonic()
+        handler.handle_webhook(body, signature)
+        elapsed = time.monotonic() - start
+
+        # Assert
+        assert sorted(handled) == ["Ua", "Ub", "Uc"]
+        assert elapsed < 0.45
+
+    def test_slow_events_return_at_sync_deadline(self, handler):
+        """測試：事件超過 WEBHOOK_SYNC_DEADLINE 時請求先回應，事件在背景完成"""
+        # Arrange
+        release = threading.Event()
+        finished = []
+
+        def stuck_message(event):
+            release.wait(5)
+            finished.append(event.source.user_id)
+
+        handler.handle_text_message = stuck_message
+        body, signature = webhook(["Ua", "Ub"])
+
+        # Act
+        start = time.monotonic()
+        handler.handle_webhook(body, signature)
+        elapsed = time.monotonic() - start
+        release.set()
+        wait_until = time.monotonic() + 5
+        while len(finished) < 2 and time.monotonic() < wait_until:
+            time.sleep(0.01)
+
+        # Assert
+        assert 0.45 <= elapsed < 1.5
+        assert sorted(finished) == ["Ua", "Ub"]
+
+
+class TestAsyncWebhookShedding:
+    """測試非同步模式在佇列已滿時的處理"""
+
+    def test_full_pool_sheds_events_instead_of_blocking(self, async_handler):
+        """測試：佇列已滿時非同步模式拒絕事件並立即回應，不在請求中處理"""
+        # Arrange
+        release = threading.Event()
+        handled = []
+        async_handler.handle_text_message = lambda event: handled.append(event.source.user_id)
+        # 佔住唯一的執行緒並塞滿佇列
+        while async_handler.worker_pool.submit(release.wait, 5):
+            time.sleep(0.01)
+        body, signature = webhook(["Ua"])
+
+        # Act
+        start = time.monotonic()
+        async_handler.handle_webhook(body, signature)
+        elapsed = time.monotonic() - start
+        release.set()
+
+        # Assert
+        assert elapsed < 0.2
+        assert handled == []
+        stats = async_handler.lane_executor.stats()
+        assert stats["rejected"] == 1
+        assert stats["inline_drains"] == 0
+        assert stats["active_lanes"] == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,86 @@
+"""
+有界工作佇列的測試案例
+確保佇列滿時立即拒絕、失敗的工作不會讓執行緒結束
+"""
+import pytest
+import sys
+import os
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker_pool import BoundedWorkerPool
+
+
+class TestBoundedWorkerPool:
+    """測試有界工作佇列"""
+
+    def test_full_queue_rejects_immediately(self):
+        """測試：執行緒與佇列都滿時 submit() 回傳 False，不會阻塞"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=1, max_queue_size=1, name="test")
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        # Act
+        assert pool.submit(block) is True
+        assert started.wait(5)
+        assert pool.submit(lambda: None) is True
+        rejected = pool.submit(lambda: None)
+        release.set()
+        pool.shutdown(timeout=5)
+
+        # Assert
+        stats = pool.stats()
+        assert rejected is False
+        assert stats["submitted"] == 2
+        assert stats["rejected"] == 1
+        assert stats["completed"] == 2
+
+    def test_failed_task_does_not_stop_worker(self):
+        """測試：工作拋出例外後，同一個執行緒繼續處理下一個工作"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=1, max_queue_size=10, name="test")
+        done = threading.Event()
+
+        def fail():
+            raise RuntimeError("boom")
+
+        # Act
+        pool.submit(fail)
+        pool.submit(done.set)
+
+        # Assert
+        assert done.wait(5)
+        pool.shutdown(timeout=5)
+        assert pool.stats()["failed"] == 1
+        assert pool.stats()["completed"] == 1
+
+    def test_submit_after_shutdown_is_rejected(self):
+        """測試：關閉後不再接收工作"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=1, max_queue_size=10, name="test")
+        pool.shutdown()
+
+        # Act & Assert
+        assert pool.submit(lambda: None) is False
+
+    def test_concurrent_counters_are_exact(self):
+        """測試：多個執行緒同時完成工作時統計數字不會遺失"""
+        # Arrange
+        pool = BoundedWorkerPool(max_workers=8, max_queue_size=2000, name="test")
+
+        # Act
+        for _ in range(1000):
+            assert pool.submit(lambda: None)
+        pool.shutdown(timeout=10)
+
+        # Assert
+        assert pool.stats()["completed"] == 1000
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,147 @@
+"""
+Gemini function call 的並行執行
+模型一次要求多個工具（例如查詢行程 + 量子記憶搜尋）時同時執行，
+日曆 API 與 pgvector 的延遲互相重疊而不是相加；每個工具各有期限，逾時的工具回傳錯誤給模型。
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from fork_safety import register_fork_hooks
+from line_http_client import HttpLatencyMetrics
+
+logger = logging.getLogger(__name__)
+
+# (工具名稱, 函式, 參數)
+ToolCall = Tuple[str, Callable[..., Dict], tuple]
+
+
+def tool_error(name: str, error: str) -> Dict:
+    """工具失敗或逾時時回傳給模型的結果"""
+    return {"success": False, "error": f"{name}: {error}"}
+
+
+class ToolExecutor:
+    """在執行緒池中並行執行工具，整體不超過回應期限
+
+    timeout：單一工具的預設期限（秒）
+    tool_timeouts：個別工具的期限，例如 {"quantum_search": 5}
+    """
+
+    def __init__(self, max_workers: int = 8, timeout: float = 8.0,
+                 tool_timeouts: Optional[Dict[str, float]] = None):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.tool_timeouts = dict(tool_timeouts or {})
+        self.metrics = HttpLatencyMetrics()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # 統計資料
+        self.batches = 0
+        self.parallel_batches = 0
+        self.timeouts = 0
+
+        register_fork_hooks(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """子程序不繼承父程序的執行緒池"""
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """工具用的執行緒池（第一次需要時才建立）"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix="gemini-tool")
+        return self._executor
+
+    def timeout_for(self, name: str, deadline: Optional[float]) -> float:
+        """工具的期限：個別設定或預設值，且不超過回應的剩餘時間"""
+        timeout = self.tool_timeouts.get(name, self.timeout)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        return max(0.0, timeout)
+
+    def _run_one(self, name: str, fn: Callable[..., Dict], args: tuple) -> Dict:
+        start = time.monotonic()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self.metrics.record(name, time.monotonic() - start, error=True)
+            logger.warning(f"Tool {name} failed: {e}")
+            return tool_error(name, str(e))
+        self.metrics.record(name, time.monotonic() - start)
+        return result
+
+    def _record_batch(self, calls: Sequence[ToolCall]):
+        self.batches += 1
+        if len(calls) > 1:
+            self.parallel_batches += 1
+
+    def _timed_out(self, name: str, timeout: float) -> Dict:
+        self.timeouts += 1
+        logger.warning(f"Tool {name} timed out after {timeout:.1f}s")
+        return tool_error(name, "timeout")
+
+    def run_all(self, calls: Sequence[ToolCall], deadline: Optional[float] = None) -> List[Dict]:
+        """同步執行所有工具，依呼叫順序回傳結果"""
+        self._record_batch(calls)
+        executor = self._get_executor()
+        started = time.monotonic()
+        futures = [(name, self.timeout_for(name, deadline), executor.submit(self._run_one, name, fn, args))
+                   for name, fn, args in calls]
+        results = []
+        for name, timeout, future in futures:
+            # 每個工具的期限從送出時開始計算，等待前一個工具的時間也算在內
+            try:
+                results.append(future.result(timeout=max(0.0, started + timeout - time.monotonic())))
+            except FutureTimeoutError:
+                # 同步的工具無法中斷，會在背景完成後丟棄結果
+                results.append(self._timed_out(name, timeout))
+        return results
+
+    async def run_all_async(self, calls: Sequence[ToolCall],
+                            deadline: Optional[float] = None) -> List[Dict]:
+        """非同步執行所有工具（同步的工具交給執行緒池，不阻塞事件迴圈）"""
+        self._record_batch(calls)
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+
+        async def run(name: str, fn: Callable[..., Dict], args: tuple) -> Dict:
+            timeout = self.timeout_for(name, deadline)
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(executor, self._run_one, name, fn, args), timeout)
+            except asyncio.TimeoutError:
+                return self._timed_out(name, timeout)
+
+        return list(await asyncio.gather(*[run(name, fn, args) for name, fn, args in calls]))
+
+    def stats(self) -> Dict:
+        """取得批次數、逾時數與各工具的延遲"""
+        return {
+            "batches": self.batches,
+            "parallel_batches": self.parallel_batches,
+            "timeouts": self.timeouts,
+            "latency": self.metrics.stats()
+        }
+
+
+def parse_tool_timeouts(spec: str) -> Dict[str, float]:
+    """解析 "quantum_search=5,list_calendar_events=6" 格式的個別期限"""
+    timeouts = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        name, value = item.split('=', 1)
+        try:
+            timeouts[name.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid tool timeout: {item}")
+    return timeouts
@@ -0,0 +1,128 @@
+"""
+依使用者分道的事件執行器
+同一使用者的訊息依序處理（對話歷史不會錯亂），不同使用者之間完全平行
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Hashable
+
+from worker_pool import BoundedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class LaneRejectedError(RuntimeError):
+    """執行緒池已滿且不允許在呼叫端處理時，道內的工作被拒絕"""
+
+
+class UserLaneExecutor:
+    """每個活躍使用者一條序列化的「道」，多條道共用同一個執行緒池
+
+    - 道內的工作依提交順序一次執行一個
+    - 道清空時立即回收，不會隨著使用者數量無限成長
+    - 一條道連續處理 max_batch 個工作後會讓出執行緒，避免單一使用者長期佔用
+    - 執行緒池佇列已滿時，inline_when_full=True 在呼叫端執行緒直接處理（背壓），順序仍然保持；
+      False 時拒絕這條道的工作（Future 設為 LaneRejectedError），呼叫端不會被卡住
+    """
+
+    def __init__(self, pool: BoundedWorkerPool, max_batch: int = 8, inline_when_full: bool = True):
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.inline_when_full = inline_when_full
+        self._lanes: Dict[Hashable, Deque] = {}
+        self._lock = threading.Lock()
+
+        # 統計資料
+        self.lanes_created = 0
+        self.lanes_reclaimed = 0
+        self.inline_drains = 0
+        self.rejected = 0
+        self.peak_lanes = 0
+
+    def submit(self, key: Hashable, fn: Callable, *args, **kwargs) -> Future:
+        """把工作放進 key 對應的道，回傳可等待結果的 Future"""
+        future = Future()
+        task = (future, fn, args, kwargs)
+
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is not None:
+                # 道正在執行中，排在後面即可
+                lane.append(task)
+                return future
+
+            lane = deque([task])
+            self._lanes[key] = lane
+            self.lanes_created += 1
+            self.peak_lanes = max(self.peak_lanes, len(self._lanes))
+
+        if not self.pool.submit(self._drain, key, lane):
+            if self.inline_when_full:
+                with self._lock:
+                    self.inline_drains += 1
+                logger.warning(f"Lane pool full, draining lane {key} inline")
+                self._drain(key, lane)
+            else:
+                self._reject(key, lane)
+
+        return future
+
+    def _reject(self, key: Hashable, lane: Deque):
+        """拒絕整條道（包含提交期間排進來的工作）並回收"""
+        with self._lock:
+            tasks = list(lane)
+            lane.clear()
+            del self._lanes[key]
+            self.lanes_reclaimed += 1
+            self.rejected += len(tasks)
+        logger.warning(f"Lane pool full, rejected {len(tasks)} task(s) for {key}")
+        for future, _, _, _ in tasks:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(LaneRejectedError(f"worker pool full, lane {key} rejected"))
+
+    def _drain(self, key: Hashable, lane: Deque):
+        """依序執行道內的工作，清空後回收這條道"""
+        processed = 0
+        while True:
+            with self._lock:
+                if not lane:
+                    del self._lanes[key]
+                    self.lanes_reclaimed += 1
+                    return
+                future, fn, args, kwargs = lane.popleft()
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    logger.error(f"Lane task for {key} failed: {e}", exc_info=True)
+                    future.set_exception(e)
+
+            processed += 1
+            if processed >= self.max_batch:
+                # 讓出執行緒給其他使用者；池子滿了就繼續在這裡處理
+                if self.pool.submit(self._drain, key, lane):
+                    return
+                processed = 0
+
+    def active_lanes(self) -> int:
+        """目前仍有工作的道數量"""
+        with self._lock:
+            return len(self._lanes)
+
+    def stats(self) -> Dict:
+        """取得分道統計"""
+        with self._lock:
+            active = len(self._lanes)
+            pending = sum(len(lane) for lane in self._lanes.values())
+        return {
+            "active_lanes": active,
+            "pending_tasks": pending,
+            "peak_lanes": self.peak_lanes,
+            "lanes_created": self.lanes_created,
+            "lanes_reclaimed": self.lanes_reclaimed,
+            "inline_drains": self.inline_drains,
+            "rejected": self.rejected
+        }
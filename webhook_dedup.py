@@ -0,0 +1,222 @@
+"""
+Webhook 重送去重
+LINE 在我們回應太慢時會重送事件，重送的事件不需要再跑一次 Gemini 和量子演化
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from config import Config
+from fork_safety import register_fork_hooks
+
+logger = logging.getLogger(__name__)
+
+
+def get_event_dedup_key(event) -> Optional[str]:
+    """取得事件的去重鍵：優先 webhookEventId，舊格式事件改用訊息 ID"""
+    event_id = getattr(event, 'webhook_event_id', None)
+    if event_id:
+        return f"event:{event_id}"
+
+    message = getattr(event, 'message', None)
+    message_id = getattr(message, 'id', None)
+    if message_id:
+        return f"message:{message_id}"
+
+    return None
+
+
+class InMemoryDedupStore:
+    """程序內的去重表（TTL + 容量上限）"""
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._clock = clock
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.unique = 0
+
+    def check_and_mark(self, key: str) -> bool:
+        """第一次看到這個鍵回傳 True 並記錄；TTL 內重複出現回傳 False"""
+        now = self._clock()
+        with self._lock:
+            self._purge_expired(now)
+
+            if key in self._seen:
+                self.duplicates += 1
+                return False
+
+            self._seen[key] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            self.unique += 1
+            return True
+
+    def _purge_expired(self, now: float):
+        """移除過期的鍵（依插入順序，最舊的在最前面）"""
+        while self._seen:
+            _, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl_seconds:
+                break
+            self._seen.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            size = len(self._seen)
+        return {
+            "backend": "memory",
+            "entries": size,
+            "unique": self.unique,
+            "duplicates": self.duplicates
+        }
+
+
+class PostgresDedupStore:
+    """以 Postgres 資料表去重，讓所有 gunicorn worker 共用同一份紀錄
+
+    資料庫失敗時退回程序內去重，不會因此擋住訊息處理。
+    """
+
+    def __init__(self, database_url: Optional[str] = None, ttl_seconds: float = 3600,
+                 cleanup_interval: int = 500):
+        self.database_url = database_url or Config.DATABASE_URL
+        if not self.database_url:
+            raise ValueError("PostgresDedupStore 需要 DATABASE_URL")
+
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_interval = max(1, cleanup_interval)
+        self.fallback = InMemoryDedupStore(ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._calls = 0
+        self.duplicates = 0
+        self.unique = 0
+        self.errors = 0
+        self._initialize_table()
+        register_fork_hooks(before=self._close_pool, after_in_child=self._reset_after_fork)
+
+    @property
+    def pool(self):
+        """連接池；fork 之後在第一次使用時重新建立"""
+        if self._pool is None:
+            from psycopg2.pool import SimpleConnectionPool
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = SimpleConnectionPool(1, 5, self.database_url)
+        return self._pool
+
+    def _close_pool(self):
+        """fork 前關閉連線，避免父子程序共用同一個資料庫 socket"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    def _reset_after_fork(self):
+        """子程序重建鎖（fork 當下可能有執行緒正持有）"""
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+
+    def _initialize_table(self):
+        """建立去重資料表"""
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS webhook_event_dedup (
+                        event_key VARCHAR(128) PRIMARY KEY,
+                        seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_webhook_dedup_seen_at ON webhook_event_dedup(seen_at)")
+            conn.commit()
+        finally:
+            self.pool.putconn(conn)
+
+    def check_and_mark(self, key: str) -> bool:
+        """第一次看到這個鍵回傳 True；已存在且未過期回傳 False"""
+        try:
+            conn = self.pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    # 新鍵直接插入；已過期的鍵視為新事件並更新時間
+                    cur.execute("""
+                        INSERT INTO webhook_event_dedup (event_key)
+                        VALUES (%s)
+                        ON CONFLICT (event_key) DO UPDATE
+                            SET seen_at = CURRENT_TIMESTAMP
+                            WHERE webhook_event_dedup.seen_at
+                                  < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                        RETURNING event_key
+                    """, (key, self.ttl_seconds))
+                    is_new = cur.fetchone() is not None
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self.pool.putconn(conn)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Dedup table unavailable, using in-process store: {e}")
+            return self.fallback.check_and_mark(key)
+
+        with self._lock:
+            if is_new:
+                self.unique += 1
+            else:
+                self.duplicates += 1
+            self._calls += 1
+            should_cleanup = self._calls % self.cleanup_interval == 0
+
+        if should_cleanup:
+            self._cleanup_expired()
+
+        return is_new
+
+    def _cleanup_expired(self):
+        """定期清除過期紀錄，避免資料表無限成長"""
+        try:
+            conn = self.pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        DELETE FROM webhook_event_dedup
+                        WHERE seen_at < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                    """, (self.ttl_seconds,))
+                conn.commit()
+            finally:
+                self.pool.putconn(conn)
+        except Exception as e:
+            logger.warning(f"Failed to clean up dedup table: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "postgres",
+            "unique": self.unique,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "fallback": self.fallback.stats()
+        }
+
+
+def create_dedup_store():
+    """依設定建立去重表；Postgres 無法使用時退回程序內版本"""
+    if Config.WEBHOOK_DEDUP_BACKEND == 'postgres':
+        try:
+            store = PostgresDedupStore(ttl_seconds=Config.WEBHOOK_DEDUP_TTL)
+            logger.info("Webhook dedup using shared Postgres table")
+            return store
+        except Exception as e:
+            logger.warning(f"Postgres dedup store unavailable, falling back to memory: {e}")
+
+    return InMemoryDedupStore(
+        ttl_seconds=Config.WEBHOOK_DEDUP_TTL,
+        max_entries=Config.WEBHOOK_DEDUP_MAX_ENTRIES
+    )
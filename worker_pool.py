@@ -0,0 +1,140 @@
+"""
+有界工作佇列與執行緒池
+讓 webhook 先回應 LINE，再由背景執行緒處理耗時工作
+"""
+import logging
+import queue
+import threading
+from typing import Callable, Dict
+
+from fork_safety import register_fork_hooks
+
+logger = logging.getLogger(__name__)
+
+# 通知工作執行緒結束的哨兵值
+_STOP = object()
+
+
+class BoundedWorkerPool:
+    """固定數量的工作執行緒 + 有上限的佇列
+
+    佇列滿時 submit() 立即回傳 False，由呼叫端決定如何降級，
+    不會無限制地堆積工作。
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue_size: int = 100,
+                 name: str = "worker"):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.name = name
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._shutdown = False
+
+        # 統計資料（多個工作執行緒同時更新）
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+        # fork 後執行緒不會跟著到子程序，佇列與鎖也要重建
+        register_fork_hooks(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """子程序中重置執行緒狀態；下一次 submit() 時重新啟動執行緒"""
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._started = False
+
+    def _ensure_started(self):
+        """第一次提交工作時才啟動執行緒（fork 之後也安全）"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.max_workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"{self.name}-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+            logger.info(f"{self.name} pool started with {self.max_workers} workers "
+                        f"(queue size {self.max_queue_size})")
+
+    def submit(self, fn: Callable, *args, **kwargs) -> bool:
+        """提交工作；佇列已滿或已關閉時回傳 False"""
+        if self._shutdown:
+            return False
+
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            return False
+
+        with self._stats_lock:
+            self.submitted += 1
+        return True
+
+    def _worker_loop(self):
+        """工作執行緒主迴圈"""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+
+                fn, args, kwargs = item
+                try:
+                    fn(*args, **kwargs)
+                    with self._stats_lock:
+                        self.completed += 1
+                except Exception as e:
+                    # 單一工作失敗不能讓執行緒死掉
+                    with self._stats_lock:
+                        self.failed += 1
+                    logger.error(f"{self.name} task {getattr(fn, '__name__', fn)} failed: {e}",
+                                 exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        """停止接收新工作，處理完佇列中的工作後結束執行緒"""
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            if not self._started:
+                return
+
+        for _ in self._threads:
+            self._queue.put(_STOP)
+
+        if wait:
+            for thread in self._threads:
+                thread.join(timeout)
+
+    def stats(self) -> Dict:
+        """取得佇列與執行緒統計"""
+        with self._stats_lock:
+            return {
+                "workers": self.max_workers,
+                "queue_size": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed
+            }